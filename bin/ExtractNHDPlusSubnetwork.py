@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""@package ExtractNHDPlusSubnetwork
+
+@brief Extract the NHDPlus2 network upstream of a streamflow gage, or of a reach, from the 
+CONUS NHDPlus2 databases into small, standalone databases for a project.
+@brief Extracted databases have the same schema and indexes as the CONUS databases, so that
+network analysis can be run against them, e.g. on cluster nodes without access to the 
+CONUS databases, by pointing the 'NHDPLUS2' section of a configuration file at them.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2015, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT 
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+@author Brian Miles <brian_miles@unc.edu>
+
+
+Pre conditions
+--------------
+1. Configuration file must define the following sections and values:
+   'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB'
+   
+2. Configuration file may define the following sections and values, in which case
+catchments and gage locations will be extracted:
+   'NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT'
+   'NHDPLUS2', 'PATH_OF_NHDPLUS2_GAGELOC'
+
+Post conditions
+---------------
+1. Will write NHDPlusDB.sqlite, and Catchment.sqlite and GageLoc.sqlite if configured, 
+to the output directory (by default the directory nhdplus2 in the project directory)
+
+2. Will write nhdplus2.cfg, containing an 'NHDPLUS2' section naming the extracted databases,
+to the output directory
+
+Usage:
+@code
+ExtractNHDPlusSubnetwork.py -p /path/to/project_dir -g 01589330
+ExtractNHDPlusSubnetwork.py -p /path/to/project_dir -c 11906197 -o /path/to/output_dir
+@endcode
+
+@note EcohydroLib configuration file must be specified by environmental variable 'ECOHYDROWORKFLOW_CFG',
+or -i option must be specified. 
+"""
+import os
+import sys
+import argparse
+import ConfigParser
+
+from ecohydrolib.context import Context
+
+from ecohydrolib.nhdplus2.connections import getNHDPlusDBConnection
+from ecohydrolib.nhdplus2.networkanalysis import getNHDReachcodeAndMeasureForGageSourceFea
+from ecohydrolib.nhdplus2.networkanalysis import getComIdForStreamGage
+from ecohydrolib.nhdplus2.networkanalysis import extractSubnetworkForReach
+
+CONFIG_FILENAME = 'nhdplus2.cfg'
+
+# Handle command line options
+parser = argparse.ArgumentParser(description='Extract the NHDPlus2 network upstream of a gage or reach into standalone databases')
+parser.add_argument('-i', '--configfile', dest='configfile', required=False,
+                    help='The configuration file')
+parser.add_argument('-p', '--projectDir', dest='projectDir', required=True,
+                    help='The directory to which metadata, intermediate, and final files should be saved')
+outlet = parser.add_mutually_exclusive_group(required=True)
+outlet.add_argument('-g', '--gageid', dest='gageid',
+                    help='The USGS site identifier of the gage at the outlet of the subnetwork')
+outlet.add_argument('-c', '--comid', dest='comid', type=int,
+                    help='The ComID of the reach at the outlet of the subnetwork')
+parser.add_argument('-o', '--outputDir', dest='outputDir', required=False,
+                    help='The directory to which databases should be written, defaults to nhdplus2 in the project directory')
+args = parser.parse_args()
+
+configFile = None
+if args.configfile:
+    configFile = args.configfile
+
+context = Context(args.projectDir, configFile) 
+
+if not context.config.has_option('NHDPLUS2', 'PATH_OF_NHDPLUS2_DB'):
+    sys.exit("Config file %s does not define option %s in section %s" % \
+          (args.configfile, 'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB'))
+
+if args.outputDir:
+    outputDir = os.path.abspath(args.outputDir)
+else:
+    outputDir = os.path.join(context.projectDir, 'nhdplus2')
+if not os.path.isdir(outputDir):
+    os.makedirs(outputDir)
+if not os.access(outputDir, os.W_OK):
+    sys.exit("Unable to write to output directory %s" % (outputDir,))
+
+if args.gageid:
+    result = getNHDReachcodeAndMeasureForGageSourceFea(context.config, args.gageid)
+    if not result:
+        sys.exit("Gage '%s' not found" % (args.gageid,))
+    comID = getComIdForStreamGage(getNHDPlusDBConnection(context.config), result[0], result[1])
+    if comID == -1:
+        sys.exit("No reach found for gage '%s'" % (args.gageid,))
+else:
+    comID = args.comid
+
+sys.stdout.write("Extracting NHDPlus2 network upstream of reach %d to %s...\n" % (comID, outputDir))
+sys.stdout.flush()
+paths = extractSubnetworkForReach(context.config, comID, outputDir, verbose=True)
+
+# Write configuration naming the extracted databases
+config = ConfigParser.RawConfigParser()
+config.optionxform = str
+config.add_section('NHDPLUS2')
+for option in sorted(paths.keys()):
+    config.set('NHDPLUS2', option, paths[option])
+configPath = os.path.join(outputDir, CONFIG_FILENAME)
+with open(configPath, 'w') as f:
+    config.write(f)
+sys.stdout.write("Configuration for extracted databases written to %s\n" % (configPath,))
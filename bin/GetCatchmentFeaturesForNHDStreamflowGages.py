@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""@package GetCatchmentFeaturesForNHDStreamflowGages
+
+@brief Query local NHDPlus2 database for the drainage areas of many streamflow gages at once.
+@brief One feature is written per gage; watersheds of nested gages are computed once
+and reused by the gages downstream of them.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2015, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+@author Brian Miles <brian_miles@unc.edu>
+
+
+Pre conditions
+--------------
+1. Configuration file must define the following sections and values:
+   'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB'
+   'NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT'
+
+Post conditions
+---------------
+1. Will write the following entry(ies) to the manifest section of metadata associated with the project directory:
+   gage_catchments [the name of the catchment feature dataset]
+
+Usage:
+@code
+GetCatchmentFeaturesForNHDStreamflowGages.py -p /path/to/project_dir -g 01589330 01589312
+GetCatchmentFeaturesForNHDStreamflowGages.py -p /path/to/project_dir -l gages.txt
+@endcode
+
+Gage list files contain one gage per line, either a Gage_Loc Source_Fea (e.g. USGS
+site number), or a reachcode and measure separated by a comma.
+
+@note EcohydroLib configuration file must be specified by environmental variable 'ECOHYDROWORKFLOW_CFG',
+or -i option must be specified.
+"""
+import os
+import sys
+import argparse
+import textwrap
+
+from ecohydrolib.context import Context
+from ecohydrolib.metadata import GenericMetadata
+from ecohydrolib.metadata import AssetProvenance
+
+from ecohydrolib.spatialdata.utils import deleteShapefile
+from ecohydrolib.spatialdata.utils import OGR_GEOJSON_DRIVER_NAME
+
+from ecohydrolib.nhdplus2.networkanalysis import getCatchmentFeaturesForGages
+from ecohydrolib.nhdplus2.networkanalysis import OGR_DRIVERS
+from ecohydrolib.nhdplus2.networkanalysis import OGR_SHAPEFILE_DRIVER_NAME
+
+FORMATS = {'shp': OGR_SHAPEFILE_DRIVER_NAME,
+           'geojson': OGR_GEOJSON_DRIVER_NAME}
+
+# Handle command line options
+parser = argparse.ArgumentParser(description='Get features for the drainage areas of many NHDPlus2 streamflow gages')
+parser.add_argument('-i', '--configfile', dest='configfile', required=False,
+                    help='The configuration file')
+parser.add_argument('-p', '--projectDir', dest='projectDir', required=True,
+                    help='The directory to which metadata, intermediate, and final files should be saved')
+parser.add_argument('-g', '--gageid', dest='gageid', required=False, nargs='+',
+                    help='One or more Gage_Loc Source_Fea identifiers (e.g. USGS site identifiers)')
+parser.add_argument('-l', '--gagelist', dest='gagelist', required=False,
+                    help='File listing one gage per line, either a Source_Fea or reachcode,measure')
+parser.add_argument('-f', '--outfile', dest='outfile', required=False, default='gage_catchments',
+                    help='The name of the catchment feature dataset to be written.  File extension will be added.')
+parser.add_argument('--format', dest='format', required=False, choices=FORMATS.keys(), default='shp',
+                    help='Format of the catchment feature dataset to be written')
+parser.add_argument('--overwrite', dest='overwrite', action='store_true', required=False,
+                    help='Overwrite existing catchment feature dataset in project directory.  If not specified, program will halt if a dataset already exists.')
+args = parser.parse_args()
+cmdline = GenericMetadata.getCommandLine()
+
+configFile = None
+if args.configfile:
+    configFile = args.configfile
+
+context = Context(args.projectDir, configFile)
+
+if not context.config.has_option('NHDPLUS2', 'PATH_OF_NHDPLUS2_DB'):
+    sys.exit("Config file %s does not define option %s in section %s" % \
+          (args.configfile, 'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB'))
+if not context.config.has_option('NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT'):
+    sys.exit("Config file %s does not define option %s in section %s" % \
+          (args.configfile, 'NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT'))
+
+gages = []
+if args.gageid:
+    gages.extend(args.gageid)
+if args.gagelist:
+    with open(args.gagelist, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            fields = line.split(',')
+            if len(fields) == 2:
+                gages.append( (fields[0].strip(), float(fields[1])) )
+            else:
+                gages.append(line)
+if len(gages) == 0:
+    sys.exit("No gages specified, use -g or -l to specify gages")
+
+format = FORMATS[args.format]
+tmpFilename = "%s%s%s" % (args.outfile, os.extsep, OGR_DRIVERS[format])
+outFilepath = os.path.join(context.projectDir, tmpFilename)
+
+if not args.overwrite:
+    if os.path.exists(outFilepath):
+        sys.exit( textwrap.fill("Catchment feature dataset already exists in project directory %s.  Use --overwrite option to overwrite." % \
+                 args.projectDir ) )
+elif os.path.exists(outFilepath):
+    # Overwrite was specified
+    if format == OGR_SHAPEFILE_DRIVER_NAME:
+        deleteShapefile(outFilepath)
+    else:
+        os.unlink(outFilepath)
+
+sys.stdout.write("Getting catchment areas draining through %d gages using local NHDPlus dataset..." % (len(gages),))
+sys.stdout.flush()
+(outFilename, notFound) = getCatchmentFeaturesForGages(context.config, context.projectDir, args.outfile,
+                                                       gages, format=format)
+sys.stdout.write('done\n')
+for gage in notFound:
+    sys.stderr.write("Gage '%s' not found\n" % (gage,))
+
+# Write provenance
+asset = AssetProvenance(GenericMetadata.MANIFEST_SECTION)
+asset.name = 'gage_catchments'
+asset.dcIdentifier = outFilename
+asset.dcSource = 'http://www.horizon-systems.com/NHDPlus/NHDPlusV2_home.php'
+asset.dcTitle = 'Streamflow gage catchments'
+asset.dcPublisher = 'USGS'
+asset.dcDescription = cmdline
+asset.writeToMetadata(context)
+
+# Write processing history
+GenericMetadata.appendProcessingHistoryItem(context, cmdline)
@@ -63,6 +63,24 @@ Usage:
 GetNHDStreamflowGageIdentifiersAndLocation.py -p /path/to/project_dir -g 01589330
 @endcode
 
+To list gages, rather than registering a gage with the project, search for gages 
+in the local NHDPlus dataset within a bounding box, within the polygon(s) of a
+feature dataset (e.g. a study area shapefile), or nearest to a point:
+@code
+GetNHDStreamflowGageIdentifiersAndLocation.py -p /path/to/project_dir -s local --bbox -76.77 39.27 -76.71 39.33
+GetNHDStreamflowGageIdentifiersAndLocation.py -p /path/to/project_dir -s local --polygon studyarea.shp
+GetNHDStreamflowGageIdentifiersAndLocation.py -p /path/to/project_dir -s local --nearest -76.74 39.30 -k 5
+@endcode
+
+Gages can also be searched for by station name (e.g. river name), optionally filtered by
+state, drainage area (in square miles) and site status; results are ranked by how well
+station names match:
+@code
+GetNHDStreamflowGageIdentifiersAndLocation.py -p /path/to/project_dir -s local --search "Neuse River" --state NC --minArea 100
+GetNHDStreamflowGageIdentifiersAndLocation.py -p /path/to/project_dir -s local --state NC --status active --maxArea 10
+@endcode
+Search results are written to standard output, one gage per line; no metadata are written.
+
 @note EcohydroLib configuration file must be specified by environmental variable 'ECOHYDROWORKFLOW_CFG',
 or -i option must be specified. 
 """
@@ -77,7 +95,13 @@ from ecohydrolib.nhdplus2.webservice import locateStreamflowGage
 from ecohydrolib.nhdplus2.webservice import RESPONSE_OK
 from ecohydrolib.nhdplus2.networkanalysis import getNHDReachcodeAndMeasureForGageSourceFea
 from ecohydrolib.nhdplus2.networkanalysis import getLocationForStreamGageByGageSourceFea
+from ecohydrolib.nhdplus2.networkanalysis import getStreamGagesInBoundingBox
+from ecohydrolib.nhdplus2.networkanalysis import getStreamGagesInPolygon
+from ecohydrolib.nhdplus2.networkanalysis import getNearestStreamGages
+from ecohydrolib.nhdplus2.networkanalysis import searchStreamGages
+from ecohydrolib.nhdplus2.networkanalysis import GAGE_SEARCH_LIMIT
 from ecohydrolib.spatialdata.utils import writeCoordinatePairsToPointShapefile
+from ecohydrolib.spatialdata.utils import getPolygonForFeatureLayer
 
 # Handle command line options
 parser = argparse.ArgumentParser(description='Get NHDPlus2 streamflow gage identifiers for a USGS gage.')
@@ -87,9 +111,38 @@ parser.add_argument('-p', '--projectDir', dest='projectDir', required=True,
                   help='The directory to which metadata, intermediate, and final files should be saved')
 parser.add_argument('-s', '--source', dest='source', required=False, choices=['local', 'webservice'], default='webservice',
                     help='Source to query NHDPlusV2 dataset')
-parser.add_argument('-g', '--gageid', dest='gageid', required=True,
+search = parser.add_mutually_exclusive_group(required=False)
+search.add_argument('-g', '--gageid', dest='gageid',
                     help='An integer representing the USGS site identifier')
+search.add_argument('--bbox', dest='bbox', nargs=4, type=float,
+                    metavar=('MINX', 'MINY', 'MAXX', 'MAXY'),
+                    help='List gages within bounding box (WGS 84 coordinates)')
+search.add_argument('--polygon', dest='polygon',
+                    help='List gages within the polygon features of an OGR feature dataset (e.g. shapefile)')
+search.add_argument('--nearest', dest='nearest', nargs=2, type=float,
+                    metavar=('LON', 'LAT'),
+                    help='List gages nearest to point (WGS 84 coordinates)')
+search.add_argument('--search', dest='search',
+                    help='List gages whose station names contain the words given (e.g. river name)')
+parser.add_argument('-k', dest='k', required=False, type=int, default=1,
+                    help='Number of gages to list when searching for gages nearest to a point')
+parser.add_argument('--state', dest='state', required=False,
+                    help='List gages in a state, identified by its two letter abbreviation or FIPS code')
+parser.add_argument('--minArea', dest='minArea', required=False, type=float,
+                    help='List gages with a drainage area of at least this many square miles')
+parser.add_argument('--maxArea', dest='maxArea', required=False, type=float,
+                    help='List gages with a drainage area of at most this many square miles')
+parser.add_argument('--status', dest='status', required=False,
+                    help='List gages with this site status (e.g. active)')
+parser.add_argument('--limit', dest='limit', required=False, type=int, default=GAGE_SEARCH_LIMIT,
+                    help='Maximum number of gages to list when searching by station name or attributes')
 args = parser.parse_args()
+
+attributeSearch = args.state or args.minArea is not None or args.maxArea is not None or args.status
+if not (args.gageid or args.bbox or args.polygon or args.nearest or args.search or attributeSearch):
+    parser.error("One of -g/--gageid, --bbox, --polygon, --nearest, --search, --state, --minArea, --maxArea or --status is required")
+if attributeSearch and (args.gageid or args.bbox or args.polygon or args.nearest):
+    parser.error("--state, --minArea, --maxArea and --status can only be used alone or with --search")
 cmdline = GenericMetadata.getCommandLine()
 
 configFile = None
@@ -98,6 +151,39 @@ if args.configfile:
 
 context = Context(args.projectDir, configFile) 
 
+if args.gageid is None:
+    # Search for gages
+    if args.source != 'local':
+        sys.exit("Searching for gages requires the local NHDPlus dataset, use '-s local'")
+    if args.search or attributeSearch:
+        if not context.config.has_option('NHDPLUS2', 'PATH_OF_NHDPLUS2_DB'):
+            sys.exit("Config file %s does not define option %s in section %s" % \
+                  (args.configfile, 'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB'))
+        gages = searchStreamGages(context.config, args.search, args.state, args.minArea, args.maxArea,
+                                  args.status, args.limit)
+        for (gageID, name, state, status, area, reachcode, measure, comID, gage_lon, gage_lat) in gages:
+            line = u"%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n" % \
+                (gageID, name, state, status, area, reachcode, measure, comID, gage_lon, gage_lat)
+            sys.stdout.write(line.encode('utf-8'))
+        sys.exit(0)
+    if not context.config.has_option('NHDPLUS2', 'PATH_OF_NHDPLUS2_GAGELOC'):
+        sys.exit("Config file %s does not define option %s in section %s" % \
+              (args.configfile, 'NHDPLUS2', 'PATH_OF_NHDPLUS2_GAGELOC'))
+    if args.bbox:
+        bbox = dict({'minX': args.bbox[0], 'minY': args.bbox[1], 
+                     'maxX': args.bbox[2], 'maxY': args.bbox[3], 'srs': 'EPSG:4326'})
+        gages = getStreamGagesInBoundingBox(context.config, bbox)
+    elif args.polygon:
+        gages = getStreamGagesInPolygon(context.config, getPolygonForFeatureLayer(args.polygon))
+    else:
+        gages = getNearestStreamGages(context.config, args.nearest[0], args.nearest[1], args.k)
+    for (gageID, reachcode, measure, gage_lon, gage_lat) in gages:
+        # GageLoc may not record the reach code and measure of every gage
+        if measure is not None:
+            measure = "%f" % (measure,)
+        sys.stdout.write("%s %s %s %f %f\n" % (gageID, reachcode, measure, gage_lon, gage_lat))
+    sys.exit(0)
+
 if args.source == 'local':
     sys.stdout.write('Getting identifiers and location from local NHDPlus dataset...')
     sys.stdout.flush()
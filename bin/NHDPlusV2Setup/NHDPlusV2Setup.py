@@ -42,18 +42,60 @@ OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 Usage:
 @code
-NHDPlusSetup.py -i <config_file> -a  <archive_dir> -o <output_dir>
+NHDPlusSetup.py -i <config_file> -a  <archive_dir> -o <output_dir> [-n <num_processes>] [--rebuild] [--partitions]
 @endcode
+
+Setup records each archive, DBF file and catchment shapefile it loads, along with
+its checksum and the records loaded from it, in the SetupManifest table of
+NHDPlusDB.sqlite and Catchment.sqlite.  If setup is interrupted, re-running it
+resumes where it left off; when NHDPlus data are updated, only the archives and
+files that changed are re-loaded.
+
+If --partitions is specified, the CONUS databases are also partitioned into one
+NHDPlus2 database and one catchment database per vector processing unit (VPU), written
+in parallel to the 'partitions' directory of the output directory, along with a
+routing database (see ecohydrolib.nhdplus2.partitions).
 """
 import os
 import sys
 import errno
 import argparse
-import subprocess
 import sqlite3
 import ConfigParser
 
-from ecohydrolib.dbf import dbfreader
+from ecohydrolib.nhdplus2.ingest import TABLES as NHDPLUS2_TABLES
+from ecohydrolib.nhdplus2.ingest import loadNHDPlusDB
+from ecohydrolib.nhdplus2.ingest import loadNHDPlusDBParallel
+from ecohydrolib.nhdplus2.ingest import getVPUForPath
+from ecohydrolib.nhdplus2.ingest import getSourceName
+from ecohydrolib.nhdplus2.upstreamgraph import UpstreamGraph
+from ecohydrolib.nhdplus2.nestedintervals import writeNestedIntervals
+from ecohydrolib.nhdplus2.catchmentdb import writeCatchmentExtents
+from ecohydrolib.nhdplus2.catchmentdb import isExtentTableComplete
+from ecohydrolib.nhdplus2.catchmentdb import convertCatchmentShapefiles
+from ecohydrolib.nhdplus2.catchmentdb import mergeCatchmentDBs
+from ecohydrolib.nhdplus2.catchmentdb import getShapefilesToLoad
+from ecohydrolib.nhdplus2.catchmentdb import loadCatchmentShapefiles
+from ecohydrolib.nhdplus2.catchmentdb import getShapefilePaths
+from ecohydrolib.nhdplus2.manifest import SOURCE_ARCHIVE
+from ecohydrolib.nhdplus2.manifest import SOURCE_CURRENT
+from ecohydrolib.nhdplus2.manifest import SOURCE_SHAPEFILE
+from ecohydrolib.nhdplus2.manifest import getFileInfo
+from ecohydrolib.nhdplus2.manifest import getChecksum
+from ecohydrolib.nhdplus2.manifest import createManifestTable
+from ecohydrolib.nhdplus2.manifest import getSourceState
+from ecohydrolib.nhdplus2.manifest import recordSource
+from ecohydrolib.nhdplus2.archives import getRequiredMemberNames
+from ecohydrolib.nhdplus2.archives import findArchives
+from ecohydrolib.nhdplus2.archives import extractArchives
+from ecohydrolib.nhdplus2.archives import createPathIndexTable
+from ecohydrolib.nhdplus2.archives import indexPaths
+from ecohydrolib.nhdplus2.archives import buildPathIndex
+from ecohydrolib.nhdplus2.archives import getIndexedPaths
+from ecohydrolib.nhdplus2.gageindex import writeGageComIdTable
+from ecohydrolib.nhdplus2.gagesearch import writeGageLocationIndex
+from ecohydrolib.nhdplus2.gageinfo import writeGageInfoIndex
+from ecohydrolib.nhdplus2.partitions import writePartitions
 
 
 parser = argparse.ArgumentParser(description='Assemble regional NHDPLus V2 data into a national dataset')
@@ -77,6 +119,30 @@ parser.add_argument('-s3', '--skipDB', dest='skipDB', action='store_true',
 parser.add_argument('-s4', '--skipGageLoc', dest='skipGageLoc', action='store_true',
                     default=False, required=False,
                     help='Skip step where GageLoc database is created')
+parser.add_argument('-s5', '--skipGraph', dest='skipGraph', action='store_true',
+                    default=False, required=False,
+                    help='Skip step where upstream graph of PlusFlow network is created')
+parser.add_argument('-s6', '--skipIntervals', dest='skipIntervals', action='store_true',
+                    default=False, required=False,
+                    help='Skip step where PlusFlow network is labelled with nested intervals')
+parser.add_argument('-s7', '--skipExtents', dest='skipExtents', action='store_true',
+                    default=False, required=False,
+                    help='Skip step where extents of CONUS catchments are indexed')
+parser.add_argument('-s8', '--skipGageComID', dest='skipGageComID', action='store_true',
+                    default=False, required=False,
+                    help='Skip step where ComIDs of streamflow gages are precomputed')
+parser.add_argument('-s9', '--skipGageSearch', dest='skipGageSearch', action='store_true',
+                    default=False, required=False,
+                    help='Skip step where station names and attributes of streamflow gages are indexed for search')
+parser.add_argument('-n', '--processes', dest='processes', type=int,
+                    default=1, required=False,
+                    help='Number of worker processes; archives are unpacked in parallel, and if greater than 1, each regional vector processing unit is converted into a staging database in parallel, and staging databases are then merged')
+parser.add_argument('--rebuild', dest='rebuild', action='store_true',
+                    default=False, required=False,
+                    help='Delete existing NHDPlus and catchment databases and rebuild them from scratch.  If not specified, archives, DBF files and shapefiles already loaded (as recorded in the setup manifest) are skipped, and only those that have changed are re-loaded.')
+parser.add_argument('--partitions', dest='partitions', action='store_true',
+                    default=False, required=False,
+                    help='Also write one NHDPlus and one catchment database per vector processing unit, and a routing database mapping ComIDs to partitions, so that network traversals only open the partitions they reach')
 args = parser.parse_args()
 
 config = ConfigParser.RawConfigParser()
@@ -85,9 +151,6 @@ config.read(args.configfile)
 if not config.has_option('GDAL/OGR', 'PATH_OF_OGR2OGR'):
     sys.exit("Config file %s does not define option %s in section %s" & \
           (args.configfile, 'GDAL/OGR', 'PATH_OF_OGR2OGR'))
-if not config.has_option('UTIL', 'PATH_OF_FIND'):
-    sys.exit("Config file %s does not define option %s in section %s" & \
-          (args.configfile, 'UTIL', 'PATH_OF_FIND'))
 if not config.has_option('UTIL', 'PATH_OF_SEVEN_ZIP'):
     sys.exit("Config file %s does not define option %s in section %s" & \
           (args.configfile, 'UTIL', 'PATH_OF_SEVEN_ZIP'))
@@ -96,7 +159,6 @@ if not config.has_option('UTIL', 'PATH_OF_SQLITE'):
           (args.configfile, 'UTIL', 'PATH_OF_SQLITE'))
     
 pathOfOgr = config.get('GDAL/OGR', 'PATH_OF_OGR2OGR')
-pathOfFind = config.get('UTIL', 'PATH_OF_FIND')
 pathOfSevenZip = config.get('UTIL', 'PATH_OF_SEVEN_ZIP')
 pathOfSqlite = config.get('UTIL', 'PATH_OF_SQLITE')
 
@@ -109,74 +171,141 @@ if not os.access(args.outputDir, os.W_OK):
                   args.outputDir)
 
 nhdPlusDB = os.path.join(args.outputDir, "NHDPlusDB.sqlite")
+conusCatchment = os.path.join(args.outputDir, "Catchment.sqlite")
+gageLocDB = os.path.join(args.outputDir, "GageLoc.sqlite")
+upstreamGraph = os.path.join(args.outputDir, "NHDPlusUpstreamGraph")
+partitionDir = os.path.join(args.outputDir, "partitions")
+
+if args.rebuild:
+    for db in [nhdPlusDB, conusCatchment, gageLocDB]:
+        if os.access(db, os.F_OK):
+            os.remove(db)
 
 # 0. Unpacking NHDPlus archives into output directory
+conn = sqlite3.connect(nhdPlusDB)
+createManifestTable(conn)
+createPathIndexTable(conn)
+requiredNames = getRequiredMemberNames(NHDPLUS2_TABLES)
 if not args.skipUnzip:
     print("Unpacking NHDPlus archives into output directory %s" % (args.outputDir,))
 
-    # Get a list of zip files
-    zipFiles = subprocess.check_output("%s %s -type f -name *.7z -print" % (pathOfFind, args.archiveDir,), shell=True).split()
-
-    # Unpack zip files into output directory
+    # Get a list of zip files, skipping archives already unpacked
+    zipFiles = findArchives(args.archiveDir)
+    toExtract = {}
     for file in zipFiles:
-        sevenZCommand = "%s x -y -o%s %s" % \
-            (pathOfSevenZip, args.outputDir, file)
-        print sevenZCommand
-        returnCode = os.system(sevenZCommand)
+        source = getSourceName(file, args.archiveDir)
+        (state, checksum, size, mtime) = getSourceState(conn, source, file)
+        if state == SOURCE_CURRENT:
+            print("Skipping %s, already unpacked" % (file,))
+            continue
+        toExtract[file] = (source, checksum, size, mtime)
+
+    # Unpack only the files needed from each archive into output directory, in parallel
+    for (file, members, returnCode) in extractArchives(pathOfSevenZip, sorted(toExtract.keys()), 
+                                                       args.outputDir, requiredNames, args.processes):
         assert(returnCode == 0)
+        print("Unpacked %d files from %s" % (len(members), file))
+        (source, checksum, size, mtime) = toExtract[file]
+        indexPaths(conn, members, source)
+        recordSource(conn, source, SOURCE_ARCHIVE, checksum, size, mtime, numRows=len(members))
+        conn.commit()
+
+# Look up files needed by later steps in the path index, indexing files unpacked by
+# earlier versions of this script if need be
+indexedPaths = dict([(name, getIndexedPaths(conn, args.outputDir, name)) for name in requiredNames])
+if not any(indexedPaths.values()):
+    print("Indexing files in output directory %s" % (args.outputDir,))
+    buildPathIndex(conn, args.outputDir, requiredNames)
+    indexedPaths = dict([(name, getIndexedPaths(conn, args.outputDir, name)) for name in requiredNames])
+conn.close()
+
+def findFiles(name):
+    return indexedPaths.get(name.lower(), [])
 
 # 1. Find GageLoc shapefile and convert it to a spatial SQLite DB
 if not args.skipGageLoc:
     print("Converting GageLoc shapefile to sqlite database ...")
-    gageLocDB = os.path.join(args.outputDir, "GageLoc.sqlite")
-    gageLoc = subprocess.check_output("%s %s -type f -iname GageLoc.shp -print" % (pathOfFind, args.outputDir,), shell=True).split()
+    gageLoc = findFiles('GageLoc.shp')
     assert(gageLoc)
     gageLocShp = gageLoc[0]
     assert(os.access(gageLocShp, os.R_OK))
-    ogrCommand = '%s -gt 65536 -f "SQLite" -t_srs "EPSG:4326" %s %s' % (pathOfFind, gageLocDB, gageLocShp)
-    returnCode = os.system(ogrCommand)
-    assert(returnCode == 0) 
-    
-    # Index fields
-    sqliteCommand = "%s %s 'CREATE INDEX IF NOT EXISTS reachcode_measure_idx on GageLoc (reachcode,measure)'" % (pathOfSqlite, gageLocDB)
-    returnCode = os.system(sqliteCommand)
-    assert(returnCode == 0)
-    
-    sqliteCommand = "%s %s 'CREATE INDEX IF NOT EXISTS gage_loc_source_fea_idx ON GageLoc (source_fea)'" % (pathOfSqlite, gageLocDB)
-    returnCode = os.system(sqliteCommand)
-    assert(returnCode == 0)
-    #cursor.execute("""""")
+    gageLocSource = getSourceName(gageLocShp, args.outputDir)
+    gageLocPaths = getShapefilePaths(gageLocShp)
+    state = None
+    if os.path.exists(gageLocDB):
+        conn = sqlite3.connect(gageLocDB)
+        createManifestTable(conn)
+        (state, checksum, size, mtime) = getSourceState(conn, gageLocSource, gageLocPaths)
+        conn.close()
+    if state == SOURCE_CURRENT:
+        print("Skipping %s, already converted to %s" % (gageLocShp, gageLocDB))
+    else:
+        # GageLoc is converted in a single pass, so a database left by an interrupted or
+        # outdated conversion is replaced
+        if os.path.exists(gageLocDB):
+            os.remove(gageLocDB)
+        ogrCommand = '%s -gt 65536 -f "SQLite" -t_srs "EPSG:4326" %s %s' % (pathOfOgr, gageLocDB, gageLocShp)
+        returnCode = os.system(ogrCommand)
+        assert(returnCode == 0) 
+        
+        # Index fields
+        sqliteCommand = "%s %s 'CREATE INDEX IF NOT EXISTS reachcode_measure_idx on GageLoc (reachcode,measure)'" % (pathOfSqlite, gageLocDB)
+        returnCode = os.system(sqliteCommand)
+        assert(returnCode == 0)
+        
+        sqliteCommand = "%s %s 'CREATE INDEX IF NOT EXISTS gage_loc_source_fea_idx ON GageLoc (source_fea)'" % (pathOfSqlite, gageLocDB)
+        returnCode = os.system(sqliteCommand)
+        assert(returnCode == 0)
+        
+        # Index gage locations for spatial searches
+        conn = sqlite3.connect(gageLocDB)
+        numGages = writeGageLocationIndex(conn)
+        print("Locations of %d gages indexed" % (numGages,))
+        
+        # Record the shapefile last, so that an interrupted conversion is redone
+        (size, mtime) = getFileInfo(gageLocPaths)
+        createManifestTable(conn)
+        recordSource(conn, gageLocSource, SOURCE_SHAPEFILE, getChecksum(gageLocPaths), size, mtime,
+                     'GageLoc', numGages)
+        conn.commit()
+        conn.close()
     
 
 # 2. Find catchment shapefiles
 if not args.skipCatchment:
-    conusCatchment = os.path.join(args.outputDir, "Catchment.sqlite")
-    #print conusCatchment
-
-    # Remove existing conusCatchment
-    if os.access(conusCatchment, os.F_OK):
-        os.remove(conusCatchment)
-
     print("Finding catchment shapefiles")
-    shapefiles = subprocess.check_output("%s %s -type f -iname Catchment.shp -print" % (pathOfFind, args.outputDir,), shell=True).split()
+    shapefiles = findFiles('Catchment.shp')
     #print shapefiles
+    
+    # Only load shapefiles not already loaded, or that have changed since they were loaded
+    toLoad = getShapefilesToLoad(conusCatchment, shapefiles, args.outputDir)
+    print("%d of %d catchment shapefiles need to be loaded" % (len(toLoad), len(shapefiles)))
 
     # 3. Intersect all catchment shapefiles into one shapefile for the entire CONUS
     print("Intersecting regional catchment shapefiles in to single CONUS catchment feature dataset ...")
-    numFiles = len(shapefiles)
-    currFile = 0
-    for file in shapefiles:
-        pctComplete = (float(currFile) / float(numFiles)) * 100
-        currFile = currFile + 1
-        ogrCommand = '%s -gt 65536 -f "SQLite" -append %s %s' % (pathOfOgr, conusCatchment, file)
-        #print ogrCommand
-        sys.stdout.write("\r\tProcessing file %d of %d (%.0f%%)" % (currFile, numFiles, pctComplete))
-        sys.stdout.flush()
-        returnCode = os.system(ogrCommand)
-        assert(returnCode == 0)
-
-    pctComplete = (float(currFile) / float(numFiles)) * 100
-    sys.stdout.write("\r\tProcessing file %d of %d (%.0f%%)\n" % (currFile, numFiles, pctComplete))
+    numFiles = len(toLoad)
+    if args.processes > 1 and numFiles > 0:
+        # Convert each regional shapefile into a staging database, and index the extents of its
+        # catchments, in parallel, then merge staging databases and their extents
+        stagingDBs = [os.path.join(args.outputDir, "Catchment_%s.sqlite" % (getVPUForPath(file),)) \
+                      for (file, source, checksum, size, mtime) in toLoad]
+        assert(len(set(stagingDBs)) == numFiles)
+        for stagingDB in stagingDBs:
+            if os.access(stagingDB, os.F_OK):
+                os.remove(stagingDB)
+        ogrCommands = ['%s -gt 65536 -f "SQLite" %s %s' % (pathOfOgr, stagingDB, load[0]) \
+                       for (stagingDB, load) in zip(stagingDBs, toLoad)]
+        returnCodes = convertCatchmentShapefiles(ogrCommands, stagingDBs, args.processes)
+        assert(all(returnCode == 0 for returnCode in returnCodes))
+        numCatchments = mergeCatchmentDBs(conusCatchment, stagingDBs, toLoad, verbose=True)
+        for stagingDB in stagingDBs:
+            os.remove(stagingDB)
+        print("\t%d catchments in CONUS catchment feature dataset" % (numCatchments,))
+    else:
+        def appendShapefile(file, catchmentDB):
+            ogrCommand = '%s -gt 65536 -f "SQLite" -append %s %s' % (pathOfOgr, catchmentDB, file)
+            return os.system(ogrCommand) == 0
+        loadCatchmentShapefiles(conusCatchment, toLoad, appendShapefile, verbose=True)
 
     # 4. Add index to CONUS catchment
     print "Indexing CONUS shapefile (this may take a while) ..."
@@ -186,342 +315,94 @@ if not args.skipCatchment:
 
 # 5. Create NHDPlus SQLite database to store flowline and stream gage records
 if not args.skipDB:
-    # Remove existing database if it's there
-    if os.access(nhdPlusDB, os.F_OK):
-        os.remove(nhdPlusDB)
-    #conn = sqlite3.connect(nhdPlusDB, isolation_level=None)
-    conn = sqlite3.connect(nhdPlusDB)
-    cursor = conn.cursor()
+    # Find regional and national DBF files of each table
+    dbfPaths = {}
+    for schema in NHDPLUS2_TABLES:
+        dbfPaths[schema.name] = findFiles(schema.dbfName)
+    for table in ['Gage_Loc', 'Gage_Info', 'Gage_Smooth']:
+        # National tables
+        assert(dbfPaths[table])
+        dbfPaths[table] = dbfPaths[table][:1]
     
-    # Create PlusFlowlineVAA table and indices
-    cursor.execute("""CREATE TABLE IF NOT EXISTS PlusFlowlineVAA
-    (ComID INTEGER,
-    Fdate DATETIME,
-    StreamLeve INTEGER,
-    StreamOrde INTEGER,
-    StreamCalc INTEGER,
-    FromNode INTEGER,
-    ToNode INTEGER,
-    Hydroseq INTEGER,
-    LevelPathI INTEGER,
-    Pathlength REAL,
-    TerminalPa INTEGER,
-    ArbolateSu REAL,
-    Divergence INTEGER,
-    StartFlag INTEGER,
-    TerminalFl INTEGER,
-    DnLevel INTEGER,
-    ThinnerCod INTEGER,
-    UpLevelPat INTEGER,
-    UpHydroseq INTEGER,
-    DnLevelPat INTEGER,
-    DnMinorHyd INTEGER,
-    DnDrainCou INTEGER,
-    DnHydroseq INTEGER,
-    FromMeas REAL,
-    ToMeas REAL,
-    ReachCode TEXT,
-    LengthKM REAL,
-    Fcode INTEGER,
-    RtnDiv INTEGER,
-    OutDiv INTEGER,
-    DivEffect INTEGER,
-    VPUIn INTEGER,
-    VPUOut INTEGER,
-    TravTime INTEGER,
-    PathTime INTEGER,
-    AreaSqKM REAL,
-    TotDASqKM REAL,
-    DivDASqKM REAL)
-    """)
-    cursor.execute("""CREATE INDEX IF NOT EXISTS PlusFlowlineVAA_Comid_idx ON PlusFlowlineVAA (ComID)""")
-    cursor.execute("""CREATE INDEX IF NOT EXISTS PlusFlowlineVAA_Reachcode_idx ON PlusFlowlineVAA (ReachCode)""")
-    cursor.execute("""CREATE INDEX IF NOT EXISTS PlusFlowlineVAA_FromMeas_idx ON PlusFlowlineVAA (FromMeas)""")
-    cursor.execute("""CREATE INDEX IF NOT EXISTS PlusFlowlineVAA_ToMeas_idx ON PlusFlowlineVAA (ToMeas)""")
-    
-    # Create PlusFlow table and indices
-    cursor.execute("""CREATE TABLE IF NOT EXISTS PlusFlow
-    (FROMCOMID INTEGER,
-    FROMHYDSEQ INTEGER,
-    FROMLVLPAT INTEGER,
-    TOCOMID INTEGER,
-    TOHYDSEQ INTEGER,
-    TOLVLPAT INTEGER,
-    NODENUMBER INTEGER,
-    DELTALEVEL INTEGER,
-    DIRECTION INTEGER,
-    GAPDISTKM REAL,
-    HasGeo TEXT,
-    TotDASqKM REAL,
-    DivDASqKM REAL)
-    """)
-    cursor.execute("""CREATE INDEX IF NOT EXISTS plusflow_from_idx ON PlusFlow (FROMCOMID)""")
-    cursor.execute("""CREATE INDEX IF NOT EXISTS plusflow_to_idx ON PlusFlow (TOCOMID)""")
-    
-    # Create Gage_Loc table and indices
-    cursor.execute("""CREATE TABLE IF NOT EXISTS Gage_Loc
-    (ComID INTEGER,
-    EventDate DATETIME, 
-    ReachCode TEXT,
-    ReachSMDat INTEGER,
-    Reachresol TEXT,
-    FeatureCom INTEGER,
-    FeatureCla INTEGER,
-    Source_Ori TEXT,
-    Source_Dat TEXT,
-    Source_Fea TEXT,
-    Featuredet TEXT,
-    Measure REAL,
-    Offset INTEGER,
-    EventType TEXT)
-    """)
-    cursor.execute("""CREATE INDEX IF NOT EXISTS gage_loc_source_fea_idx ON Gage_Loc (Source_Fea)""")
-    cursor.execute("""CREATE INDEX IF NOT EXISTS reachcode_measure_idx on Gage_Loc (ReachCode,Measure)""")
-    
-    # Create Gage_Info table
-    # Gage_Info.GageID maps to Gage_Loc.Source_Fea
-    cursor.execute("""CREATE TABLE IF NOT EXISTS Gage_Info
-    (GageID TEXT,
-    Agency_cd TEXT,
-    Station_NM TEXT,
-    State_CD TEXT,
-    State TEXT,
-    SiteStatus TEXT,
-    DA_SQ_Mile REAL,
-    Lon_Site REAL,
-    Lat_Site REAL,
-    Lon_NHD REAL,
-    Lat_NHD REAL,
-    Reviewed TEXT)
-    """)
-    cursor.execute("""CREATE INDEX IF NOT EXISTS gage_info_gageID_idx ON Gage_Info (GageID)""")
-    
-    # Create Gage_Smooth table
-    # Gage_Smooth.SITE_NO maps to Gage_Info.GageID
-    cursor.execute("""CREATE TABLE IF NOT EXISTS Gage_Smooth
-    (SITE_NO TEXT,
-    YEAR INTEGER,
-    MO INTEGER,
-    AVE REAL,
-    COMPLETERE REAL)
-    """)
-    cursor.execute("""CREATE UNIQUE INDEX IF NOT EXISTS gage_smooth_idx ON Gage_Smooth (SITE_NO, YEAR, MO)""")
-    
-    # Create NHDReachCode_Comid table and indices
-    cursor.execute("""CREATE TABLE IF NOT EXISTS NHDReachCode_Comid
-    (COMID INTEGER,
-    REACHCODE TEXT,
-    REACHSMDAT DATETIME,
-    RESOLUTION TEXT,
-    GNIS_ID INTEGER,
-    GNIS_NAME TEXT)
-    """)
-    cursor.execute("""CREATE INDEX IF NOT EXISTS NHDReachCode_Comid_Comid_idx ON NHDReachCode_Comid (COMID)""")
-    cursor.execute("""CREATE INDEX IF NOT EXISTS NHDReachCode_Comid_Reachcode_idx ON NHDReachCode_Comid (REACHCODE)""")
-    
-    # Create NHDFlowline table and indices
-    cursor.execute("""CREATE TABLE IF NOT EXISTS NHDFlowline
-    (COMID INTEGER,
-    FDATE DATETIME,
-    RESOLUTION TEXT,
-    GNIS_ID INTEGER,
-    GNIS_NAME TEXT,
-    LENGTHKM REAL,
-    REACHCODE TEXT,
-    FLOWDIR TEXT,
-    WBAREACOMI INTEGER,
-    FTYPE TEXT,
-    FCODE INTEGER,
-    SHAPE_LENG REAL,
-    ENABLED TEXT,
-    GNIS_NBR INTEGER)
-    """)
-    cursor.execute("""CREATE INDEX IF NOT EXISTS NHDFlowline_Comid_idx ON NHDReachCode_Comid (COMID)""")
-    cursor.execute("""CREATE INDEX IF NOT EXISTS NHDFlowline_Reachcode_idx ON NHDReachCode_Comid (REACHCODE)""")
-    
-    cursor.close()
-    
-    # 5. Import NHDPlus data into SQLite database
-    # Find PlusFlow.dbf files, open each, import into DB
-    print("Importing regional PlusFlowlineVAA.dbf records into CONUS database (this will take a while) ...")
-    cursor = conn.cursor()
-    dbfs = subprocess.check_output("%s %s -type f -iname PlusFlowlineVAA.dbf -print" % (pathOfFind, args.outputDir,), shell=True).split()
-    numFiles = len(dbfs)
-    currFile = 0
-    for file in dbfs:
-        #print file
-        pctComplete = (float(currFile) / float(numFiles)) * 100
-        currFile = currFile + 1
-        sys.stdout.write("\r\tProcessing file %d of %d (%.0f%%)" % (currFile, numFiles, pctComplete))
-        sys.stdout.flush()
-        f = open(file, 'rb')
-        db = list(dbfreader(f))
-        f.close()
-        records = db[2:]
-        for record in records:
-            #print record
-            cursor.execute("""INSERT INTO PlusFlowlineVAA
-    (ComID,Fdate,StreamLeve,StreamOrde,StreamCalc,FromNode,ToNode,Hydroseq,LevelPathI,Pathlength,TerminalPa,ArbolateSu,Divergence,StartFlag,TerminalFl,DnLevel,ThinnerCod,UpLevelPat,UpHydroseq,DnLevelPat,DnMinorHyd,DnDrainCou,DnHydroseq,FromMeas,ToMeas,ReachCode,LengthKM,Fcode,RtnDiv,OutDiv,DivEffect,VPUIn,VPUOut,TravTime,PathTime,AreaSqKM,TotDASqKM,DivDASqKM)
-    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
-            (record[0], record[1].strftime("%Y-%m-%d %H:%M:%S"), record[2], record[3], record[4], record[5], record[6], record[7], record[8], float(record[9]), record[10], float(record[11]), record[12], record[13], record[14], record[15], record[16], record[17], record[18], record[19], record[20], record[21], record[22], float(record[23]), float(record[24]), unicode(record[25], errors='replace'), float(record[26]), record[27], record[28], record[29], record[30], record[31], record[32], float(record[33]), float(record[34]), float(record[35]), float(record[36]), float(record[37])))
-    conn.commit()
-    cursor.close()
-    
-    pctComplete = (float(currFile) / float(numFiles)) * 100
-    sys.stdout.write("\r\tProcessing file %d of %d (%.0f%%)\n" % (currFile, numFiles, pctComplete)) 
-    
-    # Find PlusFlow.dbf files, open each, import into DB
-    print("Importing regional PlusFlow.dbf records into CONUS database (this will take a while) ...")
-    cursor = conn.cursor()
-    dbfs = subprocess.check_output("%s %s -type f -iname PlusFlow.dbf -print" % (pathOfFind, args.outputDir,), shell=True).split()
-    numFiles = len(dbfs)
-    currFile = 0
-    for file in dbfs:
-        #print file
-        pctComplete = (float(currFile) / float(numFiles)) * 100
-        currFile = currFile + 1
-        sys.stdout.write("\r\tProcessing file %d of %d (%.0f%%)" % (currFile, numFiles, pctComplete))
-        sys.stdout.flush()
-        f = open(file, 'rb')
-        db = list(dbfreader(f))
-        f.close()
-        records = db[2:]
-        for record in records:
-            #print record
-            cursor.execute("""INSERT INTO PlusFlow
-    (FROMCOMID,FROMHYDSEQ,FROMLVLPAT,TOCOMID,TOHYDSEQ,TOLVLPAT,NODENUMBER,DELTALEVEL,DIRECTION,GAPDISTKM,HasGeo,TotDASqKM,DivDASqKM)
-    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)""",
-            (record[0], record[1], record[2], record[3], record[4], record[5], record[6], record[7], record[8], float(record[9]), record[10], float(record[11]), float(record[12])))
-    conn.commit()
-    cursor.close()
-    
-    pctComplete = (float(currFile) / float(numFiles)) * 100
-    sys.stdout.write("\r\tProcessing file %d of %d (%.0f%%)\n" % (currFile, numFiles, pctComplete)) 
-    
-    # Find NHDReachCode_Comid.dbf files, open each, import into DB    
-    print("Importing regional NHDReachCode_Comid.dbf records into CONUS database (this will take a while) ...")
-    cursor = conn.cursor()
-    dbfs = subprocess.check_output("%s %s -type f -iname NHDReachCode_Comid.dbf -print" % (pathOfFind, args.outputDir,), shell=True).split()
-    numFiles = len(dbfs)
-    currFile = 0
-    for file in dbfs:
-        #print file
-        pctComplete = (float(currFile) / float(numFiles)) * 100
-        currFile = currFile + 1
-        sys.stdout.write("\r\tProcessing file %d of %d (%.0f%%)" % (currFile, numFiles, pctComplete))
-        sys.stdout.flush()
-        f = open(file, 'rb')
-        db = list(dbfreader(f))
-        f.close()
-        records = db[2:]
-        for record in records:
-            #print record
-            cursor.execute("""INSERT INTO NHDReachCode_Comid
-    (COMID,REACHCODE,REACHSMDAT,RESOLUTION,GNIS_ID,GNIS_NAME)
-    VALUES (?,?,?,?,?,?)""",
-            (record[0], unicode(record[1], errors='replace'), record[2].strftime("%Y-%m-%d %H:%M:%S"), unicode(record[3], errors='replace'), record[4], unicode(record[5], errors='replace')))
-    conn.commit()
-    cursor.close()
-    
-    pctComplete = (float(currFile) / float(numFiles)) * 100
-    sys.stdout.write("\r\tProcessing file %d of %d (%.0f%%)\n" % (currFile, numFiles, pctComplete)) 
-    
-    # Find NHDFlowline.dbf files, open each, import into DB 
-    print("Importing regional NHDFlowline.dbf records into CONUS database (this will take a while) ...")
-    cursor = conn.cursor()
-    dbfs = subprocess.check_output("%s %s -type f -iname NHDFlowline.dbf -print" % (pathOfFind, args.outputDir,), shell=True).split()
-  
-    numFiles = len(dbfs)
-    currFile = 0
-    for file in dbfs:
-        #print file
-        pctComplete = (float(currFile) / float(numFiles)) * 100
-        currFile = currFile + 1
-        sys.stdout.write("\r\tProcessing file %d of %d (%.0f%%)" % (currFile, numFiles, pctComplete))
-        sys.stdout.flush()
-        f = open(file, 'rb')
-        db = list(dbfreader(f))
-        f.close()
-        records = db[2:]
-        for record in records:
-            #print record
-            # Handle case where NHDFlowline record lacks GNIS_NBR attribute
-            try:
-                GNIS_NBR = record[13]
-            except IndexError:
-                GNIS_NBR = 0
-            cursor.execute("""INSERT INTO NHDFlowline
-    (COMID,FDATE,RESOLUTION,GNIS_ID,GNIS_NAME,LENGTHKM,REACHCODE,FLOWDIR,WBAREACOMI,FTYPE,FCODE,SHAPE_LENG,ENABLED,GNIS_NBR)
-    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
-            (record[0], record[1].strftime("%Y-%m-%d %H:%M:%S"), unicode(record[2], errors='replace'), record[3], unicode(record[4], errors='replace'), float(record[5]), unicode(record[6], errors='replace'), unicode(record[7], errors='replace'), record[8], unicode(record[9], errors='replace'), record[10], float(record[11]), unicode(record[12], errors='replace'), GNIS_NBR))
-    conn.commit()
-    cursor.close()
-    
-    pctComplete = (float(currFile) / float(numFiles)) * 100
-    sys.stdout.write("\r\tProcessing file %d of %d (%.0f%%)\n" % (currFile, numFiles, pctComplete)) 
-    
-    # Find GageLoc.dbf file, import into DB 
-    print("Importing national GageLoc.dbf ...")
-    cursor = conn.cursor()
-    dbf = subprocess.check_output("%s %s -type f -iname GageLoc.dbf -print" % (pathOfFind, args.outputDir,), shell=True).split()[0]
-    assert(dbf)
-    print dbf
-    f = open(dbf, 'rb')
-    db = list(dbfreader(f))
-    f.close()
-    records = db[2:]
-    for record in records:
-        #print record
-        cursor.execute("""INSERT INTO Gage_Loc
-    (ComID,EventDate,ReachCode,ReachSMDat,Reachresol,FeatureCom,FeatureCla,Source_Ori,Source_Dat,Source_Fea,Featuredet,Measure,Offset,EventType)
-    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
-        (record[0], record[1].strftime("%Y-%m-%d %H:%M:%S"), unicode(record[2], errors='replace'), record[3], unicode(record[4], errors='replace'), record[5], record[6], unicode(record[7], errors='replace'), unicode(record[8], errors='replace'), unicode(record[9], errors='replace'), unicode(record[10], errors='replace'), float(record[11]), record[12], unicode(record[13], errors='replace')))
-    conn.commit()
-    cursor.close()
-    
-    # Find GageInfo.dbf file, import into DB 
-    print("Importing national GageInfo.dbf ...")
-    cursor = conn.cursor()
-    dbf = subprocess.check_output("%s %s -type f -iname GageInfo.dbf -print" % (pathOfFind, args.outputDir,), shell=True).split()[0]
-    assert(dbf)
-    print dbf
-    f = open(dbf, 'rb')
-    db = list(dbfreader(f))
-    f.close()
-    records = db[2:]
-    for record in records:
-        #print record
-        # Handle presence of undocumented NHD2DAGE_D field (if present)
-        if len(record) > 12:
-            cursor.execute("""INSERT INTO Gage_Info
-        (GageID,Agency_cd,Station_NM,State_CD,State,SiteStatus,DA_SQ_Mile,Lon_Site,Lat_Site,Lon_NHD,Lat_NHD,Reviewed)
-        VALUES (?,?,?,?,?,?,?,?,?,?,?,?)""",
-            (unicode(record[0],errors='replace'), unicode(record[1], errors='replace'), unicode(record[2], errors='replace'), unicode(record[3], errors='replace'), unicode(record[4], errors='replace'), unicode(record[5], errors='replace'), float(record[6]), float(record[7]), float(record[8]), float(record[9]), float(record[10]), unicode(record[12], errors='replace') ))
-        else:
-            cursor.execute("""INSERT INTO Gage_Info
-        (GageID,Agency_cd,Station_NM,State_CD,State,SiteStatus,DA_SQ_Mile,Lon_Site,Lat_Site,Lon_NHD,Lat_NHD,Reviewed)
-        VALUES (?,?,?,?,?,?,?,?,?,?,?,?)""",
-            (unicode(record[0],errors='replace'), unicode(record[1], errors='replace'), unicode(record[2], errors='replace'), unicode(record[3], errors='replace'), unicode(record[4], errors='replace'), unicode(record[5], errors='replace'), float(record[6]), float(record[7]), float(record[8]), float(record[9]), float(record[10]), unicode(record[11], errors='replace') ))
-    conn.commit()
-    cursor.close()
-    
-    # Find Gage_Smooth.DBF file, import into DB 
-    print("Importing national Gage_Smooth.DBF ...")
-    cursor = conn.cursor()
-    dbf = subprocess.check_output("%s %s -type f -iname Gage_Smooth.DBF -print" % (pathOfFind, args.outputDir,), shell=True).split()[0]
-    assert(dbf)
-    print dbf
-    f = open(dbf, 'rb')
-    db = list(dbfreader(f))
-    f.close()
-    records = db[2:]
-    for record in records:
-        #print record
-        cursor.execute("""INSERT INTO Gage_Smooth
-    (SITE_NO,YEAR,MO,AVE,COMPLETERE)
-    VALUES (?,?,?,?,?)""",
-        (unicode(record[0], errors='replace'), record[1], record[2], float(record[3]), float(record[4]) ))
-    conn.commit()
-    cursor.close()
-    
-    conn.close()
\ No newline at end of file
+    # Stream records into the database, indexes are created once all tables are loaded.
+    # DBF files already loaded are skipped, those that have changed are re-loaded.
+    print("Importing NHDPlus DBF records into CONUS database (this will take a while) ...")
+    conn = sqlite3.connect(nhdPlusDB)
+    if args.processes > 1:
+        # Load each regional VPU into a staging database in parallel, then merge them
+        numRows = loadNHDPlusDBParallel(conn, dbfPaths, args.outputDir, 
+                                        processes=args.processes, verbose=True,
+                                        incremental=True, sourceRoot=args.outputDir)
+    else:
+        numRows = loadNHDPlusDB(conn, dbfPaths, verbose=True,
+                                incremental=True, sourceRoot=args.outputDir)
+    conn.close()
+    for schema in NHDPLUS2_TABLES:
+        print("%s: %d records" % (schema.name, numRows[schema.name]))
+
+# 6. Build upstream graph of PlusFlow network for traversal without DB queries
+if not args.skipGraph:
+    print("Building upstream graph of PlusFlow network ...")
+    conn = sqlite3.connect(nhdPlusDB)
+    graph = UpstreamGraph.fromDB(conn)
+    conn.close()
+    graph.save(upstreamGraph)
+    print("Upstream graph of %d reaches written to %s" % (graph.numReaches, upstreamGraph))
+    print("Set 'NHDPLUS2', 'PATH_OF_NHDPLUS2_UPSTREAM_GRAPH' to %s in your configuration file" % \
+          (upstreamGraph,))
+
+# 7. Label PlusFlow network with nested intervals for upstream range queries
+if not args.skipIntervals:
+    print("Labelling PlusFlow network with nested intervals ...")
+    if os.path.isdir(upstreamGraph):
+        graph = UpstreamGraph.load(upstreamGraph, mmap=False)
+    else:
+        conn = sqlite3.connect(nhdPlusDB)
+        graph = UpstreamGraph.fromDB(conn)
+        conn.close()
+    conn = sqlite3.connect(nhdPlusDB)
+    (numReaches, numExceptions) = writeNestedIntervals(conn, graph)
+    conn.close()
+    print("Labelled %d reaches, %d divergence/braid exceptions" % (numReaches, numExceptions))
+
+# 8. Index extents of CONUS catchments so that watershed extents can be computed without geometry I/O
+if not args.skipExtents:
+    print("Indexing extents of CONUS catchments (this may take a while) ...")
+    if not os.access(conusCatchment, os.R_OK):
+        sys.exit("Catchment database %s does not exist or is not readable, run without --skipCatchment to create it" % \
+                 (conusCatchment,))
+    conn = sqlite3.connect(conusCatchment)
+    if isExtentTableComplete(conn):
+        # Extents were merged or written as catchments were loaded
+        print("Extents of all catchments already indexed in %s" % (conusCatchment,))
+    else:
+        numExtents = writeCatchmentExtents(conn)
+        print("Extents of %d catchments written to %s" % (numExtents, conusCatchment))
+    conn.close()
+
+# 9. Precompute ComID of the flowline each streamflow gage is located on
+if not args.skipGageComID:
+    print("Precomputing ComIDs of streamflow gages ...")
+    conn = sqlite3.connect(nhdPlusDB)
+    numGages = writeGageComIdTable(conn)
+    conn.close()
+    print("ComIDs of %d gages written to %s" % (numGages, nhdPlusDB))
+
+# 10. Index station names and attributes of streamflow gages for search
+if not args.skipGageSearch:
+    print("Indexing station names and attributes of streamflow gages ...")
+    conn = sqlite3.connect(nhdPlusDB)
+    numGages = writeGageInfoIndex(conn)
+    conn.close()
+    if numGages is None:
+        print("SQLite does not support FTS5, only attributes of streamflow gages indexed")
+    else:
+        print("Station names of %d gages indexed in %s" % (numGages, nhdPlusDB))
+
+# 11. Partition CONUS databases by VPU
+if args.partitions:
+    print("Partitioning CONUS databases by VPU (this may take a while) ...")
+    routingDB = writePartitions(nhdPlusDB, conusCatchment, partitionDir,
+                                processes=args.processes, verbose=True)
+    print("Set 'NHDPLUS2', 'PATH_OF_NHDPLUS2_PARTITIONS' to %s in your configuration file" % \
+          (routingDB,))
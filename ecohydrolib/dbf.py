@@ -2,6 +2,9 @@
     
 @brief Methods for reading and write DBF data files
 @brief Adapted from: http://code.activestate.com/recipes/362715-dbf-reader-and-writer/
+@brief dbfcolumnreader memory-maps a DBF file and decodes only the columns requested,
+in chunks of records, into typed numpy arrays.  DBFWriter writes records from any
+iterable or from numpy arrays in blocks, without holding them in memory.
 
 This software is provided free of charge under the New BSD License. Please see
 the following license information:
@@ -37,6 +40,13 @@ OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 import struct, datetime, decimal, itertools
 
+import numpy as np
+
+DEFAULT_CHUNK_SIZE = 65536
+# Most digits, to either side of the decimal point, that can be accumulated in an int64 
+#   without overflow
+MAX_VECTORIZED_DIGITS = 18
+
 def dbfreader(f):
     """ Returns an iterator over records in a Xbase DBF file.
 
@@ -105,10 +115,372 @@ def dbfreader(f):
         yield result
 
 
+def dbffields(f):
+    """ Read the header of a Xbase DBF file.
+
+        @param f A file descriptor, positioned at the start of the file
+        @return Tuple(number of records, length of header, length of record, list of fields)
+        where each field is a tuple (name, type, size, decimal places, offset of field in record)
+    """
+    numrec, lenheader, lenrecord = struct.unpack('<xxxxLHH20x', f.read(32))
+    numfields = (lenheader - 33) // 32
+
+    fields = []
+    offset = 1                              # deletion flag
+    for fieldno in xrange(numfields):
+        name, typ, size, deci = struct.unpack('<11sc4xBB14x', f.read(32))
+        name = name.replace('\0', '')
+        fields.append((name, typ, size, deci, offset))
+        offset += size
+    return (numrec, lenheader, lenrecord, fields)
+
+
+def _decodeNumericValues(raw, isFloat):
+    """ Decode a 2-d uint8 array of fixed-width numeric field values one value at a time """
+    values = [v.replace('\0', '').strip() or '0' for v in raw.view('S%d' % (raw.shape[1],)).ravel()]
+    return np.array(values, dtype=np.float64 if isFloat else np.int64)
+
+
+def _decodeDigits(raw, isBlock, powers):
+    """ Accumulate the digits of a block (e.g. the integer part) of each value into an int64 """
+    # Number of digits of the block to the right of each position
+    digitsRight = np.cumsum(isBlock[:, ::-1], axis=1)[:, ::-1] - isBlock
+    return np.where(isBlock, (raw.astype(np.int64) - ord('0')) * powers[digitsRight], 0).sum(axis=1)
+
+
+def _decodeNumeric(raw, deci, typ):
+    """ Decode a 2-d uint8 array of fixed-width numeric field values into a 1-d array.
+        Fields without decimal places are decoded as int64, others as float64;
+        empty fields are decoded as 0.  The digits to the left and right of the 
+        decimal point are accumulated separately, so that wide fields (e.g. N(19,11))
+        are decoded without overflow.
+    """
+    isDigit = (raw >= ord('0')) & (raw <= ord('9'))
+    isBlank = (raw == ord(' ')) | (raw == 0)
+    isPoint = raw == ord('.')
+    isMinus = raw == ord('-')
+    isFloat = bool(deci) or typ == 'F'
+    if not np.all(isDigit | isBlank | isPoint | isMinus | (raw == ord('+'))):
+        # Exponents or overflow markers: decode each value
+        return _decodeNumericValues(raw, isFloat)
+    hasPoint = isPoint.any(axis=1)
+    pointColumn = np.where(hasPoint, isPoint.argmax(axis=1), raw.shape[1])
+    isFraction = isDigit & (np.arange(raw.shape[1]) > pointColumn[:, np.newaxis])
+    isInteger = isDigit & ~isFraction
+    integerDigits = isInteger.sum(axis=1)
+    fractionDigits = isFraction.sum(axis=1)
+    if raw.shape[0] > 0 and max(integerDigits.max(), fractionDigits.max()) > MAX_VECTORIZED_DIGITS:
+        # Values too wide to be accumulated in an int64
+        return _decodeNumericValues(raw, isFloat)
+    powers = 10 ** np.arange(MAX_VECTORIZED_DIGITS + 1, dtype=np.int64)
+    isNegative = isMinus.any(axis=1)
+    integer = _decodeDigits(raw, isInteger, powers)
+    if not isFloat:
+        integer[isNegative] *= -1
+        return integer
+    fraction = _decodeDigits(raw, isFraction, powers)
+    scale = 10.0 ** fractionDigits
+    # Divide the whole mantissa if it is exactly representable as a float64, so that 
+    #   values are rounded once
+    fits = integerDigits + fractionDigits <= MAX_VECTORIZED_DIGITS
+    mantissa = integer * powers[np.where(fits, fractionDigits, 0)] + fraction
+    exact = fits & (mantissa < 2 ** 53)
+    values = np.where(exact, mantissa / scale, integer + fraction / scale)
+    values[isNegative] *= -1
+    return values
+
+
+def _decodeDate(raw):
+    """ Decode a 2-d uint8 array of YYYYMMDD date field values into a datetime64[D] array.
+        Empty dates are decoded as 1900-01-01.
+    """
+    digits = raw.astype(np.int64) - ord('0')
+    empty = ~((raw >= ord('0')) & (raw <= ord('9'))).all(axis=1)
+    digits[empty] = [1, 9, 0, 0, 0, 1, 0, 1]
+    year = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+    month = digits[:, 4] * 10 + digits[:, 5]
+    day = digits[:, 6] * 10 + digits[:, 7]
+    months = (year - 1970) * 12 + month - 1
+    return months.astype('datetime64[M]').astype('datetime64[D]') + (day - 1).astype('timedelta64[D]')
+
+
+def _decodeColumn(raw, typ, deci):
+    """ Decode a 2-d uint8 array of fixed-width field values into a 1-d typed array """
+    if typ in ('N', 'F'):
+        return _decodeNumeric(raw, deci, typ)
+    if typ == 'D':
+        return _decodeDate(raw)
+    values = raw.view('S%d' % (raw.shape[1],)).ravel()
+    if typ == 'L':
+        return values
+    return np.char.strip(values)
+
+
+def _selectFields(filename, fields, columns):
+    """ Match names of columns to fields, returning a list of tuples (column, field) """
+    byName = dict([(field[0].lower(), field) for field in fields])
+    if columns is None:
+        columns = [field[0] for field in fields]
+    selected = []
+    for column in columns:
+        try:
+            selected.append((column, byName[column.lower()]))
+        except KeyError:
+            raise KeyError("Column %s not in %s" % (column, filename))
+    return selected
+
+
+def dbfcolumnreader(filename, columns=None, chunksize=DEFAULT_CHUNK_SIZE):
+    """ Returns an iterator over chunks of records of a Xbase DBF file, decoding only the
+        columns requested into typed numpy arrays.
+
+        @param filename String representing the path of the DBF file, which is memory-mapped
+        @param columns List of names of columns to decode (matched case insensitively), 
+        if None all columns will be decoded
+        @param chunksize Integer representing the number of records to decode at a time
+        @return An iterator of dicts mapping column names, as given in columns, to 1-d arrays 
+        of the values of the non-deleted records of each chunk.  Numeric fields are decoded
+        as int64, or as float64 if they have decimal places; date fields as datetime64[D];
+        logical fields as 1 character strings; other fields as strings stripped of whitespace.
+        Empty numeric fields are decoded as 0, and empty dates as 1900-01-01, as in dbfreader.
+        
+        @raise KeyError if a column is not in the DBF file
+    """
+    with open(filename, 'rb') as f:
+        numrec, lenheader, lenrecord, fields = dbffields(f)
+        f.seek(0, 2)
+        filesize = f.tell()
+    selected = _selectFields(filename, fields, columns)
+    # Ignore the count of records beyond the end of a truncated file
+    numrec = min(numrec, max(0, (filesize - lenheader) // lenrecord))
+    if numrec == 0:
+        return
+    records = np.memmap(filename, dtype=np.uint8, mode='r', offset=lenheader,
+                        shape=(numrec, lenrecord))
+    try:
+        for start in xrange(0, numrec, chunksize):
+            block = records[start:start + chunksize]
+            # Deleted records are marked with '*'
+            active = block[:, 0] == ord(' ')
+            chunk = {}
+            for (column, (name, typ, size, deci, offset)) in selected:
+                raw = np.ascontiguousarray(block[active, offset:offset + size])
+                chunk[column] = _decodeColumn(raw, typ, deci)
+            yield chunk
+    finally:
+        del records
+
+
+def dbfreadcolumns(filename, columns=None, chunksize=DEFAULT_CHUNK_SIZE):
+    """ Read columns of a Xbase DBF file into typed numpy arrays.  See dbfcolumnreader.
+
+        @param filename String representing the path of the DBF file
+        @param columns List of names of columns to read, if None all columns will be read
+        @param chunksize Integer representing the number of records to decode at a time
+        @return Dict mapping column names to 1-d arrays of the values of non-deleted records
+    """
+    chunks = list(dbfcolumnreader(filename, columns, chunksize))
+    if len(chunks) == 0:
+        with open(filename, 'rb') as f:
+            fields = dbffields(f)[3]
+        return dict([(column, _decodeColumn(np.zeros((0, size), dtype=np.uint8), typ, deci)) \
+                     for (column, (name, typ, size, deci, offset)) in _selectFields(filename, fields, columns)])
+    return dict([(column, np.concatenate([chunk[column] for chunk in chunks])) for column in chunks[0]])
+
+
+def _toBytes(values, size):
+    """ Convert strings into a 2-d uint8 array of fixed-width values, truncated to size
+        characters and padded with spaces
+    """
+    values = np.ascontiguousarray(values, dtype='S%d' % (size,))
+    raw = values.view(np.uint8).reshape(len(values), size)
+    return np.where(raw == 0, np.uint8(ord(' ')), raw)
+
+
+def _formatNumeric(values, size, deci):
+    """ Format numbers into a 2-d uint8 array of right-aligned, fixed-width values with deci
+        decimal places, without formatting each finite value in Python.  Non-finite values
+        (NaN, inf) are formatted as by str().
+        
+        @raise TypeError if values are not numbers
+        @raise ValueError if a value does not fit in size characters, or if values of a field
+        without decimal places are not integers
+    """
+    values = np.asarray(values)
+    if values.dtype.kind not in 'iuf':
+        raise TypeError("Values of a numeric field must be numbers")
+    if deci or values.dtype.kind == 'f':
+        values = values.astype(np.float64)
+        finite = np.isfinite(values)
+        magnitude = np.where(finite, np.abs(values), 0.0)
+        if not deci and (magnitude != np.floor(magnitude)).any():
+            raise ValueError("Values of a numeric field without decimal places must be integers")
+        if (magnitude * 10 ** deci >= 10.0 ** MAX_VECTORIZED_DIGITS).any():
+            raise ValueError("Values are too large to be formatted as integers")
+        scaled = np.round(magnitude * 10 ** deci).astype(np.int64)
+    else:
+        values = values.astype(np.int64)
+        finite = np.ones(len(values), dtype=np.bool_)
+        scaled = np.abs(values)
+    negative = (np.where(finite, values, 0) < 0) & (scaled > 0)
+    numRows = len(scaled)
+    # Number of digits of each value, with at least one digit before the decimal point
+    numDigits = np.ones(numRows, dtype=np.int64)
+    remaining = scaled // 10
+    while remaining.any():
+        numDigits += remaining > 0
+        remaining //= 10
+    numDigits = np.maximum(numDigits, deci + 1)
+    width = np.where(finite, numDigits + negative + (1 if deci else 0), 0)
+    if numRows and width.max() > size:
+        raise ValueError("Value %s is too wide for a numeric field of size %d" % \
+                         (values[width.argmax()], size))
+    raw = np.empty((numRows, size), dtype=np.uint8)
+    raw.fill(ord(' '))
+    if numRows == 0:
+        return raw
+    if deci:
+        raw[:, size - 1 - deci] = ord('.')
+    for digit in xrange(int(numDigits.max())):
+        column = size - 1 - digit - (1 if deci and digit >= deci else 0)
+        rows = digit < numDigits
+        raw[rows, column] = ord('0') + (scaled[rows] // 10 ** digit) % 10
+    rows = np.flatnonzero(negative)
+    raw[rows, size - width[rows]] = ord('-')
+    for row in np.flatnonzero(~finite):
+        formatted = str(values[row]).rjust(size, ' ')
+        if len(formatted) > size:
+            raise ValueError("Value %s is too wide for a numeric field of size %d" % (formatted, size))
+        raw[row] = np.frombuffer(formatted, dtype=np.uint8)
+    return raw
+
+
+def _formatColumn(values, typ, size, deci):
+    """ Format the values of a field into a 2-d uint8 array of fixed-width values """
+    if typ == 'N':
+        try:
+            return _formatNumeric(values, size, deci)
+        except (TypeError, ValueError, OverflowError):
+            # E.g. blank values given as strings, or non-integral values of integer fields
+            formatted = [str(value).rjust(size, ' ') for value in values]
+            assert all(len(value) == size for value in formatted)
+            return _toBytes(formatted, size)
+    if typ == 'D':
+        dates = np.asarray(values, dtype='datetime64[D]').astype('S10')
+        raw = dates.view(np.uint8).reshape(len(dates), 10)
+        return raw[:, [0, 1, 2, 3, 5, 6, 8, 9]]
+    if typ == 'L':
+        return _toBytes(np.char.upper(np.asarray(values).astype('S1')), size)
+    return _toBytes(np.asarray(values).astype('S%d' % (size,)), size)
+
+
+class DBFWriter(object):
+    """ Writes records to a Xbase DBF file in vectorized blocks, so that records need not
+        be held in memory.  The number of records is written into the header when the
+        writer is closed.
+        
+        Usage:
+        @code
+        with open('attributes.dbf', 'wb') as f:
+            with DBFWriter(f, fieldnames, fieldspecs) as writer:
+                writer.writeRecords(records)
+        @endcode
+    """
+    def __init__(self, f, fieldnames, fieldspecs, chunksize=DEFAULT_CHUNK_SIZE):
+        """ Write the header of a DBF file.
+        
+            @param f File descriptor, should be open for writing in a binary mode, and seekable.
+            @param fieldnames List of field names, should be no longer than ten characters and not include \x00.
+            @param fieldspecs List of field specifications, in the form (type, size, deci), see dbfwriter.
+            @param chunksize Integer representing the number of records to format at a time
+        """
+        self.f = f
+        self.fieldnames = list(fieldnames)
+        self.fieldspecs = list(fieldspecs)
+        self.chunksize = chunksize
+        self.numrec = 0
+        self.closed = False
+        self.lenrecord = sum(field[1] for field in self.fieldspecs) + 1
+        
+        # header info, the number of records is written on close
+        self.start = f.tell()
+        ver = 3
+        now = datetime.datetime.now()
+        yr, mon, day = now.year-1900, now.month, now.day
+        numfields = len(self.fieldspecs)
+        lenheader = numfields * 32 + 33
+        hdr = struct.pack('<BBBBLHH20x', ver, yr, mon, day, 0, lenheader, self.lenrecord)
+        f.write(hdr)
+        
+        # field specs
+        for name, (typ, size, deci) in itertools.izip(self.fieldnames, self.fieldspecs):
+            name = name.ljust(11, '\x00')
+            fld = struct.pack('<11sc4xBB14x', name, typ, size, deci)
+            f.write(fld)
+        
+        # terminator
+        f.write('\r')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _writeColumns(self, columns, numRows):
+        """ Format and write a block of records given as a list of columns """
+        block = np.empty((numRows, self.lenrecord), dtype=np.uint8)
+        block[:, 0] = ord(' ')                 # deletion flag
+        offset = 1
+        for (typ, size, deci), values in itertools.izip(self.fieldspecs, columns):
+            block[:, offset:offset + size] = _formatColumn(values, typ, size, deci)
+            offset += size
+        self.f.write(block.tostring())
+        self.numrec += numRows
+
+    def writeRecords(self, records):
+        """ Write records
+        
+            @param records An iterable over the records (sequences of field values), 
+            e.g. a generator
+        """
+        records = iter(records)
+        while True:
+            chunk = list(itertools.islice(records, self.chunksize))
+            if len(chunk) == 0:
+                break
+            self._writeColumns(zip(*chunk), len(chunk))
+
+    def writeArray(self, array):
+        """ Write records from columns of values
+        
+            @param array A numpy structured array, or a dict mapping field names to
+            1-d arrays, with a field for each field name of the DBF file
+        """
+        columns = [array[name] for name in self.fieldnames]
+        numRows = len(columns[0]) if columns else 0
+        for start in xrange(0, numRows, self.chunksize):
+            self._writeColumns([column[start:start + self.chunksize] for column in columns],
+                               min(self.chunksize, numRows - start))
+
+    def close(self):
+        """ Write the end of file marker and the number of records written.  The file
+            descriptor is not closed.
+        """
+        if self.closed:
+            return
+        self.f.write('\x1A')
+        end = self.f.tell()
+        self.f.seek(self.start + 4)
+        self.f.write(struct.pack('<L', self.numrec))
+        self.f.seek(end)
+        self.closed = True
+
+
 def dbfwriter(f, fieldnames, fieldspecs, records):
-    """ Return a string suitable for writing directly to a binary dbf file.
+    """ Write records to a binary dbf file.  See DBFWriter.
 
-        @param f File descriptor, should be open for writing in a binary mode.
+        @param f File descriptor, should be open for writing in a binary mode, and seekable.
         @param fieldnames List of field names, should be no longer than ten characters and not include \x00.
         @param fieldspecs List of field specifications, in the form (type, size, deci) where
             type is one of:
@@ -119,45 +491,14 @@ def dbfwriter(f, fieldnames, fieldspecs, records):
                 L for logical values 'T', 'F', or '?'
             size is the field width
             deci is the number of decimal places in the provided decimal object
-        @param records An iterable over the records (sequences of field values).
+        @param records An iterable over the records (sequences of field values), 
+        or a numpy structured array.
     """
-    # header info
-    ver = 3
-    now = datetime.datetime.now()
-    yr, mon, day = now.year-1900, now.month, now.day
-    numrec = len(records)
-    numfields = len(fieldspecs)
-    lenheader = numfields * 32 + 33
-    lenrecord = sum(field[1] for field in fieldspecs) + 1
-    hdr = struct.pack('<BBBBLHH20x', ver, yr, mon, day, numrec, lenheader, lenrecord)
-    f.write(hdr)
-                      
-    # field specs
-    for name, (typ, size, deci) in itertools.izip(fieldnames, fieldspecs):
-        name = name.ljust(11, '\x00')
-        fld = struct.pack('<11sc4xBB14x', name, typ, size, deci)
-        f.write(fld)
-
-    # terminator
-    f.write('\r')
-
-    # records
-    for record in records:
-        f.write(' ')                        # deletion flag
-        for (typ, size, deci), value in itertools.izip(fieldspecs, record):
-            if typ == "N":
-                value = str(value).rjust(size, ' ')
-            elif typ == 'D':
-                value = value.strftime('%Y%m%d')
-            elif typ == 'L':
-                value = str(value)[0].upper()
-            else:
-                value = str(value)[:size].ljust(size, ' ')
-            assert len(value) == size
-            f.write(value)
-
-    # End of file
-    f.write('\x1A')
+    with DBFWriter(f, fieldnames, fieldspecs) as writer:
+        if isinstance(records, np.ndarray):
+            writer.writeArray(records)
+        else:
+            writer.writeRecords(records)
 
 
 # -------------------------------------------------------
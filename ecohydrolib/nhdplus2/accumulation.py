@@ -0,0 +1,241 @@
+"""@package ecohydrolib.nhdplus2.accumulation
+
+@brief Accumulate per-reach (i.e. per-catchment) attributes downstream through the
+NHDPlus V2 PlusFlow network, yielding the upstream total of each attribute for 
+every reach at once.
+@brief The network is sorted topologically once: PlusFlow edges are oriented by 
+Hydroseq (which decreases downstream), and reaches are grouped into levels such that
+every reach is on a higher level than all reaches upstream of it.  Accumulating an
+attribute is then a single vectorized pass over the levels.  As with the NHDPlus
+divergence-routed drainage area (DivDASqKM), everything upstream of a divergence
+is routed down the main path; minor paths (Divergence=2) only accumulate values
+from their own catchments downward.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2015, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+@author Brian Miles <brian_miles@unc.edu>
+"""
+import re
+
+import numpy as np
+
+COMID_DTYPE = np.int64
+INDEX_DTYPE = np.int64
+
+# Divergence code of the minor path(s) downstream of a divergence
+MINOR_PATH = 2
+
+IDENTIFIER_RE = re.compile('^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+class UpstreamAccumulator(object):
+    """ Topologically sorted PlusFlow network.  Reaches are stored in ascending ComID
+        order; edges are stored grouped by the level of their upstream reach, edges
+        whose upstream reach is on level l being 
+        edgeFrom[edgeOffsets[l]:edgeOffsets[l+1]].
+    """
+    def __init__(self, comids, hydroseqs, divergences, fromComids, toComids):
+        """ Construct an accumulator
+
+            @param comids Sequence of integers representing ComIDs of reaches (PlusFlowlineVAA.ComID)
+            @param hydroseqs Sequence of integers representing Hydroseq of each reach
+            @param divergences Sequence of integers representing Divergence of each reach
+            @param fromComids Sequence of ComIDs of the upstream end of each edge (PlusFlow.FROMCOMID)
+            @param toComids Sequence of ComIDs of the downstream end of each edge (PlusFlow.TOCOMID)
+
+            @note Edges to or from reaches not in comids, and edges that do not lead to a 
+            reach with a smaller Hydroseq, are ignored.
+
+            @raise Exception if the network contains a cycle
+        """
+        comids = np.asarray(comids, dtype=COMID_DTYPE)
+        order = np.argsort(comids, kind='mergesort')
+        self.comids = comids[order]
+        hydroseqs = np.asarray(hydroseqs, dtype=np.int64)[order]
+        divergences = np.asarray(divergences, dtype=np.int64)[order]
+        n = len(self.comids)
+
+        fromIdx = self.indexOf(fromComids)
+        toIdx = self.indexOf(toComids)
+        isEdge = (fromIdx != -1) & (toIdx != -1)
+        fromIdx = fromIdx[isEdge]
+        toIdx = toIdx[isEdge]
+        # Orient edges downstream by Hydroseq, this guarantees the network is acyclic
+        isEdge = hydroseqs[fromIdx] > hydroseqs[toIdx]
+        fromIdx = fromIdx[isEdge]
+        toIdx = toIdx[isEdge]
+        if len(fromIdx) > 0:
+            keys = np.unique(fromIdx * n + toIdx)
+            fromIdx = keys // n
+            toIdx = keys % n
+
+        # Level of each reach is the length of the longest path to it from a headwater
+        level = np.zeros(n, dtype=INDEX_DTYPE)
+        inDegree = np.bincount(toIdx, minlength=n)
+        downOffsets = np.zeros(n + 1, dtype=INDEX_DTYPE)
+        np.cumsum(np.bincount(fromIdx, minlength=n), out=downOffsets[1:])
+        frontier = np.flatnonzero(inDegree == 0)
+        numVisited = 0
+        numLevels = 0
+        while len(frontier) > 0:
+            level[frontier] = numLevels
+            numVisited += len(frontier)
+            numLevels += 1
+            # Edges are sorted by upstream reach, gather the edges of the frontier
+            starts = downOffsets[frontier]
+            counts = downOffsets[frontier + 1] - starts
+            total = counts.sum()
+            if total == 0:
+                break
+            rangeStarts = np.cumsum(counts) - counts
+            edges = np.repeat(starts - rangeStarts, counts) + np.arange(total)
+            downstream = toIdx[edges]
+            inDegree -= np.bincount(downstream, minlength=n)
+            frontier = np.unique(downstream[inDegree[downstream] == 0])
+        if numVisited != n:
+            raise Exception("PlusFlow network contains a cycle")
+
+        edgeOrder = np.argsort(level[fromIdx], kind='mergesort')
+        self.edgeFrom = fromIdx[edgeOrder]
+        self.edgeTo = toIdx[edgeOrder]
+        # All upstream values are routed down the main path of divergences
+        self.edgeWeights = (divergences[self.edgeTo] != MINOR_PATH).astype(np.float64)
+        self.edgeOffsets = np.zeros(numLevels + 1, dtype=INDEX_DTYPE)
+        if numLevels > 0:
+            np.cumsum(np.bincount(level[self.edgeFrom], minlength=numLevels), 
+                      out=self.edgeOffsets[1:])
+        self.numLevels = numLevels
+
+    @property
+    def numReaches(self):
+        return len(self.comids)
+
+    @classmethod
+    def fromDB(cls, conn):
+        """ Build an accumulator from the PlusFlowlineVAA and PlusFlow tables of a 
+            NHDPlus2 database
+
+            @param conn An sqlite3 connection to a database that has the PlusFlowlineVAA
+            and PlusFlow tables
+
+            @return UpstreamAccumulator
+        """
+        cursor = conn.cursor()
+        cursor.execute("""SELECT ComID,Hydroseq,Divergence FROM PlusFlowlineVAA""")
+        vaa = np.array(cursor.fetchall(), dtype=np.int64).reshape((-1, 3))
+        cursor.execute("""SELECT FROMCOMID,TOCOMID FROM PlusFlow""")
+        edges = np.array(cursor.fetchall(), dtype=np.int64).reshape((-1, 2))
+        cursor.close()
+        return cls(vaa[:,0], vaa[:,1], vaa[:,2], edges[:,0], edges[:,1])
+
+    def indexOf(self, comIDs):
+        """ Get the indices of reaches in the network
+
+            @param comIDs Integer or sequence of integers representing ComIDs
+
+            @return Numpy array of indices, -1 for ComIDs not in the network
+        """
+        comIDs = np.atleast_1d(np.asarray(comIDs, dtype=COMID_DTYPE))
+        if self.numReaches == 0:
+            return -np.ones(len(comIDs), dtype=INDEX_DTYPE)
+        idx = np.searchsorted(self.comids, comIDs)
+        idx[idx == self.numReaches] = 0
+        found = self.comids[idx] == comIDs
+        return np.where(found, idx, -1)
+
+    def accumulate(self, values, comIDs=None):
+        """ Accumulate values downstream, giving, for each reach, the total of the values 
+            of the reach and all reaches upstream of it
+
+            @param values Numpy array of values of each reach, either one-dimensional or 
+            two-dimensional with one row per reach (to accumulate several attributes at once).
+            NaN values are treated as 0.
+            @param comIDs Sequence of integers representing the ComIDs of the reaches of each
+            row of values.  If None, values must be in the same order as self.comids.  Reaches
+            not in comIDs have values of 0; ComIDs not in the network are ignored.
+
+            @return Numpy array of accumulated values, of the same shape as values if comIDs 
+            is None, in the same order as self.comids
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if comIDs is None:
+            assert(values.shape[0] == self.numReaches)
+            totals = np.nan_to_num(values)
+        else:
+            assert(values.shape[0] == len(comIDs))
+            idx = self.indexOf(comIDs)
+            found = idx != -1
+            totals = np.zeros((self.numReaches,) + values.shape[1:], dtype=np.float64)
+            totals[idx[found]] = np.nan_to_num(values[found])
+
+        weights = self.edgeWeights
+        if totals.ndim > 1:
+            weights = weights.reshape((-1,) + (1,) * (totals.ndim - 1))
+        for l in xrange(self.numLevels):
+            start = self.edgeOffsets[l]
+            end = self.edgeOffsets[l+1]
+            if start == end:
+                continue
+            # Totals of reaches on this level are complete, push them downstream
+            np.add.at(totals, self.edgeTo[start:end], 
+                      totals[self.edgeFrom[start:end]] * weights[start:end])
+        return totals
+
+
+def writeAccumulatedValues(conn, table, comids, totals, columns):
+    """ Store accumulated values in a table (with a ComID column and one column per 
+        attribute), replacing the table if it exists
+
+        @param conn An sqlite3 connection to the database to write to
+        @param table String representing the name of the table
+        @param comids Numpy array of ComIDs of each reach
+        @param totals Numpy array of accumulated values, one row per reach
+        @param columns List of strings representing the names of the attribute columns
+
+        @return Integer representing the number of rows written
+
+        @raise Exception if table or column names are not valid SQL identifiers
+    """
+    for name in [table] + list(columns):
+        if not IDENTIFIER_RE.match(name):
+            raise Exception("'%s' is not a valid table or column name" % (name,))
+    totals = np.asarray(totals, dtype=np.float64).reshape((len(comids), -1))
+    assert(totals.shape[1] == len(columns))
+
+    cursor = conn.cursor()
+    cursor.execute("""DROP TABLE IF EXISTS %s""" % (table,))
+    cursor.execute("""CREATE TABLE %s (ComID INTEGER PRIMARY KEY, %s)""" % \
+                   (table, ", ".join(["%s REAL" % (c,) for c in columns])))
+    cursor.executemany("""INSERT INTO %s (ComID,%s) VALUES (?,%s)""" % \
+                       (table, ",".join(columns), ",".join(["?"] * len(columns))),
+                       ([int(c)] + row for (c, row) in zip(comids, totals.tolist())))
+    conn.commit()
+    cursor.close()
+    return len(comids)
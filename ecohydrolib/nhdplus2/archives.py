@@ -0,0 +1,261 @@
+"""@package ecohydrolib.nhdplus2.archives
+
+@brief Methods for selectively extracting NHDPlus V2 .7z archives, and for indexing
+the paths of extracted files, as used by NHDPlusV2Setup.py.
+@brief The contents of each archive are listed once (7z l -slt), and only the members
+needed to build the NHDPlus2 databases are extracted; archives are extracted in
+parallel.  The paths of extracted members are stored in a path index table so that
+files can be located without scanning the output directory.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2015, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+@author Brian Miles <brian_miles@unc.edu>
+"""
+import os
+import subprocess
+import tempfile
+import multiprocessing
+
+PATH_INDEX_TABLE = 'SetupPathIndex'
+ARCHIVE_EXTENSION = '.7z'
+# Components of the shapefiles needed
+SHAPEFILE_EXTENSIONS = ['.shp', '.shx', '.dbf', '.prj']
+SHAPEFILES = ['Catchment', 'GageLoc']
+LISTING_SEPARATOR = '----------'
+
+
+def getRequiredMemberNames(tables, shapefiles=SHAPEFILES):
+    """ Get the names of the archive members needed to build the NHDPlus2 databases
+
+        @param tables List of TableSchema (see ecohydrolib.nhdplus2.ingest) of tables
+        to be loaded from DBF files
+        @param shapefiles List of strings representing the names (without extension) of
+        shapefiles to be converted
+
+        @return Set of strings representing lower case file names
+    """
+    names = set([schema.dbfName.lower() for schema in tables])
+    for shapefile in shapefiles:
+        for ext in SHAPEFILE_EXTENSIONS:
+            names.add((shapefile + ext).lower())
+    return names
+
+
+def parseArchiveListing(listing):
+    """ Parse the technical listing of the contents of an archive (7z l -slt)
+
+        @param listing String representing the output of 7z l -slt
+
+        @return List of strings representing the paths of files (not directories)
+        in the archive
+    """
+    members = []
+    lines = listing.splitlines()
+    try:
+        # Members are listed after the archive properties
+        start = lines.index(LISTING_SEPARATOR) + 1
+    except ValueError:
+        return members
+    entry = {}
+    for line in lines[start:] + ['']:
+        line = line.strip()
+        if line == '':
+            if 'Path' in entry:
+                isDir = entry.get('Folder') == '+' or entry.get('Attributes', '').startswith('D')
+                if not isDir:
+                    members.append(entry['Path'].replace('\\', '/'))
+            entry = {}
+            continue
+        (key, sep, value) = line.partition(' = ')
+        if sep:
+            entry[key] = value
+    return members
+
+
+def listArchive(pathOfSevenZip, archive):
+    """ List the files in a .7z archive
+
+        @param pathOfSevenZip String representing the path of the 7z executable
+        @param archive String representing the path of the archive
+
+        @return List of strings representing the paths of files in the archive
+
+        @raise subprocess.CalledProcessError if the archive could not be listed
+    """
+    listing = subprocess.check_output([pathOfSevenZip, 'l', '-slt', archive])
+    return parseArchiveListing(listing)
+
+
+def selectMembers(members, names):
+    """ Select archive members by file name
+
+        @param members List of strings representing paths of archive members
+        @param names Set of strings representing lower case file names
+
+        @return List of strings representing paths of the members selected
+    """
+    return [m for m in members if os.path.basename(m).lower() in names]
+
+
+def extractMembers(pathOfSevenZip, archive, outputDir, members):
+    """ Extract members of a .7z archive, preserving their paths
+
+        @param pathOfSevenZip String representing the path of the 7z executable
+        @param archive String representing the path of the archive
+        @param outputDir String representing the directory into which members should be extracted
+        @param members List of strings representing paths of members to extract
+
+        @return Integer representing the return code of 7z
+    """
+    if len(members) == 0:
+        return 0
+    (fd, listFile) = tempfile.mkstemp(suffix='.txt')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write('\n'.join(members) + '\n')
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.call([pathOfSevenZip, 'x', '-y', '-o%s' % (outputDir,),
+                                    archive, '@%s' % (listFile,)], stdout=devnull)
+    finally:
+        os.unlink(listFile)
+
+
+def _extractArchive(args):
+    """ List and selectively extract an archive in a worker process """
+    (pathOfSevenZip, archive, outputDir, names) = args
+    members = selectMembers(listArchive(pathOfSevenZip, archive), names)
+    returnCode = extractMembers(pathOfSevenZip, archive, outputDir, members)
+    return (archive, members, returnCode)
+
+
+def extractArchives(pathOfSevenZip, archives, outputDir, names, processes=None):
+    """ Selectively extract .7z archives in parallel
+
+        @param pathOfSevenZip String representing the path of the 7z executable
+        @param archives List of strings representing paths of archives
+        @param outputDir String representing the directory into which members should be extracted
+        @param names Set of strings representing lower case names of files to extract
+        @param processes Integer representing the number of archives to extract at once, if None
+        the number of CPUs will be used
+
+        @return Generator of tuples (archive, list of paths of members extracted,
+        7z return code), in the order in which archives finish extracting
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if len(archives) == 0:
+        return
+    jobs = [(pathOfSevenZip, archive, outputDir, names) for archive in archives]
+    pool = multiprocessing.Pool(max(1, min(processes, len(jobs))))
+    try:
+        for result in pool.imap_unordered(_extractArchive, jobs):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def findArchives(archiveDir):
+    """ Find .7z archives
+
+        @param archiveDir String representing the directory in which to look for archives
+
+        @return List of strings representing paths of archives, sorted
+    """
+    archives = []
+    for (dirpath, dirnames, filenames) in os.walk(archiveDir):
+        archives.extend([os.path.join(dirpath, f) for f in filenames \
+                         if f.lower().endswith(ARCHIVE_EXTENSION)])
+    return sorted(archives)
+
+
+def createPathIndexTable(conn):
+    """ Create the path index table, if it does not already exist
+
+        @param conn An sqlite3 connection
+    """
+    conn.execute("""CREATE TABLE IF NOT EXISTS %s
+    (Name TEXT,
+    Path TEXT,
+    Archive TEXT)""" % (PATH_INDEX_TABLE,))
+    conn.execute("""CREATE INDEX IF NOT EXISTS %s_name_idx ON %s (Name)""" % \
+                 (PATH_INDEX_TABLE, PATH_INDEX_TABLE))
+    conn.commit()
+
+
+def indexPaths(conn, paths, archive=None):
+    """ Add paths to the path index, replacing the paths previously indexed for the
+        same archive.  The transaction is not committed.
+
+        @param conn An sqlite3 connection
+        @param paths List of strings representing paths, relative to the output directory
+        @param archive String identifying the archive the paths were extracted from
+    """
+    if archive is not None:
+        conn.execute("""DELETE FROM %s WHERE Archive=?""" % (PATH_INDEX_TABLE,), (archive,))
+    conn.executemany("""INSERT INTO %s (Name,Path,Archive) VALUES (?,?,?)""" % (PATH_INDEX_TABLE,),
+                     ((os.path.basename(p).lower(), p, archive) for p in paths))
+
+
+def buildPathIndex(conn, outputDir, names):
+    """ Index files in an output directory by scanning it, replacing the paths indexed
+
+        @param conn An sqlite3 connection
+        @param outputDir String representing the directory to scan
+        @param names Set of strings representing lower case names of files to index
+
+        @return Integer representing the number of paths indexed
+    """
+    paths = []
+    for (dirpath, dirnames, filenames) in os.walk(outputDir):
+        for f in filenames:
+            if f.lower() in names:
+                paths.append(os.path.relpath(os.path.join(dirpath, f), outputDir))
+    conn.execute("""DELETE FROM %s""" % (PATH_INDEX_TABLE,))
+    indexPaths(conn, paths)
+    conn.commit()
+    return len(paths)
+
+
+def getIndexedPaths(conn, outputDir, name):
+    """ Find files in the output directory using the path index
+
+        @param conn An sqlite3 connection
+        @param outputDir String representing the directory relative to which paths are indexed
+        @param name String representing the name of the file (matched case insensitively)
+
+        @return List of strings representing absolute paths of files that exist, sorted
+    """
+    cursor = conn.cursor()
+    cursor.execute("""SELECT DISTINCT Path FROM %s WHERE Name=? ORDER BY Path""" % (PATH_INDEX_TABLE,),
+                   (name.lower(),))
+    paths = [os.path.join(outputDir, row[0]) for row in cursor.fetchall()]
+    cursor.close()
+    return [p for p in paths if os.path.exists(p)]
@@ -0,0 +1,546 @@
+"""@package ecohydrolib.nhdplus2.catchmentdb
+
+@brief Methods for reading NHDPlus V2 catchment features directly from the
+catchment SQLite database built by NHDPlusV2Setup.py (using the OGR SQLite driver,
+which stores geometries as WKB).  The ComIDs of the reaches of interest are
+loaded into a temporary table which is joined against the indexed
+catchment.featureid column, so that any number of catchments can be read with
+a single streaming query.
+@brief The extent of each catchment can also be stored in an R*Tree table,
+catchment_extent, so that the extent of a set of catchments can be computed
+without reading any geometries.  The catchment_extent table also serves as a spatial
+index (the OGR SQLite driver does not create one), so that catchments intersecting a
+bounding box can be found without scanning the catchment table.
+@brief Catchment databases converted from regional shapefiles in parallel, each with
+its own catchment_extent table, can be merged into a single catchment database.  Shapefiles loaded are recorded in the
+setup manifest of the catchment database (see ecohydrolib.nhdplus2.manifest) so
+that only new or changed shapefiles need be loaded when setup is re-run.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2015, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+@author Brian Miles <brian_miles@unc.edu>
+"""
+import os
+import sys
+import shutil
+import sqlite3
+import subprocess
+import multiprocessing
+
+from shapely.wkb import loads
+from shapely.geometry import box
+from shapely.prepared import prep
+
+from ecohydrolib.nhdplus2.ingest import attachAndMerge
+from ecohydrolib.nhdplus2.ingest import beginBulkLoad
+from ecohydrolib.nhdplus2.ingest import endBulkLoad
+from ecohydrolib.nhdplus2.ingest import getSourceName
+from ecohydrolib.nhdplus2.manifest import SOURCE_SHAPEFILE
+from ecohydrolib.nhdplus2.manifest import SOURCE_CURRENT
+from ecohydrolib.nhdplus2.manifest import SOURCE_CHANGED
+from ecohydrolib.nhdplus2.manifest import createManifestTable
+from ecohydrolib.nhdplus2.manifest import getFileInfo
+from ecohydrolib.nhdplus2.manifest import getChecksum
+from ecohydrolib.nhdplus2.manifest import getSourceState
+from ecohydrolib.nhdplus2.manifest import recordSource
+from ecohydrolib.nhdplus2.manifest import deleteSource
+from ecohydrolib.nhdplus2.manifest import getMaxRowid
+from ecohydrolib.nhdplus2.manifest import deleteUnrecordedRows
+from ecohydrolib.nhdplus2.manifest import getSourceEntry
+from ecohydrolib.nhdplus2.manifest import getLastRecordedRowid
+from ecohydrolib.nhdplus2.connections import temporaryWrites
+
+CATCHMENT_TABLE = 'catchment'
+DEFAULT_GEOMETRY_COLUMN = 'GEOMETRY'
+REACH_ID_TABLE = 'reach_ids'
+# Primary key added by the OGR SQLite driver
+OGR_FID_COLUMN = 'ogc_fid'
+EXTENT_TABLE = 'catchment_extent'
+EXTENT_COLUMNS = ['featureid', 'minX', 'maxX', 'minY', 'maxY']
+
+
+def getGeometryColumn(conn, table=CATCHMENT_TABLE):
+    """ Get the name of the geometry column of a table written by the OGR SQLite driver
+
+        @param conn An sqlite3 connection to the catchment database
+        @param table String representing the name of the feature table
+
+        @return String representing the name of the geometry column
+
+        @raise Exception if geometries are not stored as WKB
+    """
+    cursor = conn.cursor()
+    cursor.execute("""SELECT name FROM sqlite_master WHERE type='table' AND name='geometry_columns'""")
+    if cursor.fetchone() is None:
+        cursor.close()
+        return DEFAULT_GEOMETRY_COLUMN
+    cursor.execute("""SELECT * FROM geometry_columns WHERE f_table_name=?""", (table,))
+    row = cursor.fetchone()
+    columns = [d[0].lower() for d in cursor.description]
+    cursor.close()
+    if row is None:
+        return DEFAULT_GEOMETRY_COLUMN
+    row = dict(zip(columns, row))
+    if 'geometry_format' in row and row['geometry_format'].upper() != 'WKB':
+        raise Exception("Geometries of table %s are stored as %s, not WKB" % \
+                        (table, row['geometry_format']))
+    return row['f_geometry_column']
+
+
+def loadReachIds(conn, reaches):
+    """ Load reach ComIDs into a temporary table, replacing any reaches already loaded.
+        The table is named temp.reach_ids and has a single column, featureid.
+
+        @param conn An sqlite3 connection
+        @param reaches Sequence of integers representing ComIDs of reaches
+    """
+    with temporaryWrites(conn):
+        cursor = conn.cursor()
+        cursor.execute("""CREATE TEMP TABLE IF NOT EXISTS %s (featureid INTEGER PRIMARY KEY)""" % \
+                       (REACH_ID_TABLE,))
+        cursor.execute("""DELETE FROM temp.%s""" % (REACH_ID_TABLE,))
+        cursor.executemany("""INSERT OR IGNORE INTO temp.%s (featureid) VALUES (?)""" % (REACH_ID_TABLE,),
+                           ((int(r),) for r in reaches))
+        # Don't hold a transaction open on (possibly shared) connections
+        conn.commit()
+        cursor.close()
+
+
+def getCatchmentGeometriesForReaches(conn, reaches):
+    """ Get catchment geometries for a set of reaches
+
+        @param conn An sqlite3 connection to the catchment database
+        @param reaches Sequence of integers representing ComIDs of reaches
+
+        @return Generator of strings representing catchment geometries as WKB
+    """
+    geometryColumn = getGeometryColumn(conn)
+    loadReachIds(conn, reaches)
+    cursor = conn.cursor()
+    cursor.execute("""SELECT c.{geom} FROM temp.{ids} AS r
+JOIN {catchment} AS c ON c.featureid=r.featureid""".format(geom=geometryColumn,
+                                                         ids=REACH_ID_TABLE,
+                                                         catchment=CATCHMENT_TABLE))
+    for row in cursor:
+        if row[0] is not None:
+            yield str(row[0])
+    cursor.close()
+
+
+def hasExtentTable(conn):
+    """ Determine whether the catchment database contains a catchment extent table
+
+        @param conn An sqlite3 connection to the catchment database
+
+        @return True if the catchment_extent table exists
+    """
+    cursor = conn.cursor()
+    cursor.execute("""SELECT name FROM sqlite_master WHERE type='table' AND name=?""", (EXTENT_TABLE,))
+    exists = cursor.fetchone() is not None
+    cursor.close()
+    return exists
+
+
+def writeCatchmentExtents(conn):
+    """ Build an R*Tree table, catchment_extent, storing the extent of each catchment,
+        replacing the table if it already exists.
+
+        @param conn An sqlite3 connection to the catchment database
+
+        @return Integer representing the number of catchment extents written
+
+        @note R*Tree tables store coordinates as 32-bit floats, rounded outward,
+        so stored extents may be very slightly larger than the catchments.
+    """
+    geometryColumn = getGeometryColumn(conn)
+    cursor = conn.cursor()
+    cursor.execute("""DROP TABLE IF EXISTS %s""" % (EXTENT_TABLE,))
+    cursor.execute("""CREATE VIRTUAL TABLE %s USING rtree(featureid, minX, maxX, minY, maxY)""" % \
+                   (EXTENT_TABLE,))
+    _insertCatchmentExtents(conn, geometryColumn)
+    conn.commit()
+    cursor.execute("""SELECT count(*) FROM %s""" % (EXTENT_TABLE,))
+    numExtents = cursor.fetchone()[0]
+    cursor.close()
+    return numExtents
+
+
+def _insertCatchmentExtents(conn, geometryColumn, firstRowid=1):
+    """ Write the extents of catchments whose rowid is at least firstRowid into the
+        catchment_extent table
+    """
+    def extents():
+        readCursor = conn.cursor()
+        readCursor.execute("""SELECT featureid,%s FROM %s WHERE rowid >= ?""" % \
+                           (geometryColumn, CATCHMENT_TABLE), (firstRowid,))
+        for (featureid, wkb) in readCursor:
+            if wkb is None:
+                continue
+            (minX, minY, maxX, maxY) = loads(str(wkb)).bounds
+            yield (featureid, minX, maxX, minY, maxY)
+        readCursor.close()
+
+    cursor = conn.cursor()
+    cursor.executemany("""INSERT OR REPLACE INTO %s (featureid,minX,maxX,minY,maxY) VALUES (?,?,?,?,?)""" % \
+                       (EXTENT_TABLE,), extents())
+    cursor.close()
+
+
+def deleteCatchmentExtents(conn, firstRowid, lastRowid=None):
+    """ Delete from the catchment_extent table the extents of catchments in a range of
+        rowids of the catchment table, e.g. before the catchments are deleted so that
+        they may be reloaded.  The transaction is not committed.
+
+        @param conn An sqlite3 connection to the catchment database
+        @param firstRowid Integer representing the first rowid of the range
+        @param lastRowid Integer representing the last rowid of the range, or None if the
+        range extends to the end of the catchment table
+
+        @return Integer representing the number of extents deleted
+    """
+    if not hasExtentTable(conn):
+        return 0
+    if lastRowid is None:
+        lastRowid = getMaxRowid(conn, CATCHMENT_TABLE)
+    cursor = conn.cursor()
+    cursor.execute("""DELETE FROM %s WHERE featureid IN 
+(SELECT featureid FROM %s WHERE rowid BETWEEN ? AND ?)""" % (EXTENT_TABLE, CATCHMENT_TABLE),
+                   (firstRowid, lastRowid))
+    numExtents = cursor.rowcount
+    cursor.close()
+    return numExtents
+
+
+def isExtentTableComplete(conn):
+    """ Determine whether the catchment database contains an extent for every catchment
+
+        @param conn An sqlite3 connection to the catchment database
+
+        @return True if the catchment_extent table exists and holds as many extents
+        as there are catchments
+    """
+    if not hasExtentTable(conn):
+        return False
+    cursor = conn.cursor()
+    cursor.execute("""SELECT count(*) FROM %s""" % (EXTENT_TABLE,))
+    numExtents = cursor.fetchone()[0]
+    cursor.execute("""SELECT count(DISTINCT featureid) FROM %s""" % (CATCHMENT_TABLE,))
+    numCatchments = cursor.fetchone()[0]
+    cursor.close()
+    return numExtents == numCatchments
+
+
+def getCatchmentsInBoundingBox(conn, bbox, exact=True):
+    """ Get catchments intersecting a bounding box, using the catchment_extent table
+        as a spatial index
+
+        @param conn An sqlite3 connection to the catchment database
+        @param bbox A dict containing keys: minX, minY, maxX, maxY, in WGS 84 (EPSG:4326)
+        @param exact Boolean True if catchments whose extent, but not geometry, intersects
+        the bounding box should be excluded
+
+        @return List of tuples (featureid, string representing catchment geometry as WKB)
+
+        @raise Exception if the catchment database has no catchment_extent table
+    """
+    if not hasExtentTable(conn):
+        raise Exception("Catchment database has no %s table, run NHDPlusV2Setup.py to create it" % \
+                        (EXTENT_TABLE,))
+    geometryColumn = getGeometryColumn(conn)
+    cursor = conn.cursor()
+    cursor.execute("""SELECT c.featureid,c.{geom} FROM {extent} AS e
+JOIN {catchment} AS c ON c.featureid=e.featureid
+WHERE e.maxX>=? AND e.minX<=? AND e.maxY>=? AND e.minY<=?""".format(geom=geometryColumn,
+                                                                extent=EXTENT_TABLE,
+                                                                catchment=CATCHMENT_TABLE),
+                   (bbox['minX'], bbox['maxX'], bbox['minY'], bbox['maxY']))
+    catchments = [(featureid, str(wkb)) for (featureid, wkb) in cursor if wkb is not None]
+    cursor.close()
+    if exact:
+        prepared = prep(box(bbox['minX'], bbox['minY'], bbox['maxX'], bbox['maxY']))
+        catchments = [c for c in catchments if prepared.intersects(loads(c[1]))]
+    return catchments
+
+
+def getBoundingBoxForReaches(conn, reaches):
+    """ Get the bounding box of the catchments of a set of reaches.  If the catchment
+        database has a catchment_extent table, the bounding box is computed from stored
+        extents, otherwise the bounding box is computed from catchment geometries.
+
+        @param conn An sqlite3 connection to the catchment database
+        @param reaches Sequence of integers representing ComIDs of reaches
+
+        @return A dict containing keys: minX, minY, maxX, maxY, srs, where srs='EPSG:4326';
+        None if no catchments were found
+    """
+    if hasExtentTable(conn):
+        loadReachIds(conn, reaches)
+        cursor = conn.cursor()
+        cursor.execute("""SELECT min(e.minX),min(e.minY),max(e.maxX),max(e.maxY) FROM temp.{ids} AS r
+JOIN {extent} AS e ON e.featureid=r.featureid""".format(ids=REACH_ID_TABLE, extent=EXTENT_TABLE))
+        (minX, minY, maxX, maxY) = cursor.fetchone()
+        cursor.close()
+        if minX is None:
+            return None
+        return dict({'minX': minX, 'minY': minY, 'maxX': maxX, 'maxY': maxY, 'srs': 'EPSG:4326'})
+
+    bbox = None
+    for wkb in getCatchmentGeometriesForReaches(conn, reaches):
+        (minX, minY, maxX, maxY) = loads(wkb).bounds
+        if bbox is None:
+            bbox = dict({'minX': minX, 'minY': minY, 'maxX': maxX, 'maxY': maxY, 'srs': 'EPSG:4326'})
+        else:
+            bbox['minX'] = min(bbox['minX'], minX)
+            bbox['minY'] = min(bbox['minY'], minY)
+            bbox['maxX'] = max(bbox['maxX'], maxX)
+            bbox['maxY'] = max(bbox['maxY'], maxY)
+    return bbox
+
+
+def getShapefilePaths(shapefilePath):
+    """ Get the paths of the geometry and attribute files of a shapefile
+
+        @param shapefilePath String representing the path of the .shp file
+
+        @return List of strings representing the paths of the .shp and .dbf files
+    """
+    paths = [shapefilePath]
+    (base, ext) = os.path.splitext(shapefilePath)
+    for dbfExt in ['.dbf', '.DBF']:
+        if os.path.exists(base + dbfExt):
+            paths.append(base + dbfExt)
+            break
+    return paths
+
+
+def getShapefilesToLoad(catchmentPath, shapefiles, sourceRoot=None):
+    """ Determine which catchment shapefiles have not yet been loaded into a catchment
+        database, or have changed since they were loaded, using the setup manifest
+        of the catchment database.  Catchments of shapefiles that changed, and catchments
+        written by loads that were interrupted, are deleted.
+
+        @param catchmentPath String representing the path of the catchment database, which
+        need not exist
+        @param shapefiles List of strings representing paths of catchment shapefiles
+        @param sourceRoot String representing the directory relative to which
+        shapefiles are named in the setup manifest
+
+        @return List of tuples (shapefile path, source, checksum, size, mtime) of the
+        shapefiles to be loaded
+    """
+    toLoad = []
+    if not os.path.exists(catchmentPath):
+        for shapefile in shapefiles:
+            paths = getShapefilePaths(shapefile)
+            (size, mtime) = getFileInfo(paths)
+            toLoad.append( (shapefile, getSourceName(shapefile, sourceRoot), 
+                            getChecksum(paths), size, mtime) )
+        return toLoad
+
+    conn = sqlite3.connect(catchmentPath)
+    try:
+        createManifestTable(conn)
+        deleteCatchmentExtents(conn, getLastRecordedRowid(conn, CATCHMENT_TABLE) + 1)
+        deleteUnrecordedRows(conn, CATCHMENT_TABLE)
+        for shapefile in shapefiles:
+            source = getSourceName(shapefile, sourceRoot)
+            (state, checksum, size, mtime) = getSourceState(conn, source, getShapefilePaths(shapefile))
+            if state == SOURCE_CURRENT:
+                continue
+            if state == SOURCE_CHANGED:
+                entry = getSourceEntry(conn, source)
+                if entry['FirstRowid'] is not None:
+                    deleteCatchmentExtents(conn, entry['FirstRowid'], entry['LastRowid'])
+                deleteSource(conn, source)
+                conn.commit()
+            toLoad.append( (shapefile, source, checksum, size, mtime) )
+    finally:
+        conn.close()
+    return toLoad
+
+
+def _recordCatchmentSource(conn, source, checksum, size, mtime, firstRowid):
+    lastRowid = getMaxRowid(conn, CATCHMENT_TABLE)
+    if lastRowid >= firstRowid:
+        recordSource(conn, source, SOURCE_SHAPEFILE, checksum, size, mtime, CATCHMENT_TABLE,
+                     lastRowid - firstRowid + 1, firstRowid, lastRowid)
+    else:
+        recordSource(conn, source, SOURCE_SHAPEFILE, checksum, size, mtime, CATCHMENT_TABLE)
+    conn.commit()
+
+
+def loadCatchmentShapefiles(catchmentPath, toLoad, appendShapefile, verbose=False, outfp=sys.stdout):
+    """ Append catchment shapefiles to a catchment database one at a time, recording
+        each in the setup manifest of the catchment database
+
+        @param catchmentPath String representing the path of the catchment database, which
+        need not exist
+        @param toLoad List of tuples (shapefile path, source, checksum, size, mtime), as 
+        returned by getShapefilesToLoad
+        @param appendShapefile Function taking the path of a shapefile and the path of the
+        catchment database, which appends the catchments of the shapefile to the
+        catchment database (creating it if it does not exist) and returns True on success
+        @param verbose Boolean True if progress should be printed to outfp
+        @param outfp File-like object to which verbose output should be printed
+
+        @raise Exception if a shapefile could not be appended
+    """
+    numFiles = len(toLoad)
+    for (currFile, (shapefile, source, checksum, size, mtime)) in enumerate(toLoad):
+        if verbose:
+            outfp.write("\r\tProcessing file %d of %d (%.0f%%)" % \
+                        (currFile + 1, numFiles, (float(currFile) / numFiles) * 100))
+            outfp.flush()
+        firstRowid = 1
+        if os.path.exists(catchmentPath):
+            conn = sqlite3.connect(catchmentPath)
+            firstRowid = getMaxRowid(conn, CATCHMENT_TABLE) + 1
+            conn.close()
+        if not appendShapefile(shapefile, catchmentPath):
+            raise Exception("Unable to append catchments of %s to %s" % (shapefile, catchmentPath))
+        conn = sqlite3.connect(catchmentPath)
+        try:
+            if hasExtentTable(conn):
+                # Keep extents current so that the extent table need not be rebuilt
+                _insertCatchmentExtents(conn, getGeometryColumn(conn), firstRowid)
+            createManifestTable(conn)
+            _recordCatchmentSource(conn, source, checksum, size, mtime, firstRowid)
+        finally:
+            conn.close()
+    if verbose and numFiles:
+        outfp.write("\r\tProcessing file %d of %d (100%%)\n" % (numFiles, numFiles))
+
+
+def _convertCatchmentShapefile(args):
+    """ Convert a catchment shapefile into a staging database, and write the extents of
+        its catchments, in a worker process
+    """
+    (command, stagingPath) = args
+    returnCode = subprocess.call(command, shell=True)
+    if returnCode == 0:
+        conn = sqlite3.connect(stagingPath)
+        try:
+            writeCatchmentExtents(conn)
+        finally:
+            conn.close()
+    return returnCode
+
+
+def convertCatchmentShapefiles(commands, stagingPaths, processes=None):
+    """ Convert catchment shapefiles into staging databases in parallel, writing a
+        catchment_extent table into each staging database
+
+        @param commands List of strings representing shell commands, each of which converts a
+        shapefile into a new catchment database (e.g. using ogr2ogr)
+        @param stagingPaths List of strings representing paths of the catchment databases
+        written by each command
+        @param processes Integer representing the number of conversions to run at once, if None
+        the number of CPUs will be used
+
+        @return List of integers representing the return code of each command
+    """
+    assert(len(commands) == len(stagingPaths))
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if len(commands) == 0:
+        return []
+    pool = multiprocessing.Pool(max(1, min(processes, len(commands))))
+    try:
+        returnCodes = pool.map(_convertCatchmentShapefile, zip(commands, stagingPaths))
+    finally:
+        pool.close()
+        pool.join()
+    return returnCodes
+
+
+def mergeCatchmentDBs(catchmentPath, stagingPaths, sources=None, verbose=False, outfp=sys.stdout):
+    """ Merge catchment databases written by the OGR SQLite driver (e.g. one per 
+        vector processing unit) into a single catchment database.  If the catchment
+        database does not exist, the first staging database is copied, and the catchments
+        of the others are appended to it.  The extents of staging databases that have a
+        catchment_extent table are merged too, replacing existing extents of the same
+        catchments.
+
+        @param catchmentPath String representing the path of the catchment database
+        @param stagingPaths List of strings representing paths of staging catchment databases
+        @param sources List of tuples (shapefile path, source, checksum, size, mtime), one per
+        staging database, identifying the shapefile converted into each staging database.  If
+        not None, each shapefile is recorded in the setup manifest of the catchment database.
+        @param verbose Boolean True if progress should be printed to outfp
+        @param outfp File-like object to which verbose output should be printed
+
+        @return Integer representing the number of catchments in the merged database
+    """
+    assert(len(stagingPaths) > 0)
+    assert(sources is None or len(sources) == len(stagingPaths))
+    stagingPaths = list(stagingPaths)
+    sources = list(sources) if sources is not None else None
+    copied = False
+    if not os.path.exists(catchmentPath):
+        shutil.copyfile(stagingPaths[0], catchmentPath)
+        copied = True
+    conn = sqlite3.connect(catchmentPath)
+    try:
+        if sources is not None:
+            createManifestTable(conn)
+            if copied:
+                (shapefile, source, checksum, size, mtime) = sources[0]
+                _recordCatchmentSource(conn, source, checksum, size, mtime, 1)
+        if copied:
+            stagingPaths = stagingPaths[1:]
+            sources = sources[1:] if sources is not None else None
+        cursor = conn.cursor()
+        cursor.execute("""PRAGMA table_info(%s)""" % (CATCHMENT_TABLE,))
+        # Let feature IDs of appended catchments be assigned anew
+        columns = [row[1] for row in cursor.fetchall() if row[1].lower() != OGR_FID_COLUMN]
+        cursor.close()
+        if not hasExtentTable(conn):
+            conn.execute("""CREATE VIRTUAL TABLE %s USING rtree(featureid, minX, maxX, minY, maxY)""" % \
+                         (EXTENT_TABLE,))
+            conn.commit()
+        beginBulkLoad(conn, 'OFF' if sources is None else 'WAL')
+        for (i, stagingPath) in enumerate(stagingPaths):
+            firstRowid = getMaxRowid(conn, CATCHMENT_TABLE) + 1
+            numRows = attachAndMerge(conn, stagingPath, {CATCHMENT_TABLE: columns})
+            if sources is not None:
+                (shapefile, source, checksum, size, mtime) = sources[i]
+                _recordCatchmentSource(conn, source, checksum, size, mtime, firstRowid)
+            attachAndMerge(conn, stagingPath, {EXTENT_TABLE: EXTENT_COLUMNS}, replace=True)
+            if verbose:
+                outfp.write("Merged %d catchments from %s\n" % \
+                            (numRows.get(CATCHMENT_TABLE, 0), stagingPath))
+        endBulkLoad(conn)
+        cursor = conn.cursor()
+        cursor.execute("""SELECT count(*) FROM %s""" % (CATCHMENT_TABLE,))
+        numCatchments = cursor.fetchone()[0]
+        cursor.close()
+    finally:
+        conn.close()
+    return numCatchments
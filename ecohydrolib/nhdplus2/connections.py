@@ -0,0 +1,215 @@
+"""@package ecohydrolib.nhdplus2.connections
+
+@brief Shared, read-only connections to NHDPlus V2 databases.
+@brief Connections are opened once per thread and database path and are then
+reused by subsequent calls, so that batch jobs and web services making many
+lookups do not pay the cost of opening databases and parsing their schemas on
+every call.  Where the SQLite library supports URI filenames, databases are
+opened in read-only, immutable mode, which lets SQLite skip file locking and
+change detection.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2015, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+@author Brian Miles <brian_miles@unc.edu>
+"""
+import os
+import errno
+import sqlite3
+import threading
+import urllib
+from contextlib import contextmanager
+
+# Size, in bytes, of memory-mapped I/O window for each connection
+MMAP_SIZE = 256 * 1024 * 1024
+# Size, in KiB, of page cache for each connection
+CACHE_SIZE_KIB = 64 * 1024
+
+_local = threading.local()
+_supportsURI = None
+
+
+def _getHandles():
+    try:
+        return _local.handles
+    except AttributeError:
+        _local.handles = {}
+        return _local.handles
+
+
+def supportsURIFilenames():
+    """ Determine whether the SQLite library interprets filenames as URIs.
+        Python 2 does not expose sqlite3.connect(uri=True), so URI filenames
+        can only be used if SQLite was compiled with SQLITE_USE_URI.
+    
+        @return True if URI filenames are supported
+    """
+    global _supportsURI
+    if _supportsURI is None:
+        conn = sqlite3.connect(':memory:')
+        options = [row[0] for row in conn.execute("""PRAGMA compile_options""")]
+        conn.close()
+        _supportsURI = False
+        for option in options:
+            if option == 'USE_URI' or option == 'USE_URI=1':
+                _supportsURI = True
+    return _supportsURI
+
+
+def connectReadOnly(path):
+    """ Open a new read-only connection to an SQLite database.  Temporary tables
+        can still be created using the connection, within temporaryWrites().
+    
+        @param path String representing the absolute path of the database
+        
+        @return sqlite3 connection
+        
+        @note If SQLite does not interpret filenames as URIs, the database is opened
+        normally and PRAGMA query_only is set, which also prevents writes to temporary
+        tables outside of temporaryWrites().
+    """
+    if supportsURIFilenames():
+        uri = "file:%s?mode=ro&immutable=1" % (urllib.pathname2url(path),)
+        conn = sqlite3.connect(uri)
+    else:
+        conn = sqlite3.connect(path)
+        conn.execute("""PRAGMA query_only=1""")
+    conn.execute("""PRAGMA mmap_size=%d""" % (MMAP_SIZE,))
+    conn.execute("""PRAGMA cache_size=-%d""" % (CACHE_SIZE_KIB,))
+    return conn
+
+
+@contextmanager
+def temporaryWrites(conn):
+    """ Context manager allowing temporary tables to be written using a connection
+        opened by connectReadOnly().  Only temporary tables should be written within
+        the context.
+    
+        @param conn sqlite3 connection
+    """
+    queryOnly = conn.execute("""PRAGMA query_only""").fetchone()[0]
+    if queryOnly:
+        conn.execute("""PRAGMA query_only=0""")
+    try:
+        yield conn
+    finally:
+        if queryOnly:
+            conn.execute("""PRAGMA query_only=1""")
+
+
+def getDatabasePath(config, option):
+    """ Get the absolute path of a database named by an option in the 'NHDPLUS2' section of config
+    
+        @param config A Python ConfigParser
+        @param option String representing the option in the 'NHDPLUS2' section naming the database
+        
+        @return String representing the absolute path of the database
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+    """
+    return os.path.abspath(config.get('NHDPLUS2', option))
+
+
+def getCachedHandle(key, opener):
+    """ Get a handle cached for the current thread, opening it if it has not yet been opened
+    
+        @param key Hashable object identifying the handle
+        @param opener Callable taking no arguments that opens the handle
+        
+        @return The cached handle
+    """
+    handles = _getHandles()
+    handle = handles.get(key)
+    if handle is None:
+        handle = opener()
+        handles[key] = handle
+    return handle
+
+
+def getConnection(config, option):
+    """ Get a shared, read-only connection to the database named by an option
+        in the 'NHDPLUS2' section of config
+    
+        @param config A Python ConfigParser
+        @param option String representing the option in the 'NHDPLUS2' section naming the database
+        
+        @return sqlite3 connection.  The connection is shared, callers must not close it.
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if the database is not readable
+    """
+    path = getDatabasePath(config, option)
+    def opener():
+        if not os.access(path, os.R_OK):
+            raise IOError(errno.EACCES, "The database at %s is not readable" %
+                          path)
+        return connectReadOnly(path)
+    return getCachedHandle(('sqlite', path), opener)
+
+
+def getNHDPlusDBConnection(config):
+    """ Get a shared, read-only connection to the NHDPlus2 database
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB' (absolute path to NHDPlus2 SQLite3 database)
+        
+        @return sqlite3 connection.  The connection is shared, callers must not close it.
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if NHDPlus2 DB is not readable
+    """
+    return getConnection(config, 'PATH_OF_NHDPLUS2_DB')
+
+
+def getCatchmentDBConnection(config):
+    """ Get a shared, read-only connection to the NHDPlus2 catchment feature database
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT' (absolute path to NHD catchment SQLite3 spatial DB)
+        
+        @return sqlite3 connection.  The connection is shared, callers must not close it.
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if catchment DB is not readable
+    """
+    return getConnection(config, 'PATH_OF_NHDPLUS2_CATCHMENT')
+
+
+def closeConnections():
+    """ Close all connections and release all handles cached for the current thread
+    """
+    handles = _getHandles()
+    for (key, handle) in handles.items():
+        if key[0] in ('sqlite', 'partitions', 'watershedcache'):
+            handle.close()
+    handles.clear()
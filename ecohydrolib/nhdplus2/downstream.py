@@ -0,0 +1,220 @@
+"""@package ecohydrolib.nhdplus2.downstream
+
+@brief Downstream tracing of the NHDPlus V2 flowline network using the Hydroseq, 
+DnHydroseq and TerminalPa value added attributes (PlusFlowlineVAA), stored in numpy arrays.
+@brief Each reach has at most one downstream mainstem reach (the reach whose Hydroseq
+is the reach's DnHydroseq), so the network downstream of any reach is a single path
+ending at the outlet of its terminal path.  Cumulative path length and travel time
+to the outlet are computed for all reaches at once by pointer jumping, which needs
+only O(log n) passes for paths of n reaches.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2015, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+@author Brian Miles <brian_miles@unc.edu>
+"""
+import numpy as np
+
+COMID_DTYPE = np.int64
+INDEX_DTYPE = np.int64
+
+
+class DownstreamNetwork(object):
+    """ Downstream mainstem connectivity of the NHDPlus2 flowline network.  Reaches are
+        stored in ascending ComID order; the index of the reach immediately downstream 
+        of the reach at index i is downstream[i], -1 if reach i is a terminal reach
+        (or its downstream reach is not in the network).
+    """
+    def __init__(self, comids, hydroseqs, dnHydroseqs, terminalPas, lengthKm, travTime):
+        """ Construct a downstream network from PlusFlowlineVAA attributes
+
+            @param comids Sequence of integers representing ComIDs of reaches
+            @param hydroseqs Sequence of integers representing Hydroseq of each reach
+            @param dnHydroseqs Sequence of integers representing DnHydroseq of each reach (0 if none)
+            @param terminalPas Sequence of integers representing TerminalPa (Hydroseq of
+            the outlet of the terminal path) of each reach
+            @param lengthKm Sequence of floats representing LengthKM of each reach
+            @param travTime Sequence of floats representing TravTime of each reach
+        """
+        comids = np.asarray(comids, dtype=COMID_DTYPE)
+        order = np.argsort(comids, kind='mergesort')
+        self.comids = comids[order]
+        self.hydroseqs = np.asarray(hydroseqs, dtype=np.int64)[order]
+        self.terminalPas = np.asarray(terminalPas, dtype=np.int64)[order]
+        self.lengthKm = np.nan_to_num(np.asarray(lengthKm, dtype=np.float64)[order])
+        self.travTime = np.nan_to_num(np.asarray(travTime, dtype=np.float64)[order])
+        
+        # Index reaches by Hydroseq
+        self._hydroseqOrder = np.argsort(self.hydroseqs, kind='mergesort')
+        self._sortedHydroseqs = self.hydroseqs[self._hydroseqOrder]
+        
+        self.downstream = self.indexOfHydroseq(np.asarray(dnHydroseqs, dtype=np.int64)[order])
+        self._toOutlet = None
+
+    @property
+    def numReaches(self):
+        return len(self.comids)
+
+    @classmethod
+    def fromDB(cls, conn):
+        """ Build a downstream network from the PlusFlowlineVAA table of a NHDPlus2 database
+
+            @param conn An sqlite3 connection to a database that has the PlusFlowlineVAA table
+
+            @return DownstreamNetwork
+        """
+        cursor = conn.cursor()
+        cursor.execute("""SELECT ComID,Hydroseq,DnHydroseq,TerminalPa,LengthKM,TravTime FROM PlusFlowlineVAA""")
+        rows = cursor.fetchall()
+        cursor.close()
+        if len(rows) == 0:
+            return cls([], [], [], [], [], [])
+        # ComIDs and Hydroseqs are exactly representable as float64
+        vaa = np.array(rows, dtype=np.float64)
+        return cls(vaa[:,0], vaa[:,1], vaa[:,2], vaa[:,3], vaa[:,4], vaa[:,5])
+
+    def indexOf(self, comIDs):
+        """ Get the indices of reaches in the network
+
+            @param comIDs Integer or sequence of integers representing ComIDs
+
+            @return Numpy array of indices, -1 for ComIDs not in the network
+        """
+        comIDs = np.atleast_1d(np.asarray(comIDs, dtype=COMID_DTYPE))
+        if self.numReaches == 0:
+            return -np.ones(len(comIDs), dtype=INDEX_DTYPE)
+        idx = np.searchsorted(self.comids, comIDs)
+        idx[idx == self.numReaches] = 0
+        found = self.comids[idx] == comIDs
+        return np.where(found, idx, -1)
+
+    def indexOfHydroseq(self, hydroseqs):
+        """ Get the indices of reaches in the network identified by Hydroseq
+
+            @param hydroseqs Integer or sequence of integers representing Hydroseqs
+
+            @return Numpy array of indices, -1 for Hydroseqs not in the network
+        """
+        hydroseqs = np.atleast_1d(np.asarray(hydroseqs, dtype=np.int64))
+        if self.numReaches == 0:
+            return -np.ones(len(hydroseqs), dtype=INDEX_DTYPE)
+        pos = np.searchsorted(self._sortedHydroseqs, hydroseqs)
+        pos[pos == self.numReaches] = 0
+        found = (self._sortedHydroseqs[pos] == hydroseqs) & (hydroseqs != 0)
+        return np.where(found, self._hydroseqOrder[pos], -1)
+
+    def getFlowPath(self, comID):
+        """ Trace the mainstem flow path from a reach to its outlet
+
+            @param comID Integer representing the ComID of the reach to start from
+
+            @return Tuple(numpy array of ComIDs of reaches on the path, starting with comID and 
+            ending with the outlet; numpy array of cumulative LengthKM; numpy array of cumulative 
+            TravTime).  Cumulative values include the whole of each reach.  Arrays are empty if
+            comID is not in the network.
+            
+            @raise Exception if the network contains a cycle
+        """
+        i = self.indexOf(comID)[0]
+        path = []
+        while i != -1:
+            path.append(i)
+            if len(path) > self.numReaches:
+                raise Exception("Flow path from reach %d contains a cycle" % (comID,))
+            i = self.downstream[i]
+        path = np.array(path, dtype=INDEX_DTYPE)
+        return (self.comids[path], np.cumsum(self.lengthKm[path]), np.cumsum(self.travTime[path]))
+
+    def _computeToOutlet(self):
+        """ Compute, for every reach, the outlet of its flow path and the total LengthKM
+            and TravTime from its upstream end to the outlet, by pointer jumping.
+        """
+        nxt = self.downstream.copy()
+        length = self.lengthKm.copy()
+        time = self.travTime.copy()
+        outlet = np.arange(self.numReaches, dtype=INDEX_DTYPE)
+        
+        maxPasses = int(np.ceil(np.log2(max(self.numReaches, 2)))) + 1
+        passes = 0
+        active = np.flatnonzero(nxt != -1)
+        while len(active) > 0:
+            if passes > maxPasses:
+                raise Exception("Flowline network contains a cycle")
+            # Each pass doubles the length of the path summarized by each reach
+            jump = nxt[active]
+            length[active] += length[jump]
+            time[active] += time[jump]
+            outlet[active] = outlet[jump]
+            nxt[active] = nxt[jump]
+            active = active[nxt[active] != -1]
+            passes += 1
+        self._toOutlet = (outlet, length, time)
+
+    def getOutlets(self, comIDs):
+        """ Find the outlet of, and the total length and travel time along, the mainstem flow 
+            path of each of many reaches
+
+            @param comIDs Sequence of integers representing ComIDs of reaches
+
+            @return Tuple(numpy array of ComIDs of outlets, -1 for reaches not in the network;
+            numpy array of LengthKM to outlets; numpy array of TravTime to outlets).  Lengths and
+            travel times include the whole of the starting reach; NaN for reaches not in the network.
+        """
+        idx = self.indexOf(comIDs)
+        found = idx != -1
+        outletComids = -np.ones(len(idx), dtype=COMID_DTYPE)
+        length = np.empty(len(idx))
+        length.fill(np.nan)
+        time = length.copy()
+        if not found.any():
+            return (outletComids, length, time)
+        
+        if self._toOutlet is None:
+            self._computeToOutlet()
+        (toOutlet, toOutletLength, toOutletTime) = self._toOutlet
+        outletComids[found] = self.comids[toOutlet[idx[found]]]
+        length[found] = toOutletLength[idx[found]]
+        time[found] = toOutletTime[idx[found]]
+        return (outletComids, length, time)
+
+    def getTerminalOutlets(self, comIDs):
+        """ Find the outlet of the terminal path of each of many reaches using TerminalPa.  
+            Unlike getOutlets(), the outlet is found even where the mainstem flow path
+            leaves the network.
+
+            @param comIDs Sequence of integers representing ComIDs of reaches
+
+            @return Numpy array of ComIDs of terminal path outlets, -1 if unknown
+        """
+        idx = self.indexOf(comIDs)
+        found = idx != -1
+        outletComids = -np.ones(len(idx), dtype=COMID_DTYPE)
+        outlets = self.indexOfHydroseq(self.terminalPas[idx[found]])
+        outletComids[found] = np.where(outlets != -1, self.comids[outlets], -1)
+        return outletComids
@@ -0,0 +1,202 @@
+"""@package ecohydrolib.nhdplus2.gageindex
+
+@brief In-memory index of NHDPlus V2 streamflow gages supporting vectorized lookup
+of many gages at once.
+@brief For each gage (identified by its Gage_Loc Source_Fea, e.g. USGS site number)
+the index stores its reach code, measure, the ComID of the flowline the gage is
+located on, and its longitude and latitude (WGS 84) snapped to the NHD network.
+The gage to ComID mapping can be precomputed by NHDPlusV2Setup.py and stored in
+the Gage_ComID table, so that the range join between Gage_Loc and PlusFlowlineVAA
+need not be repeated for each query.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2015, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+@author Brian Miles <brian_miles@unc.edu>
+"""
+import numpy as np
+
+GAGE_COMID_TABLE = 'Gage_ComID'
+
+# NHDPlusV21:
+## The NHDFlowline comid for a stream flow gage location can be determined from the 
+## PlusFlowlineVAA where Gage_Loc.Reachcode = PlusFlowlineVAA.Reachcode and 
+## Gage_Loc.measure => PlusFlowlineVAA.FromMeas and Gage_Loc.measure <= PlusFlowlineVAA.ToMeas.
+# Gages not located on any flowline have a ComID of -1 (as for getComIdForStreamGage())
+GAGE_COMID_QUERY = """SELECT g.Source_Fea,g.ReachCode,g.Measure,coalesce(min(p.ComID), -1) AS ComID FROM Gage_Loc AS g
+LEFT JOIN PlusFlowlineVAA AS p ON p.ReachCode=g.ReachCode
+AND (g.Measure >= p.FromMeas AND g.Measure <= p.ToMeas)
+GROUP BY g.Source_Fea,g.ReachCode,g.Measure"""
+
+
+def hasGageComIdTable(conn):
+    """ Determine whether the NHDPlus2 database contains the Gage_ComID table
+
+        @param conn An sqlite3 connection to the NHDPlus2 database
+
+        @return True if the Gage_ComID table exists
+    """
+    cursor = conn.cursor()
+    cursor.execute("""SELECT name FROM sqlite_master WHERE type='table' AND name=?""", (GAGE_COMID_TABLE,))
+    exists = cursor.fetchone() is not None
+    cursor.close()
+    return exists
+
+
+def writeGageComIdTable(conn):
+    """ Precompute the ComID of the flowline each gage in Gage_Loc is located on,
+        replacing the Gage_ComID table if it already exists.
+
+        @param conn An sqlite3 connection to an NHDPlus2 database that has the
+        Gage_Loc and PlusFlowlineVAA tables
+
+        @return Integer representing the number of gages written
+    """
+    cursor = conn.cursor()
+    cursor.execute("""DROP TABLE IF EXISTS %s""" % (GAGE_COMID_TABLE,))
+    cursor.execute("""CREATE TABLE %s
+    (Source_Fea TEXT,
+    ReachCode TEXT,
+    Measure REAL,
+    ComID INTEGER)""" % (GAGE_COMID_TABLE,))
+    cursor.execute("""INSERT INTO %s (Source_Fea,ReachCode,Measure,ComID) %s""" % \
+                   (GAGE_COMID_TABLE, GAGE_COMID_QUERY))
+    cursor.execute("""CREATE INDEX IF NOT EXISTS gage_comid_source_fea_idx ON %s (Source_Fea)""" % \
+                   (GAGE_COMID_TABLE,))
+    cursor.execute("""CREATE INDEX IF NOT EXISTS gage_comid_reachcode_measure_idx ON %s (ReachCode,Measure)""" % \
+                   (GAGE_COMID_TABLE,))
+    conn.commit()
+    cursor.execute("""SELECT count(*) FROM %s""" % (GAGE_COMID_TABLE,))
+    numGages = cursor.fetchone()[0]
+    cursor.close()
+    return numGages
+
+
+def _toBytes(values):
+    return [v.encode('ascii', 'replace') if isinstance(v, unicode) else str(v) for v in values]
+
+
+class GageIndex(object):
+    """ Streamflow gages stored in arrays sorted by source_fea.  Gages whose location
+        is not known have longitude and latitude of NaN.
+    """
+    def __init__(self, sourceFeas, reachcodes, measures, comids, lons, lats):
+        """ Construct a gage index.  If a source_fea occurs more than once, only its
+            first occurrence is indexed.
+
+            @param sourceFeas Sequence of strings representing Gage_Loc Source_Fea of each gage
+            @param reachcodes Sequence of strings representing reach code of each gage
+            @param measures Sequence of floats representing measure of each gage
+            @param comids Sequence of integers representing ComID of flowline of each gage,
+        -1 for gages not located on a flowline
+            @param lons Sequence of floats representing longitude (WGS 84) of each gage
+            @param lats Sequence of floats representing latitude (WGS 84) of each gage
+        """
+        sourceFeas = np.array(_toBytes(sourceFeas), dtype=np.string_)
+        (self.sourceFeas, first) = np.unique(sourceFeas, return_index=True)
+        self.reachcodes = np.array(_toBytes(reachcodes), dtype=np.string_)[first]
+        self.measures = np.asarray(measures, dtype=np.float64)[first]
+        self.comids = np.asarray(comids, dtype=np.int64)[first]
+        self.lons = np.asarray(lons, dtype=np.float64)[first]
+        self.lats = np.asarray(lats, dtype=np.float64)[first]
+
+    @property
+    def numGages(self):
+        return len(self.sourceFeas)
+
+    @classmethod
+    def fromDB(cls, conn):
+        """ Load a gage index from the NHDPlus2 database.  The Gage_ComID table is used
+            if present, otherwise ComIDs are computed from Gage_Loc and PlusFlowlineVAA.
+
+            @param conn An sqlite3 connection to an NHDPlus2 database that has the
+            Gage_Loc, Gage_Info and PlusFlowlineVAA tables
+
+            @return GageIndex
+        """
+        if hasGageComIdTable(conn):
+            gages = GAGE_COMID_TABLE
+        else:
+            gages = "(%s)" % (GAGE_COMID_QUERY,)
+        cursor = conn.cursor()
+        cursor.execute("""SELECT g.Source_Fea,g.ReachCode,g.Measure,g.ComID,i.Lon_NHD,i.Lat_NHD
+FROM %s AS g
+LEFT JOIN Gage_Info AS i ON i.GageID=g.Source_Fea""" % (gages,))
+        rows = cursor.fetchall()
+        cursor.close()
+        if len(rows) == 0:
+            return cls([], [], [], [], [], [])
+        (sourceFeas, reachcodes, measures, comids, lons, lats) = zip(*rows)
+        lons = [np.nan if lon is None else lon for lon in lons]
+        lats = [np.nan if lat is None else lat for lat in lats]
+        return cls(sourceFeas, reachcodes, measures, comids, lons, lats)
+
+    def indexOf(self, sourceFeas):
+        """ Get the indices of gages
+
+            @param sourceFeas String or sequence of strings representing Gage_Loc Source_Fea of gages
+
+            @return Numpy array of indices, -1 for gages not in the index
+        """
+        if isinstance(sourceFeas, basestring):
+            sourceFeas = [sourceFeas]
+        if len(sourceFeas) == 0 or self.numGages == 0:
+            return -np.ones(len(sourceFeas), dtype=np.int64)
+        keys = np.array(_toBytes(sourceFeas), dtype=np.string_)
+        idx = np.searchsorted(self.sourceFeas, keys)
+        idx[idx == self.numGages] = 0
+        found = self.sourceFeas[idx] == keys
+        return np.where(found, idx, -1)
+
+    def getGages(self, sourceFeas):
+        """ Look up many gages at once
+
+            @param sourceFeas Sequence of strings representing Gage_Loc Source_Fea of gages
+
+            @return Tuple(numpy boolean array, True for gages that were found; 
+            reachcodes, measures, comids, lons, lats of gages that were found, each a numpy array)
+        """
+        idx = self.indexOf(sourceFeas)
+        found = idx != -1
+        idx = idx[found]
+        return (found, self.reachcodes[idx], self.measures[idx], self.comids[idx],
+                self.lons[idx], self.lats[idx])
+
+    def getGage(self, sourceFea):
+        """ Look up a single gage
+
+            @param sourceFea String representing Gage_Loc Source_Fea of gage
+
+            @return Tuple(reachcode, measure, comid, lon, lat); None if the gage was not found
+        """
+        i = self.indexOf(sourceFea)[0]
+        if i == -1:
+            return None
+        return (self.reachcodes[i], float(self.measures[i]), int(self.comids[i]),
+                float(self.lons[i]), float(self.lats[i]))
@@ -0,0 +1,213 @@
+"""@package ecohydrolib.nhdplus2.gageinfo
+
+@brief Search for streamflow gages by the attributes recorded in the Gage_Info table of
+the NHDPlus V2 database: station name (e.g. river name), state, drainage area and
+site status.
+@brief Station names are indexed using an SQLite FTS5 full-text index, so that name
+searches are ranked (BM25) and do not scan Gage_Info; indexes on state, status and
+drainage area (see ecohydrolib.nhdplus2.ingest) serve attribute searches.  Results
+include the location of each gage, both its coordinates and, if ComIDs of gages were
+precomputed (see ecohydrolib.nhdplus2.gageindex), the reach it is located on.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2015, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+@author Brian Miles <brian_miles@unc.edu>
+"""
+import re
+
+from ecohydrolib.nhdplus2.ingest import getTableSchema
+from ecohydrolib.nhdplus2.gageindex import GAGE_COMID_TABLE
+from ecohydrolib.nhdplus2.gageindex import hasGageComIdTable
+
+GAGE_INFO_TABLE = 'Gage_Info'
+GAGE_INFO_FTS_TABLE = 'Gage_Info_fts'
+DEFAULT_LIMIT = 50
+# Columns of each search result
+GAGE_SEARCH_COLUMNS = ['GageID', 'Station_NM', 'State', 'SiteStatus', 'DA_SQ_Mile',
+                       'ReachCode', 'Measure', 'ComID', 'Lon_Site', 'Lat_Site']
+# Abbreviations used in USGS station names, e.g. 'NEUSE R NR CLAYTON, NC'
+STATION_NAME_ABBREVIATIONS = {'river': 'r', 'creek': 'cr', 'near': 'nr', 'at': 'a',
+                              'fork': 'fk', 'branch': 'br', 'north': 'n', 'south': 's',
+                              'east': 'e', 'west': 'w', 'little': 'ltl', 'lake': 'lk',
+                              'mouth': 'mth', 'bridge': 'brg', 'tributary': 'trib'}
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def supportsFTS5(conn):
+    """ Determine whether the SQLite library supports FTS5 full-text indexes
+
+        @param conn An sqlite3 connection
+
+        @return True if FTS5 is supported
+    """
+    cursor = conn.cursor()
+    cursor.execute("""PRAGMA compile_options""")
+    options = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    return 'ENABLE_FTS5' in options
+
+
+def hasGageInfoIndex(conn):
+    """ Determine whether the NHDPlus2 database contains the full-text index of station names
+
+        @param conn An sqlite3 connection to the NHDPlus2 database
+
+        @return True if the full-text index exists
+    """
+    cursor = conn.cursor()
+    cursor.execute("""SELECT name FROM sqlite_master WHERE type='table' AND name=?""", (GAGE_INFO_FTS_TABLE,))
+    exists = cursor.fetchone() is not None
+    cursor.close()
+    return exists
+
+
+def writeGageInfoIndex(conn):
+    """ Create the attribute indexes of Gage_Info, if they do not already exist, and build
+        the full-text index of station names, replacing any existing full-text index.  The
+        full-text index is an external content FTS5 table, i.e. station names are not
+        stored twice, and must be rebuilt if Gage_Info is reloaded.
+
+        @param conn An sqlite3 connection to an NHDPlus2 database that has the Gage_Info table
+
+        @return Integer representing the number of gages indexed, or None if FTS5 is not
+        supported, in which case only attribute indexes are created
+    """
+    cursor = conn.cursor()
+    for sql in getTableSchema(GAGE_INFO_TABLE).getCreateIndexSQL():
+        cursor.execute(sql)
+    conn.commit()
+    if not supportsFTS5(conn):
+        cursor.close()
+        return None
+    cursor.execute("""DROP TABLE IF EXISTS %s""" % (GAGE_INFO_FTS_TABLE,))
+    cursor.execute("""CREATE VIRTUAL TABLE %s USING fts5(Station_NM, content='%s', content_rowid='rowid')""" % \
+                   (GAGE_INFO_FTS_TABLE, GAGE_INFO_TABLE))
+    cursor.execute("""INSERT INTO %s (%s) VALUES ('rebuild')""" % (GAGE_INFO_FTS_TABLE, GAGE_INFO_FTS_TABLE))
+    conn.commit()
+    cursor.execute("""SELECT count(*) FROM %s""" % (GAGE_INFO_TABLE,))
+    numGages = cursor.fetchone()[0]
+    cursor.close()
+    return numGages
+
+
+def getMatchExpression(text):
+    """ Convert free text (e.g. 'Neuse River near Clayton') into an FTS5 query matching
+        station names containing all words of the text.  Words match as prefixes, or as
+        their USGS abbreviations (see STATION_NAME_ABBREVIATIONS).
+
+        @param text String representing the text to search for
+
+        @return String representing the FTS5 query, or None if the text contains no words
+    """
+    terms = []
+    for token in TOKEN_RE.findall(text.lower()):
+        abbreviation = STATION_NAME_ABBREVIATIONS.get(token)
+        if abbreviation:
+            terms.append('("%s"* OR "%s")' % (token, abbreviation))
+        else:
+            terms.append('"%s"*' % (token,))
+    if len(terms) == 0:
+        return None
+    return ' AND '.join(terms)
+
+
+def searchGages(conn, text=None, state=None, minArea=None, maxArea=None, status=None,
+                limit=DEFAULT_LIMIT):
+    """ Search for streamflow gages by station name and attributes.  If text is given,
+        results are ranked by how well station names match it, otherwise results are
+        ordered by decreasing drainage area.
+
+        @param conn An sqlite3 connection to the NHDPlus2 database
+        @param text String representing words of the station name (e.g. river name)
+        @param state String representing the state, either its two letter abbreviation
+        (Gage_Info.State, e.g. 'NC') or its FIPS code (Gage_Info.State_CD, e.g. '37')
+        @param minArea Float representing the minimum drainage area, in square miles
+        @param maxArea Float representing the maximum drainage area, in square miles
+        @param status String representing the site status (Gage_Info.SiteStatus, e.g. 'active')
+        @param limit Integer representing the maximum number of gages to return
+
+        @return List of tuples, each with the columns GAGE_SEARCH_COLUMNS.  ReachCode and
+        Measure are those of Gage_Loc; they, and ComID, are None if ComIDs of gages were not
+        precomputed or the gage is not located on a flowline.
+    """
+    where = []
+    params = []
+    if state:
+        if state.isdigit():
+            where.append("i.State_CD=?")
+        else:
+            where.append("i.State=?")
+            state = state.upper()
+        params.append(state)
+    if status:
+        where.append("i.SiteStatus=?")
+        params.append(status)
+    if minArea is not None:
+        where.append("i.DA_SQ_Mile>=?")
+        params.append(minArea)
+    if maxArea is not None:
+        where.append("i.DA_SQ_Mile<=?")
+        params.append(maxArea)
+
+    if hasGageComIdTable(conn):
+        location = "c.ReachCode,c.Measure,c.ComID"
+        join = "LEFT JOIN %s AS c ON c.Source_Fea=i.GageID" % (GAGE_COMID_TABLE,)
+    else:
+        location = "NULL,NULL,NULL"
+        join = ""
+    columns = "i.GageID,i.Station_NM,i.State,i.SiteStatus,i.DA_SQ_Mile,%s,i.Lon_Site,i.Lat_Site" % \
+        (location,)
+
+    match = getMatchExpression(text) if text else None
+    if match and hasGageInfoIndex(conn):
+        sql = """SELECT {columns} FROM {fts} AS f
+JOIN {info} AS i ON i.rowid=f.rowid
+{join}
+WHERE f.{fts} MATCH ?{where}
+ORDER BY f.rank LIMIT ?""".format(columns=columns, fts=GAGE_INFO_FTS_TABLE, info=GAGE_INFO_TABLE, join=join,
+                              where=''.join([" AND %s" % (w,) for w in where]))
+        params = [match] + params
+    else:
+        if text:
+            # No full-text index, match words anywhere in station names
+            for token in TOKEN_RE.findall(text):
+                where.append("i.Station_NM LIKE ?")
+                params.append("%%%s%%" % (token,))
+        sql = """SELECT {columns} FROM {info} AS i
+{join}
+{where}
+ORDER BY i.DA_SQ_Mile DESC LIMIT ?""".format(columns=columns, info=GAGE_INFO_TABLE, join=join,
+                                             where="WHERE %s" % (' AND '.join(where),) if where else '')
+    params.append(limit)
+    cursor = conn.cursor()
+    cursor.execute(sql, params)
+    gages = cursor.fetchall()
+    cursor.close()
+    return gages
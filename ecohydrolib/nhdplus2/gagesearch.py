@@ -0,0 +1,197 @@
+"""@package ecohydrolib.nhdplus2.gagesearch
+
+@brief Spatial search of NHDPlus V2 streamflow gages in the GageLoc SQLite database
+built by NHDPlusV2Setup.py (using the OGR SQLite driver, which stores geometries as WKB).
+@brief Gages can be found within a bounding box or polygon, or by proximity to a point.
+Searches use the gageloc_rtree R*Tree table, if present, otherwise all gages are scanned.
+Each gage found is returned as a tuple (source_fea, reachcode, measure, x, y), where
+x and y are the longitude and latitude of the gage in WGS 84 (EPSG:4326).
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2015, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+@author Brian Miles <brian_miles@unc.edu>
+"""
+import math
+
+from shapely.wkb import loads
+from shapely.geometry import Point
+from shapely.prepared import prep
+
+from ecohydrolib.nhdplus2.catchmentdb import getGeometryColumn
+
+GAGELOC_TABLE = 'gageloc'
+GAGE_RTREE_TABLE = 'gageloc_rtree'
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180.0
+# Initial search radius, in km, of nearest gage searches
+NEAREST_SEARCH_RADIUS_KM = 10.0
+
+
+def hasGageLocationIndex(conn):
+    """ Determine whether the GageLoc database contains the gageloc_rtree table
+
+        @param conn An sqlite3 connection to the GageLoc database
+
+        @return True if the gageloc_rtree table exists
+    """
+    cursor = conn.cursor()
+    cursor.execute("""SELECT name FROM sqlite_master WHERE type='table' AND name=?""", (GAGE_RTREE_TABLE,))
+    exists = cursor.fetchone() is not None
+    cursor.close()
+    return exists
+
+
+def writeGageLocationIndex(conn):
+    """ Build an R*Tree table, gageloc_rtree, indexing the location of each gage,
+        replacing the table if it already exists.
+
+        @param conn An sqlite3 connection to the GageLoc database
+
+        @return Integer representing the number of gages indexed
+    """
+    geometryColumn = getGeometryColumn(conn, GAGELOC_TABLE)
+    cursor = conn.cursor()
+    cursor.execute("""DROP TABLE IF EXISTS %s""" % (GAGE_RTREE_TABLE,))
+    cursor.execute("""CREATE VIRTUAL TABLE %s USING rtree(id, minX, maxX, minY, maxY)""" % \
+                   (GAGE_RTREE_TABLE,))
+
+    def locations():
+        readCursor = conn.cursor()
+        readCursor.execute("""SELECT rowid,%s FROM %s""" % (geometryColumn, GAGELOC_TABLE))
+        for (rowid, wkb) in readCursor:
+            if wkb is None:
+                continue
+            (minX, minY, maxX, maxY) = loads(str(wkb)).bounds
+            yield (rowid, minX, maxX, minY, maxY)
+        readCursor.close()
+
+    cursor.executemany("""INSERT INTO %s (id,minX,maxX,minY,maxY) VALUES (?,?,?,?,?)""" % \
+                       (GAGE_RTREE_TABLE,), locations())
+    conn.commit()
+    cursor.execute("""SELECT count(*) FROM %s""" % (GAGE_RTREE_TABLE,))
+    numGages = cursor.fetchone()[0]
+    cursor.close()
+    return numGages
+
+
+def _getGagesInBoundingBox(conn, minX, minY, maxX, maxY):
+    geometryColumn = getGeometryColumn(conn, GAGELOC_TABLE)
+    cursor = conn.cursor()
+    if hasGageLocationIndex(conn):
+        cursor.execute("""SELECT g.source_fea,g.reachcode,g.measure,g.{geom} FROM {rtree} AS r
+JOIN {gageloc} AS g ON g.rowid=r.id
+WHERE r.maxX>=? AND r.minX<=? AND r.maxY>=? AND r.minY<=?""".format(geom=geometryColumn,
+                                                                rtree=GAGE_RTREE_TABLE,
+                                                                gageloc=GAGELOC_TABLE),
+                       (minX, maxX, minY, maxY))
+    else:
+        cursor.execute("""SELECT source_fea,reachcode,measure,%s FROM %s""" % \
+                       (geometryColumn, GAGELOC_TABLE))
+    for (sourceFea, reachcode, measure, wkb) in cursor:
+        if wkb is None:
+            continue
+        point = loads(str(wkb))
+        # R*Tree coordinates are rounded outward, test exact coordinates
+        if point.x >= minX and point.x <= maxX and point.y >= minY and point.y <= maxY:
+            yield (sourceFea, reachcode, measure, point.x, point.y)
+    cursor.close()
+
+
+def getGagesInBoundingBox(conn, bbox):
+    """ Get gages located within a bounding box
+
+        @param conn An sqlite3 connection to the GageLoc database
+        @param bbox A dict containing keys: minX, minY, maxX, maxY, in WGS 84 (EPSG:4326)
+
+        @return List of tuples (source_fea, reachcode, measure, x, y)
+    """
+    return list(_getGagesInBoundingBox(conn, bbox['minX'], bbox['minY'], bbox['maxX'], bbox['maxY']))
+
+
+def getGagesInPolygon(conn, polygon):
+    """ Get gages located within (or on the boundary of) a polygon
+
+        @param conn An sqlite3 connection to the GageLoc database
+        @param polygon Shapely polygon or multipolygon in WGS 84 (EPSG:4326)
+
+        @return List of tuples (source_fea, reachcode, measure, x, y)
+    """
+    if polygon.is_empty:
+        return []
+    (minX, minY, maxX, maxY) = polygon.bounds
+    prepared = prep(polygon)
+    return [gage for gage in _getGagesInBoundingBox(conn, minX, minY, maxX, maxY) \
+            if prepared.intersects(Point(gage[3], gage[4]))]
+
+
+def getDistanceKm(x1, y1, x2, y2):
+    """ Get the great circle distance between two points
+
+        @param x1 Float representing longitude of first point
+        @param y1 Float representing latitude of first point
+        @param x2 Float representing longitude of second point
+        @param y2 Float representing latitude of second point
+
+        @return Float representing the distance, in km, between the points
+    """
+    (lon1, lat1, lon2, lat2) = map(math.radians, (x1, y1, x2, y2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def getNearestGages(conn, x, y, k=1):
+    """ Get the gages nearest to a point.  The search radius is doubled until k gages
+        are found within it.
+
+        @param conn An sqlite3 connection to the GageLoc database
+        @param x Float representing longitude of point, in WGS 84 (EPSG:4326)
+        @param y Float representing latitude of point, in WGS 84 (EPSG:4326)
+        @param k Integer representing the number of gages to find
+
+        @return List of up to k tuples (source_fea, reachcode, measure, x, y), nearest gage first
+    """
+    radius = NEAREST_SEARCH_RADIUS_KM
+    while True:
+        dY = radius / KM_PER_DEGREE
+        # Longitude degrees shrink towards the poles
+        dX = dY / max(math.cos(math.radians(min(abs(y) + dY, 90.0))), 1e-6)
+        gages = []
+        for gage in _getGagesInBoundingBox(conn, x - dX, y - dY, x + dX, y + dY):
+            distance = getDistanceKm(x, y, gage[3], gage[4])
+            # Only gages within radius are known to be nearer than any gage outside the box
+            if distance <= radius:
+                gages.append( (distance, gage) )
+        if len(gages) >= k or radius > math.pi * EARTH_RADIUS_KM:
+            break
+        radius *= 2
+    gages.sort(key=lambda g: g[0])
+    return [g[1] for g in gages[:k]]
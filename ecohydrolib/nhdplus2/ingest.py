@@ -0,0 +1,702 @@
+"""@package ecohydrolib.nhdplus2.ingest
+
+@brief Methods for loading NHDPlus V2 DBF tables into the NHDPlus2 SQLite database
+built by NHDPlusV2Setup.py.
+@brief DBF records are streamed into the database with executemany (no DBF file is
+held in memory), in one transaction per file, with journaling and synchronous
+writes turned off for the duration of the load.  Indexes are created after all
+data have been loaded, rather than being updated for each record.
+@brief In parallel mode, the DBF files of each NHDPlus V2 vector processing unit
+(VPU) are loaded by a worker process into a staging database of their own; the
+staging databases are then merged into the NHDPlus2 database using ATTACH and
+INSERT ... SELECT.
+@brief In incremental mode, each DBF file loaded is recorded in the setup manifest
+(see ecohydrolib.nhdplus2.manifest), files already loaded are skipped, and the
+records of files that have changed are replaced.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2015, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+@author Brian Miles <brian_miles@unc.edu>
+"""
+import os
+import re
+import sys
+import time
+import sqlite3
+import multiprocessing
+
+from ecohydrolib.dbf import dbfreader
+from ecohydrolib.nhdplus2.mainstem import MAINSTEM_INDEX
+from ecohydrolib.nhdplus2.mainstem import MAINSTEM_INDEX_COLUMNS
+from ecohydrolib.nhdplus2.manifest import MANIFEST_TABLE
+from ecohydrolib.nhdplus2.manifest import MANIFEST_COLUMNS
+from ecohydrolib.nhdplus2.manifest import SOURCE_DBF
+from ecohydrolib.nhdplus2.manifest import SOURCE_CURRENT
+from ecohydrolib.nhdplus2.manifest import SOURCE_CHANGED
+from ecohydrolib.nhdplus2.manifest import createManifestTable
+from ecohydrolib.nhdplus2.manifest import hasManifestTable
+from ecohydrolib.nhdplus2.manifest import getSourceState
+from ecohydrolib.nhdplus2.manifest import recordSource
+from ecohydrolib.nhdplus2.manifest import deleteSource
+from ecohydrolib.nhdplus2.manifest import getMaxRowid
+from ecohydrolib.nhdplus2.manifest import deleteUnrecordedRows
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Page cache used during bulk loads, negative values are in KiB
+BULK_LOAD_CACHE_SIZE_KIB = 512 * 1024
+
+# Regional data are extracted into directories named by drainage area and VPU,
+# e.g. NHDPlusMS/NHDPlus10U/NHDPlusAttributes/PlusFlow.dbf
+VPU_DIR_RE = re.compile('^NHDPlus(\d\d[A-Za-z]?)$')
+NATIONAL_VPU = 'national'
+STAGING_ALIAS = 'staging'
+
+
+class TableSchema(object):
+    """ Schema of an NHDPlus2 database table loaded from DBF files.  Table columns
+        are filled from DBF fields in order; DBF fields named in skipFields are ignored,
+        and columns with no corresponding DBF field are filled from defaults.
+    """
+    def __init__(self, name, dbfName, columns, indexes, skipFields=(), defaults=None):
+        """ @param name String representing the name of the table
+            @param dbfName String representing the name of the DBF files holding
+            records of the table (matched case insensitively)
+            @param columns List of tuples (column name, SQL type)
+            @param indexes List of tuples (index name, list of column names, unique)
+            @param skipFields Sequence of strings representing names of DBF fields that
+            do not correspond to a table column
+            @param defaults Dict mapping column names to values to use when the DBF
+            file lacks the field for that column
+        """
+        self.name = name
+        self.dbfName = dbfName
+        self.columns = columns
+        self.indexes = indexes
+        self.skipFields = set([f.upper() for f in skipFields])
+        self.defaults = defaults or {}
+
+    @property
+    def columnNames(self):
+        return [c[0] for c in self.columns]
+
+    def getCreateTableSQL(self):
+        columns = ",\n    ".join(["%s %s" % c for c in self.columns])
+        return "CREATE TABLE IF NOT EXISTS %s\n    (%s)" % (self.name, columns)
+
+    def getCreateIndexSQL(self):
+        return ["CREATE %sINDEX IF NOT EXISTS %s ON %s (%s)" % \
+                ('UNIQUE ' if unique else '', indexName, self.name, ','.join(columns)) \
+                for (indexName, columns, unique) in self.indexes]
+
+    def getInsertSQL(self):
+        return "INSERT INTO %s (%s) VALUES (%s)" % \
+            (self.name, ','.join(self.columnNames), ','.join(['?'] * len(self.columns)))
+
+
+# Index names are those used by earlier versions of NHDPlusV2Setup.py
+TABLES = [
+    TableSchema('PlusFlowlineVAA', 'PlusFlowlineVAA.dbf',
+                [('ComID', 'INTEGER'), ('Fdate', 'DATETIME'), ('StreamLeve', 'INTEGER'),
+                 ('StreamOrde', 'INTEGER'), ('StreamCalc', 'INTEGER'), ('FromNode', 'INTEGER'),
+                 ('ToNode', 'INTEGER'), ('Hydroseq', 'INTEGER'), ('LevelPathI', 'INTEGER'),
+                 ('Pathlength', 'REAL'), ('TerminalPa', 'INTEGER'), ('ArbolateSu', 'REAL'),
+                 ('Divergence', 'INTEGER'), ('StartFlag', 'INTEGER'), ('TerminalFl', 'INTEGER'),
+                 ('DnLevel', 'INTEGER'), ('ThinnerCod', 'INTEGER'), ('UpLevelPat', 'INTEGER'),
+                 ('UpHydroseq', 'INTEGER'), ('DnLevelPat', 'INTEGER'), ('DnMinorHyd', 'INTEGER'),
+                 ('DnDrainCou', 'INTEGER'), ('DnHydroseq', 'INTEGER'), ('FromMeas', 'REAL'),
+                 ('ToMeas', 'REAL'), ('ReachCode', 'TEXT'), ('LengthKM', 'REAL'),
+                 ('Fcode', 'INTEGER'), ('RtnDiv', 'INTEGER'), ('OutDiv', 'INTEGER'),
+                 ('DivEffect', 'INTEGER'), ('VPUIn', 'INTEGER'), ('VPUOut', 'INTEGER'),
+                 ('TravTime', 'INTEGER'), ('PathTime', 'INTEGER'), ('AreaSqKM', 'REAL'),
+                 ('TotDASqKM', 'REAL'), ('DivDASqKM', 'REAL')],
+                [('PlusFlowlineVAA_Comid_idx', ['ComID'], False),
+                 ('PlusFlowlineVAA_Reachcode_idx', ['ReachCode'], False),
+                 ('PlusFlowlineVAA_FromMeas_idx', ['FromMeas'], False),
+                 ('PlusFlowlineVAA_ToMeas_idx', ['ToMeas'], False),
+                 (MAINSTEM_INDEX, MAINSTEM_INDEX_COLUMNS, False)]),
+    TableSchema('PlusFlow', 'PlusFlow.dbf',
+                [('FROMCOMID', 'INTEGER'), ('FROMHYDSEQ', 'INTEGER'), ('FROMLVLPAT', 'INTEGER'),
+                 ('TOCOMID', 'INTEGER'), ('TOHYDSEQ', 'INTEGER'), ('TOLVLPAT', 'INTEGER'),
+                 ('NODENUMBER', 'INTEGER'), ('DELTALEVEL', 'INTEGER'), ('DIRECTION', 'INTEGER'),
+                 ('GAPDISTKM', 'REAL'), ('HasGeo', 'TEXT'), ('TotDASqKM', 'REAL'),
+                 ('DivDASqKM', 'REAL')],
+                [('plusflow_from_idx', ['FROMCOMID'], False),
+                 ('plusflow_to_idx', ['TOCOMID'], False)]),
+    TableSchema('NHDReachCode_Comid', 'NHDReachCode_Comid.dbf',
+                [('COMID', 'INTEGER'), ('REACHCODE', 'TEXT'), ('REACHSMDAT', 'DATETIME'),
+                 ('RESOLUTION', 'TEXT'), ('GNIS_ID', 'INTEGER'), ('GNIS_NAME', 'TEXT')],
+                [('NHDReachCode_Comid_Comid_idx', ['COMID'], False),
+                 ('NHDReachCode_Comid_Reachcode_idx', ['REACHCODE'], False)]),
+    # Some regional NHDFlowline files lack the GNIS_NBR field
+    TableSchema('NHDFlowline', 'NHDFlowline.dbf',
+                [('COMID', 'INTEGER'), ('FDATE', 'DATETIME'), ('RESOLUTION', 'TEXT'),
+                 ('GNIS_ID', 'INTEGER'), ('GNIS_NAME', 'TEXT'), ('LENGTHKM', 'REAL'),
+                 ('REACHCODE', 'TEXT'), ('FLOWDIR', 'TEXT'), ('WBAREACOMI', 'INTEGER'),
+                 ('FTYPE', 'TEXT'), ('FCODE', 'INTEGER'), ('SHAPE_LENG', 'REAL'),
+                 ('ENABLED', 'TEXT'), ('GNIS_NBR', 'INTEGER')],
+                [('NHDFlowline_Comid_idx', ['COMID'], False),
+                 ('NHDFlowline_Reachcode_idx', ['REACHCODE'], False)],
+                defaults={'GNIS_NBR': 0}),
+    TableSchema('Gage_Loc', 'GageLoc.dbf',
+                [('ComID', 'INTEGER'), ('EventDate', 'DATETIME'), ('ReachCode', 'TEXT'),
+                 ('ReachSMDat', 'INTEGER'), ('Reachresol', 'TEXT'), ('FeatureCom', 'INTEGER'),
+                 ('FeatureCla', 'INTEGER'), ('Source_Ori', 'TEXT'), ('Source_Dat', 'TEXT'),
+                 ('Source_Fea', 'TEXT'), ('Featuredet', 'TEXT'), ('Measure', 'REAL'),
+                 ('Offset', 'INTEGER'), ('EventType', 'TEXT')],
+                [('gage_loc_source_fea_idx', ['Source_Fea'], False),
+                 ('reachcode_measure_idx', ['ReachCode', 'Measure'], False)]),
+    # Gage_Info.GageID maps to Gage_Loc.Source_Fea.  Some GageInfo files have an
+    # undocumented NHD2DAGE_D field.
+    TableSchema('Gage_Info', 'GageInfo.dbf',
+                [('GageID', 'TEXT'), ('Agency_cd', 'TEXT'), ('Station_NM', 'TEXT'),
+                 ('State_CD', 'TEXT'), ('State', 'TEXT'), ('SiteStatus', 'TEXT'),
+                 ('DA_SQ_Mile', 'REAL'), ('Lon_Site', 'REAL'), ('Lat_Site', 'REAL'),
+                 ('Lon_NHD', 'REAL'), ('Lat_NHD', 'REAL'), ('Reviewed', 'TEXT')],
+                [('gage_info_gageID_idx', ['GageID'], False),
+                 # Searches by state, status and drainage area (see ecohydrolib.nhdplus2.gageinfo)
+                 ('gage_info_state_cd_da_idx', ['State_CD', 'DA_SQ_Mile'], False),
+                 ('gage_info_state_da_idx', ['State', 'DA_SQ_Mile'], False),
+                 ('gage_info_status_da_idx', ['SiteStatus', 'DA_SQ_Mile'], False),
+                 ('gage_info_da_idx', ['DA_SQ_Mile'], False)],
+                skipFields=('NHD2DAGE_D',)),
+    # Gage_Smooth.SITE_NO maps to Gage_Info.GageID
+    TableSchema('Gage_Smooth', 'Gage_Smooth.DBF',
+                [('SITE_NO', 'TEXT'), ('YEAR', 'INTEGER'), ('MO', 'INTEGER'),
+                 ('AVE', 'REAL'), ('COMPLETERE', 'REAL')],
+                [('gage_smooth_idx', ['SITE_NO', 'YEAR', 'MO'], True)])
+]
+
+
+def getTableSchema(name):
+    """ Get the schema of an NHDPlus2 database table
+
+        @param name String representing the name of the table
+
+        @return TableSchema
+
+        @raise KeyError if there is no table of that name
+    """
+    for schema in TABLES:
+        if schema.name == name:
+            return schema
+    raise KeyError("Unknown NHDPlus2 table %s" % (name,))
+
+
+def beginBulkLoad(conn, journalMode='OFF'):
+    """ Turn off synchronous writes, and by default journaling, for a bulk load.  
+        If a load without journaling is interrupted the database must be rebuilt.
+
+        @param conn An sqlite3 connection
+        @param journalMode String representing the journal mode to use during the load; 
+        'WAL' keeps each transaction atomic should the load be interrupted
+    """
+    conn.execute("""PRAGMA journal_mode=%s""" % (journalMode,))
+    conn.execute("""PRAGMA synchronous=OFF""")
+    conn.execute("""PRAGMA temp_store=MEMORY""")
+    conn.execute("""PRAGMA cache_size=%d""" % (-BULK_LOAD_CACHE_SIZE_KIB,))
+
+
+def endBulkLoad(conn):
+    """ Restore journaling and synchronous writes after a bulk load
+
+        @param conn An sqlite3 connection
+    """
+    conn.commit()
+    conn.execute("""PRAGMA journal_mode=DELETE""")
+    conn.execute("""PRAGMA synchronous=FULL""")
+
+
+def createTables(conn, schemas=TABLES):
+    """ Create NHDPlus2 database tables, without indexes
+
+        @param conn An sqlite3 connection
+        @param schemas List of TableSchema of the tables to create
+    """
+    cursor = conn.cursor()
+    for schema in schemas:
+        cursor.execute(schema.getCreateTableSQL())
+    conn.commit()
+    cursor.close()
+
+
+def createIndexes(conn, schemas=TABLES, verbose=False, outfp=sys.stdout):
+    """ Create indexes of NHDPlus2 database tables
+
+        @param conn An sqlite3 connection
+        @param schemas List of TableSchema of the tables to index
+        @param verbose Boolean True if the time taken to create each index should be printed to outfp
+        @param outfp File-like object to which verbose output should be printed
+    """
+    cursor = conn.cursor()
+    for schema in schemas:
+        for sql in schema.getCreateIndexSQL():
+            start = time.time()
+            cursor.execute(sql)
+            if verbose:
+                outfp.write("%s (%.1f seconds)\n" % (sql, time.time() - start))
+    conn.commit()
+    cursor.close()
+
+
+def _getConverter(fieldSpec):
+    """ Get a function converting values read from a DBF field into values that
+        can be stored in SQLite, or None if values can be stored as read
+
+        @param fieldSpec Tuple (type, size, decimal places) of the DBF field
+    """
+    (typ, size, deci) = fieldSpec
+    if typ == 'N' and deci:
+        # Decimal
+        return float
+    elif typ == 'D':
+        # Dates repeat a great deal, format each only once
+        formatted = {}
+        def formatDate(value):
+            try:
+                return formatted[value]
+            except KeyError:
+                formatted[value] = s = value.strftime(DATETIME_FORMAT)
+                return s
+        return formatDate
+    elif typ == 'C' or typ == 'M':
+        return lambda value: unicode(value, errors='replace')
+    return None
+
+
+def _getRecordMapping(schema, fieldNames, fieldSpecs):
+    """ Map columns of a table to the fields of a DBF file
+
+        @return Tuple(list of tuples (field index, converter or None), one per column;
+        list of default values, which are to be appended to each record and are indexed
+        from len(fieldNames))
+    """
+    fields = [i for (i, name) in enumerate(fieldNames) \
+              if name.upper() not in schema.skipFields]
+    mapping = []
+    defaults = []
+    for (i, column) in enumerate(schema.columnNames):
+        if i < len(fields):
+            mapping.append( (fields[i], _getConverter(fieldSpecs[fields[i]])) )
+        elif column in schema.defaults:
+            mapping.append( (len(fieldNames) + len(defaults), None) )
+            defaults.append(schema.defaults[column])
+        else:
+            raise Exception("DBF file for table %s lacks a field for column %s" % \
+                            (schema.name, column))
+    return (mapping, defaults)
+
+
+def readRecords(schema, dbfPath):
+    """ Read records of an NHDPlus2 table from a DBF file
+
+        @param schema TableSchema of the table
+        @param dbfPath String representing the path of the DBF file
+
+        @return Generator of tuples of column values, suitable for schema.getInsertSQL()
+
+        @raise Exception if the DBF file has too few fields for the table
+    """
+    with open(dbfPath, 'rb') as f:
+        reader = dbfreader(f)
+        fieldNames = next(reader)
+        fieldSpecs = next(reader)
+        (mapping, defaults) = _getRecordMapping(schema, fieldNames, fieldSpecs)
+        for record in reader:
+            if defaults:
+                record.extend(defaults)
+            yield tuple([conv(record[i]) if conv else record[i] for (i, conv) in mapping])
+
+
+def getSourceName(path, sourceRoot=None):
+    """ Get the name identifying a source file in the setup manifest
+
+        @param path String representing the path of the file
+        @param sourceRoot String representing the directory relative to which
+        sources are named, if None the path is used as is
+
+        @return String representing the name of the source
+    """
+    if sourceRoot is None:
+        return path
+    return os.path.relpath(path, sourceRoot)
+
+
+def loadTable(conn, schema, dbfPaths, verbose=False, outfp=sys.stdout,
+              incremental=False, sourceRoot=None):
+    """ Load records of an NHDPlus2 table from one or more DBF files.  Records of
+        each file are inserted in a single transaction.
+
+        @param conn An sqlite3 connection
+        @param schema TableSchema of the table
+        @param dbfPaths List of strings representing the paths of DBF files
+        @param verbose Boolean True if progress and throughput should be printed to outfp
+        @param outfp File-like object to which verbose output should be printed
+        @param incremental Boolean True if each file should be recorded in the setup manifest
+        (in the same transaction as its records); files already loaded are skipped, and
+        the records of files that changed since they were loaded are replaced
+        @param sourceRoot String representing the directory relative to which
+        files are named in the setup manifest
+
+        @return Integer representing the number of records loaded
+    """
+    insertSQL = schema.getInsertSQL()
+    numFiles = len(dbfPaths)
+    numRows = 0
+    numSkipped = 0
+    start = time.time()
+    cursor = conn.cursor()
+    for (currFile, dbfPath) in enumerate(dbfPaths):
+        fileStart = time.time()
+        if incremental:
+            source = getSourceName(dbfPath, sourceRoot)
+            (state, checksum, size, mtime) = getSourceState(conn, source, dbfPath)
+            if state == SOURCE_CURRENT:
+                numSkipped += 1
+                continue
+            if state == SOURCE_CHANGED:
+                deleteSource(conn, source)
+            firstRowid = getMaxRowid(conn, schema.name) + 1
+        cursor.executemany(insertSQL, readRecords(schema, dbfPath))
+        fileRows = cursor.rowcount
+        if incremental:
+            if fileRows > 0:
+                recordSource(conn, source, SOURCE_DBF, checksum, size, mtime, schema.name,
+                             fileRows, firstRowid, firstRowid + fileRows - 1)
+            else:
+                recordSource(conn, source, SOURCE_DBF, checksum, size, mtime, schema.name)
+        conn.commit()
+        numRows += fileRows
+        if verbose:
+            elapsed = max(time.time() - fileStart, 1e-6)
+            outfp.write("\r\tProcessing file %d of %d (%.0f%%): %d records, %.0f rows/sec" % \
+                        (currFile + 1, numFiles, (float(currFile + 1) / numFiles) * 100,
+                         fileRows, fileRows / elapsed))
+            outfp.flush()
+    cursor.close()
+    if verbose:
+        elapsed = max(time.time() - start, 1e-6)
+        outfp.write("\n\t%d %s records loaded in %.1f seconds (%.0f rows/sec)\n" % \
+                    (numRows, schema.name, elapsed, numRows / elapsed))
+        if numSkipped:
+            outfp.write("\t%d file(s) already loaded were skipped\n" % (numSkipped,))
+    return numRows
+
+
+def _prepareIncrementalLoad(conn, schemas):
+    """ Create tables and the setup manifest, if they do not exist, and delete records
+        written by loads that were interrupted
+    """
+    createTables(conn, schemas)
+    createManifestTable(conn)
+    for schema in schemas:
+        deleteUnrecordedRows(conn, schema.name)
+
+
+def loadNHDPlusDB(conn, dbfPaths, schemas=TABLES, verbose=False, outfp=sys.stdout,
+                  incremental=False, sourceRoot=None):
+    """ Create and load NHDPlus2 database tables, creating indexes once all tables
+        have been loaded
+
+        @param conn An sqlite3 connection to an empty database, or in incremental mode,
+        a database previously loaded in incremental mode
+        @param dbfPaths Dict mapping table names to lists of paths of DBF files
+        @param schemas List of TableSchema of the tables to load
+        @param verbose Boolean True if progress and throughput should be printed to outfp
+        @param outfp File-like object to which verbose output should be printed
+        @param incremental Boolean True if files should be recorded in the setup manifest, 
+        skipping files already loaded, and replacing records of files that changed
+        @param sourceRoot String representing the directory relative to which
+        files are named in the setup manifest
+
+        @return Dict mapping table names to the number of records loaded
+    """
+    numRows = {}
+    beginBulkLoad(conn, 'WAL' if incremental else 'OFF')
+    try:
+        if incremental:
+            _prepareIncrementalLoad(conn, schemas)
+        else:
+            createTables(conn, schemas)
+        for schema in schemas:
+            if verbose:
+                outfp.write("Importing %s records from %d file(s) ...\n" % \
+                            (schema.name, len(dbfPaths.get(schema.name, []))))
+            numRows[schema.name] = loadTable(conn, schema, dbfPaths.get(schema.name, []),
+                                             verbose, outfp, incremental, sourceRoot)
+        if verbose:
+            outfp.write("Indexing tables ...\n")
+        createIndexes(conn, schemas, verbose, outfp)
+    finally:
+        endBulkLoad(conn)
+    return numRows
+
+
+def getVPUForPath(path):
+    """ Get the vector processing unit (VPU) of a file extracted from a regional
+        NHDPlus V2 archive
+
+        @param path String representing the path of the file
+
+        @return String representing the VPU (e.g. '10U'), or NATIONAL_VPU if the path
+        does not lie within a VPU directory
+    """
+    vpu = NATIONAL_VPU
+    for component in os.path.normpath(path).split(os.sep):
+        m = VPU_DIR_RE.match(component)
+        if m:
+            vpu = m.group(1)
+    return vpu
+
+
+def groupPathsByVPU(dbfPaths):
+    """ Group DBF files of NHDPlus2 tables by vector processing unit (VPU)
+
+        @param dbfPaths Dict mapping table names to lists of paths of DBF files
+
+        @return Dict mapping VPUs to dicts mapping table names to lists of paths of DBF files
+    """
+    groups = {}
+    for (table, paths) in dbfPaths.iteritems():
+        for path in paths:
+            groups.setdefault(getVPUForPath(path), {}).setdefault(table, []).append(path)
+    return groups
+
+
+def loadStagingDB(stagingPath, dbfPaths, schemas=TABLES, incremental=False, sourceRoot=None):
+    """ Load NHDPlus2 tables into a new staging database, without indexes
+
+        @param stagingPath String representing the path of the staging database to create,
+        an existing database will be replaced
+        @param dbfPaths Dict mapping table names to lists of paths of DBF files
+        @param schemas List of TableSchema of the tables to load
+        @param incremental Boolean True if files should be recorded in a setup manifest in
+        the staging database, to be merged with records of the files
+        @param sourceRoot String representing the directory relative to which
+        files are named in the setup manifest
+
+        @return Dict mapping table names to the number of records loaded
+    """
+    if os.path.exists(stagingPath):
+        os.unlink(stagingPath)
+    conn = sqlite3.connect(stagingPath)
+    numRows = {}
+    try:
+        beginBulkLoad(conn)
+        createTables(conn, schemas)
+        if incremental:
+            createManifestTable(conn)
+        for schema in schemas:
+            numRows[schema.name] = loadTable(conn, schema, dbfPaths.get(schema.name, []),
+                                             incremental=incremental, sourceRoot=sourceRoot)
+        endBulkLoad(conn)
+    finally:
+        conn.close()
+    return numRows
+
+
+def _loadStagingDB(args):
+    """ Load a staging database in a worker process """
+    (vpu, stagingPath, dbfPaths, schemas, incremental, sourceRoot) = args
+    start = time.time()
+    numRows = loadStagingDB(stagingPath, dbfPaths, schemas, incremental, sourceRoot)
+    return (vpu, stagingPath, numRows, time.time() - start)
+
+
+def attachAndMerge(conn, stagingPath, tables, replace=False):
+    """ Append the records of tables of a staging database to the same tables of a database.
+        If the staging database has a setup manifest, its entries are merged, in the same
+        transaction, with rowids translated to those of the merged records.
+
+        @param conn An sqlite3 connection to the destination database
+        @param stagingPath String representing the path of the staging database
+        @param tables Dict mapping table names to lists of names of columns to copy
+        @param replace Boolean True if records conflicting with existing records (e.g.
+        with the same primary key) should replace them
+
+        @return Dict mapping table names to the number of records merged; tables
+        absent from the staging database are skipped
+
+        @note Rowids of tables of the staging database must be contiguous, i.e. no records
+        may have been deleted from the staging database
+    """
+    numRows = {}
+    conn.commit()
+    conn.execute("""ATTACH DATABASE ? AS %s""" % (STAGING_ALIAS,), (stagingPath,))
+    try:
+        mergeManifest = hasManifestTable(conn, STAGING_ALIAS)
+        if mergeManifest:
+            createManifestTable(conn)
+        cursor = conn.cursor()
+        for (table, columns) in tables.iteritems():
+            cursor.execute("""SELECT name FROM %s.sqlite_master WHERE type='table' AND name=?""" % \
+                           (STAGING_ALIAS,), (table,))
+            if cursor.fetchone() is None:
+                continue
+            cursor.execute("""SELECT min(rowid) FROM %s.%s""" % (STAGING_ALIAS, table))
+            stagingFirstRowid = cursor.fetchone()[0] or 1
+            # Merged records are appended in rowid order after the last record of the table
+            offset = getMaxRowid(conn, 'main.%s' % (table,)) + 1 - stagingFirstRowid
+            columns = ','.join(columns)
+            cursor.execute("""INSERT {replace}INTO main.{table} ({columns}) SELECT {columns} FROM {alias}.{table}
+ORDER BY rowid""".format(replace='OR REPLACE ' if replace else '', table=table, columns=columns, 
+                         alias=STAGING_ALIAS))
+            numRows[table] = cursor.rowcount
+            if mergeManifest:
+                cursor.execute("""INSERT OR REPLACE INTO main.{manifest} ({columns})
+SELECT Source,Kind,TableName,Checksum,Size,Mtime,NumRows,FirstRowid+?,LastRowid+?,LoadedAt
+FROM {alias}.{manifest} WHERE TableName=?""".format(manifest=MANIFEST_TABLE, 
+                                                    columns=','.join(MANIFEST_COLUMNS),
+                                                    alias=STAGING_ALIAS),
+                               (offset, offset, table))
+        conn.commit()
+        cursor.close()
+    finally:
+        conn.execute("""DETACH DATABASE %s""" % (STAGING_ALIAS,))
+    return numRows
+
+
+def mergeStagingDBs(conn, stagingPaths, schemas=TABLES, verbose=False, outfp=sys.stdout,
+                    incremental=False):
+    """ Merge staging databases into an NHDPlus2 database, creating indexes once all
+        staging databases have been merged
+
+        @param conn An sqlite3 connection to the NHDPlus2 database
+        @param stagingPaths List of strings representing paths of staging databases
+        @param schemas List of TableSchema of the tables to merge
+        @param verbose Boolean True if progress and throughput should be printed to outfp
+        @param outfp File-like object to which verbose output should be printed
+        @param incremental Boolean True if the NHDPlus2 database is loaded incrementally, in 
+        which case each staging database is merged in a journaled transaction
+
+        @return Dict mapping table names to the number of records merged
+    """
+    tables = dict([(schema.name, schema.columnNames) for schema in schemas])
+    numRows = dict([(schema.name, 0) for schema in schemas])
+    beginBulkLoad(conn, 'WAL' if incremental else 'OFF')
+    try:
+        createTables(conn, schemas)
+        for stagingPath in stagingPaths:
+            start = time.time()
+            merged = attachAndMerge(conn, stagingPath, tables)
+            for (table, n) in merged.iteritems():
+                numRows[table] += n
+            if verbose:
+                total = sum(merged.values())
+                elapsed = max(time.time() - start, 1e-6)
+                outfp.write("Merged %d records from %s (%.0f rows/sec)\n" % \
+                            (total, stagingPath, total / elapsed))
+        if verbose:
+            outfp.write("Indexing tables ...\n")
+        createIndexes(conn, schemas, verbose, outfp)
+    finally:
+        endBulkLoad(conn)
+    return numRows
+
+
+def _getPathsToLoad(conn, dbfPaths, sourceRoot):
+    """ Filter out DBF files already loaded, deleting records of files that have changed
+
+        @return Dict mapping table names to lists of paths of DBF files to be loaded
+    """
+    toLoad = {}
+    for (table, paths) in dbfPaths.iteritems():
+        toLoad[table] = []
+        for path in paths:
+            source = getSourceName(path, sourceRoot)
+            state = getSourceState(conn, source, path)[0]
+            if state == SOURCE_CURRENT:
+                continue
+            if state == SOURCE_CHANGED:
+                deleteSource(conn, source)
+            toLoad[table].append(path)
+    conn.commit()
+    return toLoad
+
+
+def loadNHDPlusDBParallel(conn, dbfPaths, stagingDir, schemas=TABLES, processes=None,
+                          deleteStagingDBs=True, verbose=False, outfp=sys.stdout,
+                          incremental=False, sourceRoot=None):
+    """ Create and load NHDPlus2 database tables, loading the DBF files of each
+        vector processing unit (VPU) into a staging database in a separate worker
+        process, then merging the staging databases
+
+        @param conn An sqlite3 connection to an empty database
+        @param dbfPaths Dict mapping table names to lists of paths of DBF files
+        @param stagingDir String representing the directory in which staging databases
+        should be created
+        @param schemas List of TableSchema of the tables to load
+        @param processes Integer representing the number of worker processes to use, if None
+        the number of CPUs will be used
+        @param deleteStagingDBs Boolean True if staging databases should be deleted once merged
+        @param verbose Boolean True if progress and throughput should be printed to outfp
+        @param outfp File-like object to which verbose output should be printed
+        @param incremental Boolean True if files should be recorded in the setup manifest, 
+        skipping files already loaded, and replacing records of files that changed
+        @param sourceRoot String representing the directory relative to which
+        files are named in the setup manifest
+
+        @return Dict mapping table names to the number of records loaded
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if incremental:
+        # Only files that are new or have changed need to be staged
+        beginBulkLoad(conn, 'WAL')
+        try:
+            _prepareIncrementalLoad(conn, schemas)
+            dbfPaths = _getPathsToLoad(conn, dbfPaths, sourceRoot)
+        finally:
+            endBulkLoad(conn)
+    groups = groupPathsByVPU(dbfPaths)
+    jobs = [(vpu, os.path.join(stagingDir, "NHDPlusDB_%s.sqlite" % (vpu,)), groups[vpu], schemas,
+             incremental, sourceRoot) for vpu in sorted(groups.keys())]
+
+    stagingPaths = []
+    pool = multiprocessing.Pool(max(1, min(processes, len(jobs))))
+    try:
+        for (vpu, stagingPath, numRows, elapsed) in pool.imap_unordered(_loadStagingDB, jobs):
+            stagingPaths.append(stagingPath)
+            if verbose:
+                total = sum(numRows.values())
+                outfp.write("Loaded %d records of VPU %s in %.1f seconds (%.0f rows/sec)\n" % \
+                            (total, vpu, elapsed, total / max(elapsed, 1e-6)))
+                outfp.flush()
+    finally:
+        pool.close()
+        pool.join()
+
+    try:
+        numRows = mergeStagingDBs(conn, sorted(stagingPaths), schemas, verbose, outfp, incremental)
+    finally:
+        if deleteStagingDBs:
+            for stagingPath in stagingPaths:
+                os.unlink(stagingPath)
+    return numRows
+
@@ -0,0 +1,102 @@
+"""@package ecohydrolib.nhdplus2.mainstem
+
+@brief Upstream tracing of the mainstem of the NHDPlus V2 flowline network using the 
+LevelPathI, Hydroseq and UpHydroseq value added attributes (PlusFlowlineVAA).
+@brief All reaches of a mainstem share a LevelPathI, and Hydroseq increases upstream,
+so the mainstem above a reach is read, in upstream order, by a single range scan of 
+the composite (LevelPathI, Hydroseq, UpHydroseq) index created by NHDPlusV2Setup.py,
+rather than by traversing the whole upstream network.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2015, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+@author Brian Miles <brian_miles@unc.edu>
+"""
+import numpy as np
+
+VAA_TABLE = 'PlusFlowlineVAA'
+MAINSTEM_INDEX = 'PlusFlowlineVAA_LevelPathI_Hydroseq_idx'
+MAINSTEM_INDEX_COLUMNS = ['LevelPathI', 'Hydroseq', 'UpHydroseq']
+COMID_DTYPE = np.int64
+# With the mainstem index this is a single range scan, in index order
+MAINSTEM_QUERY = """SELECT ComID,Hydroseq,UpHydroseq,LengthKM,TotDASqKM FROM %s
+WHERE LevelPathI=? AND Hydroseq>=? ORDER BY Hydroseq""" % (VAA_TABLE,)
+
+
+def hasMainstemIndex(conn):
+    """ Determine whether the NHDPlus2 database has the mainstem index
+
+        @param conn An sqlite3 connection to the NHDPlus2 database
+
+        @return True if the mainstem index exists
+    """
+    cursor = conn.cursor()
+    cursor.execute("""SELECT name FROM sqlite_master WHERE type='index' AND name=?""", (MAINSTEM_INDEX,))
+    exists = cursor.fetchone() is not None
+    cursor.close()
+    return exists
+
+
+def getMainstemUpstream(conn, comID):
+    """ Trace the mainstem from a reach up to its headwater
+
+        @param conn An sqlite3 connection to the NHDPlus2 database
+        @param comID Integer representing the ComID of the reach to start from
+
+        @return Tuple(numpy array of ComIDs of reaches on the mainstem, starting with comID and
+        ending with the headwater reach; numpy array of cumulative LengthKM, measured upstream
+        from the downstream end of comID and including the whole of each reach; numpy array of
+        TotDASqKM of each reach).  Arrays are empty if comID was not found.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""SELECT LevelPathI,Hydroseq FROM %s WHERE ComID=?""" % (VAA_TABLE,), (comID,))
+    row = cursor.fetchone()
+    comids = []
+    lengthKm = []
+    totDASqKm = []
+    if row is not None:
+        (levelPath, hydroseq) = row
+        cursor.execute(MAINSTEM_QUERY, (levelPath, hydroseq))
+        expected = hydroseq
+        for (reach, reachHydroseq, upHydroseq, length, area) in cursor:
+            # Skip reaches of the level path that are not on the chain of UpHydroseq (Hydroseq
+            #   need not be consecutive), and stop where the chain is broken, e.g. at gaps in the data
+            if reachHydroseq < expected:
+                continue
+            if reachHydroseq > expected:
+                break
+            comids.append(reach)
+            lengthKm.append(length or 0.0)
+            totDASqKm.append(area or 0.0)
+            if not upHydroseq:
+                break
+            expected = upHydroseq
+    cursor.close()
+    return (np.array(comids, dtype=COMID_DTYPE), np.cumsum(np.array(lengthKm, dtype=np.float64)),
+            np.array(totDASqKm, dtype=np.float64))
@@ -0,0 +1,268 @@
+"""@package ecohydrolib.nhdplus2.manifest
+
+@brief Manifest of the source files (archives, DBF files, shapefiles) loaded into the
+databases built by NHDPlusV2Setup.py, so that setup can be resumed after it was
+interrupted, and so that only the sources that changed are re-loaded when NHDPlus
+data are updated.
+@brief Each source is recorded with its checksum and the range of rowids of the records
+loaded from it.  Because records are only ever appended, the records of a source are
+contiguous, and records beyond the last recorded range of a table were written by a
+load that did not complete.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2015, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+@author Brian Miles <brian_miles@unc.edu>
+"""
+import os
+import time
+import hashlib
+
+MANIFEST_TABLE = 'SetupManifest'
+
+SOURCE_ARCHIVE = 'archive'
+SOURCE_DBF = 'dbf'
+SOURCE_SHAPEFILE = 'shapefile'
+
+SOURCE_NEW = 'new'
+SOURCE_CURRENT = 'current'
+SOURCE_CHANGED = 'changed'
+
+CHECKSUM_BLOCK_SIZE = 1024 * 1024
+
+MANIFEST_COLUMNS = ['Source', 'Kind', 'TableName', 'Checksum', 'Size', 'Mtime',
+                    'NumRows', 'FirstRowid', 'LastRowid', 'LoadedAt']
+
+
+def createManifestTable(conn):
+    """ Create the manifest table, if it does not already exist
+
+        @param conn An sqlite3 connection
+    """
+    conn.execute("""CREATE TABLE IF NOT EXISTS %s
+    (Source TEXT PRIMARY KEY,
+    Kind TEXT,
+    TableName TEXT,
+    Checksum TEXT,
+    Size INTEGER,
+    Mtime REAL,
+    NumRows INTEGER,
+    FirstRowid INTEGER,
+    LastRowid INTEGER,
+    LoadedAt DATETIME)""" % (MANIFEST_TABLE,))
+    conn.commit()
+
+
+def hasManifestTable(conn, database='main'):
+    """ Determine whether a database contains a manifest table
+
+        @param conn An sqlite3 connection
+        @param database String representing the name of the (possibly attached) database
+
+        @return True if the manifest table exists
+    """
+    cursor = conn.cursor()
+    cursor.execute("""SELECT name FROM %s.sqlite_master WHERE type='table' AND name=?""" % \
+                   (database,), (MANIFEST_TABLE,))
+    exists = cursor.fetchone() is not None
+    cursor.close()
+    return exists
+
+
+def getFileInfo(paths):
+    """ Get the combined size and latest modification time of one or more files
+
+        @param paths String or list of strings representing paths of files
+
+        @return Tuple(integer size in bytes, float modification time)
+    """
+    if isinstance(paths, basestring):
+        paths = [paths]
+    stats = [os.stat(path) for path in paths]
+    return (sum(s.st_size for s in stats), max(s.st_mtime for s in stats))
+
+
+def getChecksum(paths):
+    """ Compute the MD5 checksum of the contents of one or more files
+
+        @param paths String or list of strings representing paths of files,
+        checksummed in order as if they were one file
+
+        @return String representing the hexadecimal checksum
+    """
+    if isinstance(paths, basestring):
+        paths = [paths]
+    md5 = hashlib.md5()
+    for path in paths:
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(CHECKSUM_BLOCK_SIZE)
+                if not block:
+                    break
+                md5.update(block)
+    return md5.hexdigest()
+
+
+def getSourceEntry(conn, source):
+    """ Get the manifest entry of a source
+
+        @param conn An sqlite3 connection
+        @param source String identifying the source, e.g. its path relative to the setup
+        output directory
+
+        @return Dict with keys MANIFEST_COLUMNS, or None if the source is not in the manifest
+    """
+    cursor = conn.cursor()
+    cursor.execute("""SELECT %s FROM %s WHERE Source=?""" % (','.join(MANIFEST_COLUMNS), MANIFEST_TABLE),
+                   (source,))
+    row = cursor.fetchone()
+    cursor.close()
+    if row is None:
+        return None
+    return dict(zip(MANIFEST_COLUMNS, row))
+
+
+def getSourceState(conn, source, paths):
+    """ Determine whether a source has been loaded, and whether it has changed since.
+        Sources whose size and modification time match those recorded are assumed not
+        to have changed, otherwise their checksum is compared with that recorded.
+
+        @param conn An sqlite3 connection
+        @param source String identifying the source
+        @param paths String or list of strings representing paths of the files of the source
+
+        @return Tuple(state, checksum, size, mtime) where state is one of SOURCE_NEW,
+        SOURCE_CURRENT, SOURCE_CHANGED
+    """
+    (size, mtime) = getFileInfo(paths)
+    entry = getSourceEntry(conn, source)
+    if entry is not None and entry['Size'] == size and entry['Mtime'] == mtime:
+        return (SOURCE_CURRENT, entry['Checksum'], size, mtime)
+    checksum = getChecksum(paths)
+    if entry is None:
+        return (SOURCE_NEW, checksum, size, mtime)
+    if entry['Checksum'] == checksum:
+        return (SOURCE_CURRENT, checksum, size, mtime)
+    return (SOURCE_CHANGED, checksum, size, mtime)
+
+
+def recordSource(conn, source, kind, checksum, size, mtime, table=None,
+                 numRows=0, firstRowid=None, lastRowid=None):
+    """ Record a source in the manifest, replacing any existing entry.  The
+        transaction is not committed, so that a source can be recorded atomically
+        with the records loaded from it.
+
+        @param conn An sqlite3 connection
+        @param source String identifying the source
+        @param kind String representing the kind of source, e.g. SOURCE_DBF
+        @param checksum String representing the checksum of the source
+        @param size Integer representing the size of the source
+        @param mtime Float representing the modification time of the source
+        @param table String representing the name of the table records were loaded into
+        @param numRows Integer representing the number of records loaded
+        @param firstRowid Integer representing the rowid of the first record loaded
+        @param lastRowid Integer representing the rowid of the last record loaded
+    """
+    conn.execute("""INSERT OR REPLACE INTO %s (%s) VALUES (?,?,?,?,?,?,?,?,?,?)""" % \
+                 (MANIFEST_TABLE, ','.join(MANIFEST_COLUMNS)),
+                 (source, kind, table, checksum, size, mtime, numRows, firstRowid, lastRowid,
+                  time.strftime("%Y-%m-%d %H:%M:%S")))
+
+
+def deleteSource(conn, source):
+    """ Delete the records loaded from a source, and its manifest entry.  The transaction
+        is not committed.
+
+        @param conn An sqlite3 connection
+        @param source String identifying the source
+
+        @return Integer representing the number of records deleted
+    """
+    entry = getSourceEntry(conn, source)
+    if entry is None:
+        return 0
+    numRows = 0
+    if entry['TableName'] and entry['FirstRowid'] is not None:
+        cursor = conn.cursor()
+        cursor.execute("""DELETE FROM %s WHERE rowid BETWEEN ? AND ?""" % (entry['TableName'],),
+                       (entry['FirstRowid'], entry['LastRowid']))
+        numRows = cursor.rowcount
+        cursor.close()
+    conn.execute("""DELETE FROM %s WHERE Source=?""" % (MANIFEST_TABLE,), (source,))
+    return numRows
+
+
+def getMaxRowid(conn, table):
+    """ Get the largest rowid of a table
+
+        @param conn An sqlite3 connection
+        @param table String representing the name of the table
+
+        @return Integer representing the largest rowid, 0 if the table is empty
+    """
+    cursor = conn.cursor()
+    cursor.execute("""SELECT max(rowid) FROM %s""" % (table,))
+    maxRowid = cursor.fetchone()[0]
+    cursor.close()
+    return maxRowid or 0
+
+
+def getLastRecordedRowid(conn, table):
+    """ Get the last rowid of a table recorded in the manifest
+
+        @param conn An sqlite3 connection
+        @param table String representing the name of the table
+
+        @return Integer representing the last recorded rowid, 0 if no rows of the table
+        have been recorded
+    """
+    cursor = conn.cursor()
+    cursor.execute("""SELECT max(LastRowid) FROM %s WHERE TableName=?""" % (MANIFEST_TABLE,), (table,))
+    lastRowid = cursor.fetchone()[0] or 0
+    cursor.close()
+    return lastRowid
+
+
+def deleteUnrecordedRows(conn, table):
+    """ Delete records of a table beyond the last range of records recorded in the
+        manifest, i.e. records written by a load that was interrupted before its source
+        was recorded.  The transaction is committed.
+
+        @param conn An sqlite3 connection
+        @param table String representing the name of the table
+
+        @return Integer representing the number of records deleted
+    """
+    lastRowid = getLastRecordedRowid(conn, table)
+    cursor = conn.cursor()
+    cursor.execute("""DELETE FROM %s WHERE rowid > ?""" % (table,), (lastRowid,))
+    numRows = cursor.rowcount
+    conn.commit()
+    cursor.close()
+    return numRows
@@ -0,0 +1,218 @@
+"""@package ecohydrolib.nhdplus2.nestedintervals
+
+@brief Nested-interval (pre-order/post-order) labelling of the NHDPlus V2 PlusFlow
+network.  Each ComID is labelled with the interval [Pre, Post] of a depth-first
+search of a spanning tree of the upstream graph, so that all reaches upstream of a
+reach along tree edges have Pre labels within the reach's interval.  Flow edges not
+in the spanning tree (i.e. below divergences and braids) are stored in a small side
+table of exceptions, which are followed when answering upstream queries.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2015, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+@author Brian Miles <brian_miles@unc.edu>
+"""
+import numpy as np
+
+INTERVAL_TABLE = 'PlusFlowInterval'
+EXCEPTION_TABLE = 'PlusFlowIntervalException'
+
+
+def computeNestedIntervals(graph):
+    """ Label each reach of an upstream graph with a nested interval.  A depth-first
+        search is started from each terminal reach (i.e. reaches with no downstream
+        reach); the first time a reach is reached defines its spanning tree edge,
+        subsequent flow edges into the reach are recorded as exceptions.
+
+        @param graph UpstreamGraph
+
+        @return Tuple(pre, post, exceptionFrom, exceptionTo) of numpy arrays.  pre and
+        post are indexed in the same order as graph.comids, exceptionFrom and exceptionTo
+        hold the indices of the upstream and downstream reaches of each exception edge.
+    """
+    n = graph.numReaches
+    offsets = graph.offsets.tolist()
+    neighbors = graph.neighbors.tolist()
+
+    pre = [-1] * n
+    post = [-1] * n
+    exceptionFrom = []
+    exceptionTo = []
+
+    # Start from terminal reaches, then from any reaches left unvisited (which
+    #   can only happen if PlusFlow contains a cycle with no outlet)
+    numDownstream = np.bincount(graph.neighbors, minlength=n)
+    roots = np.concatenate((np.nonzero(numDownstream == 0)[0],
+                            np.arange(n))).tolist()
+
+    counter = 0
+    for root in roots:
+        if pre[root] != -1:
+            continue
+        pre[root] = counter
+        counter += 1
+        stack = [root]
+        position = [offsets[root]]
+        while stack:
+            v = stack[-1]
+            p = position[-1]
+            if p < offsets[v+1]:
+                position[-1] = p + 1
+                u = neighbors[p]
+                if pre[u] == -1:
+                    pre[u] = counter
+                    counter += 1
+                    stack.append(u)
+                    position.append(offsets[u])
+                else:
+                    exceptionFrom.append(u)
+                    exceptionTo.append(v)
+            else:
+                post[v] = counter - 1
+                stack.pop()
+                position.pop()
+
+    return (np.array(pre, dtype=np.int64), np.array(post, dtype=np.int64),
+            np.array(exceptionFrom, dtype=np.int64), np.array(exceptionTo, dtype=np.int64))
+
+
+def writeNestedIntervals(conn, graph):
+    """ Compute nested intervals for an upstream graph and store them, and their
+        exceptions, in an NHDPlus2 database.  Existing intervals are replaced.
+
+        @param conn An sqlite3 connection to the database to write to
+        @param graph UpstreamGraph
+
+        @return Tuple(number of reaches labelled, number of exceptions)
+    """
+    (pre, post, exceptionFrom, exceptionTo) = computeNestedIntervals(graph)
+    comids = graph.comids
+
+    cursor = conn.cursor()
+    cursor.execute("""DROP TABLE IF EXISTS %s""" % (INTERVAL_TABLE,))
+    cursor.execute("""DROP TABLE IF EXISTS %s""" % (EXCEPTION_TABLE,))
+    cursor.execute("""CREATE TABLE %s
+    (ComID INTEGER PRIMARY KEY,
+    Pre INTEGER,
+    Post INTEGER)
+    """ % (INTERVAL_TABLE,))
+    cursor.execute("""CREATE TABLE %s
+    (FromComID INTEGER,
+    ToComID INTEGER,
+    ToPre INTEGER)
+    """ % (EXCEPTION_TABLE,))
+
+    cursor.executemany("""INSERT INTO %s (ComID,Pre,Post) VALUES (?,?,?)""" % (INTERVAL_TABLE,),
+                       zip(comids.tolist(), pre.tolist(), post.tolist()))
+    cursor.executemany("""INSERT INTO %s (FromComID,ToComID,ToPre) VALUES (?,?,?)""" % (EXCEPTION_TABLE,),
+                       zip(comids[exceptionFrom].tolist(), comids[exceptionTo].tolist(),
+                           pre[exceptionTo].tolist()))
+
+    cursor.execute("""CREATE UNIQUE INDEX IF NOT EXISTS %s_Pre_idx ON %s (Pre)""" % \
+                   (INTERVAL_TABLE, INTERVAL_TABLE))
+    cursor.execute("""CREATE INDEX IF NOT EXISTS %s_ToPre_idx ON %s (ToPre)""" % \
+                   (EXCEPTION_TABLE, EXCEPTION_TABLE))
+    conn.commit()
+    cursor.close()
+
+    return (len(comids), len(exceptionFrom))
+
+
+def getIntervalForReach(conn, comID):
+    """ Get the nested interval of a reach
+
+        @param conn An sqlite3 connection to a database that has nested interval tables
+        @param comID Integer representing the ComID of the reach
+
+        @return Tuple(pre, post); None if the reach has no interval
+    """
+    cursor = conn.cursor()
+    cursor.execute("""SELECT Pre,Post FROM %s WHERE ComID=?""" % (INTERVAL_TABLE,), (comID,))
+    result = cursor.fetchone()
+    cursor.close()
+    return result
+
+
+def getUpstreamReachesForInterval(conn, comID, includeStart=True):
+    """ Get all reaches upstream of a reach using nested intervals.  Reaches upstream
+        along spanning tree edges are found with a single range scan; exceptions
+        falling within the interval add the intervals of their upstream reaches.
+
+        @param conn An sqlite3 connection to a database that has nested interval tables
+        @param comID Integer representing the ComID of the reach whose upstream reaches are to be discovered
+        @param includeStart Boolean, True if comID should be included in the result
+
+        @return Numpy array of ComIDs of upstream reaches, in pre-order
+    """
+    cursor = conn.cursor()
+    cursor.execute("""WITH RECURSIVE roots(Pre,Post) AS (
+SELECT Pre,Post FROM {intervals} WHERE ComID=?
+UNION
+SELECT i.Pre,i.Post FROM roots AS r
+JOIN {exceptions} AS e ON e.ToPre BETWEEN r.Pre AND r.Post
+JOIN {intervals} AS i ON i.ComID=e.FromComID)
+SELECT DISTINCT i.ComID FROM roots AS r
+JOIN {intervals} AS i ON i.Pre BETWEEN r.Pre AND r.Post
+ORDER BY i.Pre""".format(intervals=INTERVAL_TABLE, exceptions=EXCEPTION_TABLE), (comID,))
+    reaches = np.fromiter((row[0] for row in cursor), dtype=np.int64)
+    cursor.close()
+    if not includeStart:
+        reaches = reaches[reaches != comID]
+    return reaches
+
+
+def isUpstreamOf(conn, upstreamComID, comID):
+    """ Determine whether a reach is upstream of another reach.  If the reach is
+        within the interval of the other reach, or there are no exceptions within
+        the interval, the answer requires only two indexed lookups.
+
+        @param conn An sqlite3 connection to a database that has nested interval tables
+        @param upstreamComID Integer representing the ComID of the candidate upstream reach
+        @param comID Integer representing the ComID of the downstream reach
+
+        @return True if upstreamComID is upstream of (or the same reach as) comID
+    """
+    interval = getIntervalForReach(conn, comID)
+    upstreamInterval = getIntervalForReach(conn, upstreamComID)
+    if interval is None or upstreamInterval is None:
+        return False
+    (pre, post) = interval
+    upstreamPre = upstreamInterval[0]
+    if pre <= upstreamPre <= post:
+        return True
+
+    cursor = conn.cursor()
+    cursor.execute("""SELECT 1 FROM %s WHERE ToPre BETWEEN ? AND ? LIMIT 1""" % (EXCEPTION_TABLE,),
+                   (pre, post))
+    hasExceptions = cursor.fetchone() is not None
+    cursor.close()
+    if not hasExceptions:
+        return False
+
+    return upstreamComID in set(getUpstreamReachesForInterval(conn, comID).tolist())
@@ -35,11 +35,12 @@ OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 @author Brian Miles <brian_miles@unc.edu>
 """
 import os
+import sys
 import errno
-import time
-import sqlite3
-import re
+import hashlib
+from collections import OrderedDict
 
+import numpy as np
 import ogr
 from shapely.geometry import Polygon
 from shapely.wkb import loads, dumps
@@ -47,13 +48,50 @@ from shapely.ops import *
 
 from ecohydrolib.spatialdata.utils import OGR_SHAPEFILE_DRIVER_NAME
 from ecohydrolib.spatialdata.utils import OGR_DRIVERS
-from ecohydrolib.spatialdata.utils import getBoundingBoxForShapefile
-from ecohydrolib.spatialdata.utils import deleteShapefile
+from ecohydrolib.spatialdata.dissolve import dissolveGeometries
+from ecohydrolib.spatialdata.dissolve import getPolygons
+from ecohydrolib.spatialdata.simplify import MultiResolutionGeometry
+from ecohydrolib.nhdplus2.upstreamgraph import UpstreamGraph
+from ecohydrolib.nhdplus2.upstreamgraph import getUpstreamReachesFromDB
+from ecohydrolib.nhdplus2.nestedintervals import getUpstreamReachesForInterval
+from ecohydrolib.nhdplus2.nestedintervals import isUpstreamOf
+from ecohydrolib.nhdplus2.connections import getDatabasePath
+from ecohydrolib.nhdplus2.connections import getConnection
+from ecohydrolib.nhdplus2.connections import getCachedHandle
+from ecohydrolib.nhdplus2.connections import getNHDPlusDBConnection
+from ecohydrolib.nhdplus2.connections import getCatchmentDBConnection
+from ecohydrolib.nhdplus2.gageindex import GageIndex
+from ecohydrolib.nhdplus2.downstream import DownstreamNetwork
+from ecohydrolib.nhdplus2.mainstem import getMainstemUpstream
+from ecohydrolib.nhdplus2.accumulation import UpstreamAccumulator
+from ecohydrolib.nhdplus2.gageindex import hasGageComIdTable
+from ecohydrolib.nhdplus2.gagesearch import getGagesInBoundingBox
+from ecohydrolib.nhdplus2.gagesearch import getGagesInPolygon
+from ecohydrolib.nhdplus2.gagesearch import getNearestGages
+from ecohydrolib.nhdplus2.gageinfo import searchGages
+from ecohydrolib.nhdplus2.gageinfo import DEFAULT_LIMIT as GAGE_SEARCH_LIMIT
+from ecohydrolib.nhdplus2.catchmentdb import CATCHMENT_TABLE
+from ecohydrolib.nhdplus2.catchmentdb import getCatchmentGeometriesForReaches
+from ecohydrolib.nhdplus2.catchmentdb import getBoundingBoxForReaches
+from ecohydrolib.nhdplus2.catchmentdb import getCatchmentsInBoundingBox as _getCatchmentsInBoundingBox
+from ecohydrolib.nhdplus2.subnetwork import extractSubnetwork
+from ecohydrolib.nhdplus2.partitions import PartitionedNetwork
+from ecohydrolib.nhdplus2.watershedcache import WatershedCache
+from ecohydrolib.nhdplus2.watershedcache import getDatasetVersion
 
 OGR_UPDATE_MODE = False
 NORTH = 0
 EAST = 90
 UPSTREAM_SEARCH_THRESHOLD = 998
+# Number of dissolved watersheds (and their simplified levels) cached per process
+WATERSHED_CACHE_SIZE = 32
+
+_upstreamGraphs = {}
+_gageIndexes = {}
+_downstreamNetworks = {}
+_upstreamAccumulators = {}
+_watersheds = OrderedDict()
+_datasetVersions = {}
 
 
 def getNHDReachcodeAndMeasureForGageSourceFea(config, source_fea):
@@ -70,17 +108,12 @@ def getNHDReachcodeAndMeasureForGageSourceFea(config, source_fea):
         @raise ConfigParser.NoOptionError
         @raise IOError(errno.EACCES) if NHDPlus2 DB is not readable
     """
-    nhddbPath = config.get('NHDPLUS2', 'PATH_OF_NHDPLUS2_DB')
-    if not os.access(nhddbPath, os.R_OK):
-        raise IOError(errno.EACCES, "The database at %s is not readable" %
-                      nhddbPath)
-    nhddbPath = os.path.abspath(nhddbPath)
-    
-    conn = sqlite3.connect(nhddbPath)
+    conn = getNHDPlusDBConnection(config)
     
     cursor = conn.cursor()
     cursor.execute("""SELECT ReachCode,Measure FROM Gage_Loc WHERE Source_Fea=?""", (source_fea,))
     result = cursor.fetchone()
+    cursor.close()
     if None == result:
         return None
     
@@ -142,15 +175,7 @@ def getLocationForStreamGage(config, whereFilter):
         @raise Exception if unable to open gage database
         @raise IOError(errno.ENOTDIR) if GageLoc is not readable
     """
-    gageLocPath = config.get('NHDPLUS2', 'PATH_OF_NHDPLUS2_GAGELOC')
-    if not os.access(gageLocPath, os.R_OK):
-        raise IOError(errno.EACCES, "The database at %s is not readable" %
-                      gageLocPath)
-    gageLocPath = os.path.abspath(gageLocPath)
-    
-    poDS = ogr.Open(gageLocPath, OGR_UPDATE_MODE)
-    if not poDS:
-        raise Exception("Unable to open gage database %s" (gageLocPath,))
+    poDS = _getDataSource(config, 'PATH_OF_NHDPLUS2_GAGELOC')
     assert(poDS.GetLayerCount() > 0)
     poLayer = poDS.GetLayer(0)
     assert(poLayer)
@@ -160,18 +185,142 @@ def getLocationForStreamGage(config, whereFilter):
         poGeometry = poFeature.GetGeometryRef()
         
         # Make sure spatial reference is EPSG:4326
-        pattern = re.compile("\ssrsName=\"(.+)\">")
-        gml = poGeometry.ExportToGML()
-        result = pattern.search(gml)
-        assert(result.group(1) == 'EPSG:4326')
+        srs = poLayer.GetSpatialRef()
+        assert(srs.GetAuthorityName(None) == 'EPSG' and srs.GetAuthorityCode(None) == '4326')
         
         # Get coordinates
         x = poGeometry.GetX()
         y = poGeometry.GetY()
+        poLayer.SetAttributeFilter(None)
         return (x,y)
+    poLayer.SetAttributeFilter(None)
     return None
     
 
+def getStreamGagesInBoundingBox(config, bbox):
+    """ Get streamflow gages, from gage point layer (Gage_Loc), located within a bounding box
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_GAGELOC' (absolute path to NHD GageLoc SQLite3 spatial database)
+        @param bbox A dict containing keys: minX, minY, maxX, maxY, in 'EPSG:4326' (WGS 84)
+         
+        @return List of tuples (source_fea, reachcode, measure, x, y), with (x,y) coordinates 
+        in 'EPSG:4326' (WGS 84)
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if GageLoc is not readable
+    """
+    return getGagesInBoundingBox(getConnection(config, 'PATH_OF_NHDPLUS2_GAGELOC'), bbox)
+
+
+def searchStreamGages(config, text=None, state=None, minArea=None, maxArea=None, status=None,
+                      limit=GAGE_SEARCH_LIMIT):
+    """ Search for streamflow gages by station name (e.g. river name), state, drainage area
+        and site status, using the attributes of Gage_Info
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB' (absolute path to SQLite3 DB of NHDFlow data)
+        @param text String representing words of the station name
+        @param state String representing the two letter abbreviation or FIPS code of the state
+        @param minArea Float representing the minimum drainage area, in square miles
+        @param maxArea Float representing the maximum drainage area, in square miles
+        @param status String representing the site status (e.g. 'active')
+        @param limit Integer representing the maximum number of gages to return
+         
+        @return List of tuples (gage_id, station_name, state, site_status, drainage_area_sq_mile,
+        reachcode, measure, comid, x, y), with (x,y) coordinates in 'EPSG:4326' (WGS 84), ranked 
+        by how well station names match text (see ecohydrolib.nhdplus2.gageinfo.searchGages())
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if NHDPlus2 DB is not readable
+    """
+    return searchGages(getNHDPlusDBConnection(config), text, state, minArea, maxArea, status, limit)
+
+
+def getCatchmentsInBoundingBox(config, bbox, exact=True):
+    """ Get NHDPlus catchments, from the CONUS catchment database, that intersect a bounding box.
+        Catchments are found using the catchment_extent R*Tree index built by NHDPlusV2Setup.py.
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT' (absolute path to NHD catchment SQLite3 spatial database)
+        @param bbox A dict containing keys: minX, minY, maxX, maxY, in 'EPSG:4326' (WGS 84)
+        @param exact Boolean True if catchments whose extent, but not geometry, intersects
+        the bounding box should be excluded
+         
+        @return List of tuples (featureid, string representing catchment geometry as WKB)
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if the catchment database is not readable
+        @raise Exception if the catchment database has no catchment_extent table
+    """
+    return _getCatchmentsInBoundingBox(getCatchmentDBConnection(config), bbox, exact)
+
+
+def getStreamGagesInPolygon(config, polygon):
+    """ Get streamflow gages, from gage point layer (Gage_Loc), located within a polygon
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_GAGELOC' (absolute path to NHD GageLoc SQLite3 spatial database)
+        @param polygon Shapely polygon or multipolygon in 'EPSG:4326' (WGS 84)
+         
+        @return List of tuples (source_fea, reachcode, measure, x, y), with (x,y) coordinates 
+        in 'EPSG:4326' (WGS 84)
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if GageLoc is not readable
+    """
+    return getGagesInPolygon(getConnection(config, 'PATH_OF_NHDPLUS2_GAGELOC'), polygon)
+
+
+def getNearestStreamGages(config, x, y, k=1):
+    """ Get the streamflow gages, from gage point layer (Gage_Loc), nearest to a point
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_GAGELOC' (absolute path to NHD GageLoc SQLite3 spatial database)
+        @param x Float representing longitude of point in 'EPSG:4326' (WGS 84)
+        @param y Float representing latitude of point in 'EPSG:4326' (WGS 84)
+        @param k Integer representing the number of gages to find
+         
+        @return List of up to k tuples (source_fea, reachcode, measure, x, y), with (x,y) 
+        coordinates in 'EPSG:4326' (WGS 84), nearest gage first
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if GageLoc is not readable
+    """
+    return getNearestGages(getConnection(config, 'PATH_OF_NHDPLUS2_GAGELOC'), x, y, k)
+
+
+def _getDataSource(config, option):
+    """ Get a shared, read-only OGR data source, opened once per thread, for the
+        dataset named by an option in the 'NHDPLUS2' section of config
+    
+        @param config A Python ConfigParser
+        @param option String representing the option in the 'NHDPLUS2' section naming the dataset
+        
+        @return OGR data source.  The data source is shared, callers must not destroy it.
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if the dataset is not readable
+        @raise Exception if unable to open the dataset
+    """
+    path = getDatabasePath(config, option)
+    def opener():
+        if not os.access(path, os.R_OK):
+            raise IOError(errno.EACCES, "The database at %s is not readable" %
+                          path)
+        poDS = ogr.Open(path, OGR_UPDATE_MODE)
+        if not poDS:
+            raise Exception("Unable to open database %s" % (path,))
+        return poDS
+    return getCachedHandle(('ogr', path), opener)
+
+
 def getComIdForStreamGage(conn, reachcode, measure):
     """ Uses NHDFlowline and/or NHDReachCode_ComID table(s) to lookup the ComID associated with a stream gage
         identified by reach code and measure.
@@ -188,6 +337,15 @@ def getComIdForStreamGage(conn, reachcode, measure):
     """
     comID = -1
     cursor = conn.cursor()
+    if hasGageComIdTable(conn):
+        # Use mapping precomputed by NHDPlusV2Setup.py
+        cursor.execute("""SELECT ComID FROM Gage_ComID WHERE ReachCode=? AND Measure=?""", 
+                       (reachcode, measure))
+        result = cursor.fetchone()
+        cursor.close()
+        if None != result:
+            comID = result[0]
+        return comID
     # NHDPlusV21:
     ## The NHDFlowline comid for a stream flow gage location can be determined from the 
     ## PlusFlowlineVAA where Gage_Loc.Reachcode = PlusFlowlineVAA.Reachcode and 
@@ -197,12 +355,284 @@ JOIN Gage_Loc as g ON p.ReachCode=g.ReachCode
 WHERE (g.Measure >= p.FromMeas AND g.Measure <= p.ToMeas)
 AND g.ReachCode=? AND g.Measure=?""", (reachcode, measure))
     result = cursor.fetchone()
+    cursor.close()
     if None != result:
         comID = result[0]
 
     return comID
 
 
+def getGageIndex(config):
+    """ Get the index of streamflow gages in the NHDPlus2 database.  Indexes are cached 
+        for the life of the process.
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB' (absolute path to NHDPlus2 SQLite3 database)
+        
+        @return GageIndex
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if NHDPlus2 DB is not readable
+    """
+    nhddbPath = getDatabasePath(config, 'PATH_OF_NHDPLUS2_DB')
+    gageIndex = _gageIndexes.get(nhddbPath)
+    if gageIndex is None:
+        gageIndex = GageIndex.fromDB(getNHDPlusDBConnection(config))
+        _gageIndexes[nhddbPath] = gageIndex
+    return gageIndex
+
+
+def getUpstreamGraph(config):
+    """ Get the upstream graph of the NHDPlus2 PlusFlow network.  If the graph was
+        saved by NHDPlusV2Setup.py and its path is configured, the graph is
+        memory-mapped from disk, otherwise the graph is built from the PlusFlow
+        table of the NHDPlus2 database.  Graphs are cached for the life of the process.
+        
+        @note Building the graph reads the entire PlusFlow table, which is only worthwhile
+        for long-running or batch processes; configure PATH_OF_NHDPLUS2_UPSTREAM_GRAPH for
+        short-lived processes (e.g. CGI scripts).  getUpstreamReaches() does not build the 
+        graph if its path is not configured.
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_UPSTREAM_GRAPH' (optional, absolute path to 
+            directory containing upstream graph written by NHDPlusV2Setup.py)
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB' (absolute path to SQLite3 DB of NHDFlow data;
+            used if PATH_OF_NHDPLUS2_UPSTREAM_GRAPH is not defined)
+        
+        @return UpstreamGraph
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if upstream graph or NHDPlus2 DB is not readable
+    """
+    if config.has_option('NHDPLUS2', 'PATH_OF_NHDPLUS2_UPSTREAM_GRAPH'):
+        graphPath = os.path.abspath(config.get('NHDPLUS2', 'PATH_OF_NHDPLUS2_UPSTREAM_GRAPH'))
+        graph = _upstreamGraphs.get(graphPath)
+        if graph is None:
+            graph = UpstreamGraph.load(graphPath)
+            _upstreamGraphs[graphPath] = graph
+        return graph
+    
+    nhddbPath = getDatabasePath(config, 'PATH_OF_NHDPLUS2_DB')
+    graph = _upstreamGraphs.get(nhddbPath)
+    if graph is None:
+        graph = UpstreamGraph.fromDB(getNHDPlusDBConnection(config))
+        _upstreamGraphs[nhddbPath] = graph
+    return graph
+
+
+def getUpstreamReaches(config, comID, includeStart=True):
+    """ Get all reaches upstream of a given reach.  The upstream graph is used if its path
+        is configured (or it has already been built by this process), otherwise the VPU 
+        partitions are traversed if they are configured, otherwise the PlusFlow table of 
+        the NHDPlus2 database is traversed with a recursive query.
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_UPSTREAM_GRAPH' (optional, absolute path to 
+            directory containing upstream graph written by NHDPlusV2Setup.py)
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_PARTITIONS' (optional, absolute path to the routing 
+            database of the partitions written by NHDPlusV2Setup.py)
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB' (absolute path to SQLite3 DB of NHDFlow data;
+            used if neither of the above is defined)
+        @param comID Integer representing the ComID of the reach whose upstream reaches are to be discovered
+        @param includeStart Boolean, True if comID should be included in the result
+        
+        @return Numpy array of ComIDs of upstream reaches
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if upstream graph or NHDPlus2 DB is not readable
+    """
+    if config.has_option('NHDPLUS2', 'PATH_OF_NHDPLUS2_UPSTREAM_GRAPH'):
+        return getUpstreamGraph(config).getUpstreamReaches(comID, includeStart)
+    if config.has_option('NHDPLUS2', 'PATH_OF_NHDPLUS2_PARTITIONS'):
+        return getUpstreamReachesByPartition(config, comID, includeStart)
+    graph = _getAvailableUpstreamGraph(config)
+    if graph is not None:
+        return graph.getUpstreamReaches(comID, includeStart)
+    return getUpstreamReachesFromDB(getNHDPlusDBConnection(config), comID, includeStart)
+
+
+def _getAvailableUpstreamGraph(config):
+    """ Get the upstream graph if it can be had without reading the PlusFlow table, i.e.
+        if its path is configured or it has already been built by this process
+    
+        @return UpstreamGraph, or None if the graph would have to be built
+    """
+    if config.has_option('NHDPLUS2', 'PATH_OF_NHDPLUS2_UPSTREAM_GRAPH'):
+        return getUpstreamGraph(config)
+    return _upstreamGraphs.get(getDatabasePath(config, 'PATH_OF_NHDPLUS2_DB'))
+
+
+def _searchForReachesSQL(config, search, comIDs, comIdsInSet, maxdepth):
+    """ Run a recursive PlusFlow search for each of many reaches
+    
+        @return Tuple(numpy array of ComIDs of start reaches, numpy array of ComIDs of
+        reaches found), one element per (start, reach) pair
+    """
+    conn = getNHDPlusDBConnection(config)
+    starts = []
+    reaches = []
+    for comID in np.atleast_1d(np.asarray(comIDs, dtype=np.int64)):
+        found = set()
+        search(conn, int(comID), comIdsInSet, found, 0, maxdepth)
+        found = sorted(found)
+        starts.extend([comID] * len(found))
+        reaches.extend(found)
+    return (np.array(starts, dtype=np.int64), np.array(reaches, dtype=np.int64))
+
+
+def getDownstreamNetwork(config):
+    """ Get the downstream mainstem network of the NHDPlus2 flowlines, built from
+        the PlusFlowlineVAA table.  Networks are cached for the life of the process.
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB' (absolute path to SQLite3 DB of NHDFlow data)
+        
+        @return DownstreamNetwork
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if NHDPlus2 DB is not readable
+    """
+    nhddbPath = getDatabasePath(config, 'PATH_OF_NHDPLUS2_DB')
+    network = _downstreamNetworks.get(nhddbPath)
+    if network is None:
+        network = DownstreamNetwork.fromDB(getNHDPlusDBConnection(config))
+        _downstreamNetworks[nhddbPath] = network
+    return network
+
+
+def getDownstreamFlowPath(config, comID):
+    """ Trace the mainstem flow path from a reach to its outlet, following DnHydroseq
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB' (absolute path to SQLite3 DB of NHDFlow data)
+        @param comID Integer representing the ComID of the reach to start from
+        
+        @return Tuple(numpy array of ComIDs of reaches on the path, starting with comID and 
+        ending with the outlet; numpy array of cumulative LengthKM; numpy array of cumulative 
+        TravTime).  Arrays are empty if comID was not found.
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if NHDPlus2 DB is not readable
+    """
+    return getDownstreamNetwork(config).getFlowPath(comID)
+
+
+def getMainstemUpstreamOfReach(config, comID):
+    """ Trace the mainstem from a reach up to its headwater, following LevelPathI
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB' (absolute path to SQLite3 DB of NHDFlow data)
+        @param comID Integer representing the ComID of the reach to start from
+        
+        @return Tuple(numpy array of ComIDs of reaches on the mainstem, starting with comID and 
+        ending with the headwater reach; numpy array of cumulative LengthKM upstream of the 
+        downstream end of comID; numpy array of TotDASqKM).  Arrays are empty if comID was not found.
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if NHDPlus2 DB is not readable
+    """
+    return getMainstemUpstream(getNHDPlusDBConnection(config), comID)
+
+
+def getOutletsForReaches(config, comIDs):
+    """ Find the outlet of, and the total length and travel time along, the mainstem 
+        flow path of each of many reaches at once
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB' (absolute path to SQLite3 DB of NHDFlow data)
+        @param comIDs Sequence of integers representing ComIDs of reaches
+        
+        @return Tuple(numpy array of ComIDs of outlets, -1 for reaches not found;
+        numpy array of LengthKM to outlets; numpy array of TravTime to outlets)
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if NHDPlus2 DB is not readable
+    """
+    return getDownstreamNetwork(config).getOutlets(comIDs)
+
+
+def getUpstreamAccumulator(config):
+    """ Get the topologically sorted PlusFlow network used to accumulate per-reach 
+        attributes downstream.  Accumulators are cached for the life of the process.
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB' (absolute path to SQLite3 DB of NHDFlow data)
+        
+        @return UpstreamAccumulator
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if NHDPlus2 DB is not readable
+    """
+    nhddbPath = getDatabasePath(config, 'PATH_OF_NHDPLUS2_DB')
+    accumulator = _upstreamAccumulators.get(nhddbPath)
+    if accumulator is None:
+        accumulator = UpstreamAccumulator.fromDB(getNHDPlusDBConnection(config))
+        _upstreamAccumulators[nhddbPath] = accumulator
+    return accumulator
+
+
+def accumulateUpstreamValues(config, comIDs, values):
+    """ Compute the upstream total of per-reach attributes for every reach in the network
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB' (absolute path to SQLite3 DB of NHDFlow data)
+        @param comIDs Sequence of integers representing ComIDs of reaches with values
+        @param values Numpy array of values (one row per ComID; one column per attribute, 
+        if two-dimensional)
+        
+        @return Tuple(numpy array of ComIDs of all reaches in the network, numpy array of 
+        upstream totals of each reach)
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if NHDPlus2 DB is not readable
+    """
+    accumulator = getUpstreamAccumulator(config)
+    return (accumulator.comids, accumulator.accumulate(values, comIDs))
+
+
+def extractSubnetworkForReach(config, comID, outputDir, verbose=False, outfp=sys.stdout):
+    """ Extract the subnetwork upstream of, and including, a reach from the CONUS NHDPlus2
+        databases into small, standalone databases with the same schema and indexes
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB' (absolute path to SQLite3 DB of NHDFlow data)
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT' (optional, absolute path to NHD catchment 
+            SQLite3 spatial DB)
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_GAGELOC' (optional, absolute path to NHD GageLoc 
+            SQLite3 spatial DB)
+        @param comID Integer representing the ComID of the outlet reach of the subnetwork
+        @param outputDir String representing the directory to write the databases to
+        @param verbose Boolean True if the number of records copied should be printed to outfp
+        @param outfp File-like object to which verbose output should be printed
+        
+        @return Dict mapping options of the 'NHDPLUS2' section to paths of the databases written; 
+        a config with these options can be used to run the functions of this module against the 
+        extracted databases
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if a database is not readable
+    """
+    catchmentDBPath = None
+    if config.has_option('NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT'):
+        catchmentDBPath = getDatabasePath(config, 'PATH_OF_NHDPLUS2_CATCHMENT')
+    gageLocDBPath = None
+    if config.has_option('NHDPLUS2', 'PATH_OF_NHDPLUS2_GAGELOC'):
+        gageLocDBPath = getDatabasePath(config, 'PATH_OF_NHDPLUS2_GAGELOC')
+    return extractSubnetwork(getUpstreamGraph(config), comID, 
+                             getDatabasePath(config, 'PATH_OF_NHDPLUS2_DB'),
+                             catchmentDBPath, gageLocDBPath, outputDir, verbose, outfp)
+
+
 def getPlusFlowPredecessors(conn, comID):
     """ Get the immediate predecessors of the NHDPlus2 PlusFlow feature of comID
     
@@ -228,6 +658,9 @@ def getUpstreamReachesSQL(conn, comID, allUpstreamReaches):
         @param conn A connection to an SQLite3 database
         @param comID The ComID of the reach whose upstream reaches are to be discovered
         @param allUpstreamReaches A list containing integers representing comIDs of upstream reaches
+        
+        @note Superseded by UpstreamGraph.getUpstreamReaches(), which does not recurse
+        and visits each reach only once.
     """
     upstream_reaches = getPlusFlowPredecessors(conn, comID)
     if len(upstream_reaches) == 0:
@@ -245,42 +678,150 @@ def getUpstreamReachesSQL(conn, comID, allUpstreamReaches):
         getUpstreamReachesSQL(conn, u, allUpstreamReaches)
 
 
+def getUpstreamReachesByInterval(config, comID, includeStart=False):
+    """ Get all reaches upstream of a given reach using the nested-interval labelling
+        of the PlusFlow network written by NHDPlusV2Setup.py.
+    
+        @param config A Python ConfigParser containing the following
+        sections and options:
+            'NHDPLUS2' and option 'PATH_OF_NHDPLUS2_DB' (absolute path to
+            SQLite3 DB of NHDFlow data)
+        @param comID The ComID of the reach whose upstream reaches are to be discovered
+        @param includeStart Boolean, True if comID should be included in the result
+        
+        @return Numpy array of ComIDs of upstream reaches
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if NHDPlus2 DB is not readable
+    """
+    conn = getNHDPlusDBConnection(config)
+    return getUpstreamReachesForInterval(conn, comID, includeStart)
+
+
+def getPartitionedNetwork(config):
+    """ Get the NHDPlus2 network partitioned by VPU by NHDPlusV2Setup.py.  Partitions
+        are only attached when a traversal reaches them.  Networks are cached for the
+        current thread; see ecohydrolib.nhdplus2.connections.closeConnections().
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_PARTITIONS' (absolute path to the routing 
+            database of the partitions written by NHDPlusV2Setup.py)
+        
+        @return PartitionedNetwork
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if the routing database is not readable
+    """
+    routingPath = getDatabasePath(config, 'PATH_OF_NHDPLUS2_PARTITIONS')
+    return getCachedHandle(('partitions', routingPath), lambda: PartitionedNetwork(routingPath))
+
+
+def getUpstreamReachesByPartition(config, comID, includeStart=False):
+    """ Get all reaches upstream of a given reach, querying the PlusFlow tables of only 
+        the VPU partitions the upstream reaches lie in.
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_PARTITIONS' (absolute path to the routing 
+            database of the partitions written by NHDPlusV2Setup.py)
+        @param comID The ComID of the reach whose upstream reaches are to be discovered
+        @param includeStart Boolean, True if comID should be included in the result
+        
+        @return Numpy array of ComIDs of upstream reaches
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if the routing database is not readable
+    """
+    return getPartitionedNetwork(config).getUpstreamReaches(comID, includeStart)
+
+
+def isUpstreamReach(config, upstreamComID, comID):
+    """ Determine whether a reach is upstream of another reach using the nested-interval 
+        labelling of the PlusFlow network written by NHDPlusV2Setup.py.
+    
+        @param config A Python ConfigParser containing the following
+        sections and options:
+            'NHDPLUS2' and option 'PATH_OF_NHDPLUS2_DB' (absolute path to
+            SQLite3 DB of NHDFlow data)
+        @param upstreamComID The ComID of the candidate upstream reach
+        @param comID The ComID of the downstream reach
+        
+        @return True if upstreamComID is upstream of comID
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if NHDPlus2 DB is not readable
+    """
+    conn = getNHDPlusDBConnection(config)
+    return isUpstreamOf(conn, upstreamComID, comID)
+
+
 def getFirstOrderUpstreamReachesNotInSet(config, comID, comIdsInSet, maxdepth=30):
     """ Search for upstream reaches downstream of reaches in the specified set.
+        Every upstream branch of comID is searched until it reaches the set.
     
         @param config A Python ConfigParser containing the following
         sections and options:
             'NHDPLUS2' and option 'PATH_OF_NHDPLUS2_DB' (absolute path to
             SQLite3 DB of NHDFlow data)
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_UPSTREAM_GRAPH' (optional, absolute path to
+            directory containing upstream graph written by NHDPlusV2Setup.py; if it is
+            not defined, PlusFlow is searched with indexed queries)
         @param comID The ComID of the reach whose upstream reaches downstream of those in the set
         are to be discovered
         @param comIdsInSet A set containing candidate comids
-        @param upstreamReaches List containing integers representing comIDs of upstream reaches in set comIdsInSet
         @param maxdepth Integer representing maximum depth of recursion
         
-        @return Set containing first order upstream reaches in set
+        @return List containing upstream reaches not in set
         
         @raise ConfigParser.NoSectionError
         @raise ConfigParser.NoOptionError
     """
-    nhddbPath = config.get('NHDPLUS2', 'PATH_OF_NHDPLUS2_DB')
-    if not os.access(nhddbPath, os.R_OK):
-        raise IOError(errno.EACCES, "The database at %s is not readable" %
-                      nhddbPath)
-    nhddbPath = os.path.abspath(nhddbPath)
-    
-    # Connect to DB
-    conn = sqlite3.connect(nhddbPath)
-    
+    graph = _getAvailableUpstreamGraph(config)
+    if graph is not None:
+        return graph.getFirstOrderUpstreamReachesNotInSet(comID, comIdsInSet, maxdepth).tolist()
     upstreamReaches = set()
-    depth = 0
-    getFirstOrderUpstreamReachesNotInSetSQL(conn, comID, comIdsInSet, upstreamReaches, depth, maxdepth)
-    return list(upstreamReaches)
+    getFirstOrderUpstreamReachesNotInSetSQL(getNHDPlusDBConnection(config), comID, comIdsInSet,
+                                         upstreamReaches, 0, maxdepth)
+    return sorted(upstreamReaches)
+
+
+def getFirstOrderUpstreamReachesNotInSetForReaches(config, comIDs, comIdsInSet, maxdepth=30):
+    """ Search for upstream reaches downstream of reaches in the specified set for 
+        many reaches at once.
+    
+        @param config A Python ConfigParser containing the following
+        sections and options:
+            'NHDPLUS2' and option 'PATH_OF_NHDPLUS2_DB' (absolute path to
+            SQLite3 DB of NHDFlow data)
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_UPSTREAM_GRAPH' (optional, absolute path to
+            directory containing upstream graph written by NHDPlusV2Setup.py; if it is
+            not defined, PlusFlow is searched with indexed queries)
+        @param comIDs Sequence of ComIDs of the reaches whose upstream reaches downstream of 
+        those in the set are to be discovered
+        @param comIdsInSet A set containing candidate comids
+        @param maxdepth Integer representing maximum depth of search
+        
+        @return Tuple(numpy array of ComIDs of start reaches, numpy array of ComIDs of
+        upstream reaches not in set), one element per (start, reach) pair
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+    """
+    graph = _getAvailableUpstreamGraph(config)
+    if graph is not None:
+        return graph.getFirstOrderUpstreamReachesNotInSetForReaches(comIDs, comIdsInSet, maxdepth)
+    return _searchForReachesSQL(config, getFirstOrderUpstreamReachesNotInSetSQL, comIDs, comIdsInSet, maxdepth)
 
 
 def getFirstOrderUpstreamReachesNotInSetSQL(conn, comID, comIdsInSet, upstreamReaches, depth, maxdepth):
     """ Recursively search for upstream reaches downstream of reaches in the specified set.
     
+        @note Used by getFirstOrderUpstreamReachesNotInSet when the upstream graph is
+        not available.  Every upstream branch of comID is searched until it reaches the set.
+    
         @param conn An sqlite3 connection to a database that has NHDPlus2 tables
         @param comID The ComID of the reach whose upstream reaches downstream of those in the set
         are to be discovered
@@ -304,9 +845,9 @@ def getFirstOrderUpstreamReachesNotInSetSQL(conn, comID, comIdsInSet, upstreamRe
     # Foreach reach upstream of this reach
     for u in upstream_reaches:
         #print("\timmediate upstream: %s" % (type(u),) )
-        # Return if upstream reach is in set
+        # Stop searching this branch if upstream reach is in set
         if u in comIdsInSet:
-            return
+            continue
         else:
             # Keep looking in other upstream branches for first order reaches in set
             upstreamReaches.add(u)
@@ -321,29 +862,53 @@ def getFirstOrderUpstreamReachesInSet(config, comID, comIdsInSet, maxdepth=30):
         sections and options:
             'NHDPLUS2' and option 'PATH_OF_NHDPLUS2_DB' (absolute path to
             SQLite3 DB of NHDFlow data)
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_UPSTREAM_GRAPH' (optional, absolute path to
+            directory containing upstream graph written by NHDPlusV2Setup.py; if it is
+            not defined, PlusFlow is searched with indexed queries)
         @param comID The ComID of the reach whose first-order upstream reaches are to be discovered
         @param comIdsInSet A set containing candidate comids
         @param upstreamReaches List containing integers representing comIDs of upstream reaches in set comIdsInSet
         @param maxdepth Integer representing maximum depth of recursion
         
-        @return Set containing first order upstream reaches in set
+        @return List containing first order upstream reaches in set
         
         @raise ConfigParser.NoSectionError
         @raise ConfigParser.NoOptionError
     """
-    nhddbPath = config.get('NHDPLUS2', 'PATH_OF_NHDPLUS2_DB')
-    if not os.access(nhddbPath, os.R_OK):
-        raise IOError(errno.EACCES, "The database at %s is not readable" %
-                      nhddbPath)
-    nhddbPath = os.path.abspath(nhddbPath)
-    
-    # Connect to DB
-    conn = sqlite3.connect(nhddbPath)
-    
+    graph = _getAvailableUpstreamGraph(config)
+    if graph is not None:
+        return graph.getFirstOrderUpstreamReachesInSet(comID, comIdsInSet, maxdepth).tolist()
     upstreamReaches = set()
-    depth = 0
-    getFirstOrderUpstreamReachesInSetSQL(conn, comID, comIdsInSet, upstreamReaches, depth, maxdepth)
-    return list(upstreamReaches)
+    getFirstOrderUpstreamReachesInSetSQL(getNHDPlusDBConnection(config), comID, comIdsInSet,
+                                         upstreamReaches, 0, maxdepth)
+    return sorted(upstreamReaches)
+
+
+def getFirstOrderUpstreamReachesInSetForReaches(config, comIDs, comIdsInSet, maxdepth=30):
+    """ Search for first-order upstream reaches in the specified set for many reaches at once.
+    
+        @param config A Python ConfigParser containing the following
+        sections and options:
+            'NHDPLUS2' and option 'PATH_OF_NHDPLUS2_DB' (absolute path to
+            SQLite3 DB of NHDFlow data)
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_UPSTREAM_GRAPH' (optional, absolute path to
+            directory containing upstream graph written by NHDPlusV2Setup.py; if it is
+            not defined, PlusFlow is searched with indexed queries)
+        @param comIDs Sequence of ComIDs of the reaches whose first-order upstream reaches are
+        to be discovered
+        @param comIdsInSet A set containing candidate comids
+        @param maxdepth Integer representing maximum depth of search
+        
+        @return Tuple(numpy array of ComIDs of start reaches, numpy array of ComIDs of
+        first order upstream reaches in set), one element per (start, reach) pair
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+    """
+    graph = _getAvailableUpstreamGraph(config)
+    if graph is not None:
+        return graph.getFirstOrderUpstreamReachesInSetForReaches(comIDs, comIdsInSet, maxdepth)
+    return _searchForReachesSQL(config, getFirstOrderUpstreamReachesInSetSQL, comIDs, comIdsInSet, maxdepth)
 
 
 def getFirstOrderUpstreamReachesInSetSQL(conn, comID, comIdsInSet, upstreamReaches, depth, maxdepth):
@@ -379,87 +944,110 @@ def getFirstOrderUpstreamReachesInSetSQL(conn, comID, comIdsInSet, upstreamReach
             getFirstOrderUpstreamReachesInSetSQL(conn, u, comIdsInSet, upstreamReaches, depth + 1, maxdepth)
 
         
+def getWatershedCache(config):
+    """ Get the on-disk cache of watershed polygons, if one is configured.  Caches are 
+        opened once for the current thread; see ecohydrolib.nhdplus2.connections.closeConnections().
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_WATERSHED_CACHE' (optional, absolute path to the 
+            watershed cache database, which will be created if it does not exist)
+            'NHDPLUS2', 'WATERSHED_CACHE_SIZE_MB' (optional, maximum size of geometries
+            stored in the cache, in megabytes)
+        
+        @return WatershedCache, or None if no watershed cache is configured
+        
+        @raise IOError(errno.EACCES) if the watershed cache does not exist and its directory 
+        is not writable
+    """
+    if not config.has_option('NHDPLUS2', 'PATH_OF_NHDPLUS2_WATERSHED_CACHE'):
+        return None
+    cachePath = getDatabasePath(config, 'PATH_OF_NHDPLUS2_WATERSHED_CACHE')
+    def opener():
+        if config.has_option('NHDPLUS2', 'WATERSHED_CACHE_SIZE_MB'):
+            maxSize = int(config.getfloat('NHDPLUS2', 'WATERSHED_CACHE_SIZE_MB') * 1024 * 1024)
+            return WatershedCache(cachePath, maxSize)
+        return WatershedCache(cachePath)
+    return getCachedHandle(('watershedcache', cachePath), opener)
+
+
+def _getDatasetVersion(config):
+    """ Get the version of the NHDPlus2 dataset that cached watersheds are keyed by
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'NHDPLUS2_VERSION' (optional, version of the NHDPlus2 dataset)
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_DB' (absolute path to SQLite3 DB of NHDFlow data;
+            used if NHDPLUS2_VERSION is not defined)
+        
+        @return String representing the version
+    """
+    if config.has_option('NHDPLUS2', 'NHDPLUS2_VERSION'):
+        return config.get('NHDPLUS2', 'NHDPLUS2_VERSION')
+    nhddbPath = getDatabasePath(config, 'PATH_OF_NHDPLUS2_DB')
+    version = _datasetVersions.get(nhddbPath)
+    if version is None:
+        version = getDatasetVersion(getNHDPlusDBConnection(config), nhddbPath)
+        _datasetVersions[nhddbPath] = version
+    return version
+
+
 def getBoundingBoxForCatchmentsForGage(config, outputDir, reachcode, measure, deleteIntermediateFiles=True):
     """ Get bounding box coordinates (in WGS 84) for the drainage area associated with a given NHD 
         (National Hydrography Dataset) streamflow gage identified by a reach code and measure.
         
         @param config A Python ConfigParser containing the following sections and options:
-            'GDAL/OGR' and option 'PATH_OF_OGR2OGR' (absolute path of ogr2ogr binary)
             'NHDPLUS2' and option 'PATH_OF_NHDPLUS2_DB' (absolute path to SQLite3 DB of NHDFlow data)
             'NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT' (absolute path to NHD catchment SQLite3 spatial DB)
-        @param outputDir String representing the absolute/relative path of the directory into which output rasters should be written
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_PARTITIONS' (optional, absolute path to the routing 
+            database of the partitions written by NHDPlusV2Setup.py; if defined, extents
+            are read from the catchment partitions)
+        @param outputDir Unused, retained for backward compatibility
         @param reachcode String representing NHD streamflow gage 
         @param measure Float representing the measure along reach where Stream Gage is located 
             in percent from downstream end of the one or more NHDFlowline features that are 
             assigned to the ReachCode (see NHDPlusV21 GageLoc table)
-        @param deleteIntermediateFiles A boolean, True if intermediate files generated from the analysis should be deleted
+        @param deleteIntermediateFiles Unused, retained for backward compatibility;
+            no intermediate files are written
+        
+        @note If 'NHDPLUS2', 'PATH_OF_NHDPLUS2_WATERSHED_CACHE' is configured, the bounding box
+            is read from the watershed cache if it is cached (see getWatershedCache())
          
-        @return A dictionary with keys: minX, minY, maxX, maxY, srs. The key srs is set to 'EPSG:4326' (WGS 84)
+        @return A dictionary with keys: minX, minY, maxX, maxY, srs. The key srs is set to 'EPSG:4326' (WGS 84);
+            None if no catchments were found
         
         @raise ConfigParser.NoSectionError
         @raise ConfigParser.NoOptionError
-        @raise IOError(errno.ENOTDIR) if outputDir is not a directory
-        @raise IOError(errno.EACCESS) if outputDir is not writable
+        @raise IOError(errno.EACCES) if the NHD DB or catchment feature DB is not readable
     """
-    nhddbPath = config.get('NHDPLUS2', 'PATH_OF_NHDPLUS2_DB')
-    if not os.access(nhddbPath, os.R_OK):
-        raise IOError(errno.EACCES, "The database at %s is not readable" %
-                      nhddbPath)
-    nhddbPath = os.path.abspath(nhddbPath)
-        
-    catchmentFeatureDBPath = config.get('NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT')
-    if not os.access(catchmentFeatureDBPath, os.R_OK):
-        raise IOError(errno.EACCES, "The catchment feature DB at %s is not readable" %
-                      catchmentFeatureDBPath)
-    catchmentFeatureDBPath = os.path.abspath(catchmentFeatureDBPath)
-    
-    ogrCmdPath = config.get('GDAL/OGR', 'PATH_OF_OGR2OGR')
-    if not os.access(ogrCmdPath, os.X_OK):
-        raise IOError(errno.EACCES, "The ogr2ogr binary at %s is not executable" %
-                      ogrCmdPath)
-    ogrCmdPath = os.path.abspath(ogrCmdPath)
-    
-    if not os.path.isdir(outputDir):
-        raise IOError(errno.ENOTDIR, "Output directory %s is not a directory" % (outputDir,))
-    if not os.access(outputDir, os.W_OK):
-        raise IOError(errno.EACCES, "Not allowed to write to output directory %s" % (outputDir,))
-    outputDir = os.path.abspath(outputDir)
-    
-    # Connect to DB
-    conn = sqlite3.connect(nhddbPath)
+    conn = getNHDPlusDBConnection(config)
     
     comID = getComIdForStreamGage(conn, reachcode, measure)
     #sys.stderr.write("Gage with reachcode %s, measure %f has ComID %d" % (reachcode, measure, comID))
+    if comID == -1:
+        # No reach with reachcode, don't cache misses for it
+        return None
     
-    # Get upstream reaches
-    upstream_reaches = []
-    getUpstreamReachesSQL(conn, comID, upstream_reaches)
-    #sys.stderr.write("Upstream reaches: ")
-    #sys.stderr.write(upstream_reaches)
-    
-    # Extract polygons for upstream catchments
-    catchmentOut = os.path.join(outputDir, "catchment-%s.shp" % time.time())
-    ogrCommand = "%s -s_srs EPSG:4326 -t_srs EPSG:4326  -f 'ESRI Shapefile' -sql 'SELECT * FROM catchment WHERE featureid=%s" % (ogrCmdPath, comID) # NHDPlusV2
-    for reach in upstream_reaches:
-        ogrCommand = ogrCommand + " OR featureid=%s" % reach # NHDPlusV2
-    ogrCommand = ogrCommand +"' " + catchmentOut + " " + catchmentFeatureDBPath  
-    #sys.stderr.write("ogr command: %s" % ogrCommand)
-    os.system(ogrCommand)
-    
-    bbox = getBoundingBoxForShapefile(catchmentOut)
+    cache = getWatershedCache(config)
+    if cache is not None:
+        version = _getDatasetVersion(config)
+        bbox = cache.getBoundingBox(comID, version)
+        if bbox is not None:
+            return bbox
     
-    # Clean-up temporary shapefile/ancillary files
-    if deleteIntermediateFiles:
-        deleteShapefile(catchmentOut)
+    # Get upstream reaches (including the reach the gage is on)
+    upstream_reaches = getUpstreamReaches(config, comID)
     
-    conn.close()
-
+    # Compute extent of upstream catchments
+    bbox = _getBoundingBoxForReaches(config, upstream_reaches)
+    if cache is not None and bbox is not None:
+        cache.putBoundingBox(comID, version, bbox, len(upstream_reaches))
     return bbox
 
 
 def getCatchmentFeaturesForReaches(config, outputDir,
                                    catchmentFilename, reaches,
-                                   format=OGR_SHAPEFILE_DRIVER_NAME):
+                                   format=OGR_SHAPEFILE_DRIVER_NAME,
+                                   verbose=False, outfp=sys.stdout,
+                                   tolerance=None):
     """ Get features (in WGS 84) for the drainage area associated with a
         set of NHD (National Hydrography Dataset) stream reaches.
         
@@ -474,6 +1062,11 @@ def getCatchmentFeaturesForReaches(config, outputDir,
         save catchment features to.  The appropriate extension will be added to the file name
         @param reaches List representing catchment features to be output
         @param format String representing OGR driver to use
+        @param verbose Boolean True if dissolve progress should be printed to outfp
+        @param outfp File-like object to which verbose output should be printed
+        @param tolerance Float representing the tolerance, in degrees, to which the
+        watershed polygon should be simplified (see ecohydrolib.spatialdata.simplify.getToleranceForZoom());
+        if None the full resolution polygon is written
         
         @return String representing the name of the dataset in outputDir created to hold
         the features
@@ -484,24 +1077,102 @@ def getCatchmentFeaturesForReaches(config, outputDir,
         @raise IOError(errno.EACCESS) if outputDir is not writable
         @raise Exception if output format is not known
         
-        @todo Detect and fix non-closed geometries, e.g.
-        kalisti:archive miles$ ./GetCatchmentsForComidsSP.py -p test -c 10462287
-        Traceback (most recent call last):
-          File "./GetCatchmentsForComidsSP.py", line 29, in <module>
-            catchmentFilename, comid)
-          File "/Users/miles/Dropbox/EarthCube-Multilayered/RHESSys-workflow/eclipse/EcohydroWorkflowLib/ecohydrolib/nhdplus2/networkanalysis.py", line 506, in getCatchmentFeaturesForComid
-            outGeom = outGeom.Union( inGeom )
-          File "/usr/local/Cellar/python/2.7.5/Frameworks/Python.framework/Versions/2.7/lib/python2.7/site-packages/osgeo/ogr.py", line 4065, in Union
-            return _ogr.Geometry_Union(self, *args)
-        RuntimeError: TopologyException: found non-noded intersection between LINESTRING (-77.9145 37.0768, -77.9147 37.0768) and LINESTRING (-77.9147 37.0768, -77.9145 37.0768) at -77.914621661942761 37.076822779115943
+        @note Catchments are dissolved with ecohydrolib.spatialdata.dissolve.dissolveGeometries(),
+        invalid catchment geometries are repaired before being dissolved.  Dissolved 
+        watersheds are cached, along with versions simplified at several tolerances, so 
+        that the same watershed can be written at another tolerance without being dissolved
+        again.
+    """
+    watershed = _getWatershed(config, reaches, verbose, outfp)
+    return _writeWatershedFeature(config, outputDir, catchmentFilename, watershed, format, tolerance)
+
+
+def _writeWatershedFeature(config, outputDir, catchmentFilename, watershed, format, tolerance):
+    """ Write a watershed to a new data source, as a single feature with the fields of 
+        the NHD catchment feature layer
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT' (absolute path to NHD catchment DB)
+        @param outputDir String representing the absolute/relative path of the directory 
+        into which output should be written
+        @param catchmentFilename String representing name of file to save catchment features 
+        to.  The appropriate extension will be added to the file name
+        @param watershed MultiResolutionGeometry
+        @param format String representing OGR driver to use
+        @param tolerance Float representing the tolerance, in degrees, to which the
+        watershed polygon should be simplified; if None the full resolution polygon is written
+        
+        @return String representing the name of the dataset in outputDir created to hold
+        the features
+    """
+    (poDS, poLayer) = _openCatchmentLayer(config)
+    (catchmentFilename, poODS, poOLayer) = _createCatchmentDataSource(poLayer, outputDir,
+                                                                      catchmentFilename, format)
+    
+    # Create fields in output layer
+    layerDefn = poLayer.GetLayerDefn()
+    i = 0
+    fieldCount = layerDefn.GetFieldCount()
+    while i < fieldCount:
+        fieldDefn = layerDefn.GetFieldDefn(i)
+        poOLayer.CreateField(fieldDefn)
+        i = i + 1
+    
+    # Write new feature to output feature data source
+    outFeat = ogr.Feature( poOLayer.GetLayerDefn() )
+    outFeat.SetGeometry( _getExteriorPolygon(watershed.getGeometry(tolerance)) )
+    poOLayer.CreateFeature(outFeat)
+        
+    return catchmentFilename
+
+
+def _openCatchmentLayer(config):
+    """ Open the NHD catchment feature layer
     
+        @param config A Python ConfigParser containing the following
+        sections and options:
+            'PATH_OF_NHDPLUS2_CATCHMENT' (absolute path to
+            NHD catchment shapefile)
+        
+        @return Tuple(OGR data source, OGR layer).  The data source is shared
+        with other callers in the same thread, callers must not destroy it.
+        
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.EACCES) if the catchment feature DB is not readable
+        @raise Exception if unable to open catchment feature DB
     """
-    catchmentFeatureDBPath = config.get('NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT')
-    if not os.access(catchmentFeatureDBPath, os.R_OK):
-        raise IOError(errno.EACCES, "The catchment feature DB at %s is not readable" %
-                      catchmentFeatureDBPath)
-    catchmentFeatureDBPath = os.path.abspath(catchmentFeatureDBPath)
+    ogr.UseExceptions()
+    poDS = _getDataSource(config, 'PATH_OF_NHDPLUS2_CATCHMENT')
+    assert(poDS.GetLayerCount() > 0)
+    # Catchment DB may also contain non-feature tables (e.g. catchment extents)
+    poLayer = poDS.GetLayerByName(CATCHMENT_TABLE)
+    if not poLayer:
+        poLayer = poDS.GetLayer(0)
+    assert(poLayer)
+    
+    return (poDS, poLayer)
+
+
+def _createCatchmentDataSource(poLayer, outputDir, catchmentFilename, format):
+    """ Create an output data source, with a single multipolygon layer named 'catchment', 
+        to hold catchment features
     
+        @param poLayer OGR layer of NHD catchment features, whose spatial reference
+        will be used for the output layer
+        @param outputDir String representing the absolute/relative
+        path of the directory into which output should be written
+        @param catchmentFilename String representing name of file to
+        save catchment features to.  The appropriate extension will be added to the file name
+        @param format String representing OGR driver to use
+        
+        @return Tuple(String representing the name of the dataset in outputDir, 
+        OGR data source, OGR layer)
+        
+        @raise IOError(errno.ENOTDIR) if outputDir is not a directory
+        @raise IOError(errno.EACCESS) if outputDir is not writable
+        @raise Exception if output format is not known
+    """
     if not os.path.isdir(outputDir):
         raise IOError(errno.ENOTDIR, "Output directory %s is not a directory" % (outputDir,))
     if not os.access(outputDir, os.W_OK):
@@ -514,98 +1185,133 @@ def getCatchmentFeaturesForReaches(config, outputDir,
     catchmentFilename ="%s%s%s" % ( catchmentFilename, os.extsep, OGR_DRIVERS[format] )
     catchmentFilepath = os.path.join(outputDir, catchmentFilename)
     
-    # Open input layer
-    ogr.UseExceptions()
-    poDS = ogr.Open(catchmentFeatureDBPath, OGR_UPDATE_MODE)
-    if not poDS:
-        raise Exception("Unable to open catchment feature database %s" (catchmentFeatureDBPath,))
-    assert(poDS.GetLayerCount() > 0)
-    poLayer = poDS.GetLayer(0)
-    assert(poLayer)
-    
     # Create output data source
     poDriver = ogr.GetDriverByName(format)
     assert(poDriver)
     poODS = poDriver.CreateDataSource(catchmentFilepath)
     assert(poODS != None)
-#    poOLayer = poODS.CreateLayer("catchment", poLayer.GetSpatialRef(), poLayer.GetGeomType())
     poOLayer = poODS.CreateLayer("catchment", poLayer.GetSpatialRef(), ogr.wkbMultiPolygon )
-#    poOLayer = poODS.CreateLayer("catchment", poLayer.GetSpatialRef(), ogr.wkbPolygon )
     
-    # Create fields in output layer
-    layerDefn = poLayer.GetLayerDefn()
-    i = 0
-    fieldCount = layerDefn.GetFieldCount()
-    while i < fieldCount:
-        fieldDefn = layerDefn.GetFieldDefn(i)
-        poOLayer.CreateField(fieldDefn)
-        i = i + 1
+    return (catchmentFilename, poODS, poOLayer)
 
-    # Create single geometry to hold catchment polygon in output shapefile
-    outGeom = ogr.Geometry( poOLayer.GetGeomType() )
-#    polygon = Polygon()
-
-    # Copy features, unioning them as we go
-    numReaches = len(reaches)
-    # Copy features in batches of UPSTREAM_SEARCH_THRESHOLD to overcome limit in 
-    #   OGR driver for input layer
-    start = 0
-    end = UPSTREAM_SEARCH_THRESHOLD
-    while end < numReaches:
-        whereFilter = "featureid=%s" % (reaches[start],)
-        for reach in reaches[start+1:end]:
-            whereFilter = whereFilter + " OR featureid=%s" % (reach,)
-        # Copy features
-        assert(poLayer.SetAttributeFilter(whereFilter) == 0)
-        inFeature = poLayer.GetNextFeature()
-        # Union geometry of input feature to output feature
-        while inFeature:
-#            inGeom = inFeature.GetGeometryRef().SimplifyPreserveTopology(0.0001)
-            inGeom = inFeature.GetGeometryRef()
-            outGeom = outGeom.Union( inGeom )
-#            polygon = polygon.union( loads( inGeom.ExportToWkb() ) )
-#            polygon = cascaded_union( [polygon, loads( inGeom.ExportToWkb() )] )
-            inFeature.Destroy()
-            inFeature = poLayer.GetNextFeature() 
-        start = end
-        end = end + UPSTREAM_SEARCH_THRESHOLD
-    # Copy remaining features
-    whereFilter = "featureid=%s" % (reaches[start],)
-    for reach in reaches[start+1:end]:
-        whereFilter = whereFilter + " OR featureid=%s" % (reach,)
-    # Copy features
-    poLayer.SetAttributeFilter(whereFilter)
-    assert(poLayer.SetAttributeFilter(whereFilter) == 0)
-    inFeature = poLayer.GetNextFeature()
-    while inFeature:
-#        inGeom = inFeature.GetGeometryRef().SimplifyPreserveTopology(0.0001)
-        inGeom = inFeature.GetGeometryRef()
-        outGeom = outGeom.Union( inGeom )
-#        polygon = polygon.union( loads( inGeom.ExportToWkb() ) )
-#        polygon = cascaded_union( [polygon, loads( inGeom.ExportToWkb() )] )
-        inFeature.Destroy()
-        inFeature = poLayer.GetNextFeature()
-    
-    # Create a new polygon that only contains exterior points
-    outGeom = ogr.ForceToPolygon( outGeom )
-    polygon = loads( outGeom.ExportToWkb() )
-    if polygon.exterior:
-        coords = polygon.exterior.coords
-        newPolygon = Polygon(coords)
+
+def _getCatchmentPartitions(config):
+    """ Get the partitioned network, if partitions with catchments are configured
+    
+        @return PartitionedNetwork, or None if catchments are to be read from the 
+        CONUS catchment DB
+    """
+    if not config.has_option('NHDPLUS2', 'PATH_OF_NHDPLUS2_PARTITIONS'):
+        return None
+    network = getPartitionedNetwork(config)
+    if not network.hasCatchments():
+        return None
+    return network
+
+
+def _getCatchmentGeometryForReaches(config, reaches, verbose=False, outfp=sys.stdout):
+    """ Dissolve catchment features of a set of reaches into a single geometry
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_PARTITIONS' (optional, absolute path to the routing 
+            database of the partitions written by NHDPlusV2Setup.py; if defined, catchments
+            are read from the catchment partitions the reaches lie in)
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT' (absolute path to NHD catchment DB)
+        @param reaches Sequence of ComIDs of reaches whose catchments are to be dissolved
+        @param verbose Boolean True if dissolve progress should be printed to outfp
+        @param outfp File-like object to which verbose output should be printed
+        
+        @return Shapely geometry
+    """
+    # Reaches are joined against catchment.featureid in a single query, 
+    #   WKB geometries are streamed directly to the dissolve
+    network = _getCatchmentPartitions(config)
+    if network is not None:
+        wkbs = network.getCatchmentGeometriesForReaches(reaches)
     else:
-        newPolygon = Polygon()
+        wkbs = getCatchmentGeometriesForReaches(getCatchmentDBConnection(config), reaches)
+    return dissolveGeometries(wkbs, verbose=verbose, outfp=outfp)
+
+
+def _getBoundingBoxForReaches(config, reaches):
+    """ Get the bounding box of the catchments of a set of reaches, reading the catchment
+        partitions the reaches lie in if partitions are configured
+    """
+    network = _getCatchmentPartitions(config)
+    if network is not None:
+        return network.getBoundingBoxForReaches(reaches)
+    return getBoundingBoxForReaches(getCatchmentDBConnection(config), reaches)
+
+
+def _getWatershedKey(config, reaches):
+    """ Get the key of the watershed of a set of reaches in the watershed cache
     
-    # Write new feature to output feature data source
-    outFeat = ogr.Feature( poOLayer.GetLayerDefn() )
-    outFeat.SetGeometry( ogr.CreateGeometryFromWkb( dumps(newPolygon) ) )
-    poOLayer.CreateFeature(outFeat)
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT' (absolute path to NHD catchment DB)
+        @param reaches Sequence of ComIDs of reaches of the watershed
         
-    return catchmentFilename
+        @return Tuple(string representing the path of the catchment DB, string representing 
+        the digest of the set of reaches)
+    """
+    reaches = np.unique(np.asarray(reaches, dtype=np.int64))
+    return (getDatabasePath(config, 'PATH_OF_NHDPLUS2_CATCHMENT'),
+            hashlib.md5(reaches.tostring()).hexdigest())
+
+
+def _cacheWatershed(key, watershed):
+    """ Add a watershed to the watershed cache, evicting the least recently used
+        watershed if the cache is full
+    """
+    _watersheds.pop(key, None)
+    _watersheds[key] = watershed
+    while len(_watersheds) > WATERSHED_CACHE_SIZE:
+        _watersheds.popitem(last=False)
+
+
+def _getWatershed(config, reaches, verbose=False, outfp=sys.stdout):
+    """ Get the dissolved watershed of a set of reaches, and its simplified levels, 
+        dissolving catchments only if the watershed is not cached
+    
+        @param config A Python ConfigParser containing the following sections and options:
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT' (absolute path to NHD catchment DB)
+        @param reaches Sequence of ComIDs of reaches whose catchments are to be dissolved
+        @param verbose Boolean True if dissolve progress should be printed to outfp
+        @param outfp File-like object to which verbose output should be printed
+        
+        @return MultiResolutionGeometry
+    """
+    key = _getWatershedKey(config, reaches)
+    watershed = _watersheds.get(key)
+    if watershed is None:
+        watershed = MultiResolutionGeometry(_getCatchmentGeometryForReaches(config, reaches,
+                                                                            verbose, outfp))
+    _cacheWatershed(key, watershed)
+    return watershed
+
+
+def _getExteriorPolygon(geom):
+    """ Create a new polygon that only contains the exterior points of a geometry.
+        For multipolygons and geometry collections, the exterior of the largest 
+        polygon is used.
+    
+        @param geom Shapely geometry
+        
+        @return OGR polygon geometry
+    """
+    polygons = getPolygons(geom)
+    if polygons:
+        geom = max(polygons, key=lambda g: g.area)
+        newPolygon = Polygon(geom.exterior.coords)
+    else:
+        newPolygon = Polygon()
+    return ogr.CreateGeometryFromWkb( dumps(newPolygon) )
 
 
 def getCatchmentFeaturesForComid(config, outputDir,
                                 catchmentFilename, comID,
-                                format=OGR_SHAPEFILE_DRIVER_NAME):
+                                format=OGR_SHAPEFILE_DRIVER_NAME,
+                                verbose=False, outfp=sys.stdout,
+                                tolerance=None):
     """ Get features (in WGS 84) for the drainage area associated with a
         given NHD (National Hydrography Dataset) stream reach.
          
@@ -620,6 +1326,10 @@ def getCatchmentFeaturesForComid(config, outputDir,
         @param comID String representing comid of stream reach whose upstream
         catchment area is to be determined
         @param format String representing OGR driver to use
+        @param verbose Boolean True if dissolve progress should be printed to outfp
+        @param outfp File-like object to which verbose output should be printed
+        @param tolerance Float representing the tolerance, in degrees, to which the
+        watershed polygon should be simplified; if None the full resolution polygon is written
         
         @return String representing the name of the dataset in outputDir created to hold
         the features
@@ -630,31 +1340,32 @@ def getCatchmentFeaturesForComid(config, outputDir,
         @raise IOError(errno.EACCESS) if outputDir is not writable
         @raise Exception if output format is not known
         
+        @note If 'NHDPLUS2', 'PATH_OF_NHDPLUS2_WATERSHED_CACHE' is configured, the watershed
+        is read from the watershed cache if it is cached, and is otherwise added to the cache
+        (see getWatershedCache())
     """
-    nhddbPath = config.get('NHDPLUS2', 'PATH_OF_NHDPLUS2_DB')
-    if not os.access(nhddbPath, os.R_OK):
-        raise IOError(errno.EACCES, "The database at %s is not readable" %
-                      nhddbPath)
-    nhddbPath = os.path.abspath(nhddbPath)
-    
-    # Connect to DB
-    conn = sqlite3.connect(nhddbPath)
+    cache = getWatershedCache(config)
+    if cache is not None:
+        version = _getDatasetVersion(config)
+        cached = cache.getWatershed(comID, version)
+        if cached is not None:
+            return _writeWatershedFeature(config, outputDir, catchmentFilename, cached[0],
+                                          format, tolerance)
     
     # Get upstream reaches
-    reaches = [comID]
-    getUpstreamReachesSQL(conn, comID, reaches)
-    #sys.stderr.write("Upstream reaches: ")
-    #sys.stderr.write(upstream_reaches)
-    conn.close()
+    reaches = getUpstreamReaches(config, comID)
     
-    return getCatchmentFeaturesForReaches(config, outputDir,
-                                   catchmentFilename, reaches,
-                                   format)
+    watershed = _getWatershed(config, reaches, verbose, outfp)
+    if cache is not None and not watershed.geom.is_empty:
+        cache.putWatershed(comID, version, watershed, len(reaches))
+    return _writeWatershedFeature(config, outputDir, catchmentFilename, watershed, format, tolerance)
 
  
 def getCatchmentFeaturesForGage(config, outputDir,
                                 catchmentFilename, reachcode, measure, 
-                                format=OGR_SHAPEFILE_DRIVER_NAME):
+                                format=OGR_SHAPEFILE_DRIVER_NAME,
+                                verbose=False, outfp=sys.stdout,
+                                tolerance=None):
     """ Get features (in WGS 84) for the drainage area associated with a
         given NHD (National Hydrography Dataset) streamflow gage
         identified by a reach code and measure.
@@ -671,6 +1382,9 @@ def getCatchmentFeaturesForGage(config, outputDir,
 
             'NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT' (absolute path to
             NHD catchment shapefile)
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_PARTITIONS' (optional, absolute path to the 
+            routing database of the partitions written by NHDPlusV2Setup.py; if defined, 
+            catchments are read from the catchment partitions)
         @param outputDir String representing the absolute/relative
         path of the directory into which output rasters should be
         written
@@ -682,6 +1396,10 @@ def getCatchmentFeaturesForGage(config, outputDir,
         end of the one or more NHDFlowline features that are
         assigned to the ReachCode (see NHDPlusV21 GageLoc table)
         @param format String representing OGR driver to use
+        @param verbose Boolean True if dissolve progress should be printed to outfp
+        @param outfp File-like object to which verbose output should be printed
+        @param tolerance Float representing the tolerance, in degrees, to which the
+        watershed polygon should be simplified; if None the full resolution polygon is written
         
         @return String representing the name of the dataset in outputDir created to hold
         the features
@@ -692,18 +1410,132 @@ def getCatchmentFeaturesForGage(config, outputDir,
         @raise IOError(errno.EACCESS) if outputDir is not writable
         @raise Exception if output format is not known
     """
-    nhddbPath = config.get('NHDPLUS2', 'PATH_OF_NHDPLUS2_DB')
-    if not os.access(nhddbPath, os.R_OK):
-        raise IOError(errno.EACCES, "The database at %s is not readable" %
-                      nhddbPath)
-    nhddbPath = os.path.abspath(nhddbPath)
-    
-    # Connect to DB
-    conn = sqlite3.connect(nhddbPath)
+    conn = getNHDPlusDBConnection(config)
     
     comID = getComIdForStreamGage(conn, reachcode, measure)
     #sys.stderr.write("Gage with reachcode %s, measure %f has ComID %d" % (reachcode, measure, comID))
     
     return getCatchmentFeaturesForComid(config, outputDir,
                                 catchmentFilename, comID,
-                                format)
+                                format, verbose, outfp, tolerance)
+
+
+def getCatchmentFeaturesForGages(config, outputDir,
+                                 catchmentFilename, gages,
+                                 format=OGR_SHAPEFILE_DRIVER_NAME,
+                                verbose=False, outfp=sys.stdout,
+                                tolerance=None):
+    """ Get features (in WGS 84) for the drainage areas associated with a 
+        set of NHD (National Hydrography Dataset) streamflow gages.  One
+        feature is written per gage.
+        
+        Gages are processed in topological order (upstream gages first).  The 
+        upstream search for each gage stops at the outlets of other gages, and the
+        watershed of a downstream gage is assembled from the reach sets and 
+        dissolved polygons of the gages nested within it, so that shared upstream
+        sub-networks are traversed and dissolved only once.
+        
+        @param config A Python ConfigParser containing the following
+        sections and options:
+            'NHDPLUS2' and option 'PATH_OF_NHDPLUS2_DB' (absolute path to
+            SQLite3 DB of NHDFlow data)
+
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_CATCHMENT' (absolute path to
+            NHD catchment shapefile)
+            'NHDPLUS2', 'PATH_OF_NHDPLUS2_PARTITIONS' (optional, absolute path to the 
+            routing database of the partitions written by NHDPlusV2Setup.py; if defined, 
+            catchments are read from the catchment partitions)
+        @param outputDir String representing the absolute/relative
+        path of the directory into which output should be written
+        @param catchmentFilename String representing name of file to
+        save catchment features to.  The appropriate extension will be added to the file name
+        @param gages List of gages, each either a string representing the Gage_Loc Source_Fea
+        (e.g. USGS site number) of the gage, or a tuple(reachcode, measure)
+        @param format String representing OGR driver to use
+        @param verbose Boolean True if dissolve progress should be printed to outfp
+        @param outfp File-like object to which verbose output should be printed
+        @param tolerance Float representing the tolerance, in degrees, to which
+        watershed polygons should be simplified; if None full resolution polygons are written
+        
+        @return Tuple(String representing the name of the dataset in outputDir created to hold
+        the features, list of gages that could not be found)
+         
+        @raise ConfigParser.NoSectionError
+        @raise ConfigParser.NoOptionError
+        @raise IOError(errno.ENOTDIR) if outputDir is not a directory
+        @raise IOError(errno.EACCESS) if outputDir is not writable
+        @raise Exception if output format is not known
+    """
+    # Find the outlet reach of each gage, looking up all gages identified by source_fea at once
+    conn = getNHDPlusDBConnection(config)
+    gageIndex = getGageIndex(config)
+    sourceFeaIdx = gageIndex.indexOf([g for g in gages if isinstance(g, basestring)])
+    gageOutlets = []
+    notFound = []
+    i = 0
+    for gage in gages:
+        if isinstance(gage, basestring):
+            gageID = gage
+            idx = sourceFeaIdx[i]
+            i += 1
+            if idx == -1 or gageIndex.comids[idx] == -1:
+                notFound.append(gage)
+                continue
+            gageOutlets.append( (gageID, gageIndex.reachcodes[idx], gageIndex.measures[idx],
+                                 int(gageIndex.comids[idx])) )
+        else:
+            (reachcode, measure) = gage
+            comID = getComIdForStreamGage(conn, reachcode, measure)
+            if comID == -1:
+                notFound.append(gage)
+                continue
+            gageOutlets.append( (None, reachcode, measure, comID) )
+    
+    # Search upstream of each outlet, stopping at other outlets.  Outlets are ordered
+    #   so that nested upstream outlets come first
+    outlets = np.unique([g[3] for g in gageOutlets])
+    nested = getUpstreamGraph(config).getNestedUpstreamReaches(outlets)
+    
+    (poDS, poLayer) = _openCatchmentLayer(config)
+    (catchmentFilename, poODS, poOLayer) = _createCatchmentDataSource(poLayer, outputDir,
+                                                                      catchmentFilename, format)
+    poOLayer.CreateField( ogr.FieldDefn('gage_id', ogr.OFTString) )
+    poOLayer.CreateField( ogr.FieldDefn('reachcode', ogr.OFTString) )
+    poOLayer.CreateField( ogr.FieldDefn('measure', ogr.OFTReal) )
+    poOLayer.CreateField( ogr.FieldDefn('comid', ogr.OFTInteger) )
+    poOLayer.CreateField( ogr.FieldDefn('numreaches', ogr.OFTInteger) )
+    
+    # Dissolve each watershed, reusing the watersheds of nested upstream gages
+    reaches = {}
+    geometries = {}
+    for (outlet, incrementalReaches, upstreamOutlets, outletReaches) in nested:
+        geom = _getCatchmentGeometryForReaches(config, incrementalReaches, verbose, outfp)
+        geoms = [dumps(geom)] + [geometries[u] for u in upstreamOutlets]
+        reaches[outlet] = outletReaches
+        geometries[outlet] = dumps( dissolveGeometries(geoms, processes=1) )
+    
+    # Cache the watershed of each gage, along with its simplified levels
+    watersheds = {}
+    for outlet in outlets:
+        watersheds[outlet] = MultiResolutionGeometry(loads(geometries[outlet]))
+        _cacheWatershed(_getWatershedKey(config, reaches[outlet]), watersheds[outlet])
+    cache = getWatershedCache(config)
+    if cache is not None:
+        version = _getDatasetVersion(config)
+        for outlet in outlets:
+            if not watersheds[outlet].geom.is_empty:
+                cache.putWatershed(outlet, version, watersheds[outlet], len(reaches[outlet]))
+    
+    # Write one feature per gage
+    for (gageID, reachcode, measure, comID) in gageOutlets:
+        outFeat = ogr.Feature( poOLayer.GetLayerDefn() )
+        if gageID:
+            outFeat.SetField('gage_id', gageID)
+        outFeat.SetField('reachcode', str(reachcode))
+        outFeat.SetField('measure', float(measure))
+        outFeat.SetField('comid', int(comID))
+        outFeat.SetField('numreaches', len(reaches[comID]))
+        outFeat.SetGeometry( _getExteriorPolygon(watersheds[comID].getGeometry(tolerance)) )
+        poOLayer.CreateFeature(outFeat)
+    
+    return (catchmentFilename, notFound)
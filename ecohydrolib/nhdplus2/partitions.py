@@ -0,0 +1,450 @@
+"""@package ecohydrolib.nhdplus2.partitions
+
+@brief Partition the CONUS NHDPlus V2 databases built by NHDPlusV2Setup.py into one
+NHDPlus2 database, and one catchment database, per vector processing unit (VPU), plus
+a small routing database mapping ComIDs to VPUs and storing PlusFlow links between VPUs.
+@brief Reaches are assigned to the VPU of the DBF file they were loaded from, as recorded
+in the setup manifest of the CONUS database (see ecohydrolib.nhdplus2.manifest).  VPUs
+are extracted in parallel (see ecohydrolib.nhdplus2.subnetwork), so each partition has
+the same schema and indexes as the CONUS database.
+@brief PartitionedNetwork traverses the network by attaching, to a connection to the
+routing database, only the partitions a traversal reaches, so that the pages cached
+for each job are those of the regions it works in.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2015, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+@author Brian Miles <brian_miles@unc.edu>
+"""
+import os
+import sys
+import errno
+import sqlite3
+import multiprocessing
+from collections import OrderedDict
+
+import numpy as np
+
+from ecohydrolib.nhdplus2.ingest import getVPUForPath
+from ecohydrolib.nhdplus2.manifest import MANIFEST_TABLE
+from ecohydrolib.nhdplus2.manifest import hasManifestTable
+from ecohydrolib.nhdplus2.subnetwork import extractNHDPlusDB
+from ecohydrolib.nhdplus2.subnetwork import extractCatchmentDB
+from ecohydrolib.nhdplus2.catchmentdb import getCatchmentGeometriesForReaches
+from ecohydrolib.nhdplus2.catchmentdb import getBoundingBoxForReaches
+from ecohydrolib.nhdplus2.connections import connectReadOnly
+from ecohydrolib.nhdplus2.connections import temporaryWrites
+
+ROUTING_DB_FILENAME = 'NHDPlusRouting.sqlite'
+PARTITION_TABLE = 'Partition'
+RANGE_TABLE = 'PartitionComIDRange'
+FLOW_TABLE = 'PartitionFlow'
+FRONTIER_TABLE = 'partition_frontier'
+PARTITION_ALIAS_PREFIX = 'vpu_'
+# SQLite allows 10 attached databases by default
+MAX_ATTACHED = 8
+COMID_DTYPE = np.int64
+
+
+def getPartitionFilenames(vpu):
+    """ Get the file names of the partition databases of a VPU
+
+        @param vpu String representing the VPU
+
+        @return Tuple(string representing the name of the NHDPlus2 database, string
+        representing the name of the catchment database)
+    """
+    return ("NHDPlusDB_%s.sqlite" % (vpu,), "Catchment_%s.sqlite" % (vpu,))
+
+
+def getReachesByVPU(conn):
+    """ Get the ComIDs of the reaches of each VPU, from the rowid ranges of the
+        PlusFlowlineVAA DBF files recorded in the setup manifest
+
+        @param conn An sqlite3 connection to the CONUS NHDPlus2 database
+
+        @return Dict mapping VPUs to numpy arrays of ComIDs
+
+        @raise Exception if the database has no setup manifest
+    """
+    if not hasManifestTable(conn):
+        raise Exception("NHDPlus2 database has no %s table, run NHDPlusV2Setup.py to create it" % \
+                        (MANIFEST_TABLE,))
+    cursor = conn.cursor()
+    cursor.execute("""SELECT Source,FirstRowid,LastRowid FROM %s
+WHERE TableName='PlusFlowlineVAA' AND FirstRowid IS NOT NULL ORDER BY FirstRowid""" % (MANIFEST_TABLE,))
+    ranges = cursor.fetchall()
+    reaches = {}
+    for (source, firstRowid, lastRowid) in ranges:
+        cursor.execute("""SELECT ComID FROM PlusFlowlineVAA WHERE rowid BETWEEN ? AND ?""",
+                       (firstRowid, lastRowid))
+        comids = np.array([row[0] for row in cursor.fetchall()], dtype=COMID_DTYPE)
+        vpu = getVPUForPath(source)
+        reaches[vpu] = np.concatenate([reaches[vpu], comids]) if vpu in reaches else comids
+    cursor.close()
+    return reaches
+
+
+def computeComIDRanges(reachesByVPU):
+    """ Compute ranges of consecutive ComIDs (in sorted order) that lie in the same VPU
+
+        @param reachesByVPU Dict mapping VPUs to sequences of ComIDs
+
+        @return Tuple(numpy array of the smallest ComID of each range, numpy array of the
+        largest ComID of each range, list of the VPU of each range), sorted by ComID.  A
+        ComID found in more than one VPU is assigned to the first VPU in sorted order.
+    """
+    vpus = sorted(reachesByVPU.keys())
+    if len(vpus) == 0:
+        return (np.empty(0, dtype=COMID_DTYPE), np.empty(0, dtype=COMID_DTYPE), [])
+    comids = np.concatenate([np.asarray(reachesByVPU[v], dtype=COMID_DTYPE) for v in vpus])
+    vpuIndex = np.concatenate([np.repeat(i, len(reachesByVPU[v])) for (i, v) in enumerate(vpus)])
+    order = np.lexsort((vpuIndex, comids))
+    comids = comids[order]
+    vpuIndex = vpuIndex[order]
+    first = np.ones(len(comids), dtype=np.bool_)
+    first[1:] = comids[1:] != comids[:-1]
+    comids = comids[first]
+    vpuIndex = vpuIndex[first]
+    if len(comids) == 0:
+        return (comids, comids.copy(), [])
+    starts = np.flatnonzero(np.concatenate([[True], vpuIndex[1:] != vpuIndex[:-1]]))
+    ends = np.concatenate([starts[1:] - 1, [len(comids) - 1]])
+    return (comids[starts], comids[ends], [vpus[i] for i in vpuIndex[starts]])
+
+
+def lookupVPUs(minComids, maxComids, rangeVPUs, comIDs):
+    """ Find the VPU of each of many reaches using ComID ranges
+
+        @param minComids Numpy array of the smallest ComID of each range, sorted
+        @param maxComids Numpy array of the largest ComID of each range
+        @param rangeVPUs List of the VPU of each range
+        @param comIDs Sequence of integers representing ComIDs
+
+        @return List of strings representing the VPU of each reach, None for reaches not
+        in any range
+    """
+    comIDs = np.atleast_1d(np.asarray(comIDs, dtype=COMID_DTYPE))
+    pos = np.searchsorted(minComids, comIDs, side='right') - 1
+    found = (pos >= 0) & (comIDs <= maxComids[np.maximum(pos, 0)]) if len(minComids) else \
+        np.zeros(len(comIDs), dtype=np.bool_)
+    return [rangeVPUs[p] if f else None for (p, f) in zip(pos, found)]
+
+
+def _extractPartition(args):
+    """ Extract the partition databases of a VPU in a worker process """
+    (vpu, reaches, nhdPlusDBPath, catchmentDBPath, partitionDir) = args
+    (nhdPlusFilename, catchmentFilename) = getPartitionFilenames(vpu)
+    numRows = extractNHDPlusDB(nhdPlusDBPath, os.path.join(partitionDir, nhdPlusFilename), reaches)
+    if catchmentDBPath is not None:
+        numRows.update(extractCatchmentDB(catchmentDBPath, os.path.join(partitionDir, catchmentFilename),
+                                          reaches))
+    return (vpu, numRows)
+
+
+def writeRoutingDB(routingPath, reachesByVPU, nhdPlusConn, hasCatchments=True):
+    """ Write the routing database of a set of partitions, replacing any existing database
+
+        @param routingPath String representing the path of the routing database
+        @param reachesByVPU Dict mapping VPUs to sequences of ComIDs
+        @param nhdPlusConn An sqlite3 connection to the CONUS NHDPlus2 database, from which
+        PlusFlow links between VPUs are read
+        @param hasCatchments Boolean True if catchment partitions were written
+
+        @return Integer representing the number of PlusFlow links between VPUs
+    """
+    (minComids, maxComids, rangeVPUs) = computeComIDRanges(reachesByVPU)
+    
+    # Flows between reaches of different VPUs
+    cursor = nhdPlusConn.cursor()
+    cursor.execute("""SELECT FROMCOMID,TOCOMID FROM PlusFlow WHERE FROMCOMID<>0 AND TOCOMID<>0""")
+    flows = np.array(cursor.fetchall(), dtype=COMID_DTYPE).reshape((-1, 2))
+    cursor.close()
+    fromVPUs = lookupVPUs(minComids, maxComids, rangeVPUs, flows[:,0])
+    toVPUs = lookupVPUs(minComids, maxComids, rangeVPUs, flows[:,1])
+    crossFlows = [(int(f[0]), int(f[1]), fv, tv) for (f, fv, tv) in zip(flows, fromVPUs, toVPUs) \
+                  if fv is not None and tv is not None and fv != tv]
+
+    if os.path.exists(routingPath):
+        os.unlink(routingPath)
+    conn = sqlite3.connect(routingPath)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""CREATE TABLE %s
+    (VPU TEXT PRIMARY KEY,
+    NHDPlusDB TEXT,
+    CatchmentDB TEXT)""" % (PARTITION_TABLE,))
+        cursor.execute("""CREATE TABLE %s
+    (MinComID INTEGER PRIMARY KEY,
+    MaxComID INTEGER,
+    VPU TEXT)""" % (RANGE_TABLE,))
+        cursor.execute("""CREATE TABLE %s
+    (FROMCOMID INTEGER,
+    TOCOMID INTEGER,
+    FromVPU TEXT,
+    ToVPU TEXT)""" % (FLOW_TABLE,))
+        for vpu in sorted(reachesByVPU.keys()):
+            (nhdPlusFilename, catchmentFilename) = getPartitionFilenames(vpu)
+            cursor.execute("""INSERT INTO %s (VPU,NHDPlusDB,CatchmentDB) VALUES (?,?,?)""" % (PARTITION_TABLE,),
+                           (vpu, nhdPlusFilename, catchmentFilename if hasCatchments else None))
+        cursor.executemany("""INSERT INTO %s (MinComID,MaxComID,VPU) VALUES (?,?,?)""" % (RANGE_TABLE,),
+                           zip(minComids.tolist(), maxComids.tolist(), rangeVPUs))
+        cursor.executemany("""INSERT INTO %s (FROMCOMID,TOCOMID,FromVPU,ToVPU) VALUES (?,?,?,?)""" % (FLOW_TABLE,),
+                           crossFlows)
+        cursor.execute("""CREATE INDEX %s_to_idx ON %s (TOCOMID)""" % (FLOW_TABLE, FLOW_TABLE))
+        cursor.execute("""CREATE INDEX %s_from_idx ON %s (FROMCOMID)""" % (FLOW_TABLE, FLOW_TABLE))
+        conn.commit()
+        cursor.close()
+    finally:
+        conn.close()
+    return len(crossFlows)
+
+
+def writePartitions(nhdPlusDBPath, catchmentDBPath, partitionDir, processes=None,
+                    verbose=False, outfp=sys.stdout):
+    """ Partition the CONUS NHDPlus2 and catchment databases by VPU, extracting VPUs
+        in parallel, and write the routing database of the partitions
+
+        @param nhdPlusDBPath String representing the path of the CONUS NHDPlus2 database
+        @param catchmentDBPath String representing the path of the CONUS catchment database,
+        if None catchments will not be partitioned
+        @param partitionDir String representing the directory to write partitions to
+        @param processes Integer representing the number of VPUs to extract at once, if None
+        the number of CPUs will be used
+        @param verbose Boolean True if progress should be printed to outfp
+        @param outfp File-like object to which verbose output should be printed
+
+        @return String representing the path of the routing database
+
+        @raise Exception if the NHDPlus2 database has no setup manifest
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if not os.path.isdir(partitionDir):
+        os.makedirs(partitionDir)
+    conn = sqlite3.connect(nhdPlusDBPath)
+    try:
+        reachesByVPU = getReachesByVPU(conn)
+        jobs = [(vpu, reachesByVPU[vpu], nhdPlusDBPath, catchmentDBPath, partitionDir) \
+                for vpu in sorted(reachesByVPU.keys())]
+        if len(jobs) > 0:
+            pool = multiprocessing.Pool(max(1, min(processes, len(jobs))))
+            try:
+                for (vpu, numRows) in pool.imap_unordered(_extractPartition, jobs):
+                    if verbose:
+                        outfp.write("VPU %s: %d reaches, %d catchments\n" % \
+                                    (vpu, numRows.get('PlusFlowlineVAA', 0), numRows.get('catchment', 0)))
+                        outfp.flush()
+            finally:
+                pool.close()
+                pool.join()
+        routingPath = os.path.join(partitionDir, ROUTING_DB_FILENAME)
+        numFlows = writeRoutingDB(routingPath, reachesByVPU, conn, catchmentDBPath is not None)
+        if verbose:
+            outfp.write("%d flows between VPUs written to %s\n" % (numFlows, routingPath))
+    finally:
+        conn.close()
+    return routingPath
+
+
+class PartitionedNetwork(object):
+    """ NHDPlus2 network partitioned by VPU.  Partitions are attached to a connection
+        to the routing database when a traversal first reaches them; the least recently
+        used partition is detached when MAX_ATTACHED partitions are attached.
+    """
+    def __init__(self, routingPath, maxAttached=MAX_ATTACHED):
+        """ Open a partitioned network
+
+            @param routingPath String representing the path of the routing database
+            @param maxAttached Integer representing the number of partitions that may be
+            attached at once
+
+            @raise IOError(errno.EACCES) if the routing database is not readable
+        """
+        if not os.access(routingPath, os.R_OK):
+            raise IOError(errno.EACCES, "The routing database at %s is not readable" % (routingPath,))
+        self.routingPath = routingPath
+        self.maxAttached = maxAttached
+        partitionDir = os.path.dirname(os.path.abspath(routingPath))
+        self.conn = connectReadOnly(routingPath)
+        cursor = self.conn.cursor()
+        cursor.execute("""SELECT VPU,NHDPlusDB,CatchmentDB FROM %s""" % (PARTITION_TABLE,))
+        self.partitions = dict([(vpu, (os.path.join(partitionDir, nhdPlusDB),
+                                       os.path.join(partitionDir, catchmentDB) if catchmentDB else None)) \
+                                for (vpu, nhdPlusDB, catchmentDB) in cursor.fetchall()])
+        cursor.execute("""SELECT MinComID,MaxComID,VPU FROM %s ORDER BY MinComID""" % (RANGE_TABLE,))
+        ranges = cursor.fetchall()
+        with temporaryWrites(self.conn):
+            cursor.execute("""CREATE TEMP TABLE %s (ComID INTEGER PRIMARY KEY)""" % (FRONTIER_TABLE,))
+        cursor.close()
+        self.minComids = np.array([r[0] for r in ranges], dtype=COMID_DTYPE)
+        self.maxComids = np.array([r[1] for r in ranges], dtype=COMID_DTYPE)
+        self.rangeVPUs = [r[2] for r in ranges]
+        self.attached = OrderedDict()
+        self.catchmentConns = {}
+
+    def getVPUs(self, comIDs):
+        """ Find the VPU of each of many reaches
+
+            @param comIDs Sequence of integers representing ComIDs
+
+            @return List of strings representing the VPU of each reach, None for reaches
+            not in any partition
+        """
+        return lookupVPUs(self.minComids, self.maxComids, self.rangeVPUs, comIDs)
+
+    def attach(self, vpu):
+        """ Attach the NHDPlus2 database of a partition, if it is not already attached
+
+            @param vpu String representing the VPU
+
+            @return String representing the schema name the partition is attached as
+        """
+        alias = PARTITION_ALIAS_PREFIX + vpu
+        if vpu in self.attached:
+            # Most recently used partitions are last
+            del self.attached[vpu]
+            self.attached[vpu] = alias
+            return alias
+        if len(self.attached) >= self.maxAttached:
+            (lruVPU, lruAlias) = self.attached.popitem(last=False)
+            self.conn.execute("""DETACH DATABASE %s""" % (lruAlias,))
+        self.conn.execute("""ATTACH DATABASE ? AS %s""" % (alias,), (self.partitions[vpu][0],))
+        self.attached[vpu] = alias
+        return alias
+
+    def getUpstreamReaches(self, comID, includeStart=True):
+        """ Find all reaches upstream of a given reach, attaching only the partitions
+            upstream reaches lie in
+
+            @param comID Integer representing the ComID of the reach whose upstream reaches are to be discovered
+            @param includeStart Boolean, True if comID should be included in the result
+
+            @return Numpy array of ComIDs of upstream reaches
+        """
+        visited = set([comID])
+        found = [comID] if includeStart else []
+        frontier = [comID]
+        cursor = self.conn.cursor()
+        while len(frontier) > 0:
+            with temporaryWrites(self.conn):
+                cursor.execute("""DELETE FROM temp.%s""" % (FRONTIER_TABLE,))
+                cursor.executemany("""INSERT INTO temp.%s (ComID) VALUES (?)""" % (FRONTIER_TABLE,),
+                                   ((int(c),) for c in frontier))
+            upstream = set()
+            for vpu in set(self.getVPUs(frontier)):
+                if vpu is None:
+                    continue
+                cursor.execute("""SELECT p.FROMCOMID FROM {alias}.PlusFlow AS p
+JOIN temp.{frontier} AS f ON p.TOCOMID=f.ComID""".format(alias=self.attach(vpu), frontier=FRONTIER_TABLE))
+                upstream.update(row[0] for row in cursor)
+            # Flows into the frontier from other partitions
+            cursor.execute("""SELECT p.FROMCOMID FROM {flow} AS p
+JOIN temp.{frontier} AS f ON p.TOCOMID=f.ComID""".format(flow=FLOW_TABLE, frontier=FRONTIER_TABLE))
+            upstream.update(row[0] for row in cursor)
+            upstream.discard(0)
+            frontier = sorted(upstream - visited)
+            visited.update(frontier)
+            found.extend(frontier)
+        self.conn.commit()
+        cursor.close()
+        return np.array(found, dtype=COMID_DTYPE)
+
+    def hasCatchments(self):
+        """ Determine whether the catchments of every partition were partitioned
+
+            @return True if every partition has a catchment database
+        """
+        return all([catchmentPath is not None for (nhdPlusPath, catchmentPath) in self.partitions.values()])
+
+    def _groupByVPU(self, reaches):
+        groups = {}
+        for (reach, vpu) in zip(reaches, self.getVPUs(reaches)):
+            if vpu is not None:
+                groups.setdefault(vpu, []).append(reach)
+        return groups
+
+    def _getCatchmentConnection(self, vpu):
+        conn = self.catchmentConns.get(vpu)
+        if conn is None:
+            catchmentPath = self.partitions[vpu][1]
+            if catchmentPath is None:
+                raise Exception("Catchments of VPU %s were not partitioned" % (vpu,))
+            conn = connectReadOnly(catchmentPath)
+            self.catchmentConns[vpu] = conn
+        return conn
+
+    def getCatchmentGeometriesForReaches(self, reaches):
+        """ Get catchment geometries of a set of reaches, opening only the catchment
+            partitions the reaches lie in
+
+            @param reaches Sequence of integers representing ComIDs of reaches
+
+            @return Generator of strings representing catchment geometries as WKB
+
+            @raise Exception if catchments were not partitioned
+        """
+        groups = self._groupByVPU(reaches)
+        for vpu in sorted(groups.keys()):
+            for wkb in getCatchmentGeometriesForReaches(self._getCatchmentConnection(vpu), groups[vpu]):
+                yield wkb
+
+    def getBoundingBoxForReaches(self, reaches):
+        """ Get the bounding box of the catchments of a set of reaches, opening only the 
+            catchment partitions the reaches lie in
+
+            @param reaches Sequence of integers representing ComIDs of reaches
+
+            @return A dict containing keys: minX, minY, maxX, maxY, srs, where srs='EPSG:4326';
+            None if no catchments were found
+
+            @raise Exception if catchments were not partitioned
+        """
+        bbox = None
+        groups = self._groupByVPU(reaches)
+        for vpu in sorted(groups.keys()):
+            vpuBbox = getBoundingBoxForReaches(self._getCatchmentConnection(vpu), groups[vpu])
+            if vpuBbox is None:
+                continue
+            if bbox is None:
+                bbox = vpuBbox
+            else:
+                bbox['minX'] = min(bbox['minX'], vpuBbox['minX'])
+                bbox['minY'] = min(bbox['minY'], vpuBbox['minY'])
+                bbox['maxX'] = max(bbox['maxX'], vpuBbox['maxX'])
+                bbox['maxY'] = max(bbox['maxY'], vpuBbox['maxY'])
+        return bbox
+
+    def close(self):
+        """ Close connections to the routing database and to partitions """
+        for conn in self.catchmentConns.values():
+            conn.close()
+        self.catchmentConns.clear()
+        self.attached.clear()
+        self.conn.close()
@@ -0,0 +1,284 @@
+"""@package ecohydrolib.nhdplus2.subnetwork
+
+@brief Extract the part of the NHDPlus V2 network upstream of a reach (e.g. the reach
+a streamflow gage is located on) from the CONUS databases built by NHDPlusV2Setup.py
+into small, standalone databases for a project.
+@brief Each extracted database has the same tables, schema and indexes as the CONUS
+database it was extracted from, copied from its sqlite_master table, so that functions
+of ecohydrolib.nhdplus2.networkanalysis run unchanged against extracted databases.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2015, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+@author Brian Miles <brian_miles@unc.edu>
+"""
+import os
+import sys
+import errno
+import sqlite3
+
+from ecohydrolib.nhdplus2.catchmentdb import REACH_ID_TABLE
+from ecohydrolib.nhdplus2.catchmentdb import loadReachIds
+
+NHDPLUS_DB_FILENAME = 'NHDPlusDB.sqlite'
+CATCHMENT_DB_FILENAME = 'Catchment.sqlite'
+GAGELOC_DB_FILENAME = 'GageLoc.sqlite'
+
+SOURCE_ALIAS = 'source'
+GAGE_ID_TABLE = 'gage_ids'
+
+_REACHES = "(SELECT featureid FROM temp.%s)" % (REACH_ID_TABLE,)
+_GAGES = "(SELECT Source_Fea FROM temp.%s)" % (GAGE_ID_TABLE,)
+
+# Filters selecting the records of each table of the subnetwork, in the order tables are copied.
+# Tables of the NHDPlus2 database not listed here are copied if they have a ComID column.
+NHDPLUS_DB_FILTERS = [
+    ('PlusFlowlineVAA', "t.ComID IN %s" % (_REACHES,)),
+    # Flows into headwaters and out of terminal reaches have a ComID of 0
+    ('PlusFlow', "(t.FROMCOMID IN {0} OR t.FROMCOMID=0) AND (t.TOCOMID IN {0} OR t.TOCOMID=0)".format(_REACHES)),
+    ('NHDReachCode_Comid', "t.COMID IN %s" % (_REACHES,)),
+    ('NHDFlowline', "t.COMID IN %s" % (_REACHES,)),
+    ('Gage_Loc', """EXISTS (SELECT 1 FROM main.PlusFlowlineVAA AS p WHERE p.ReachCode=t.ReachCode
+AND t.Measure >= p.FromMeas AND t.Measure <= p.ToMeas)"""),
+    ('Gage_Info', "t.GageID IN (SELECT Source_Fea FROM main.Gage_Loc)"),
+    ('Gage_Smooth', "t.SITE_NO IN (SELECT Source_Fea FROM main.Gage_Loc)"),
+    ('PlusFlowIntervalException', "t.FromComID IN {0} AND t.ToComID IN {0}".format(_REACHES))
+]
+CATCHMENT_DB_FILTERS = [
+    ('geometry_columns', None),
+    ('spatial_ref_sys', None),
+    ('catchment', "t.featureid IN %s" % (_REACHES,)),
+    ('catchment_extent', "t.featureid IN %s" % (_REACHES,))
+]
+GAGELOC_DB_FILTERS = [
+    ('geometry_columns', None),
+    ('spatial_ref_sys', None),
+    ('gageloc', "t.source_fea IN %s" % (_GAGES,)),
+    # OGR feature IDs, and hence rowids, of copied gages are preserved
+    ('gageloc_rtree', "t.id IN (SELECT rowid FROM main.gageloc)")
+]
+
+
+def _getTables(conn):
+    """ Get the names of tables of the attached source database, excluding the shadow
+        tables of virtual (e.g. R*Tree) tables
+    """
+    cursor = conn.cursor()
+    cursor.execute("""SELECT name,sql FROM %s.sqlite_master WHERE type='table'""" % (SOURCE_ALIAS,))
+    rows = cursor.fetchall()
+    cursor.close()
+    virtual = [name for (name, sql) in rows if sql and sql.upper().startswith('CREATE VIRTUAL TABLE')]
+    shadow = set(["%s_%s" % (name, suffix) for name in virtual for suffix in ('node', 'rowid', 'parent')])
+    return [name for (name, sql) in rows if name not in shadow and not name.startswith('sqlite_')]
+
+
+def _getColumns(conn, table):
+    cursor = conn.cursor()
+    cursor.execute("""PRAGMA %s.table_info(%s)""" % (SOURCE_ALIAS, table))
+    columns = [row[1] for row in cursor.fetchall()]
+    cursor.close()
+    return columns
+
+
+def copyTable(conn, table, where=None):
+    """ Copy a table of the attached source database, with its indexes, into the main database
+
+        @param conn An sqlite3 connection to the destination database, to which the source
+        database is attached as SOURCE_ALIAS
+        @param table String representing the name of the table
+        @param where String representing an SQL expression, in which the table is aliased as t,
+        selecting the records to copy; if None all records are copied
+
+        @return Integer representing the number of records copied
+    """
+    cursor = conn.cursor()
+    cursor.execute("""SELECT sql FROM %s.sqlite_master WHERE type='table' AND name=?""" % (SOURCE_ALIAS,),
+                   (table,))
+    cursor.execute(cursor.fetchone()[0])
+    cursor.execute("""INSERT INTO main.{table} SELECT * FROM {alias}.{table} AS t{where}""".format(
+                   table=table, alias=SOURCE_ALIAS, where=" WHERE %s" % (where,) if where else ''))
+    numRows = cursor.rowcount
+    # Create indexes once records are copied
+    cursor.execute("""SELECT sql FROM %s.sqlite_master WHERE type='index' AND tbl_name=? AND sql IS NOT NULL""" % \
+                   (SOURCE_ALIAS,), (table,))
+    for (sql,) in cursor.fetchall():
+        cursor.execute(sql)
+    conn.commit()
+    cursor.close()
+    return numRows
+
+
+def _extract(sourcePath, destPath, filters, prepare, copyComIdTables=False,
+             verbose=False, outfp=sys.stdout):
+    """ Copy the filtered tables of a source database into a new destination database """
+    if not os.access(sourcePath, os.R_OK):
+        raise IOError(errno.EACCES, "The database at %s is not readable" % (sourcePath,))
+    if os.path.exists(destPath):
+        os.unlink(destPath)
+    conn = sqlite3.connect(destPath)
+    numRows = {}
+    try:
+        conn.execute("""PRAGMA journal_mode=OFF""")
+        conn.execute("""ATTACH DATABASE ? AS %s""" % (SOURCE_ALIAS,), (sourcePath,))
+        prepare(conn)
+        tables = _getTables(conn)
+        copy = [(table, where) for (table, where) in filters if table in tables]
+        if copyComIdTables:
+            filtered = set([table for (table, where) in filters])
+            for table in tables:
+                if table in filtered:
+                    continue
+                if 'comid' in [c.lower() for c in _getColumns(conn, table)]:
+                    copy.append((table, "t.ComID IN %s" % (_REACHES,)))
+        for (table, where) in copy:
+            numRows[table] = copyTable(conn, table, where)
+            if verbose:
+                outfp.write("%s: %d records\n" % (table, numRows[table]))
+        conn.execute("""DETACH DATABASE %s""" % (SOURCE_ALIAS,))
+    finally:
+        conn.close()
+    return numRows
+
+
+def extractNHDPlusDB(sourcePath, destPath, reaches, verbose=False, outfp=sys.stdout):
+    """ Extract the records of a subnetwork from an NHDPlus2 database into a new database.
+        Gages located on reaches of the subnetwork, and their attributes, are extracted.
+
+        @param sourcePath String representing the path of the NHDPlus2 database
+        @param destPath String representing the path of the database to create, replacing
+        any existing database
+        @param reaches Sequence of integers representing ComIDs of reaches of the subnetwork
+        @param verbose Boolean True if the number of records copied should be printed to outfp
+        @param outfp File-like object to which verbose output should be printed
+
+        @return Dict mapping table names to the number of records copied
+
+        @raise IOError(errno.EACCES) if the NHDPlus2 database is not readable
+    """
+    return _extract(sourcePath, destPath, NHDPLUS_DB_FILTERS, lambda conn: loadReachIds(conn, reaches),
+                    copyComIdTables=True, verbose=verbose, outfp=outfp)
+
+
+def extractCatchmentDB(sourcePath, destPath, reaches, verbose=False, outfp=sys.stdout):
+    """ Extract the catchments of a subnetwork, and their extents, from a catchment database
+        into a new database
+
+        @param sourcePath String representing the path of the catchment database
+        @param destPath String representing the path of the database to create, replacing
+        any existing database
+        @param reaches Sequence of integers representing ComIDs of reaches of the subnetwork
+        @param verbose Boolean True if the number of records copied should be printed to outfp
+        @param outfp File-like object to which verbose output should be printed
+
+        @return Dict mapping table names to the number of records copied
+
+        @raise IOError(errno.EACCES) if the catchment database is not readable
+    """
+    return _extract(sourcePath, destPath, CATCHMENT_DB_FILTERS, lambda conn: loadReachIds(conn, reaches),
+                    verbose=verbose, outfp=outfp)
+
+
+def getGageIds(nhdPlusDBPath):
+    """ Get the source feature IDs (e.g. USGS site numbers) of gages in an NHDPlus2 database
+
+        @param nhdPlusDBPath String representing the path of the NHDPlus2 database
+
+        @return List of strings representing gage source feature IDs
+    """
+    conn = sqlite3.connect(nhdPlusDBPath)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""SELECT DISTINCT Source_Fea FROM Gage_Loc""")
+        gageIDs = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+    finally:
+        conn.close()
+    return gageIDs
+
+
+def extractGageLocDB(sourcePath, destPath, gageIDs, verbose=False, outfp=sys.stdout):
+    """ Extract the locations of gages from a GageLoc database into a new database
+
+        @param sourcePath String representing the path of the GageLoc database
+        @param destPath String representing the path of the database to create, replacing
+        any existing database
+        @param gageIDs Sequence of strings representing source feature IDs of gages
+        @param verbose Boolean True if the number of records copied should be printed to outfp
+        @param outfp File-like object to which verbose output should be printed
+
+        @return Dict mapping table names to the number of records copied
+
+        @raise IOError(errno.EACCES) if the GageLoc database is not readable
+    """
+    def prepare(conn):
+        conn.execute("""CREATE TEMP TABLE %s (Source_Fea TEXT PRIMARY KEY)""" % (GAGE_ID_TABLE,))
+        conn.executemany("""INSERT OR IGNORE INTO temp.%s (Source_Fea) VALUES (?)""" % (GAGE_ID_TABLE,),
+                         ((g,) for g in gageIDs))
+        conn.commit()
+    return _extract(sourcePath, destPath, GAGELOC_DB_FILTERS, prepare, verbose=verbose, outfp=outfp)
+
+
+def extractSubnetwork(graph, comID, nhdPlusDBPath, catchmentDBPath, gageLocDBPath, outputDir,
+                      verbose=False, outfp=sys.stdout):
+    """ Extract the subnetwork upstream of, and including, a reach into standalone NHDPlus2,
+        catchment and GageLoc databases.
+
+        @param graph UpstreamGraph of the CONUS NHDPlus2 network
+        @param comID Integer representing the ComID of the outlet reach of the subnetwork
+        @param nhdPlusDBPath String representing the path of the CONUS NHDPlus2 database
+        @param catchmentDBPath String representing the path of the CONUS catchment database,
+        if None catchments will not be extracted
+        @param gageLocDBPath String representing the path of the CONUS GageLoc database,
+        if None gage locations will not be extracted
+        @param outputDir String representing the directory to write the databases to
+        @param verbose Boolean True if the number of records copied should be printed to outfp
+        @param outfp File-like object to which verbose output should be printed
+
+        @return Dict mapping options of the 'NHDPLUS2' configuration section
+        (e.g. 'PATH_OF_NHDPLUS2_DB') to paths of the databases written
+
+        @raise IOError(errno.EACCES) if a database is not readable
+
+        @note Flow out of the outlet reach, to reaches outside the subnetwork, is not extracted,
+        so the outlet is a terminal reach of the extracted network.
+    """
+    reaches = graph.getUpstreamReaches(comID)
+    if verbose:
+        outfp.write("%d reaches upstream of reach %d\n" % (len(reaches), comID))
+    paths = {}
+    paths['PATH_OF_NHDPLUS2_DB'] = os.path.join(outputDir, NHDPLUS_DB_FILENAME)
+    extractNHDPlusDB(nhdPlusDBPath, paths['PATH_OF_NHDPLUS2_DB'], reaches, verbose, outfp)
+    if catchmentDBPath is not None:
+        paths['PATH_OF_NHDPLUS2_CATCHMENT'] = os.path.join(outputDir, CATCHMENT_DB_FILENAME)
+        extractCatchmentDB(catchmentDBPath, paths['PATH_OF_NHDPLUS2_CATCHMENT'], reaches, verbose, outfp)
+    if gageLocDBPath is not None:
+        paths['PATH_OF_NHDPLUS2_GAGELOC'] = os.path.join(outputDir, GAGELOC_DB_FILENAME)
+        extractGageLocDB(gageLocDBPath, paths['PATH_OF_NHDPLUS2_GAGELOC'], 
+                         getGageIds(paths['PATH_OF_NHDPLUS2_DB']), verbose, outfp)
+    return paths
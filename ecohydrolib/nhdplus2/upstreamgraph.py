@@ -0,0 +1,465 @@
+"""@package ecohydrolib.nhdplus2.upstreamgraph
+
+@brief Compressed sparse row (CSR) representation of the upstream adjacency of the
+NHDPlus V2 PlusFlow network.  The graph is built once from the PlusFlow table of a
+NHDPlus V2 database (see NHDPlusV2Setup.py), can be saved to disk, and is
+memory-mapped using numpy when loaded so that network traversals require no
+database queries.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2015, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+@author Brian Miles <brian_miles@unc.edu>
+"""
+import os
+import errno
+
+import numpy as np
+
+COMIDS_FILENAME = 'comids.npy'
+OFFSETS_FILENAME = 'offsets.npy'
+NEIGHBORS_FILENAME = 'neighbors.npy'
+
+COMID_DTYPE = np.int64
+INDEX_DTYPE = np.int32
+# Largest number of (start, reach) pairs for which searches of many start reaches keep a
+#   boolean mask of visited reaches per start
+MAX_VISITED_MASK_SIZE = 64 * 1024 * 1024
+
+
+def getUpstreamReachesFromDB(conn, comID, includeStart=True):
+    """ Find all reaches upstream of a given reach by traversing the PlusFlow table 
+        of a NHDPlus2 database with a recursive query, without building an UpstreamGraph.  
+        Each reach is visited only once, even below divergences.
+
+        @param conn An sqlite3 connection to a database that has the PlusFlow table
+        @param comID Integer representing the ComID of the reach whose upstream reaches are to be discovered
+        @param includeStart Boolean, True if comID should be included in the result
+
+        @return Numpy array of ComIDs of upstream reaches
+
+        @note Suited to looking up the upstream reaches of a few reaches per process;
+        the query uses the index of PlusFlow on TOCOMID.
+    """
+    cursor = conn.cursor()
+    cursor.execute("""WITH RECURSIVE upstream(comid) AS (SELECT ? 
+UNION SELECT PlusFlow.FROMCOMID FROM PlusFlow JOIN upstream ON PlusFlow.TOCOMID=upstream.comid 
+WHERE PlusFlow.FROMCOMID != 0) 
+SELECT comid FROM upstream""", (comID,))
+    reaches = np.fromiter((row[0] for row in cursor), dtype=COMID_DTYPE)
+    cursor.close()
+    if not includeStart:
+        reaches = reaches[1:]
+    return reaches
+
+
+class UpstreamGraph(object):
+    """ Upstream adjacency of the NHDPlus2 PlusFlow graph stored in compressed
+        sparse row form.  ComIDs are stored in ascending order in comids; the
+        indices of the reaches immediately upstream of the reach at index i
+        are neighbors[offsets[i]:offsets[i+1]].
+    """
+    def __init__(self, comids, offsets, neighbors):
+        """ Construct an upstream graph from CSR arrays
+
+            @param comids Sorted numpy array of ComIDs of all reaches in the network
+            @param offsets Numpy array of length len(comids)+1 of offsets into neighbors
+            @param neighbors Numpy array of indices (into comids) of upstream reaches
+        """
+        assert(len(offsets) == len(comids) + 1)
+        self.comids = comids
+        self.offsets = offsets
+        self.neighbors = neighbors
+
+    @property
+    def numReaches(self):
+        return len(self.comids)
+
+    @classmethod
+    def fromEdges(cls, fromComids, toComids):
+        """ Build an upstream graph from PlusFlow edges
+
+            @param fromComids Sequence of ComIDs of the upstream end of each edge (PlusFlow.FROMCOMID)
+            @param toComids Sequence of ComIDs of the downstream end of each edge (PlusFlow.TOCOMID)
+
+            @note A ComID of 0 denotes the absence of a reach (i.e. the upstream end of
+            a headwater reach, or the downstream end of a terminal reach).  Such edges
+            contribute reaches, but not adjacencies, to the graph.
+
+            @return UpstreamGraph
+        """
+        fromComids = np.asarray(fromComids, dtype=COMID_DTYPE)
+        toComids = np.asarray(toComids, dtype=COMID_DTYPE)
+        assert(len(fromComids) == len(toComids))
+
+        comids = np.unique(np.concatenate((fromComids, toComids)))
+        comids = comids[comids != 0]
+
+        # Only keep edges between two reaches, each edge only once
+        isEdge = (fromComids != 0) & (toComids != 0)
+        fromIdx = np.searchsorted(comids, fromComids[isEdge]).astype(INDEX_DTYPE)
+        toIdx = np.searchsorted(comids, toComids[isEdge]).astype(INDEX_DTYPE)
+        if len(fromIdx) > 0:
+            keys = np.unique(toIdx.astype(np.int64) * len(comids) + fromIdx)
+            toIdx = (keys // len(comids)).astype(INDEX_DTYPE)
+            fromIdx = (keys % len(comids)).astype(INDEX_DTYPE)
+
+        # Edges are sorted by downstream reach, upstream neighbors are therefore contiguous
+        counts = np.bincount(toIdx, minlength=len(comids))
+        offsets = np.zeros(len(comids) + 1, dtype=INDEX_DTYPE)
+        np.cumsum(counts, out=offsets[1:])
+
+        return cls(comids, offsets, fromIdx)
+
+    @classmethod
+    def fromDB(cls, conn):
+        """ Build an upstream graph from the PlusFlow table of a NHDPlus2 database
+
+            @param conn An sqlite3 connection to a database that has the PlusFlow table
+
+            @return UpstreamGraph
+        """
+        cursor = conn.cursor()
+        cursor.execute("""SELECT COUNT(*) FROM PlusFlow""")
+        numEdges = cursor.fetchone()[0]
+        cursor.execute("""SELECT FROMCOMID,TOCOMID FROM PlusFlow""")
+        edges = np.fromiter((c for row in cursor for c in row), dtype=COMID_DTYPE,
+                            count=2*numEdges)
+        cursor.close()
+        edges = edges.reshape((numEdges, 2))
+        return cls.fromEdges(edges[:,0], edges[:,1])
+
+    @classmethod
+    def load(cls, graphPath, mmap=True):
+        """ Load an upstream graph saved by UpstreamGraph.save()
+
+            @param graphPath String representing the path of the directory the graph was saved to
+            @param mmap Boolean, True if the graph arrays should be memory-mapped read-only
+            rather than read into memory
+
+            @return UpstreamGraph
+
+            @raise IOError(errno.EACCES) if graphPath is not readable
+        """
+        if not os.access(graphPath, os.R_OK):
+            raise IOError(errno.EACCES, "The upstream graph at %s is not readable" %
+                          graphPath)
+        mmapMode = 'r' if mmap else None
+        comids = np.load(os.path.join(graphPath, COMIDS_FILENAME), mmap_mode=mmapMode)
+        offsets = np.load(os.path.join(graphPath, OFFSETS_FILENAME), mmap_mode=mmapMode)
+        neighbors = np.load(os.path.join(graphPath, NEIGHBORS_FILENAME), mmap_mode=mmapMode)
+        return cls(comids, offsets, neighbors)
+
+    def save(self, graphPath):
+        """ Save graph arrays to a directory, creating the directory if need be
+
+            @param graphPath String representing the path of the directory to save the graph to
+
+            @raise IOError(errno.EACCES) if graphPath is not writable
+        """
+        if not os.path.exists(graphPath):
+            os.makedirs(graphPath)
+        if not os.access(graphPath, os.W_OK):
+            raise IOError(errno.EACCES, "Not allowed to write to upstream graph directory %s" %
+                          graphPath)
+        np.save(os.path.join(graphPath, COMIDS_FILENAME), self.comids)
+        np.save(os.path.join(graphPath, OFFSETS_FILENAME), self.offsets)
+        np.save(os.path.join(graphPath, NEIGHBORS_FILENAME), self.neighbors)
+
+    def indexOf(self, comIDs):
+        """ Get the indices of reaches in the graph
+
+            @param comIDs Integer or sequence of integers representing ComIDs
+
+            @return Numpy array of indices, -1 for ComIDs not in the graph
+        """
+        comIDs = np.atleast_1d(np.asarray(comIDs, dtype=COMID_DTYPE))
+        idx = np.searchsorted(self.comids, comIDs)
+        idx[idx == len(self.comids)] = 0
+        found = self.comids[idx] == comIDs
+        return np.where(found, idx, -1)
+
+    def getImmediateUpstream(self, indices):
+        """ Get the indices of the reaches immediately upstream of a set of reaches
+
+            @param indices Numpy array of indices of reaches
+
+            @return Numpy array of indices of the immediate upstream reaches of each
+            reach, in order, including duplicates
+        """
+        starts = self.offsets[indices]
+        counts = self.offsets[indices + 1] - starts
+        total = counts.sum()
+        if total == 0:
+            return np.empty(0, dtype=INDEX_DTYPE)
+        # Expand each [start, start+count) range into one index array
+        rangeStarts = np.cumsum(counts) - counts
+        idx = np.repeat(starts - rangeStarts, counts) + np.arange(total)
+        return self.neighbors[idx]
+
+    def getUpstreamReaches(self, comID, includeStart=True):
+        """ Find all reaches upstream of a given reach.  The search is iterative
+            and each reach is visited only once, even below divergences.
+
+            @param comID Integer representing the ComID of the reach whose upstream reaches are to be discovered
+            @param includeStart Boolean, True if comID should be included in the result
+
+            @return Numpy array of ComIDs of upstream reaches; empty if comID is not in the graph
+        """
+        start = self.indexOf(comID)
+        if start[0] == -1:
+            if includeStart:
+                return np.array([comID], dtype=COMID_DTYPE)
+            return np.empty(0, dtype=COMID_DTYPE)
+
+        visited = np.zeros(len(self.comids), dtype=np.bool_)
+        visited[start] = True
+        frontier = start
+        found = []
+        while len(frontier) > 0:
+            upstream = np.unique(self.getImmediateUpstream(frontier))
+            frontier = upstream[~visited[upstream]]
+            visited[frontier] = True
+            found.append(frontier)
+
+        if includeStart:
+            found.insert(0, start)
+        return self.comids[np.concatenate(found)]
+
+    def getIncrementalUpstreamReaches(self, comID, stopComids):
+        """ Find reaches upstream of a given reach, without searching upstream of any
+            of a set of stop reaches (e.g. the outlets of nested upstream watersheds).
+
+            @param comID Integer representing the ComID of the reach whose upstream reaches are to be discovered
+            @param stopComids Sequence of ComIDs of reaches at which to stop searching.  comID
+            itself is never treated as a stop reach.
+
+            @return Tuple(numpy array of ComIDs of upstream reaches including comID but excluding
+            stop reaches, numpy array of ComIDs of stop reaches encountered)
+        """
+        start = self.indexOf(comID)
+        if start[0] == -1:
+            return (np.array([comID], dtype=COMID_DTYPE), np.empty(0, dtype=COMID_DTYPE))
+        isStop = np.zeros(len(self.comids), dtype=np.bool_)
+        stopIdx = self.indexOf(stopComids)
+        isStop[stopIdx[stopIdx != -1]] = True
+        isStop[start] = False
+
+        visited = np.zeros(len(self.comids), dtype=np.bool_)
+        visited[start] = True
+        frontier = start
+        found = [start]
+        stops = []
+        while len(frontier) > 0:
+            upstream = np.unique(self.getImmediateUpstream(frontier))
+            upstream = upstream[~visited[upstream]]
+            visited[upstream] = True
+            stops.append(upstream[isStop[upstream]])
+            frontier = upstream[~isStop[upstream]]
+            found.append(frontier)
+
+        return (self.comids[np.concatenate(found)], self.comids[np.concatenate(stops)])
+
+    def getNestedUpstreamReaches(self, outlets):
+        """ Find the reaches upstream of each of a set of outlets (e.g. of streamflow gages),
+            searching upstream of each outlet only as far as the outlets nested upstream of it
+
+            @param outlets Sequence of ComIDs of outlet reaches
+
+            @return List of tuples (ComID of outlet, numpy array of ComIDs of reaches upstream
+            of the outlet but not of nested outlets, numpy array of ComIDs of nested upstream
+            outlets encountered, numpy array of ComIDs of all reaches upstream of the outlet),
+            one per unique outlet, ordered so that nested upstream outlets come first
+        """
+        outlets = np.unique(np.asarray(outlets, dtype=COMID_DTYPE))
+        incrementalReaches = {}
+        upstreamOutlets = {}
+        for outlet in outlets:
+            (incrementalReaches[outlet], upstreamOutlets[outlet]) = \
+                self.getIncrementalUpstreamReaches(outlet, outlets)
+
+        # Order outlets so that nested upstream outlets come first
+        ordered = []
+        visited = set()
+        for outlet in outlets:
+            if outlet in visited:
+                continue
+            visited.add(outlet)
+            stack = [(outlet, iter(upstreamOutlets[outlet]))]
+            while stack:
+                (o, upstream) = stack[-1]
+                u = next(upstream, None)
+                if u is None:
+                    ordered.append(o)
+                    stack.pop()
+                elif u not in visited:
+                    visited.add(u)
+                    stack.append( (u, iter(upstreamOutlets[u])) )
+
+        reaches = {}
+        nested = []
+        for outlet in ordered:
+            reachSets = [incrementalReaches[outlet]] + [reaches[u] for u in upstreamOutlets[outlet]]
+            reaches[outlet] = np.unique(np.concatenate(reachSets))
+            nested.append( (outlet, incrementalReaches[outlet], upstreamOutlets[outlet], reaches[outlet]) )
+        return nested
+
+    def _searchUpstreamForSet(self, comIDs, comIdsInSet, maxdepth, collectInSet):
+        """ Level-synchronous search upstream of many reaches at once, stopping each branch
+            at the first reach in a set.  The frontier holds (start, reach) pairs, so that
+            each start reach is searched independently, but all starts are expanded together.
+
+            @param comIDs Sequence of integers representing ComIDs of reaches to start from
+            @param comIdsInSet A set (or sequence) containing candidate ComIDs
+            @param maxdepth Integer representing the maximum number of reaches upstream
+            of each start reach to search
+            @param collectInSet Boolean, True if reaches in the set at which the search stopped 
+            should be returned, False if the reaches searched before reaching the set should be returned
+
+            @return Tuple(numpy array of ComIDs of start reaches, numpy array of ComIDs of reaches
+            found upstream of them), sorted by start reach
+        """
+        comIDs = np.atleast_1d(np.asarray(comIDs, dtype=COMID_DTYPE))
+        n = len(self.comids)
+        inSet = np.zeros(n, dtype=np.bool_)
+        setIdx = self.indexOf(np.fromiter(comIdsInSet, dtype=COMID_DTYPE))
+        inSet[setIdx[setIdx != -1]] = True
+
+        startIdx = self.indexOf(comIDs)
+        frontierStart = np.flatnonzero(startIdx != -1)
+        frontier = startIdx[frontierStart]
+        # (start, reach) pairs are encoded as start * n + reach.  Visited pairs are marked in
+        #   a boolean mask per start if the masks fit, otherwise kept as sorted keys
+        useMask = len(comIDs) * n <= MAX_VISITED_MASK_SIZE
+        if useMask:
+            visitedMask = np.zeros(len(comIDs) * n, dtype=np.bool_)
+            visitedMask[frontierStart * n + frontier] = True
+        else:
+            visited = np.unique(frontierStart * n + frontier)
+        foundStart = []
+        found = []
+        depth = 0
+        while len(frontier) > 0 and depth <= maxdepth:
+            counts = self.offsets[frontier + 1] - self.offsets[frontier]
+            upstream = self.getImmediateUpstream(frontier)
+            keys = np.unique(np.repeat(frontierStart, counts) * n + upstream)
+            if useMask:
+                keys = keys[~visitedMask[keys]]
+                visitedMask[keys] = True
+            else:
+                # Look up and merge the (few) new keys into the sorted visited keys by binary
+                #   search, rather than re-sorting all visited keys at every level
+                pos = np.searchsorted(visited, keys)
+                if len(visited) > 0:
+                    isNew = visited[np.minimum(pos, len(visited) - 1)] != keys
+                    keys = keys[isNew]
+                    pos = pos[isNew]
+                visited = np.insert(visited, pos, keys)
+            frontierStart = keys // n
+            frontier = keys % n
+            # Stop searching a branch at the first reach in the set
+            isInSet = inSet[frontier]
+            if collectInSet:
+                foundStart.append(frontierStart[isInSet])
+                found.append(frontier[isInSet])
+            frontierStart = frontierStart[~isInSet]
+            frontier = frontier[~isInSet]
+            if not collectInSet:
+                foundStart.append(frontierStart)
+                found.append(frontier)
+            depth += 1
+
+        if len(found) == 0:
+            return (np.empty(0, dtype=COMID_DTYPE), np.empty(0, dtype=COMID_DTYPE))
+        foundStart = np.concatenate(foundStart)
+        found = np.concatenate(found)
+        order = np.argsort(foundStart, kind='mergesort')
+        return (comIDs[foundStart[order]], self.comids[found[order]])
+
+    def getFirstOrderUpstreamReachesInSetForReaches(self, comIDs, comIdsInSet, maxdepth=30):
+        """ Search for first-order upstream reaches in the specified set for each of many 
+            reaches at once, i.e., for each start reach, reaches in the set with no reach 
+            of the set between them and the start reach.
+
+            @param comIDs Sequence of integers representing ComIDs of reaches whose first-order
+            upstream reaches are to be discovered
+            @param comIdsInSet A set (or sequence) containing candidate ComIDs
+            @param maxdepth Integer representing the maximum number of reaches upstream
+            of each start reach to search
+
+            @return Tuple(numpy array of ComIDs of start reaches, numpy array of ComIDs of
+            first order upstream reaches in set), one element per (start, reach) pair, 
+            sorted by start reach
+        """
+        return self._searchUpstreamForSet(comIDs, comIdsInSet, maxdepth, True)
+
+    def getFirstOrderUpstreamReachesNotInSetForReaches(self, comIDs, comIdsInSet, maxdepth=30):
+        """ Search for upstream reaches downstream of reaches in the specified set for each
+            of many reaches at once.  Every upstream branch of each start reach is searched
+            until it reaches the set.
+
+            @param comIDs Sequence of integers representing ComIDs of reaches whose upstream
+            reaches downstream of those in the set are to be discovered
+            @param comIdsInSet A set (or sequence) containing candidate ComIDs
+            @param maxdepth Integer representing the maximum number of reaches upstream
+            of each start reach to search
+
+            @return Tuple(numpy array of ComIDs of start reaches, numpy array of ComIDs of
+            upstream reaches not in set), one element per (start, reach) pair, sorted by 
+            start reach
+        """
+        return self._searchUpstreamForSet(comIDs, comIdsInSet, maxdepth, False)
+
+    def getFirstOrderUpstreamReachesInSet(self, comID, comIdsInSet, maxdepth=30):
+        """ Search for first-order upstream reaches in the specified set, i.e. reaches
+            in the set with no reach of the set between them and comID.
+
+            @param comID Integer representing the ComID of the reach whose first-order
+            upstream reaches are to be discovered
+            @param comIdsInSet A set (or sequence) containing candidate ComIDs
+            @param maxdepth Integer representing the maximum number of reaches upstream
+            of comID to search
+
+            @return Numpy array of ComIDs of first order upstream reaches in set
+        """
+        return self._searchUpstreamForSet([comID], comIdsInSet, maxdepth, True)[1]
+
+    def getFirstOrderUpstreamReachesNotInSet(self, comID, comIdsInSet, maxdepth=30):
+        """ Search for upstream reaches downstream of reaches in the specified set.
+            Every upstream branch is searched until it reaches the set.
+
+            @param comID Integer representing the ComID of the reach whose upstream
+            reaches downstream of those in the set are to be discovered
+            @param comIdsInSet A set (or sequence) containing candidate ComIDs
+            @param maxdepth Integer representing the maximum number of reaches upstream
+            of comID to search
+
+            @return Numpy array of ComIDs of upstream reaches not in set
+        """
+        return self._searchUpstreamForSet([comID], comIdsInSet, maxdepth, False)[1]
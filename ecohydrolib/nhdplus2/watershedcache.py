@@ -0,0 +1,353 @@
+"""@package ecohydrolib.nhdplus2.watershedcache
+
+@brief On-disk cache of dissolved watershed polygons, and their bounding boxes, keyed
+by the ComID of the outlet reach and the version of the NHDPlus V2 dataset, so that
+watersheds that are delineated repeatedly (e.g. of popular streamflow gages) are not
+traversed and dissolved each time.
+@brief Watersheds are stored as WKB in an SQLite database, along with simplified
+versions of them (see ecohydrolib.spatialdata.simplify).  The cache is bounded in size;
+the least recently used watersheds are evicted first.  Hits and misses are counted in
+the cache database, so counts are shared by all processes using the cache.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2015, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+@author Brian Miles <brian_miles@unc.edu>
+"""
+import os
+import time
+import errno
+import hashlib
+import sqlite3
+
+from shapely.wkb import loads, dumps
+
+from ecohydrolib.spatialdata.simplify import MultiResolutionGeometry
+from ecohydrolib.nhdplus2.manifest import MANIFEST_TABLE
+from ecohydrolib.nhdplus2.manifest import hasManifestTable
+from ecohydrolib.nhdplus2.manifest import getFileInfo
+
+WATERSHED_TABLE = 'Watershed'
+LEVEL_TABLE = 'WatershedLevel'
+STATS_TABLE = 'WatershedCacheStats'
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+# Seconds to wait for other processes writing to the cache
+TIMEOUT = 30.0
+STAT_HITS = 'hits'
+STAT_MISSES = 'misses'
+# Number of lookups after which usage and statistics are written to the cache
+FLUSH_INTERVAL = 64
+# Nominal size, in bytes, of watersheds for which only the bounding box is cached, so 
+#   that they count towards the size of the cache and are evicted
+BOUNDING_BOX_SIZE = 64
+
+
+def getDatasetVersion(conn, path):
+    """ Get the version of an NHDPlus2 database, i.e. a digest of the checksums of the
+        sources recorded in its setup manifest (see ecohydrolib.nhdplus2.manifest), or,
+        if the database has no manifest, of the size and modification time of the database
+
+        @param conn An sqlite3 connection to the NHDPlus2 database
+        @param path String representing the path of the NHDPlus2 database
+
+        @return String representing the version
+    """
+    md5 = hashlib.md5()
+    if hasManifestTable(conn):
+        cursor = conn.cursor()
+        cursor.execute("""SELECT Source,Checksum FROM %s ORDER BY Source""" % (MANIFEST_TABLE,))
+        for (source, checksum) in cursor:
+            md5.update("%s:%s\n" % (source, checksum))
+        cursor.close()
+    else:
+        md5.update("%d:%f" % getFileInfo(path))
+    return md5.hexdigest()
+
+
+class WatershedCache(object):
+    """ Size-bounded, least recently used, on-disk cache of watershed polygons and bounding boxes
+    """
+    def __init__(self, path, maxSize=DEFAULT_MAX_SIZE):
+        """ Open a watershed cache, creating it if it does not exist
+
+            @param path String representing the path of the cache database
+            @param maxSize Integer representing the maximum size, in bytes, of the
+            geometries stored in the cache; bounding boxes count BOUNDING_BOX_SIZE bytes each
+
+            @raise IOError(errno.EACCES) if the cache does not exist and its directory is not
+            writable
+
+            @note A cache that is not writable can still be read; watersheds are then
+            not added to the cache, and usage is not recorded.
+        """
+        cacheDir = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(path) and not os.access(cacheDir, os.W_OK):
+            raise IOError(errno.EACCES, "Not allowed to write to watershed cache directory %s" % (cacheDir,))
+        self.path = path
+        self.maxSize = maxSize
+        # Usage and statistics of lookups not yet written to the cache
+        self.used = {}
+        self.stats = {STAT_HITS: 0, STAT_MISSES: 0}
+        self.numPending = 0
+        self.conn = sqlite3.connect(path, timeout=TIMEOUT)
+        try:
+            # Readers (e.g. concurrent CGI requests) don't block the writer
+            self.conn.execute("""PRAGMA journal_mode=WAL""")
+            self.createTables()
+        except sqlite3.OperationalError:
+            # The cache may still be read if it is not writable
+            self.conn.rollback()
+
+    def createTables(self):
+        """ Create the tables of the cache, if they do not already exist """
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS %s
+    (ComID INTEGER,
+    Version TEXT,
+    NumReaches INTEGER,
+    minX REAL,
+    minY REAL,
+    maxX REAL,
+    maxY REAL,
+    Geometry BLOB,
+    Size INTEGER,
+    LastUsed REAL,
+    PRIMARY KEY (ComID, Version))""" % (WATERSHED_TABLE,))
+        self.conn.execute("""CREATE INDEX IF NOT EXISTS %s_LastUsed_idx ON %s (LastUsed)""" % \
+                          (WATERSHED_TABLE, WATERSHED_TABLE))
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS %s
+    (ComID INTEGER,
+    Version TEXT,
+    Tolerance REAL,
+    Geometry BLOB,
+    PRIMARY KEY (ComID, Version, Tolerance))""" % (LEVEL_TABLE,))
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS %s
+    (Name TEXT PRIMARY KEY,
+    Value INTEGER)""" % (STATS_TABLE,))
+        self.conn.executemany("""INSERT OR IGNORE INTO %s (Name,Value) VALUES (?,0)""" % (STATS_TABLE,),
+                              [(STAT_HITS,), (STAT_MISSES,)])
+        self.conn.commit()
+
+    def _lookup(self, comID, version, column):
+        """ Look up a watershed, counting a hit if column is not NULL, and marking the
+            watershed as used.  Usage is only written to the cache every FLUSH_INTERVAL
+            lookups (see flush()), so lookups do not wait for other writers.
+
+            @return Tuple(NumReaches, minX, minY, maxX, maxY, Geometry), or None on a miss
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("""SELECT NumReaches,minX,minY,maxX,maxY,Geometry FROM %s
+WHERE ComID=? AND Version=? AND %s IS NOT NULL""" % (WATERSHED_TABLE, column), (int(comID), version))
+        row = cursor.fetchone()
+        cursor.close()
+        if row is None:
+            self.stats[STAT_MISSES] += 1
+        else:
+            self.stats[STAT_HITS] += 1
+            self.used[(int(comID), version)] = time.time()
+        self.numPending += 1
+        if self.numPending >= FLUSH_INTERVAL:
+            self.flush()
+        return row
+
+    def _writeUsage(self, cursor):
+        cursor.executemany("""UPDATE %s SET LastUsed=max(LastUsed,?) WHERE ComID=? AND Version=?""" % \
+                           (WATERSHED_TABLE,),
+                           [(lastUsed, comID, version) for ((comID, version), lastUsed) in self.used.items()])
+        cursor.executemany("""UPDATE %s SET Value=Value+? WHERE Name=?""" % (STATS_TABLE,),
+                           [(count, name) for (name, count) in self.stats.items()])
+
+    def _clearUsage(self):
+        self.used.clear()
+        self.stats = {STAT_HITS: 0, STAT_MISSES: 0}
+        self.numPending = 0
+
+    def flush(self):
+        """ Write the usage of watersheds, and statistics, of lookups since the last flush to
+            the cache.  Writing is best-effort: if the cache is locked by another writer, or is
+            not writable, usage is kept to be written by a later flush.
+
+            @return True if usage was written
+        """
+        if self.numPending == 0:
+            return True
+        cursor = self.conn.cursor()
+        try:
+            # Don't wait for other writers
+            self.conn.execute("""PRAGMA busy_timeout=0""")
+            self._writeUsage(cursor)
+            self.conn.commit()
+        except sqlite3.OperationalError:
+            self.conn.rollback()
+            return False
+        finally:
+            cursor.close()
+            self.conn.execute("""PRAGMA busy_timeout=%d""" % (int(TIMEOUT * 1000),))
+        self._clearUsage()
+        return True
+
+    def getWatershed(self, comID, version):
+        """ Get a cached watershed
+
+            @param comID Integer representing the ComID of the outlet reach of the watershed
+            @param version String representing the version of the NHDPlus2 dataset
+
+            @return Tuple(MultiResolutionGeometry, integer representing the number of reaches
+            in the watershed), or None if the watershed is not cached
+        """
+        row = self._lookup(comID, version, 'Geometry')
+        if row is None:
+            return None
+        cursor = self.conn.cursor()
+        cursor.execute("""SELECT Tolerance,Geometry FROM %s WHERE ComID=? AND Version=?""" % (LEVEL_TABLE,),
+                       (int(comID), version))
+        levels = dict([(tolerance, loads(str(wkb))) for (tolerance, wkb) in cursor.fetchall()])
+        cursor.close()
+        return (MultiResolutionGeometry.fromLevels(loads(str(row[5])), levels), row[0])
+
+    def getBoundingBox(self, comID, version):
+        """ Get the cached bounding box of a watershed
+
+            @param comID Integer representing the ComID of the outlet reach of the watershed
+            @param version String representing the version of the NHDPlus2 dataset
+
+            @return A dict containing keys: minX, minY, maxX, maxY, srs, where srs='EPSG:4326';
+            None if the bounding box is not cached
+        """
+        row = self._lookup(comID, version, 'minX')
+        if row is None:
+            return None
+        return dict({'minX': row[1], 'minY': row[2], 'maxX': row[3], 'maxY': row[4], 'srs': 'EPSG:4326'})
+
+    def putWatershed(self, comID, version, watershed, numReaches):
+        """ Cache a watershed, and its simplified levels, evicting least recently used
+            watersheds if the cache is full
+
+            @param comID Integer representing the ComID of the outlet reach of the watershed
+            @param version String representing the version of the NHDPlus2 dataset
+            @param watershed MultiResolutionGeometry
+            @param numReaches Integer representing the number of reaches in the watershed
+        """
+        wkb = dumps(watershed.geom)
+        levels = [(tolerance, dumps(watershed.levels[tolerance])) for tolerance in watershed.tolerances]
+        size = len(wkb) + sum([len(level[1]) for level in levels])
+        bbox = watershed.geom.bounds if not watershed.geom.is_empty else (None, None, None, None)
+        cursor = self.conn.cursor()
+        try:
+            # Usage is written first, so that recently used watersheds are not evicted
+            self._writeUsage(cursor)
+            cursor.execute("""DELETE FROM %s WHERE ComID=? AND Version=?""" % (LEVEL_TABLE,), (int(comID), version))
+            cursor.execute("""INSERT OR REPLACE INTO %s 
+(ComID,Version,NumReaches,minX,minY,maxX,maxY,Geometry,Size,LastUsed) VALUES (?,?,?,?,?,?,?,?,?,?)""" % \
+                           (WATERSHED_TABLE,),
+                           (int(comID), version, int(numReaches)) + tuple(bbox) + \
+                           (buffer(wkb), size, time.time()))
+            cursor.executemany("""INSERT INTO %s (ComID,Version,Tolerance,Geometry) VALUES (?,?,?,?)""" % \
+                               (LEVEL_TABLE,),
+                               [(int(comID), version, tolerance, buffer(level)) for (tolerance, level) in levels])
+            self.conn.commit()
+        except sqlite3.OperationalError:
+            # Caching is best-effort, e.g. the cache may not be writable
+            self.conn.rollback()
+            return
+        finally:
+            cursor.close()
+        self._clearUsage()
+        self.evict()
+
+    def putBoundingBox(self, comID, version, bbox, numReaches):
+        """ Cache the bounding box of a watershed whose geometry is not cached, evicting
+            least recently used watersheds if the cache is full
+
+            @param comID Integer representing the ComID of the outlet reach of the watershed
+            @param version String representing the version of the NHDPlus2 dataset
+            @param bbox A dict containing keys: minX, minY, maxX, maxY
+            @param numReaches Integer representing the number of reaches in the watershed
+        """
+        try:
+            self.conn.execute("""INSERT OR IGNORE INTO %s 
+(ComID,Version,NumReaches,minX,minY,maxX,maxY,Size,LastUsed) VALUES (?,?,?,?,?,?,?,?,?)""" % \
+                              (WATERSHED_TABLE,),
+                              (int(comID), version, int(numReaches), bbox['minX'], bbox['minY'],
+                               bbox['maxX'], bbox['maxY'], BOUNDING_BOX_SIZE, time.time()))
+            self.conn.commit()
+        except sqlite3.OperationalError:
+            # Caching is best-effort, e.g. the cache may not be writable
+            self.conn.rollback()
+            return
+        self.evict()
+
+    def evict(self):
+        """ Evict least recently used watersheds until the size of the cache does not
+            exceed its maximum size
+
+            @return Integer representing the number of watersheds evicted
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("""SELECT total(Size) FROM %s""" % (WATERSHED_TABLE,))
+        excess = cursor.fetchone()[0] - self.maxSize
+        evicted = []
+        if excess > 0:
+            cursor.execute("""SELECT ComID,Version,Size FROM %s ORDER BY LastUsed,rowid""" % (WATERSHED_TABLE,))
+            for (comID, version, size) in cursor.fetchall():
+                if excess <= 0:
+                    break
+                evicted.append((comID, version))
+                excess -= size
+            try:
+                for table in [LEVEL_TABLE, WATERSHED_TABLE]:
+                    cursor.executemany("""DELETE FROM %s WHERE ComID=? AND Version=?""" % (table,), evicted)
+                self.conn.commit()
+            except sqlite3.OperationalError:
+                self.conn.rollback()
+                evicted = []
+        cursor.close()
+        return len(evicted)
+
+    def getStats(self):
+        """ Get statistics of the cache
+
+            @return Dict with keys: hits, misses, entries, size (in bytes)
+        """
+        self.flush()
+        cursor = self.conn.cursor()
+        cursor.execute("""SELECT Name,Value FROM %s""" % (STATS_TABLE,))
+        stats = dict(cursor.fetchall())
+        # Include lookups that could not yet be written
+        for name in self.stats.keys():
+            stats[name] = stats.get(name, 0) + self.stats[name]
+        cursor.execute("""SELECT count(*),total(Size) FROM %s""" % (WATERSHED_TABLE,))
+        (stats['entries'], size) = cursor.fetchone()
+        stats['size'] = int(size)
+        cursor.close()
+        return stats
+
+    def close(self):
+        """ Write pending usage, if possible, and close the cache database """
+        self.flush()
+        self.conn.close()
@@ -0,0 +1,192 @@
+"""@package ecohydrolib.spatialdata.dissolve
+
+@brief Dissolve (union) large numbers of polygons into a single geometry.
+@brief Polygons are unioned in a balanced tree rather than one at a time: leaf
+batches are dissolved with a cascaded union, in parallel using a process pool,
+and the resulting geometries are then merged pairwise, level by level, until one
+geometry remains.  Invalid geometries are repaired before they are merged.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2015, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+@author Brian Miles <brian_miles@unc.edu>
+"""
+import sys
+import time
+import multiprocessing
+
+from shapely.wkb import loads, dumps
+from shapely.geometry import Polygon, LineString
+from shapely.ops import unary_union, polygonize
+try:
+    from shapely.validation import make_valid
+except ImportError:
+    # Shapely < 1.8
+    make_valid = None
+
+DISSOLVE_BATCH_SIZE = 512
+# Don't bother starting a process pool for fewer leaf batches than this
+MIN_BATCHES_FOR_POOL = 4
+
+
+def getPolygons(geom):
+    """ Get the polygons of a geometry, descending into multi-part geometries and
+        geometry collections, and discarding points and lines
+
+        @param geom Shapely geometry
+
+        @return List of Shapely polygons
+    """
+    if geom.is_empty:
+        return []
+    if geom.geom_type == 'Polygon':
+        return [geom]
+    if hasattr(geom, 'geoms'):
+        polygons = []
+        for part in geom.geoms:
+            polygons.extend(getPolygons(part))
+        return polygons
+    return []
+
+
+def _getPolygonalPart(geom):
+    """ Get the polygonal part of a geometry as a Polygon or MultiPolygon, an empty
+        Polygon if it has none
+    """
+    polygons = getPolygons(geom)
+    if not polygons:
+        return Polygon()
+    if len(polygons) == 1:
+        return polygons[0]
+    return unary_union(polygons)
+
+
+def _polygonizeRing(ring):
+    # Node the ring at its self-intersections, so that each lobe becomes a face
+    return unary_union(list(polygonize(unary_union(LineString(ring.coords)))))
+
+
+def _repairPolygon(polygon):
+    """ Repair a polygon by rebuilding it from the faces of its noded rings, keeping
+        every lobe of a self-intersecting ring (buffer(0) would keep only one)
+    """
+    repaired = _polygonizeRing(polygon.exterior)
+    for interior in polygon.interiors:
+        repaired = repaired.difference(_polygonizeRing(interior))
+    return repaired
+
+
+def repairGeometry(geom):
+    """ Repair an invalid polygon geometry (e.g. self-intersecting or non-closed
+        rings) so that it can be unioned
+
+        @param geom Shapely geometry
+
+        @return Valid Shapely Polygon or MultiPolygon; an empty Polygon if the geometry
+        has no area.  Points and lines produced by the repair are discarded.
+    """
+    if geom.is_valid:
+        return _getPolygonalPart(geom)
+    if make_valid:
+        return _getPolygonalPart(make_valid(geom))
+    repaired = unary_union([_repairPolygon(p) for p in getPolygons(geom)])
+    if not repaired.is_valid:
+        repaired = repaired.buffer(0)
+    return _getPolygonalPart(repaired)
+
+
+def _dissolve(wkbs):
+    """ Dissolve a list of WKB geometries using a cascaded union
+
+        @param wkbs List of strings representing geometries as WKB
+
+        @return String representing dissolved geometry as WKB
+    """
+    geoms = [repairGeometry(loads(wkb)) for wkb in wkbs]
+    return dumps(repairGeometry(unary_union(geoms)))
+
+
+def _batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def dissolveGeometries(wkbs, batchSize=DISSOLVE_BATCH_SIZE, processes=None,
+                       verbose=False, outfp=sys.stdout):
+    """ Dissolve geometries into a single geometry using a balanced tree of unions
+
+        @param wkbs Iterable of strings representing geometries as WKB
+        @param batchSize Integer representing the number of geometries dissolved together
+        in each leaf batch
+        @param processes Integer representing the number of worker processes to use, if None
+        the number of CPUs will be used.  If 1, no worker processes will be started.
+        @param verbose Boolean True if progress and timing of each level should be printed to outfp
+        @param outfp File-like object to which verbose output should be printed
+
+        @return Shapely geometry; an empty Polygon if there were no geometries to dissolve
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    level = 0
+    pool = None
+    try:
+        batches = _batches(wkbs, batchSize)
+        while True:
+            start = time.time()
+            if pool is None and processes > 1:
+                batches = list(batches)
+                if len(batches) >= MIN_BATCHES_FOR_POOL:
+                    pool = multiprocessing.Pool(processes)
+            if pool:
+                results = pool.map(_dissolve, batches)
+            else:
+                results = map(_dissolve, batches)
+            if verbose:
+                outfp.write("Dissolve level %d: %d geometries in %.2f seconds\n" % \
+                            (level, len(results), time.time() - start))
+            if len(results) <= 1:
+                break
+            # Merge pairs of geometries from the previous level
+            batches = _batches(results, 2)
+            level += 1
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    if len(results) == 0:
+        return Polygon()
+    return loads(results[0])
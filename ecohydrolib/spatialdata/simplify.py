@@ -0,0 +1,132 @@
+"""@package ecohydrolib.spatialdata.simplify
+
+@brief Multi-resolution representations of polygons (e.g. dissolved watersheds) for
+drawing on maps.  A geometry is simplified once, at several tolerances, using
+topology-preserving Douglas-Peucker simplification, and the level appropriate for a
+requested tolerance (or web map zoom level) is then returned without re-simplifying.
+
+This software is provided free of charge under the New BSD License. Please see
+the following license information:
+
+Copyright (c) 2015, University of North Carolina at Chapel Hill
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are met:
+    * Redistributions of source code must retain the above copyright
+      notice, this list of conditions and the following disclaimer.
+    * Redistributions in binary form must reproduce the above copyright
+      notice, this list of conditions and the following disclaimer in the
+      documentation and/or other materials provided with the distribution.
+    * Neither the name of the University of North Carolina at Chapel Hill nor the
+      names of its contributors may be used to endorse or promote products
+      derived from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+@author Brian Miles <brian_miles@unc.edu>
+"""
+import math
+
+
+# Tolerances in the units of the geometry (degrees for NHDPlus catchments), i.e.
+#   roughly 10 m, 100 m and 1 km
+SIMPLIFY_TOLERANCES = (0.0001, 0.001, 0.01)
+# Size, in pixels, of the tiles of web maps
+TILE_SIZE = 256
+# Finest web map zoom level to which geometries are simplified on request (about 1 cm)
+MAX_ZOOM = 24
+
+
+def getToleranceForZoom(zoom, tileSize=TILE_SIZE):
+    """ Get the simplification tolerance, in degrees, at which vertices of a geometry
+        drawn on a web (spherical mercator) map at a zoom level would be less than a
+        pixel apart at the equator
+
+        @param zoom Integer representing the web map zoom level (0 is the whole world in one tile)
+        @param tileSize Integer representing the size of map tiles in pixels
+
+        @return Float representing the tolerance in degrees
+    """
+    return 360.0 / (tileSize * math.pow(2, zoom))
+
+
+class MultiResolutionGeometry(object):
+    """ A geometry and simplified versions of it at several tolerances.  Each level is
+        simplified from the next finer level, so the vertices dropped from a level are
+        within (about 1.1 times) its tolerance of the full resolution geometry when
+        successive tolerances differ by a factor of 10.
+    """
+    def __init__(self, geom, tolerances=SIMPLIFY_TOLERANCES):
+        """ Simplify a geometry at several tolerances
+
+            @param geom Shapely geometry
+            @param tolerances Sequence of floats representing tolerances, in the units of geom
+        """
+        self.geom = geom
+        self.levels = {}
+        level = geom
+        for tolerance in sorted(tolerances):
+            level = level.simplify(tolerance, preserve_topology=True)
+            self.levels[tolerance] = level
+
+    @classmethod
+    def fromLevels(cls, geom, levels):
+        """ Construct a multi-resolution geometry from levels simplified previously
+
+            @param geom Shapely geometry at full resolution
+            @param levels Dict mapping floats representing tolerances to Shapely geometries
+
+            @return MultiResolutionGeometry
+        """
+        multiResolution = cls(geom, tolerances=())
+        multiResolution.levels.update(levels)
+        return multiResolution
+
+    @property
+    def tolerances(self):
+        return sorted(self.levels.keys())
+
+    def getGeometry(self, tolerance=None):
+        """ Get the geometry at a given tolerance.  The coarsest level whose tolerance
+            does not exceed the tolerance requested is returned; if the tolerance requested
+            is finer than all levels, the geometry is simplified to the tolerance of the 
+            coarsest web map zoom level (see getToleranceForZoom()) not exceeding it, and 
+            the level added.  Geometries are not simplified beyond MAX_ZOOM.
+
+            @param tolerance Float representing the tolerance, in the units of the geometry;
+            if None, the full resolution geometry is returned
+
+            @return Shapely geometry
+
+            @raise ValueError if tolerance is not a positive, finite number
+        """
+        if tolerance is None:
+            return self.geom
+        if math.isnan(tolerance) or math.isinf(tolerance) or tolerance <= 0:
+            raise ValueError("Tolerance must be a positive, finite number, not %s" % (tolerance,))
+        if self.geom.is_empty:
+            return self.geom
+        levels = [t for t in self.levels.keys() if t <= tolerance]
+        if len(levels) > 0:
+            return self.levels[max(levels)]
+        # Snap to the zoom level ladder, so that the number of levels added is bounded
+        zoom = max(0, int(math.ceil(math.log(getToleranceForZoom(0) / tolerance, 2))))
+        while getToleranceForZoom(zoom) > tolerance:
+            zoom += 1
+        if zoom > MAX_ZOOM:
+            return self.geom
+        snapped = getToleranceForZoom(zoom)
+        level = self.geom.simplify(snapped, preserve_topology=True)
+        self.levels[snapped] = level
+        return level
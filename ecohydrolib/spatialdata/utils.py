@@ -54,6 +54,8 @@ from pyproj import transform
 from pyproj import Geod
 
 from shapely.geometry import shape
+from shapely.wkb import loads
+from shapely.ops import unary_union
 
 SHP_MINX = 0
 SHP_MAXX = 1
@@ -919,6 +921,44 @@ def getBoundingBoxForShapefile(shapefileName, buffer=0.0):
     return bbox
 
 
+def getPolygonForFeatureLayer(featureFilepath):
+    """ Return the union, in WGS84 (EPSG:4326) coordinates, of the polygon features of the 
+        first layer of an OGR feature dataset (e.g. ESRI shapefile).
+        
+        @param featureFilepath String representing the path of the feature dataset
+        
+        @return Shapely polygon or multipolygon
+        
+        @raise Exception if unable to open the feature dataset
+    """
+    poDS = ogr.Open(featureFilepath, False)
+    if not poDS:
+        raise Exception("Unable to open feature dataset %s" % (featureFilepath,))
+    assert(poDS.GetLayerCount() > 0)
+    poLayer = poDS.GetLayer(0)
+    assert(poLayer)
+    
+    # Setup transformation to EPSG:4326 (WGS84), if needed
+    coordTransform = None
+    srs = poLayer.GetSpatialRef()
+    if srs:
+        wgs84 = osr.SpatialReference()
+        wgs84.ImportFromEPSG(WGS84_EPSG)
+        if not srs.IsSame(wgs84):
+            coordTransform = osr.CoordinateTransformation(srs, wgs84)
+    
+    polygons = []
+    poFeature = poLayer.GetNextFeature()
+    while poFeature:
+        poGeometry = poFeature.GetGeometryRef()
+        if coordTransform:
+            poGeometry.Transform(coordTransform)
+        polygons.append( loads(poGeometry.ExportToWkb()) )
+        poFeature = poLayer.GetNextFeature()
+    
+    return unary_union(polygons)
+
+
 def bufferBoundingBox(bbox, buffer):
     """ Buffer the bounding by a given percentage
     
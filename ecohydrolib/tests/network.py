@@ -0,0 +1,87 @@
+"""@package ecohydrolib.tests.network
+
+    @brief Synthetic NHDPlus2 network and database fixtures shared by tests
+
+    This software is provided free of charge under the New BSD License. Please see
+    the following license information:
+
+    Copyright (c) 2015, University of North Carolina at Chapel Hill
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+        * Redistributions of source code must retain the above copyright
+          notice, this list of conditions and the following disclaimer.
+        * Redistributions in binary form must reproduce the above copyright
+          notice, this list of conditions and the following disclaimer in the
+          documentation and/or other materials provided with the distribution.
+        * Neither the name of the University of North Carolina at Chapel Hill nor the
+          names of its contributors may be used to endorse or promote products
+          derived from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+    ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+    WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+    CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+    GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+    HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+    OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+    @author Brian Miles <brian_miles@unc.edu>
+"""
+from shapely.geometry import box
+
+from ecohydrolib.nhdplus2.upstreamgraph import UpstreamGraph
+
+# Test network, flow is from top to bottom.  Reach 5 diverges into 6 (main path)
+#   and 7 (minor path), which rejoin at 8.  Reach 10 is a separate network 
+#   draining through 9.
+#
+#    1   2
+#     \ /
+#      3   4
+#       \ /
+#        5      10
+#       / \      |
+#      6   7     9
+#       \ /
+#        8
+PLUSFLOW = [(0, 1), (0, 2), (1, 3), (2, 3), (0, 4), (3, 5), (4, 5),
+            (5, 6), (5, 7), (6, 8), (7, 8), (8, 0)]
+SEPARATE_PLUSFLOW = [(0, 10), (10, 9), (9, 0)]
+# Both networks, reaches 1 to 10
+ALL_PLUSFLOW = PLUSFLOW + SEPARATE_PLUSFLOW
+
+
+def getUpstreamGraph(plusFlow=PLUSFLOW):
+    """ Build the upstream graph of test PlusFlow edges """
+    return UpstreamGraph.fromEdges([e[0] for e in plusFlow], [e[1] for e in plusFlow])
+
+
+def insertPlusFlow(conn, plusFlow=PLUSFLOW):
+    """ Insert test PlusFlow edges, creating a minimal PlusFlow table if need be """
+    conn.execute("""CREATE TABLE IF NOT EXISTS PlusFlow (FROMCOMID INTEGER, TOCOMID INTEGER)""")
+    conn.executemany("""INSERT INTO PlusFlow (FROMCOMID,TOCOMID) VALUES (?,?)""", plusFlow)
+
+
+def createGeometryColumns(conn, table, geometryType=3):
+    """ Mimic the geometry_columns table written by the OGR SQLite driver """
+    conn.execute("""CREATE TABLE geometry_columns (f_table_name TEXT, f_geometry_column TEXT,
+geometry_type INTEGER, coord_dimension INTEGER, srid INTEGER, geometry_format TEXT)""")
+    conn.execute("""INSERT INTO geometry_columns VALUES (?, 'GEOMETRY', ?, 2, 4326, 'WKB')""",
+                 (table, geometryType))
+
+
+def createCatchmentTable(conn, reaches=()):
+    """ Mimic the layout of a catchment DB written by the OGR SQLite driver.  The 
+        catchment of reach r is the unit square from (r, 0) to (r + 1, 1).
+    """
+    createGeometryColumns(conn, 'catchment')
+    conn.execute("""CREATE TABLE catchment (OGC_FID INTEGER PRIMARY KEY, GEOMETRY BLOB, featureid INTEGER)""")
+    conn.execute("""CREATE INDEX featureid_idx ON catchment (featureid)""")
+    conn.executemany("""INSERT INTO catchment (GEOMETRY, featureid) VALUES (?,?)""",
+                     ((buffer(box(r, 0, r + 1, 1).wkb), r) for r in reaches))
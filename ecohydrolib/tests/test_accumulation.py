@@ -0,0 +1,101 @@
+"""@package ecohydrolib.tests.test_accumulation
+
+    @brief Test methods for ecohydrolib.nhdplus2.accumulation
+
+    This software is provided free of charge under the New BSD License. Please see
+    the following license information:
+
+    Copyright (c) 2015, University of North Carolina at Chapel Hill
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+        * Redistributions of source code must retain the above copyright
+          notice, this list of conditions and the following disclaimer.
+        * Redistributions in binary form must reproduce the above copyright
+          notice, this list of conditions and the following disclaimer in the
+          documentation and/or other materials provided with the distribution.
+        * Neither the name of the University of North Carolina at Chapel Hill nor the
+          names of its contributors may be used to endorse or promote products
+          derived from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+    ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+    WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+    CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+    GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+    HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+    OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+    @author Brian Miles <brian_miles@unc.edu>
+
+    Usage:
+    @code
+    python -m unittest test_accumulation
+    @endcode
+
+"""
+from unittest import TestCase
+import sqlite3
+
+import numpy as np
+
+from ecohydrolib.nhdplus2.accumulation import UpstreamAccumulator
+from ecohydrolib.nhdplus2.accumulation import writeAccumulatedValues
+from ecohydrolib.tests.network import PLUSFLOW
+from ecohydrolib.tests.network import insertPlusFlow
+
+# Test network, see ecohydrolib.tests.network.  Reach 5 diverges into 6 (main path) 
+#   and 7 (minor path).
+# ComID, Hydroseq, Divergence
+VAA = [(1, 80, 0), (2, 70, 0), (3, 60, 0), (4, 50, 0), 
+       (5, 40, 0), (6, 30, 1), (7, 20, 2), (8, 10, 0)]
+
+class TestUpstreamAccumulator(TestCase):
+
+    def setUp(self):
+        (comids, hydroseqs, divergences) = zip(*VAA)
+        (fromComids, toComids) = zip(*PLUSFLOW)
+        self.accumulator = UpstreamAccumulator(comids, hydroseqs, divergences, fromComids, toComids)
+
+    def test_accumulate(self):
+        self.assertEqual(list(self.accumulator.comids), range(1, 9))
+        self.assertEqual(self.accumulator.numLevels, 5)
+        
+        # Upstream area, everything upstream of the divergence goes down main path 6
+        totals = self.accumulator.accumulate(np.ones(8))
+        self.assertEqual(list(totals), [1, 1, 3, 1, 5, 6, 1, 8])
+        
+        # Several attributes at once, values given for some reaches
+        values = np.array([[1.0, 10.0], [2.0, np.nan], [5.0, 0.0], [42.0, 42.0]])
+        totals = self.accumulator.accumulate(values, comIDs=[1, 2, 7, 99])
+        self.assertEqual(totals.shape, (8, 2))
+        self.assertEqual(list(totals[:,0]), [1, 2, 3, 0, 3, 3, 5, 8])
+        self.assertEqual(list(totals[:,1]), [10, 0, 10, 0, 10, 10, 0, 10])
+
+    def test_hydroseq_orientation(self):
+        # Edge against Hydroseq order (which would form a cycle) is ignored
+        (comids, hydroseqs, divergences) = zip(*VAA)
+        (fromComids, toComids) = zip(*(PLUSFLOW + [(8, 1)]))
+        accumulator = UpstreamAccumulator(comids, hydroseqs, divergences, fromComids, toComids)
+        self.assertEqual(list(accumulator.accumulate(np.ones(8))), [1, 1, 3, 1, 5, 6, 1, 8])
+
+    def test_db(self):
+        conn = sqlite3.connect(':memory:')
+        conn.execute("""CREATE TABLE PlusFlowlineVAA (ComID INTEGER, Hydroseq INTEGER, Divergence INTEGER)""")
+        conn.executemany("""INSERT INTO PlusFlowlineVAA VALUES (?,?,?)""", VAA)
+        insertPlusFlow(conn)
+        accumulator = UpstreamAccumulator.fromDB(conn)
+        totals = accumulator.accumulate(np.ones(8))
+        
+        self.assertEqual(writeAccumulatedValues(conn, 'UpstreamArea', accumulator.comids, 
+                                                totals, ['AreaSqKM']), 8)
+        rows = conn.execute("""SELECT ComID,AreaSqKM FROM UpstreamArea ORDER BY ComID""").fetchall()
+        self.assertEqual(rows[4], (5, 5.0))
+        self.assertRaises(Exception, writeAccumulatedValues, conn, 'Upstream Area', 
+                          accumulator.comids, totals, ['AreaSqKM'])
+        conn.close()
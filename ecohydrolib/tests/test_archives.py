@@ -0,0 +1,144 @@
+"""@package ecohydrolib.tests.test_archives
+
+    @brief Test methods for ecohydrolib.nhdplus2.archives
+
+    This software is provided free of charge under the New BSD License. Please see
+    the following license information:
+
+    Copyright (c) 2015, University of North Carolina at Chapel Hill
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+        * Redistributions of source code must retain the above copyright
+          notice, this list of conditions and the following disclaimer.
+        * Redistributions in binary form must reproduce the above copyright
+          notice, this list of conditions and the following disclaimer in the
+          documentation and/or other materials provided with the distribution.
+        * Neither the name of the University of North Carolina at Chapel Hill nor the
+          names of its contributors may be used to endorse or promote products
+          derived from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+    ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+    WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+    CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+    GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+    HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+    OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+    @author Brian Miles <brian_miles@unc.edu>
+
+    Usage:
+    @code
+    python -m unittest test_archives
+    @endcode
+
+"""
+from unittest import TestCase
+import os
+import sqlite3
+import tempfile, shutil
+
+from ecohydrolib.nhdplus2.ingest import TABLES
+from ecohydrolib.nhdplus2.archives import getRequiredMemberNames
+from ecohydrolib.nhdplus2.archives import parseArchiveListing
+from ecohydrolib.nhdplus2.archives import selectMembers
+from ecohydrolib.nhdplus2.archives import createPathIndexTable
+from ecohydrolib.nhdplus2.archives import indexPaths
+from ecohydrolib.nhdplus2.archives import buildPathIndex
+from ecohydrolib.nhdplus2.archives import getIndexedPaths
+
+LISTING = """
+7-Zip [64] 9.20  Copyright (c) 1999-2010 Igor Pavlov  2010-11-18
+p7zip Version 9.20 (locale=en_US.UTF-8,Utf16=on,HugeFiles=on,8 CPUs)
+
+Listing archive: NHDPlusV21_MA_02_NHDPlusAttributes_08.7z
+
+--
+Path = NHDPlusV21_MA_02_NHDPlusAttributes_08.7z
+Type = 7z
+Method = LZMA
+Solid = +
+Blocks = 1
+Physical Size = 24523415
+Headers Size = 595
+
+----------
+Path = NHDPlusMA/NHDPlus02/NHDPlusAttributes/PlusFlow.dbf
+Size = 5738830
+Packed Size = 24522820
+Modified = 2012-07-11 14:41:16
+Attributes = ....A
+CRC = 8F1F6F7B
+Encrypted = -
+Method = LZMA:24
+Block = 0
+
+Path = NHDPlusMA/NHDPlus02/NHDPlusAttributes/elevslope.dbf
+Size = 3425810
+Packed Size = 
+Modified = 2012-07-11 14:41:16
+Attributes = ....A
+CRC = 40A8D2A5
+Encrypted = -
+Method = LZMA:24
+Block = 0
+
+Path = NHDPlusMA/NHDPlus02/NHDPlusAttributes
+Size = 0
+Packed Size = 0
+Modified = 2012-07-11 14:41:18
+Attributes = D....
+CRC = 
+Encrypted = -
+Method = 
+Block = 
+"""
+
+class TestArchives(TestCase):
+
+    def test_select_members(self):
+        members = parseArchiveListing(LISTING)
+        self.assertEqual(members, ['NHDPlusMA/NHDPlus02/NHDPlusAttributes/PlusFlow.dbf',
+                                   'NHDPlusMA/NHDPlus02/NHDPlusAttributes/elevslope.dbf'])
+        names = getRequiredMemberNames(TABLES)
+        self.assertTrue('plusflow.dbf' in names)
+        self.assertTrue('catchment.shx' in names)
+        self.assertTrue('gage_smooth.dbf' in names)
+        self.assertEqual(selectMembers(members, names), members[:1])
+        self.assertEqual(parseArchiveListing(''), [])
+
+    def test_path_index(self):
+        outputDir = tempfile.mkdtemp()
+        try:
+            paths = [os.path.join('NHDPlusMA', 'NHDPlus02', 'NHDPlusAttributes', 'PlusFlow.dbf'),
+                     os.path.join('NHDPlusMA', 'NHDPlus02', 'NHDPlusAttributes', 'elevslope.dbf'),
+                     os.path.join('NHDPlusMS', 'NHDPlus10U', 'NHDPlusAttributes', 'PLUSFLOW.DBF')]
+            for path in paths:
+                if not os.path.isdir(os.path.join(outputDir, os.path.dirname(path))):
+                    os.makedirs(os.path.join(outputDir, os.path.dirname(path)))
+                open(os.path.join(outputDir, path), 'w').close()
+            
+            conn = sqlite3.connect(':memory:')
+            createPathIndexTable(conn)
+            self.assertEqual(buildPathIndex(conn, outputDir, set(['plusflow.dbf'])), 2)
+            self.assertEqual(getIndexedPaths(conn, outputDir, 'PlusFlow.dbf'),
+                             [os.path.join(outputDir, paths[0]), os.path.join(outputDir, paths[2])])
+            
+            # Paths extracted from an archive replace those previously extracted from it
+            indexPaths(conn, paths[1:2], 'a.7z')
+            indexPaths(conn, paths[0:2], 'a.7z')
+            self.assertEqual(getIndexedPaths(conn, outputDir, 'elevslope.dbf'),
+                             [os.path.join(outputDir, paths[1])])
+            # Files that no longer exist are not returned
+            os.unlink(os.path.join(outputDir, paths[2]))
+            self.assertEqual(getIndexedPaths(conn, outputDir, 'plusflow.dbf'),
+                             [os.path.join(outputDir, paths[0])])
+            conn.close()
+        finally:
+            shutil.rmtree(outputDir)
@@ -0,0 +1,224 @@
+"""@package ecohydrolib.tests.test_catchmentdb
+
+    @brief Test methods for ecohydrolib.nhdplus2.catchmentdb
+
+    This software is provided free of charge under the New BSD License. Please see
+    the following license information:
+
+    Copyright (c) 2015, University of North Carolina at Chapel Hill
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+        * Redistributions of source code must retain the above copyright
+          notice, this list of conditions and the following disclaimer.
+        * Redistributions in binary form must reproduce the above copyright
+          notice, this list of conditions and the following disclaimer in the
+          documentation and/or other materials provided with the distribution.
+        * Neither the name of the University of North Carolina at Chapel Hill nor the
+          names of its contributors may be used to endorse or promote products
+          derived from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+    ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+    WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+    CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+    GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+    HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+    OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+    @author Brian Miles <brian_miles@unc.edu>
+
+    Usage:
+    @code
+    python -m unittest test_catchmentdb
+    @endcode
+
+"""
+from unittest import TestCase
+import os
+import sqlite3
+import tempfile, shutil
+
+from shapely.geometry import box
+from shapely.wkb import loads
+
+from ecohydrolib.nhdplus2.catchmentdb import getGeometryColumn
+from ecohydrolib.nhdplus2.catchmentdb import getCatchmentGeometriesForReaches
+from ecohydrolib.nhdplus2.catchmentdb import getBoundingBoxForReaches
+from ecohydrolib.nhdplus2.catchmentdb import hasExtentTable
+from ecohydrolib.nhdplus2.catchmentdb import writeCatchmentExtents
+from ecohydrolib.nhdplus2.catchmentdb import isExtentTableComplete
+from ecohydrolib.nhdplus2.catchmentdb import getCatchmentsInBoundingBox
+from ecohydrolib.nhdplus2.catchmentdb import mergeCatchmentDBs
+from ecohydrolib.nhdplus2.catchmentdb import getShapefilesToLoad
+from ecohydrolib.nhdplus2.catchmentdb import loadCatchmentShapefiles
+from ecohydrolib.tests.network import createCatchmentTable
+
+class TestCatchmentDB(TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.createCatchmentDB(self.conn)
+        # 3000 unit squares in a row, more than can be selected by an OR filter
+        self.conn.executemany("""INSERT INTO catchment (GEOMETRY, featureid) VALUES (?,?)""",
+                              ((buffer(box(i, 0, i + 1, 1).wkb), i + 1) for i in xrange(3000)))
+
+    def createCatchmentDB(self, conn):
+        createCatchmentTable(conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_geometries(self):
+        self.assertEqual(getGeometryColumn(self.conn), 'GEOMETRY')
+        
+        reaches = range(1, 3001, 2) + [42, 42, 5000]
+        geoms = [loads(wkb) for wkb in getCatchmentGeometriesForReaches(self.conn, reaches)]
+        self.assertEqual(len(geoms), 1501)
+        
+        # Reaches from a previous query must not be returned
+        geoms = [loads(wkb) for wkb in getCatchmentGeometriesForReaches(self.conn, [3])]
+        self.assertEqual(len(geoms), 1)
+        self.assertEqual(geoms[0].bounds, (2.0, 0.0, 3.0, 1.0))
+
+    def test_bounding_box(self):
+        bbox = getBoundingBoxForReaches(self.conn, [10, 2500, 7])
+        self.assertEqual(bbox['minX'], 6.0)
+        self.assertEqual(bbox['maxX'], 2500.0)
+        self.assertEqual(bbox['minY'], 0.0)
+        self.assertEqual(bbox['maxY'], 1.0)
+        self.assertEqual(bbox['srs'], 'EPSG:4326')
+        
+        self.assertEqual(getBoundingBoxForReaches(self.conn, [5000]), None)
+
+    def test_extent_table(self):
+        self.assertFalse(hasExtentTable(self.conn))
+        self.assertEqual(writeCatchmentExtents(self.conn), 3000)
+        self.assertTrue(hasExtentTable(self.conn))
+        # Rebuilding replaces the existing table
+        self.assertEqual(writeCatchmentExtents(self.conn), 3000)
+        
+        bbox = getBoundingBoxForReaches(self.conn, [10, 2500, 7])
+        self.assertEqual(bbox['minX'], 6.0)
+        self.assertEqual(bbox['maxX'], 2500.0)
+        self.assertEqual(bbox['minY'], 0.0)
+        self.assertEqual(bbox['maxY'], 1.0)
+        self.assertEqual(bbox['srs'], 'EPSG:4326')
+        
+        self.assertEqual(getBoundingBoxForReaches(self.conn, [5000]), None)
+
+    def test_catchments_in_bounding_box(self):
+        self.assertRaises(Exception, getCatchmentsInBoundingBox, self.conn, 
+                          {'minX': 0.0, 'minY': 0.0, 'maxX': 1.0, 'maxY': 1.0})
+        writeCatchmentExtents(self.conn)
+        self.assertTrue(isExtentTableComplete(self.conn))
+        
+        catchments = getCatchmentsInBoundingBox(self.conn, {'minX': 9.5, 'minY': 0.25, 'maxX': 12.5, 'maxY': 0.75})
+        self.assertEqual(sorted(c[0] for c in catchments), [10, 11, 12, 13])
+        self.assertEqual(loads(dict(catchments)[11]).bounds, (10.0, 0.0, 11.0, 1.0))
+        
+        self.assertEqual(getCatchmentsInBoundingBox(self.conn, {'minX': 0.0, 'minY': 2.0, 'maxX': 10.0, 'maxY': 3.0}), [])
+
+    def test_merge(self):
+        tmpDir = tempfile.mkdtemp()
+        try:
+            stagingPaths = []
+            for vpu in xrange(3):
+                stagingPath = os.path.join(tmpDir, "Catchment_%02d.sqlite" % (vpu,))
+                conn = sqlite3.connect(stagingPath)
+                self.createCatchmentDB(conn)
+                conn.executemany("""INSERT INTO catchment (GEOMETRY, featureid) VALUES (?,?)""",
+                                 ((buffer(box(i, vpu, i + 1, vpu + 1).wkb), vpu * 100 + i) for i in xrange(10)))
+                conn.commit()
+                writeCatchmentExtents(conn)
+                conn.close()
+                stagingPaths.append(stagingPath)
+            
+            catchmentPath = os.path.join(tmpDir, "Catchment.sqlite")
+            self.assertEqual(mergeCatchmentDBs(catchmentPath, stagingPaths), 30)
+            conn = sqlite3.connect(catchmentPath)
+            bbox = getBoundingBoxForReaches(conn, [0, 109, 205])
+            self.assertEqual((bbox['minX'], bbox['minY'], bbox['maxX'], bbox['maxY']), (0.0, 0.0, 10.0, 3.0))
+            # Extents of staging databases are merged
+            self.assertTrue(isExtentTableComplete(conn))
+            catchments = getCatchmentsInBoundingBox(conn, {'minX': 4.5, 'minY': 2.5, 'maxX': 4.6, 'maxY': 2.6})
+            self.assertEqual([c[0] for c in catchments], [204])
+            conn.close()
+        finally:
+            shutil.rmtree(tmpDir)
+
+    def test_incremental_load(self):
+        tmpDir = tempfile.mkdtemp()
+        try:
+            # Stand-ins for regional shapefiles: each lists the featureids of its catchments
+            shapefiles = []
+            for vpu in xrange(2):
+                shapefile = os.path.join(tmpDir, "Catchment_%02d.shp" % (vpu,))
+                with open(shapefile, 'w') as f:
+                    f.write(' '.join([str(vpu * 100 + i) for i in xrange(5)]))
+                shapefiles.append(shapefile)
+            
+            def appendShapefile(shapefile, catchmentPath):
+                conn = sqlite3.connect(catchmentPath)
+                if conn.execute("""SELECT count(*) FROM sqlite_master WHERE name='catchment'""").fetchone()[0] == 0:
+                    self.createCatchmentDB(conn)
+                with open(shapefile) as f:
+                    featureids = [int(i) for i in f.read().split()]
+                conn.executemany("""INSERT INTO catchment (GEOMETRY, featureid) VALUES (?,?)""",
+                                 ((buffer(box(i, 0, i + 1, 1).wkb), i) for i in featureids))
+                conn.commit()
+                conn.close()
+                return True
+            
+            catchmentPath = os.path.join(tmpDir, "Catchment.sqlite")
+            toLoad = getShapefilesToLoad(catchmentPath, shapefiles, tmpDir)
+            self.assertEqual(len(toLoad), 2)
+            loadCatchmentShapefiles(catchmentPath, toLoad, appendShapefile)
+            self.assertEqual(getShapefilesToLoad(catchmentPath, shapefiles, tmpDir), [])
+            conn = sqlite3.connect(catchmentPath)
+            writeCatchmentExtents(conn)
+            conn.close()
+            
+            # Same featureids, so the number of catchments is unchanged, but different extents
+            with open(shapefiles[0], 'w') as f:
+                f.write('4 3 2 1 0')
+            toLoad = getShapefilesToLoad(catchmentPath, shapefiles, tmpDir)
+            self.assertEqual([t[1] for t in toLoad], ['Catchment_00.shp'])
+            
+            def appendShifted(shapefile, catchmentPath):
+                conn = sqlite3.connect(catchmentPath)
+                with open(shapefile) as f:
+                    featureids = [int(i) for i in f.read().split()]
+                conn.executemany("""INSERT INTO catchment (GEOMETRY, featureid) VALUES (?,?)""",
+                                 ((buffer(box(i, 10, i + 1, 11).wkb), i) for i in featureids))
+                conn.commit()
+                conn.close()
+                return True
+            loadCatchmentShapefiles(catchmentPath, toLoad, appendShifted)
+            
+            conn = sqlite3.connect(catchmentPath)
+            self.assertTrue(isExtentTableComplete(conn))
+            self.assertEqual(conn.execute("""SELECT minY FROM catchment_extent WHERE featureid=2""").fetchone()[0], 10)
+            self.assertEqual(conn.execute("""SELECT minY FROM catchment_extent WHERE featureid=102""").fetchone()[0], 0)
+            conn.close()
+            
+            with open(shapefiles[0], 'w') as f:
+                f.write('1 2 3')
+            toLoad = getShapefilesToLoad(catchmentPath, shapefiles, tmpDir)
+            self.assertEqual([t[1] for t in toLoad], ['Catchment_00.shp'])
+            loadCatchmentShapefiles(catchmentPath, toLoad, appendShapefile)
+            
+            conn = sqlite3.connect(catchmentPath)
+            featureids = [r[0] for r in conn.execute("""SELECT featureid FROM catchment ORDER BY featureid""")]
+            extentids = [r[0] for r in conn.execute("""SELECT featureid FROM catchment_extent ORDER BY featureid""")]
+            self.assertTrue(isExtentTableComplete(conn))
+            conn.close()
+            self.assertEqual(featureids, [1, 2, 3, 100, 101, 102, 103, 104])
+            self.assertEqual(extentids, featureids)
+        finally:
+            shutil.rmtree(tmpDir)
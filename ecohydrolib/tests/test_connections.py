@@ -0,0 +1,106 @@
+"""@package ecohydrolib.tests.test_connections
+
+    @brief Test methods for ecohydrolib.nhdplus2.connections
+
+    This software is provided free of charge under the New BSD License. Please see
+    the following license information:
+
+    Copyright (c) 2015, University of North Carolina at Chapel Hill
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+        * Redistributions of source code must retain the above copyright
+          notice, this list of conditions and the following disclaimer.
+        * Redistributions in binary form must reproduce the above copyright
+          notice, this list of conditions and the following disclaimer in the
+          documentation and/or other materials provided with the distribution.
+        * Neither the name of the University of North Carolina at Chapel Hill nor the
+          names of its contributors may be used to endorse or promote products
+          derived from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+    ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+    WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+    CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+    GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+    HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+    OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+    @author Brian Miles <brian_miles@unc.edu>
+
+    Usage:
+    @code
+    python -m unittest test_connections
+    @endcode
+
+"""
+from unittest import TestCase
+import os
+import sqlite3
+import tempfile, shutil
+import threading
+import ConfigParser
+
+from ecohydrolib.nhdplus2 import connections
+from ecohydrolib.nhdplus2.connections import getNHDPlusDBConnection
+from ecohydrolib.nhdplus2.connections import closeConnections
+from ecohydrolib.nhdplus2.catchmentdb import loadReachIds
+
+class TestConnections(TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        dbPath = os.path.join(self.tmpDir, 'NHDPlusDB.sqlite')
+        conn = sqlite3.connect(dbPath)
+        conn.execute("""CREATE TABLE PlusFlow (FROMCOMID INTEGER, TOCOMID INTEGER)""")
+        conn.execute("""INSERT INTO PlusFlow (FROMCOMID,TOCOMID) VALUES (1,2)""")
+        conn.commit()
+        conn.close()
+        self.config = ConfigParser.RawConfigParser()
+        self.config.add_section('NHDPLUS2')
+        self.config.set('NHDPLUS2', 'PATH_OF_NHDPLUS2_DB', dbPath)
+
+    def tearDown(self):
+        closeConnections()
+        shutil.rmtree(self.tmpDir)
+
+    def test_shared_connection_without_uri(self):
+        # Connections are read-only whether or not SQLite interprets URI filenames
+        connections._supportsURI = False
+        try:
+            self.test_shared_connection()
+            conn = getNHDPlusDBConnection(self.config)
+            self.assertEqual(conn.execute("""PRAGMA query_only""").fetchone()[0], 1)
+        finally:
+            closeConnections()
+            connections._supportsURI = None
+
+    def test_shared_connection(self):
+        conn = getNHDPlusDBConnection(self.config)
+        self.assertTrue(conn is getNHDPlusDBConnection(self.config))
+        self.assertEqual(conn.execute("""SELECT TOCOMID FROM PlusFlow""").fetchone()[0], 2)
+        # Connection is read-only ...
+        self.assertRaises(sqlite3.DatabaseError, conn.execute,
+                          """INSERT INTO PlusFlow (FROMCOMID,TOCOMID) VALUES (2,3)""")
+        # ... but temporary tables can still be used
+        loadReachIds(conn, [1, 2])
+        self.assertEqual(conn.execute("""SELECT count(*) FROM temp.reach_ids""").fetchone()[0], 2)
+        
+        # Each thread has its own connection
+        others = []
+        t = threading.Thread(target=lambda: others.append(getNHDPlusDBConnection(self.config)))
+        t.start()
+        t.join()
+        self.assertFalse(others[0] is conn)
+        
+        closeConnections()
+        self.assertFalse(conn is getNHDPlusDBConnection(self.config))
+
+    def test_unreadable(self):
+        self.config.set('NHDPLUS2', 'PATH_OF_NHDPLUS2_DB', os.path.join(self.tmpDir, 'missing.sqlite'))
+        self.assertRaises(IOError, getNHDPlusDBConnection, self.config)
@@ -0,0 +1,188 @@
+"""@package ecohydrolib.tests.test_dbf
+
+    @brief Test methods for ecohydrolib.dbf
+
+    This software is provided free of charge under the New BSD License. Please see
+    the following license information:
+
+    Copyright (c) 2015, University of North Carolina at Chapel Hill
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+        * Redistributions of source code must retain the above copyright
+          notice, this list of conditions and the following disclaimer.
+        * Redistributions in binary form must reproduce the above copyright
+          notice, this list of conditions and the following disclaimer in the
+          documentation and/or other materials provided with the distribution.
+        * Neither the name of the University of North Carolina at Chapel Hill nor the
+          names of its contributors may be used to endorse or promote products
+          derived from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+    ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+    WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+    CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+    GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+    HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+    OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+    @author Brian Miles <brian_miles@unc.edu>
+
+    Usage:
+    @code
+    python -m unittest test_dbf
+    @endcode
+
+"""
+from unittest import TestCase
+import os
+import datetime
+import decimal
+import tempfile, shutil
+
+import numpy as np
+
+from ecohydrolib.dbf import dbfreader
+from ecohydrolib.dbf import dbfwriter
+from ecohydrolib.dbf import dbffields
+from ecohydrolib.dbf import dbfcolumnreader
+from ecohydrolib.dbf import dbfreadcolumns
+from ecohydrolib.dbf import DBFWriter
+from ecohydrolib import dbf
+
+class TestDBF(TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpDir, 'PlusFlowlineVAA.dbf')
+        fieldnames = ['ComID', 'Hydroseq', 'LengthKM', 'FDate', 'ReachCode', 'Divergence', 'Flag']
+        fieldspecs = [('N', 9, 0), ('N', 11, 0), ('N', 8, 3), ('D', 8, 0), ('C', 14, 0), 
+                      ('N', 9, 0), ('L', 1, 0)]
+        records = []
+        for i in xrange(1000):
+            records.append([i + 1, 510000000 + i * 7, decimal.Decimal(i) / 8 - 5, 
+                            datetime.date(1999 + i % 12, 1 + i % 12, 1 + i % 28),
+                            '%014d' % (i,), -i if i % 3 else '', 'T' if i % 2 else 'F'])
+        with open(self.path, 'wb') as f:
+            dbfwriter(f, fieldnames, fieldspecs, records)
+        # Mark the third record as deleted
+        with open(self.path, 'r+b') as f:
+            (numrec, lenheader, lenrecord, fields) = dbffields(f)
+            f.seek(lenheader + 2 * lenrecord)
+            f.write('*')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_columns(self):
+        with open(self.path, 'rb') as f:
+            expected = list(dbfreader(f))[2:]
+        self.assertEqual(len(expected), 999)
+        
+        columns = dbfreadcolumns(self.path, ['COMID', 'LengthKM', 'FDate', 'ReachCode', 'Divergence', 'Flag'])
+        self.assertEqual(columns['COMID'].dtype, np.int64)
+        self.assertEqual(list(columns['COMID']), [r[0] for r in expected])
+        self.assertEqual(columns['LengthKM'].dtype, np.float64)
+        self.assertTrue(np.allclose(columns['LengthKM'], [float(r[2]) for r in expected]))
+        self.assertEqual(list(columns['FDate'].astype(datetime.date)), [r[3] for r in expected])
+        self.assertEqual(list(columns['ReachCode']), [r[4] for r in expected])
+        self.assertEqual(list(columns['Divergence']), [r[5] for r in expected])
+        self.assertEqual(list(columns['Flag']), [r[6] for r in expected])
+        
+        self.assertRaises(KeyError, dbfreadcolumns, self.path, ['TotDASqKM'])
+
+    def test_chunks(self):
+        chunks = list(dbfcolumnreader(self.path, ['Hydroseq'], chunksize=300))
+        self.assertEqual([len(c['Hydroseq']) for c in chunks], [299, 300, 300, 100])
+        hydroseq = np.concatenate([c['Hydroseq'] for c in chunks])
+        self.assertEqual(hydroseq[0], 510000000)
+        self.assertEqual(hydroseq[2], 510000000 + 3 * 7)
+
+    def test_writer(self):
+        fieldnames = ['MUKEY', 'AVGKSAT', 'HYDGRP', 'UPDATED', 'HYDRIC']
+        fieldspecs = [('N', 10, 0), ('N', 12, 4), ('C', 4, 0), ('D', 8, 0), ('L', 1, 0)]
+        def records():
+            for i in xrange(2500):
+                yield (i * 1001, (i - 1250) / 3.0, 'A/D' if i % 2 else 'B', 
+                       datetime.date(2014, 1 + i % 12, 1 + i % 28), i % 5 == 0)
+        path = os.path.join(self.tmpDir, 'soil.dbf')
+        with open(path, 'wb') as f:
+            with DBFWriter(f, fieldnames, fieldspecs, chunksize=1000) as writer:
+                writer.writeRecords(records())
+        
+        with open(path, 'rb') as f:
+            written = list(dbfreader(f))
+        self.assertEqual(written[0], fieldnames)
+        self.assertEqual(written[1], [spec for spec in fieldspecs])
+        self.assertEqual(len(written) - 2, 2500)
+        for (record, expected) in zip(written[2:], records()):
+            self.assertEqual(record[0], expected[0])
+            self.assertEqual(record[1], decimal.Decimal('%.4f' % (expected[1],)))
+            self.assertEqual(record[2], expected[2])
+            self.assertEqual(record[3], expected[3])
+            self.assertEqual(record[4], 'T' if expected[4] else 'F')
+        
+        # Write a structured array
+        array = np.zeros(10, dtype=[('MUKEY', np.int64), ('AVGKSAT', np.float64), ('HYDGRP', 'S4'), 
+                                    ('UPDATED', 'datetime64[D]'), ('HYDRIC', np.bool_)])
+        array['MUKEY'] = np.arange(10) - 5
+        array['AVGKSAT'] = np.linspace(-1.5, 1.5, 10)
+        array['HYDGRP'] = 'C'
+        array['UPDATED'] = np.datetime64('2015-06-30')
+        with open(path, 'wb') as f:
+            with DBFWriter(f, fieldnames, fieldspecs) as writer:
+                writer.writeArray(array)
+        columns = dbfreadcolumns(path)
+        self.assertEqual(list(columns['MUKEY']), range(-5, 5))
+        self.assertTrue(np.allclose(columns['AVGKSAT'], array['AVGKSAT'], atol=1e-4))
+        self.assertEqual(list(columns['UPDATED']), list(array['UPDATED']))
+        self.assertEqual(list(columns['HYDRIC']), ['F'] * 10)
+
+    def test_writerNumeric(self):
+        path = os.path.join(self.tmpDir, 'numeric.dbf')
+        nan = float('nan')
+        inf = float('inf')
+        records = [(2.7, 1.25, 3), (nan, nan, 4), (inf, -inf, 5), (-2.0, 0.5, 6)]
+        with open(path, 'wb') as f:
+            dbfwriter(f, ['A', 'B', 'C'], [('N', 10, 0), ('N', 10, 2), ('N', 10, 0)], records)
+        with open(path, 'rb') as f:
+            (numrec, lenheader, lenrecord, fields) = dbffields(f)
+            f.seek(lenheader)
+            data = f.read(numrec * lenrecord)
+        # Records start with the deletion flag
+        written = [[data[i*lenrecord+1+j*10:i*lenrecord+1+(j+1)*10].strip() for j in range(3)] \
+                   for i in range(numrec)]
+        # Non-integral values of fields without decimal places, and non-finite values,
+        #   are written as by str()
+        self.assertEqual([r[0] for r in written], ['2.7', 'nan', 'inf', '-2.0'])
+        self.assertEqual([r[1] for r in written], ['1.25', 'nan', '-inf', '0.50'])
+        self.assertEqual([r[2] for r in written], ['3', '4', '5', '6'])
+        
+        # Integral float values of fields without decimal places are written as integers
+        with open(path, 'wb') as f:
+            dbfwriter(f, ['A', 'B'], [('N', 10, 0), ('N', 10, 2)], [(2.0, nan), (-3.0, 1.0)])
+        columns = dbfreadcolumns(path)
+        self.assertEqual(list(columns['A']), [2, -3])
+        self.assertTrue(np.isnan(columns['B'][0]))
+        self.assertEqual(columns['B'][1], 1.0)
+
+    def test_wideNumeric(self):
+        # NHDPlus REAL columns are N(19,11)
+        path = os.path.join(self.tmpDir, 'wide.dbf')
+        values = ['1234567.12345678901', '-123456.12345678901', '0.00012345678', '-0.5', '']
+        with open(path, 'wb') as f:
+            dbfwriter(f, ['QA_MA'], [('N', 19, 11)], [[decimal.Decimal(v or '0')] for v in values])
+        def decodeNumericValues(raw, isFloat):
+            self.fail("N(19,11) field not decoded by vectorized path")
+        _decodeNumericValues = dbf._decodeNumericValues
+        dbf._decodeNumericValues = decodeNumericValues
+        try:
+            columns = dbfreadcolumns(path)
+        finally:
+            dbf._decodeNumericValues = _decodeNumericValues
+        self.assertEqual(list(columns['QA_MA']), [float(v or '0') for v in values])
@@ -0,0 +1,87 @@
+"""@package ecohydrolib.tests.test_dissolve
+
+    @brief Test methods for ecohydrolib.spatialdata.dissolve
+
+    This software is provided free of charge under the New BSD License. Please see
+    the following license information:
+
+    Copyright (c) 2015, University of North Carolina at Chapel Hill
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+        * Redistributions of source code must retain the above copyright
+          notice, this list of conditions and the following disclaimer.
+        * Redistributions in binary form must reproduce the above copyright
+          notice, this list of conditions and the following disclaimer in the
+          documentation and/or other materials provided with the distribution.
+        * Neither the name of the University of North Carolina at Chapel Hill nor the
+          names of its contributors may be used to endorse or promote products
+          derived from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+    ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+    WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+    CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+    GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+    HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+    OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+    @author Brian Miles <brian_miles@unc.edu>
+
+    Usage:
+    @code
+    python -m unittest test_dissolve
+    @endcode
+
+"""
+from unittest import TestCase
+from StringIO import StringIO
+
+from shapely.geometry import Polygon, LineString, Point, GeometryCollection, box
+from shapely.wkb import dumps
+
+from ecohydrolib.spatialdata.dissolve import dissolveGeometries
+from ecohydrolib.spatialdata.dissolve import repairGeometry
+
+class TestDissolve(TestCase):
+
+    def setUp(self):
+        # 20 x 20 grid of adjoining unit squares
+        self.wkbs = [dumps(box(x, y, x+1, y+1)) for x in xrange(20) for y in xrange(20)]
+
+    def test_dissolve(self):
+        geom = dissolveGeometries(self.wkbs, batchSize=16, processes=1)
+        self.assertEqual(geom.geom_type, 'Polygon')
+        self.assertAlmostEqual(geom.area, 400.0)
+        self.assertEqual(geom.bounds, (0.0, 0.0, 20.0, 20.0))
+
+    def test_dissolve_pool(self):
+        outfp = StringIO()
+        geom = dissolveGeometries(iter(self.wkbs), batchSize=16, processes=2,
+                                  verbose=True, outfp=outfp)
+        self.assertAlmostEqual(geom.area, 400.0)
+        # 25 leaf batches are reduced pairwise in 5 further levels
+        self.assertEqual(len(outfp.getvalue().splitlines()), 6)
+
+    def test_dissolve_empty(self):
+        self.assertTrue(dissolveGeometries([]).is_empty)
+
+    def test_repair(self):
+        bowtie = Polygon([(0, 0), (1, 1), (1, 0), (0, 1)])
+        self.assertFalse(bowtie.is_valid)
+        repaired = repairGeometry(bowtie)
+        self.assertTrue(repaired.is_valid)
+        # Both lobes of the bow-tie are kept
+        self.assertAlmostEqual(repaired.area, 0.5)
+        self.assertEqual(repaired.geom_type, 'MultiPolygon')
+        # Lines and points of a collection are discarded
+        collection = GeometryCollection([box(0, 0, 1, 1), LineString([(2, 2), (3, 3)]), Point(4, 4)])
+        self.assertEqual(repairGeometry(collection).geom_type, 'Polygon')
+        self.assertTrue(repairGeometry(LineString([(0, 0), (1, 1)])).is_empty)
+        geom = dissolveGeometries([dumps(bowtie), dumps(box(2, 2, 3, 3))], processes=1)
+        self.assertTrue(geom.is_valid)
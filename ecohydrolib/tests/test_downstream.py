@@ -0,0 +1,126 @@
+"""@package ecohydrolib.tests.test_downstream
+
+    @brief Test methods for ecohydrolib.nhdplus2.downstream
+
+    This software is provided free of charge under the New BSD License. Please see
+    the following license information:
+
+    Copyright (c) 2015, University of North Carolina at Chapel Hill
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+        * Redistributions of source code must retain the above copyright
+          notice, this list of conditions and the following disclaimer.
+        * Redistributions in binary form must reproduce the above copyright
+          notice, this list of conditions and the following disclaimer in the
+          documentation and/or other materials provided with the distribution.
+        * Neither the name of the University of North Carolina at Chapel Hill nor the
+          names of its contributors may be used to endorse or promote products
+          derived from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+    ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+    WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+    CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+    GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+    HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+    OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+    @author Brian Miles <brian_miles@unc.edu>
+
+    Usage:
+    @code
+    python -m unittest test_downstream
+    @endcode
+
+"""
+from unittest import TestCase
+import sqlite3
+
+from ecohydrolib.nhdplus2.downstream import DownstreamNetwork
+
+# Test network (see test_upstreamgraph), flow is from top to bottom.  Reach 5 
+#   diverges into 6 (main path) and 7 (minor path), which rejoin at 8.
+#
+#    1   2
+#     \ /
+#      3   4
+#       \ /
+#        5
+#       / \
+#      6   7
+#       \ /
+#        8
+# ComID, Hydroseq, DnHydroseq, TerminalPa, LengthKM, TravTime
+VAA = [(1, 80, 60, 10, 1.0, 0.1),
+       (2, 70, 60, 10, 2.0, 0.2),
+       (3, 60, 40, 10, 3.0, 0.3),
+       (4, 50, 40, 10, 4.0, 0.4),
+       (5, 40, 30, 10, 5.0, 0.5),
+       (6, 30, 10, 10, 6.0, 0.6),
+       (7, 20, 10, 10, 7.0, 0.7),
+       (8, 10, 0, 10, 8.0, 0.8),
+       # Isolated reach whose downstream reach is in another VPU
+       (9, 100, 5000, 5, 1.5, 0.15)]
+
+class TestDownstreamNetwork(TestCase):
+
+    def setUp(self):
+        self.network = DownstreamNetwork(*zip(*VAA))
+
+    def test_flow_path(self):
+        (comids, length, time) = self.network.getFlowPath(1)
+        self.assertEqual(list(comids), [1, 3, 5, 6, 8])
+        self.assertEqual(list(length), [1.0, 4.0, 9.0, 15.0, 23.0])
+        self.assertAlmostEqual(time[-1], 2.3)
+        
+        (comids, length, time) = self.network.getFlowPath(7)
+        self.assertEqual(list(comids), [7, 8])
+        
+        (comids, length, time) = self.network.getFlowPath(42)
+        self.assertEqual(len(comids), 0)
+
+    def test_outlets(self):
+        (outlets, length, time) = self.network.getOutlets([1, 2, 3, 4, 5, 6, 7, 8, 9, 42])
+        self.assertEqual(list(outlets), [8, 8, 8, 8, 8, 8, 8, 8, 9, -1])
+        self.assertEqual(list(length[:9]), [23.0, 24.0, 22.0, 23.0, 19.0, 14.0, 15.0, 8.0, 1.5])
+        self.assertAlmostEqual(time[1], 2.4)
+        self.assertTrue(length[9] != length[9])
+        
+        # Agrees with tracing each path
+        for comid in range(1, 10):
+            (comids, pathLength, pathTime) = self.network.getFlowPath(comid)
+            self.assertEqual(outlets[comid - 1], comids[-1])
+            self.assertAlmostEqual(length[comid - 1], pathLength[-1])
+            self.assertAlmostEqual(time[comid - 1], pathTime[-1])
+        
+        self.assertEqual(list(self.network.getTerminalOutlets([1, 9, 42])), [8, -1, -1])
+
+    def test_long_path(self):
+        # Path of 1000 reaches, ComID i flows to i+1
+        n = 1000
+        network = DownstreamNetwork(range(1, n + 1), range(n, 0, -1), range(n - 1, -1, -1),
+                                    [1] * n, [1.0] * n, [0.0] * n)
+        (outlets, length, time) = network.getOutlets([1, 500, n])
+        self.assertEqual(list(outlets), [n, n, n])
+        self.assertEqual(list(length), [n, n - 499, 1.0])
+
+    def test_cycle(self):
+        network = DownstreamNetwork([1, 2], [2, 1], [1, 2], [1, 1], [1.0, 1.0], [0.0, 0.0])
+        self.assertRaises(Exception, network.getFlowPath, 1)
+        self.assertRaises(Exception, network.getOutlets, [1])
+
+    def test_db(self):
+        conn = sqlite3.connect(':memory:')
+        conn.execute("""CREATE TABLE PlusFlowlineVAA (ComID INTEGER, Hydroseq INTEGER, DnHydroseq INTEGER,
+TerminalPa INTEGER, LengthKM REAL, TravTime REAL)""")
+        conn.executemany("""INSERT INTO PlusFlowlineVAA VALUES (?,?,?,?,?,?)""", VAA)
+        network = DownstreamNetwork.fromDB(conn)
+        conn.close()
+        self.assertEqual(network.numReaches, len(VAA))
+        self.assertEqual(list(network.getFlowPath(2)[0]), [2, 3, 5, 6, 8])
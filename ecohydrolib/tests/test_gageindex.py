@@ -0,0 +1,105 @@
+"""@package ecohydrolib.tests.test_gageindex
+
+    @brief Test methods for ecohydrolib.nhdplus2.gageindex
+
+    This software is provided free of charge under the New BSD License. Please see
+    the following license information:
+
+    Copyright (c) 2015, University of North Carolina at Chapel Hill
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+        * Redistributions of source code must retain the above copyright
+          notice, this list of conditions and the following disclaimer.
+        * Redistributions in binary form must reproduce the above copyright
+          notice, this list of conditions and the following disclaimer in the
+          documentation and/or other materials provided with the distribution.
+        * Neither the name of the University of North Carolina at Chapel Hill nor the
+          names of its contributors may be used to endorse or promote products
+          derived from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+    ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+    WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+    CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+    GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+    HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+    OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+    @author Brian Miles <brian_miles@unc.edu>
+
+    Usage:
+    @code
+    python -m unittest test_gageindex
+    @endcode
+
+"""
+from unittest import TestCase
+import sqlite3
+import math
+
+from ecohydrolib.nhdplus2.gageindex import GageIndex
+from ecohydrolib.nhdplus2.gageindex import hasGageComIdTable
+from ecohydrolib.nhdplus2.gageindex import writeGageComIdTable
+
+# ComID, ReachCode, FromMeas, ToMeas
+VAA = [(100, '02060006000001', 0.0, 50.0),
+       (101, '02060006000001', 50.0, 100.0),
+       (200, '02060006000002', 0.0, 100.0)]
+# Source_Fea, ReachCode, Measure
+GAGE_LOC = [(u'01589330', u'02060006000001', 75.0),
+            (u'01589312', u'02060006000002', 10.0),
+            (u'01589300', u'02060006000003', 10.0)]
+# GageID, Lon_NHD, Lat_NHD
+GAGE_INFO = [(u'01589330', -76.7, 39.3)]
+
+class TestGageIndex(TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.execute("""CREATE TABLE PlusFlowlineVAA (ComID INTEGER, ReachCode TEXT, FromMeas REAL, ToMeas REAL)""")
+        self.conn.executemany("""INSERT INTO PlusFlowlineVAA VALUES (?,?,?,?)""", VAA)
+        self.conn.execute("""CREATE TABLE Gage_Loc (Source_Fea TEXT, ReachCode TEXT, Measure REAL)""")
+        self.conn.executemany("""INSERT INTO Gage_Loc VALUES (?,?,?)""", GAGE_LOC)
+        self.conn.execute("""CREATE TABLE Gage_Info (GageID TEXT, Lon_NHD REAL, Lat_NHD REAL)""")
+        self.conn.executemany("""INSERT INTO Gage_Info VALUES (?,?,?)""", GAGE_INFO)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def checkIndex(self, gageIndex):
+        self.assertEqual(gageIndex.numGages, 3)
+        
+        (reachcode, measure, comid, lon, lat) = gageIndex.getGage('01589330')
+        self.assertEqual((reachcode, measure, comid, lon, lat), 
+                         ('02060006000001', 75.0, 101, -76.7, 39.3))
+        gage = gageIndex.getGage(u'01589312')
+        self.assertEqual(gage[2], 200)
+        self.assertTrue(math.isnan(gage[3]))
+        # Gage on a reach code not in PlusFlowlineVAA
+        self.assertEqual(gageIndex.getGage('01589300')[2], -1)
+        self.assertEqual(gageIndex.getGage('01589301'), None)
+        
+        (found, reachcodes, measures, comids, lons, lats) = \
+            gageIndex.getGages(['01589312', '0158931', '01589330', '015893300', '01589312'])
+        self.assertEqual(list(found), [True, False, True, False, True])
+        self.assertEqual(list(comids), [200, 101, 200])
+        self.assertEqual(list(reachcodes), ['02060006000002', '02060006000001', '02060006000002'])
+
+    def test_index(self):
+        self.assertFalse(hasGageComIdTable(self.conn))
+        self.checkIndex(GageIndex.fromDB(self.conn))
+
+    def test_precomputed_index(self):
+        self.assertEqual(writeGageComIdTable(self.conn), 3)
+        self.assertTrue(hasGageComIdTable(self.conn))
+        self.checkIndex(GageIndex.fromDB(self.conn))
+
+    def test_empty_index(self):
+        gageIndex = GageIndex([], [], [], [], [], [])
+        self.assertEqual(list(gageIndex.indexOf(['01589330'])), [-1])
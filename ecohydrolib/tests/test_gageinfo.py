@@ -0,0 +1,118 @@
+"""@package ecohydrolib.tests.test_gageinfo
+
+    @brief Test methods for ecohydrolib.nhdplus2.subnetwork
+
+    This software is provided free of charge under the New BSD License. Please see
+    the following license information:
+
+    Copyright (c) 2015, University of North Carolina at Chapel Hill
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+        * Redistributions of source code must retain the above copyright
+          notice, this list of conditions and the following disclaimer.
+        * Redistributions in binary form must reproduce the above copyright
+          notice, this list of conditions and the following disclaimer in the
+          documentation and/or other materials provided with the distribution.
+        * Neither the name of the University of North Carolina at Chapel Hill nor the
+          names of its contributors may be used to endorse or promote products
+          derived from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+    ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+    WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+    CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+    GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+    HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+    OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+    @author Brian Miles <brian_miles@unc.edu>
+
+    Usage:
+    @code
+    python -m unittest test_gageinfo
+    @endcode
+
+"""
+from unittest import TestCase
+import sqlite3
+
+from ecohydrolib.nhdplus2.ingest import createTables
+from ecohydrolib.nhdplus2.ingest import createIndexes
+from ecohydrolib.nhdplus2.gageindex import writeGageComIdTable
+from ecohydrolib.nhdplus2.gageinfo import GAGE_INFO_FTS_TABLE
+from ecohydrolib.nhdplus2.gageinfo import supportsFTS5
+from ecohydrolib.nhdplus2.gageinfo import hasGageInfoIndex
+from ecohydrolib.nhdplus2.gageinfo import writeGageInfoIndex
+from ecohydrolib.nhdplus2.gageinfo import getMatchExpression
+from ecohydrolib.nhdplus2.gageinfo import searchGages
+
+# GageID, Station_NM, State, State_CD, SiteStatus, DA_SQ_Mile
+GAGE_INFO = [('02087500', 'NEUSE RIVER NEAR CLAYTON, NC', 'NC', '37', 'active', 1150.0),
+             ('02089000', 'NEUSE R NR GOLDSBORO, NC', 'NC', '37', 'active', 2399.0),
+             ('02087570', 'NEUSE RIVER AT SMITHFIELD, NC', 'NC', '37', 'inactive', 1206.0),
+             ('01589330', 'DEAD RUN AT FRANKLINTOWN, MD', 'MD', '24', 'active', 5.52)]
+
+class TestGageInfo(TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        createTables(self.conn)
+        for (i, gage) in enumerate(GAGE_INFO):
+            self.conn.execute("""INSERT INTO Gage_Info 
+(GageID,Station_NM,State,State_CD,SiteStatus,DA_SQ_Mile,Lon_Site,Lat_Site) VALUES (?,?,?,?,?,?,?,?)""",
+                              gage + (-78.0 - i, 35.0 + i))
+        self.conn.execute("""INSERT INTO Gage_Loc (Source_Fea,ReachCode,Measure) VALUES ('02087500','03020201000001',50.0)""")
+        self.conn.execute("""INSERT INTO PlusFlowlineVAA (ComID,ReachCode,FromMeas,ToMeas) 
+VALUES (8,'03020201000001',0.0,100.0)""")
+        self.conn.commit()
+        createIndexes(self.conn)
+        writeGageComIdTable(self.conn)
+        self.numGages = writeGageInfoIndex(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_getMatchExpression(self):
+        self.assertEqual(getMatchExpression('Neuse  River!'), '"neuse"* AND ("river"* OR "r")')
+        self.assertEqual(getMatchExpression('"*'), None)
+
+    def test_searchByName(self):
+        if not supportsFTS5(self.conn):
+            self.assertEqual(self.numGages, None)
+            return
+        self.assertEqual(self.numGages, len(GAGE_INFO))
+        self.assertTrue(hasGageInfoIndex(self.conn))
+        # Abbreviated station names match
+        gages = searchGages(self.conn, 'neuse river')
+        self.assertEqual(sorted(g[0] for g in gages), ['02087500', '02087570', '02089000'])
+        gages = searchGages(self.conn, 'neuse river near clayton')
+        self.assertEqual([g[0] for g in gages], ['02087500'])
+        self.assertEqual(gages[0][5:], ('03020201000001', 50.0, 8, -78.0, 35.0))
+        # Prefixes match
+        gages = searchGages(self.conn, 'neu smith')
+        self.assertEqual([g[0] for g in gages], ['02087570'])
+        # Ranked results are filtered by attributes
+        gages = searchGages(self.conn, 'neuse', state='37', status='active', minArea=2000.0)
+        self.assertEqual([g[0] for g in gages], ['02089000'])
+        self.assertEqual(searchGages(self.conn, 'neuse', limit=1)[0][0] in ['02087500', '02087570', '02089000'], True)
+
+    def test_searchByAttributes(self):
+        gages = searchGages(self.conn, state='nc', maxArea=1500.0)
+        # Ordered by decreasing drainage area
+        self.assertEqual([g[0] for g in gages], ['02087570', '02087500'])
+        cursor = self.conn.cursor()
+        cursor.execute("""EXPLAIN QUERY PLAN SELECT GageID FROM Gage_Info WHERE State_CD=? AND DA_SQ_Mile>=?""",
+                       ('37', 1000.0))
+        self.assertTrue('gage_info_state_cd_da_idx' in ' '.join(str(row[-1]) for row in cursor.fetchall()))
+        cursor.close()
+
+    def test_searchWithoutIndex(self):
+        self.conn.execute("""DROP TABLE IF EXISTS %s""" % (GAGE_INFO_FTS_TABLE,))
+        gages = searchGages(self.conn, 'dead run', state='MD')
+        self.assertEqual([g[0] for g in gages], ['01589330'])
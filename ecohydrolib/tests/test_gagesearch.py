@@ -0,0 +1,106 @@
+"""@package ecohydrolib.tests.test_gagesearch
+
+    @brief Test methods for ecohydrolib.nhdplus2.gagesearch
+
+    This software is provided free of charge under the New BSD License. Please see
+    the following license information:
+
+    Copyright (c) 2015, University of North Carolina at Chapel Hill
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+        * Redistributions of source code must retain the above copyright
+          notice, this list of conditions and the following disclaimer.
+        * Redistributions in binary form must reproduce the above copyright
+          notice, this list of conditions and the following disclaimer in the
+          documentation and/or other materials provided with the distribution.
+        * Neither the name of the University of North Carolina at Chapel Hill nor the
+          names of its contributors may be used to endorse or promote products
+          derived from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+    ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+    WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+    CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+    GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+    HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+    OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+    @author Brian Miles <brian_miles@unc.edu>
+
+    Usage:
+    @code
+    python -m unittest test_gagesearch
+    @endcode
+
+"""
+from unittest import TestCase
+import sqlite3
+
+from shapely.geometry import Point, box
+
+from ecohydrolib.nhdplus2.gagesearch import hasGageLocationIndex
+from ecohydrolib.nhdplus2.gagesearch import writeGageLocationIndex
+from ecohydrolib.nhdplus2.gagesearch import getGagesInBoundingBox
+from ecohydrolib.nhdplus2.gagesearch import getGagesInPolygon
+from ecohydrolib.nhdplus2.gagesearch import getNearestGages
+from ecohydrolib.nhdplus2.gagesearch import getDistanceKm
+
+# source_fea, reachcode, measure, x, y
+GAGES = [(u'01589330', u'02060003000740', 33.4, -76.7, 39.3),
+         (u'01589312', u'02060003000741', 50.0, -76.72, 39.31),
+         (u'01589300', u'02060003000742', 10.0, -76.8, 39.4),
+         (u'01580000', u'02060003000743', 90.0, -76.0, 39.0),
+         (u'09380000', u'14070006000001', 50.0, -111.59, 36.86)]
+
+class TestGageSearch(TestCase):
+
+    def setUp(self):
+        # Mimic the layout of a GageLoc DB written by the OGR SQLite driver
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.execute("""CREATE TABLE geometry_columns (f_table_name TEXT, f_geometry_column TEXT,
+geometry_type INTEGER, coord_dimension INTEGER, srid INTEGER, geometry_format TEXT)""")
+        self.conn.execute("""INSERT INTO geometry_columns VALUES ('gageloc', 'GEOMETRY', 1, 2, 4326, 'WKB')""")
+        self.conn.execute("""CREATE TABLE gageloc (OGC_FID INTEGER PRIMARY KEY, GEOMETRY BLOB, 
+source_fea TEXT, reachcode TEXT, measure REAL)""")
+        self.conn.executemany("""INSERT INTO gageloc (GEOMETRY,source_fea,reachcode,measure) VALUES (?,?,?,?)""",
+                              ((buffer(Point(g[3], g[4]).wkb), g[0], g[1], g[2]) for g in GAGES))
+
+    def tearDown(self):
+        self.conn.close()
+
+    def checkSearches(self):
+        bbox = dict({'minX': -76.75, 'minY': 39.25, 'maxX': -76.7, 'maxY': 39.35, 'srs': 'EPSG:4326'})
+        gages = getGagesInBoundingBox(self.conn, bbox)
+        self.assertEqual(sorted([g[0] for g in gages]), ['01589312', '01589330'])
+        self.assertEqual([g for g in gages if g[0] == '01589330'][0], GAGES[0])
+        
+        polygon = box(-77.0, 39.0, -76.5, 39.5).difference(box(-76.75, 39.25, -76.7, 39.35))
+        gages = getGagesInPolygon(self.conn, polygon)
+        # Gages on the boundary of the polygon are included, those in its hole are not
+        self.assertEqual(sorted([g[0] for g in gages]), ['01589300', '01589330'])
+        
+        gages = getNearestGages(self.conn, -76.71, 39.3, k=3)
+        self.assertEqual([g[0] for g in gages], ['01589330', '01589312', '01589300'])
+        # Search radius must grow to find distant gages
+        gages = getNearestGages(self.conn, -110.0, 35.0, k=1)
+        self.assertEqual([g[0] for g in gages], ['09380000'])
+        self.assertEqual(len(getNearestGages(self.conn, -76.71, 39.3, k=10)), len(GAGES))
+
+    def test_search(self):
+        self.assertFalse(hasGageLocationIndex(self.conn))
+        self.checkSearches()
+
+    def test_indexed_search(self):
+        self.assertEqual(writeGageLocationIndex(self.conn), len(GAGES))
+        self.assertTrue(hasGageLocationIndex(self.conn))
+        self.checkSearches()
+
+    def test_distance(self):
+        self.assertAlmostEqual(getDistanceKm(0.0, 0.0, 1.0, 0.0), 111.195, places=2)
+        self.assertAlmostEqual(getDistanceKm(-76.7, 39.3, -76.7, 39.3), 0.0)
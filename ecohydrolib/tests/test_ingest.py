@@ -0,0 +1,188 @@
+"""@package ecohydrolib.tests.test_ingest
+
+    @brief Test methods for ecohydrolib.nhdplus2.ingest
+
+    This software is provided free of charge under the New BSD License. Please see
+    the following license information:
+
+    Copyright (c) 2015, University of North Carolina at Chapel Hill
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+        * Redistributions of source code must retain the above copyright
+          notice, this list of conditions and the following disclaimer.
+        * Redistributions in binary form must reproduce the above copyright
+          notice, this list of conditions and the following disclaimer in the
+          documentation and/or other materials provided with the distribution.
+        * Neither the name of the University of North Carolina at Chapel Hill nor the
+          names of its contributors may be used to endorse or promote products
+          derived from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+    ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+    WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+    CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+    GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+    HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+    OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+    @author Brian Miles <brian_miles@unc.edu>
+
+    Usage:
+    @code
+    python -m unittest test_ingest
+    @endcode
+
+"""
+from unittest import TestCase
+import os
+import sqlite3
+import datetime
+import decimal
+import tempfile, shutil
+
+from ecohydrolib.dbf import dbfwriter
+from ecohydrolib.nhdplus2.ingest import getTableSchema
+from ecohydrolib.nhdplus2.ingest import loadNHDPlusDB
+from ecohydrolib.nhdplus2.ingest import loadNHDPlusDBParallel
+from ecohydrolib.nhdplus2.ingest import getVPUForPath
+from ecohydrolib.nhdplus2.manifest import getSourceEntry
+
+class TestIngest(TestCase):
+
+    def setUp(self):
+        self.dataDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dataDir)
+
+    def writeDBF(self, filename, fieldnames, fieldspecs, records):
+        path = os.path.join(self.dataDir, filename)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            dbfwriter(f, fieldnames, fieldspecs, records)
+        return path
+
+    def test_load(self):
+        # GNIS_NBR field is missing
+        flowline = self.writeDBF('NHDFlowline.dbf',
+            ['COMID', 'FDATE', 'RESOLUTION', 'GNIS_ID', 'GNIS_NAME', 'LENGTHKM', 'REACHCODE',
+             'FLOWDIR', 'WBAREACOMI', 'FTYPE', 'FCODE', 'SHAPE_LENG', 'ENABLED'],
+            [('N', 9, 0), ('D', 8, 0), ('C', 7, 0), ('N', 9, 0), ('C', 20, 0), ('N', 8, 3),
+             ('C', 14, 0), ('C', 15, 0), ('N', 9, 0), ('C', 12, 0), ('N', 5, 0), ('N', 10, 5),
+             ('C', 5, 0)],
+            [(8896, datetime.date(2001, 2, 3), 'Medium', 590117, 'Dead Run', decimal.Decimal('1.250'),
+              '02060003000123', 'With Digitized', 0, 'StreamRiver', 46006, decimal.Decimal('0.01234'),
+              'True')])
+        # Undocumented NHD2DAGE_D field is present
+        gageInfo = self.writeDBF('GageInfo.dbf',
+            ['GageID', 'Agency_cd', 'Station_NM', 'State_CD', 'State', 'SiteStatus', 'DA_SQ_Mile',
+             'Lon_Site', 'Lat_Site', 'Lon_NHD', 'Lat_NHD', 'NHD2DAGE_D', 'Reviewed'],
+            [('C', 15, 0), ('C', 5, 0), ('C', 50, 0), ('C', 2, 0), ('C', 2, 0), ('C', 8, 0),
+             ('N', 10, 2), ('N', 12, 6), ('N', 12, 6), ('N', 12, 6), ('N', 12, 6), ('N', 10, 2),
+             ('C', 1, 0)],
+            [('01589330', 'USGS', 'DEAD RUN AT FRANKLINTOWN, MD', '24', 'MD', 'active',
+              decimal.Decimal('5.52'), decimal.Decimal('-76.716389'), decimal.Decimal('39.310833'),
+              decimal.Decimal('-76.716000'), decimal.Decimal('39.311000'), decimal.Decimal('5.50'), 'Y')])
+
+        schemas = [getTableSchema('NHDFlowline'), getTableSchema('Gage_Info')]
+        conn = sqlite3.connect(':memory:')
+        numRows = loadNHDPlusDB(conn, {'NHDFlowline': [flowline, flowline], 'Gage_Info': [gageInfo]},
+                                schemas=schemas)
+        self.assertEqual(numRows, {'NHDFlowline': 2, 'Gage_Info': 1})
+
+        cursor = conn.cursor()
+        cursor.execute("""SELECT COMID,FDATE,GNIS_NAME,LENGTHKM,REACHCODE,GNIS_NBR FROM NHDFlowline""")
+        self.assertEqual(cursor.fetchone(),
+                         (8896, u'2001-02-03 00:00:00', u'Dead Run', 1.25, u'02060003000123', 0))
+        cursor.execute("""SELECT GageID,DA_SQ_Mile,Lat_NHD,Reviewed FROM Gage_Info""")
+        self.assertEqual(cursor.fetchone(), (u'01589330', 5.52, 39.311, u'Y'))
+        
+        # Indexes are created after loading
+        cursor.execute("""SELECT name FROM sqlite_master WHERE type='index' ORDER BY name""")
+        self.assertEqual([r[0] for r in cursor.fetchall()],
+                         [u'NHDFlowline_Comid_idx', u'NHDFlowline_Reachcode_idx', u'gage_info_da_idx',
+                          u'gage_info_gageID_idx', u'gage_info_state_cd_da_idx', u'gage_info_state_da_idx',
+                          u'gage_info_status_da_idx'])
+        cursor.close()
+        conn.close()
+
+    def test_vpu(self):
+        self.assertEqual(getVPUForPath('/data/NHDPlusMS/NHDPlus10U/NHDPlusAttributes/PlusFlow.dbf'), '10U')
+        self.assertEqual(getVPUForPath('/data/NHDPlusMA/NHDPlus02/NHDSnapshot/Hydrography/NHDFlowline.dbf'), '02')
+        self.assertEqual(getVPUForPath('/data/NHDPlusNationalData/GageInfo.dbf'), 'national')
+
+    def writePlusFlow(self, vpu, comids):
+        fieldnames = ['FROMCOMID', 'FROMHYDSEQ', 'FROMLVLPAT', 'TOCOMID', 'TOHYDSEQ', 'TOLVLPAT',
+                      'NODENUMBER', 'DELTALEVEL', 'DIRECTION', 'GAPDISTKM', 'HasGeo', 'TotDASqKM',
+                      'DivDASqKM']
+        fieldspecs = [('N', 9, 0)] * 9 + [('N', 8, 3), ('C', 1, 0), ('N', 10, 2), ('N', 10, 2)]
+        records = [(c, 0, 0, c + 1, 0, 0, 0, 0, 709, decimal.Decimal('0.000'), 'Y',
+                    decimal.Decimal('1.00'), decimal.Decimal('1.00')) for c in comids]
+        return self.writeDBF(os.path.join('NHDPlus%s' % (vpu,), 'PlusFlow.dbf'),
+                             fieldnames, fieldspecs, records)
+
+    def test_parallel_load(self):
+        dbfPaths = [self.writePlusFlow('01', [1, 2, 3]), self.writePlusFlow('10U', [10, 11])]
+
+        conn = sqlite3.connect(':memory:')
+        numRows = loadNHDPlusDBParallel(conn, {'PlusFlow': dbfPaths}, self.dataDir,
+                                        schemas=[getTableSchema('PlusFlow')], processes=2)
+        self.assertEqual(numRows, {'PlusFlow': 5})
+        cursor = conn.cursor()
+        cursor.execute("""SELECT FROMCOMID,TOCOMID FROM PlusFlow ORDER BY FROMCOMID""")
+        self.assertEqual(cursor.fetchall(), [(1, 2), (2, 3), (3, 4), (10, 11), (11, 12)])
+        cursor.execute("""SELECT count(*) FROM sqlite_master WHERE type='index'""")
+        self.assertEqual(cursor.fetchone()[0], 2)
+        cursor.close()
+        conn.close()
+        # Staging databases are deleted once merged
+        self.assertFalse(any(f.endswith('.sqlite') for f in os.listdir(self.dataDir)))
+
+    def test_incremental_load(self):
+        schemas = [getTableSchema('PlusFlow')]
+        dbfPaths = [self.writePlusFlow('01', [1, 2, 3]), self.writePlusFlow('02', [20, 21])]
+        def getFromComids(conn):
+            cursor = conn.cursor()
+            cursor.execute("""SELECT FROMCOMID FROM PlusFlow ORDER BY FROMCOMID""")
+            comids = [r[0] for r in cursor.fetchall()]
+            cursor.close()
+            return comids
+
+        for parallel in [False, True]:
+            dbPath = os.path.join(self.dataDir, 'NHDPlusDB.sqlite')
+            if os.path.exists(dbPath):
+                os.unlink(dbPath)
+            self.writePlusFlow('01', [1, 2, 3])
+            conn = sqlite3.connect(dbPath)
+            def load():
+                if parallel:
+                    return loadNHDPlusDBParallel(conn, {'PlusFlow': dbfPaths}, self.dataDir, schemas=schemas,
+                                                 processes=2, incremental=True, sourceRoot=self.dataDir)
+                return loadNHDPlusDB(conn, {'PlusFlow': dbfPaths}, schemas=schemas,
+                                     incremental=True, sourceRoot=self.dataDir)
+            self.assertEqual(load(), {'PlusFlow': 5})
+            entry = getSourceEntry(conn, os.path.join('NHDPlus02', 'PlusFlow.dbf'))
+            self.assertEqual((entry['NumRows'], entry['FirstRowid'], entry['LastRowid']), (2, 4, 5))
+            
+            # Files already loaded are skipped
+            self.assertEqual(load(), {'PlusFlow': 0})
+            self.assertEqual(getFromComids(conn), [1, 2, 3, 20, 21])
+            
+            # Records of a file that changed are replaced
+            self.writePlusFlow('01', [1, 2, 3, 4])
+            self.assertEqual(load(), {'PlusFlow': 4})
+            self.assertEqual(getFromComids(conn), [1, 2, 3, 4, 20, 21])
+            
+            # Records of an interrupted load are discarded
+            conn.execute("""INSERT INTO PlusFlow (FROMCOMID) VALUES (99)""")
+            conn.commit()
+            self.assertEqual(load(), {'PlusFlow': 0})
+            self.assertEqual(getFromComids(conn), [1, 2, 3, 4, 20, 21])
+            conn.close()
@@ -0,0 +1,106 @@
+"""@package ecohydrolib.tests.test_mainstem
+
+    @brief Test methods for ecohydrolib.nhdplus2.mainstem
+
+    This software is provided free of charge under the New BSD License. Please see
+    the following license information:
+
+    Copyright (c) 2015, University of North Carolina at Chapel Hill
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+        * Redistributions of source code must retain the above copyright
+          notice, this list of conditions and the following disclaimer.
+        * Redistributions in binary form must reproduce the above copyright
+          notice, this list of conditions and the following disclaimer in the
+          documentation and/or other materials provided with the distribution.
+        * Neither the name of the University of North Carolina at Chapel Hill nor the
+          names of its contributors may be used to endorse or promote products
+          derived from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+    ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+    WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+    CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+    GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+    HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+    OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+    @author Brian Miles <brian_miles@unc.edu>
+
+    Usage:
+    @code
+    python -m unittest test_mainstem
+    @endcode
+
+"""
+from unittest import TestCase
+import sqlite3
+
+from ecohydrolib.nhdplus2.ingest import getTableSchema
+from ecohydrolib.nhdplus2.ingest import createTables
+from ecohydrolib.nhdplus2.ingest import createIndexes
+from ecohydrolib.nhdplus2.mainstem import MAINSTEM_INDEX
+from ecohydrolib.nhdplus2.mainstem import MAINSTEM_QUERY
+from ecohydrolib.nhdplus2.mainstem import hasMainstemIndex
+from ecohydrolib.nhdplus2.mainstem import getMainstemUpstream
+
+# ComID, LevelPathI, Hydroseq, UpHydroseq, LengthKM, TotDASqKM
+# Level path 1 runs from headwater 103 to outlet 100; level path 10 joins it at 101.
+# Reach 106 is on level path 1 but is not connected to its mainstem (UpHydroseq 0).
+# On level path 2, Hydroseq of 108 lies between those of 107 and the reach upstream of it, 109.
+VAA = [(100, 1, 1, 2, 1.0, 100.0),
+       (101, 1, 2, 3, 2.0, 90.0),
+       (102, 1, 3, 4, 3.0, 40.0),
+       (103, 1, 4, 0, 4.0, 10.0),
+       (104, 10, 10, 11, 1.5, 45.0),
+       (105, 10, 11, 0, 2.5, 20.0),
+       (106, 1, 20, 0, 1.0, 1.0),
+       (107, 2, 30, 32, 1.0, 5.0),
+       (108, 2, 31, 0, 1.0, 1.0),
+       (109, 2, 32, 0, 2.0, 3.0)]
+
+class TestMainstem(TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        schemas = [getTableSchema('PlusFlowlineVAA')]
+        createTables(self.conn, schemas)
+        self.conn.executemany("""INSERT INTO PlusFlowlineVAA (ComID,LevelPathI,Hydroseq,UpHydroseq,LengthKM,TotDASqKM)
+VALUES (?,?,?,?,?,?)""", VAA)
+        createIndexes(self.conn, schemas)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_mainstem(self):
+        self.assertTrue(hasMainstemIndex(self.conn))
+        plan = ' '.join([str(row[-1]) for row in self.conn.execute("EXPLAIN QUERY PLAN " + MAINSTEM_QUERY, (1, 2))])
+        self.assertTrue(MAINSTEM_INDEX in plan)
+        self.assertFalse('TEMP B-TREE' in plan)
+        
+        (comids, lengthKm, totDASqKm) = getMainstemUpstream(self.conn, 101)
+        self.assertEqual(list(comids), [101, 102, 103])
+        self.assertEqual(list(lengthKm), [2.0, 5.0, 9.0])
+        self.assertEqual(list(totDASqKm), [90.0, 40.0, 10.0])
+        
+        (comids, lengthKm, totDASqKm) = getMainstemUpstream(self.conn, 104)
+        self.assertEqual(list(comids), [104, 105])
+        
+        (comids, lengthKm, totDASqKm) = getMainstemUpstream(self.conn, 103)
+        self.assertEqual(list(comids), [103])
+        self.assertEqual(list(lengthKm), [4.0])
+        
+        (comids, lengthKm, totDASqKm) = getMainstemUpstream(self.conn, 107)
+        self.assertEqual(list(comids), [107, 109])
+        self.assertEqual(list(lengthKm), [1.0, 3.0])
+        
+        (comids, lengthKm, totDASqKm) = getMainstemUpstream(self.conn, 999)
+        self.assertEqual(len(comids), 0)
+        self.assertEqual(len(lengthKm), 0)
+        self.assertEqual(len(totDASqKm), 0)
@@ -0,0 +1,89 @@
+"""@package ecohydrolib.tests.test_nestedintervals
+
+    @brief Test methods for ecohydrolib.nhdplus2.nestedintervals
+
+    This software is provided free of charge under the New BSD License. Please see
+    the following license information:
+
+    Copyright (c) 2015, University of North Carolina at Chapel Hill
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+        * Redistributions of source code must retain the above copyright
+          notice, this list of conditions and the following disclaimer.
+        * Redistributions in binary form must reproduce the above copyright
+          notice, this list of conditions and the following disclaimer in the
+          documentation and/or other materials provided with the distribution.
+        * Neither the name of the University of North Carolina at Chapel Hill nor the
+          names of its contributors may be used to endorse or promote products
+          derived from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+    ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+    WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+    CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+    GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+    HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+    OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+    @author Brian Miles <brian_miles@unc.edu>
+
+    Usage:
+    @code
+    python -m unittest test_nestedintervals
+    @endcode
+
+"""
+from unittest import TestCase
+import sqlite3
+
+from ecohydrolib.nhdplus2.nestedintervals import computeNestedIntervals
+from ecohydrolib.nhdplus2.nestedintervals import writeNestedIntervals
+from ecohydrolib.nhdplus2.nestedintervals import getUpstreamReachesForInterval
+from ecohydrolib.nhdplus2.nestedintervals import isUpstreamOf
+from ecohydrolib.tests.network import ALL_PLUSFLOW
+from ecohydrolib.tests.network import getUpstreamGraph
+
+# Both test networks, reaches 1 to 10; see ecohydrolib.tests.network
+
+class TestNestedIntervals(TestCase):
+
+    def setUp(self):
+        self.graph = getUpstreamGraph(ALL_PLUSFLOW)
+        self.conn = sqlite3.connect(':memory:')
+        writeNestedIntervals(self.conn, self.graph)
+        
+    def tearDown(self):
+        self.conn.close()
+
+    def test_intervals(self):
+        (pre, post, exceptionFrom, exceptionTo) = computeNestedIntervals(self.graph)
+        # Every reach gets a unique pre-order label within its own interval
+        self.assertEqual(sorted(pre), range(self.graph.numReaches))
+        self.assertTrue((pre <= post).all())
+        # Only the second flow edge out of the divergence at reach 5 is an exception
+        self.assertEqual(len(exceptionFrom), 1)
+        self.assertEqual(self.graph.comids[exceptionFrom[0]], 5)
+        
+    def test_upstream(self):
+        for comID in xrange(1, 11):
+            expected = sorted(self.graph.getUpstreamReaches(comID))
+            reaches = getUpstreamReachesForInterval(self.conn, comID)
+            self.assertEqual(sorted(reaches), expected)
+        reaches = getUpstreamReachesForInterval(self.conn, 3, includeStart=False)
+        self.assertEqual(sorted(reaches), [1, 2])
+        self.assertEqual(len(getUpstreamReachesForInterval(self.conn, 42)), 0)
+        
+    def test_is_upstream(self):
+        self.assertTrue(isUpstreamOf(self.conn, 1, 8))
+        self.assertTrue(isUpstreamOf(self.conn, 5, 6))
+        self.assertTrue(isUpstreamOf(self.conn, 5, 7))
+        self.assertFalse(isUpstreamOf(self.conn, 6, 7))
+        self.assertFalse(isUpstreamOf(self.conn, 8, 1))
+        self.assertFalse(isUpstreamOf(self.conn, 10, 8))
+        self.assertFalse(isUpstreamOf(self.conn, 42, 8))
@@ -0,0 +1,140 @@
+"""@package ecohydrolib.tests.test_partitions
+
+    @brief Test methods for ecohydrolib.nhdplus2.subnetwork
+
+    This software is provided free of charge under the New BSD License. Please see
+    the following license information:
+
+    Copyright (c) 2015, University of North Carolina at Chapel Hill
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+        * Redistributions of source code must retain the above copyright
+          notice, this list of conditions and the following disclaimer.
+        * Redistributions in binary form must reproduce the above copyright
+          notice, this list of conditions and the following disclaimer in the
+          documentation and/or other materials provided with the distribution.
+        * Neither the name of the University of North Carolina at Chapel Hill nor the
+          names of its contributors may be used to endorse or promote products
+          derived from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+    ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+    WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+    CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+    GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+    HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+    OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+    @author Brian Miles <brian_miles@unc.edu>
+
+    Usage:
+    @code
+    python -m unittest test_partitions
+    @endcode
+
+"""
+from unittest import TestCase
+import os
+import sqlite3
+import tempfile, shutil
+
+from ecohydrolib.nhdplus2.ingest import createTables
+from ecohydrolib.nhdplus2.ingest import createIndexes
+from ecohydrolib.nhdplus2.manifest import createManifestTable
+from ecohydrolib.nhdplus2.manifest import recordSource
+from ecohydrolib.nhdplus2.manifest import SOURCE_DBF
+from ecohydrolib.nhdplus2.partitions import ROUTING_DB_FILENAME
+from ecohydrolib.nhdplus2.partitions import FLOW_TABLE
+from ecohydrolib.nhdplus2.partitions import computeComIDRanges
+from ecohydrolib.nhdplus2.partitions import writePartitions
+from ecohydrolib.nhdplus2.partitions import PartitionedNetwork
+from ecohydrolib.tests.network import ALL_PLUSFLOW
+from ecohydrolib.tests.network import insertPlusFlow
+from ecohydrolib.tests.network import createCatchmentTable
+
+# Both test networks (see ecohydrolib.tests.network).  Reaches 1-4 lie in VPU 01,
+#   reaches 5-10 in VPU 02.
+VPUS = [('NHDPlusNE/NHDPlus01/NHDPlusAttributes/PlusFlowlineVAA.dbf', [1, 2, 3, 4]),
+        ('NHDPlusMA/NHDPlus02/NHDPlusAttributes/PlusFlowlineVAA.dbf', [5, 6, 7, 8, 9, 10])]
+
+class TestPartitions(TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.partitionDir = os.path.join(self.tmpDir, 'partitions')
+        
+        self.nhdPlusDB = os.path.join(self.tmpDir, 'NHDPlusDB.sqlite')
+        conn = sqlite3.connect(self.nhdPlusDB)
+        createTables(conn)
+        createManifestTable(conn)
+        for (source, reaches) in VPUS:
+            for r in reaches:
+                conn.execute("""INSERT INTO PlusFlowlineVAA (ComID,Hydroseq) VALUES (?,?)""", (r, 100 - r))
+            recordSource(conn, source, SOURCE_DBF, '', 0, 0.0, table='PlusFlowlineVAA',
+                         numRows=len(reaches), firstRowid=reaches[0], lastRowid=reaches[-1])
+        insertPlusFlow(conn, ALL_PLUSFLOW)
+        conn.commit()
+        createIndexes(conn)
+        conn.close()
+        
+        self.catchmentDB = os.path.join(self.tmpDir, 'Catchment.sqlite')
+        conn = sqlite3.connect(self.catchmentDB)
+        createCatchmentTable(conn, range(1, 11))
+        conn.commit()
+        conn.close()
+        
+        self.routingDB = writePartitions(self.nhdPlusDB, self.catchmentDB, self.partitionDir, processes=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_computeComIDRanges(self):
+        (minComids, maxComids, vpus) = computeComIDRanges({'01': [1, 2, 3, 7], '02': [4, 5, 6, 8, 3]})
+        self.assertEqual(list(minComids), [1, 4, 7, 8])
+        self.assertEqual(list(maxComids), [3, 6, 7, 8])
+        self.assertEqual(vpus, ['01', '02', '01', '02'])
+
+    def test_writePartitions(self):
+        self.assertEqual(self.routingDB, os.path.join(self.partitionDir, ROUTING_DB_FILENAME))
+        conn = sqlite3.connect(os.path.join(self.partitionDir, 'NHDPlusDB_01.sqlite'))
+        comids = [row[0] for row in conn.execute("""SELECT ComID FROM PlusFlowlineVAA ORDER BY ComID""")]
+        self.assertEqual(comids, [1, 2, 3, 4])
+        conn.close()
+        conn = sqlite3.connect(self.routingDB)
+        flows = conn.execute("""SELECT FROMCOMID,TOCOMID,FromVPU,ToVPU FROM %s ORDER BY FROMCOMID""" % \
+                             (FLOW_TABLE,)).fetchall()
+        self.assertEqual(flows, [(3, 5, '01', '02'), (4, 5, '01', '02')])
+        conn.close()
+
+    def test_getUpstreamReaches(self):
+        network = PartitionedNetwork(self.routingDB)
+        try:
+            self.assertEqual(network.getVPUs([1, 5, 11]), ['01', '02', None])
+            # Only partitions reached are attached
+            self.assertEqual(sorted(network.getUpstreamReaches(3)), [1, 2, 3])
+            self.assertEqual(network.attached.keys(), ['01'])
+            self.assertEqual(sorted(network.getUpstreamReaches(9, includeStart=False)), [10])
+            self.assertEqual(network.attached.keys(), ['01', '02'])
+            self.assertEqual(sorted(network.getUpstreamReaches(8)), range(1, 9))
+            self.assertTrue(network.hasCatchments())
+            geoms = list(network.getCatchmentGeometriesForReaches([3, 5, 8]))
+            self.assertEqual(len(geoms), 3)
+            bbox = network.getBoundingBoxForReaches([3, 5, 8, 11])
+            self.assertEqual((bbox['minX'], bbox['minY'], bbox['maxX'], bbox['maxY']), (3, 0, 9, 1))
+            self.assertTrue(network.getBoundingBoxForReaches([11]) is None)
+        finally:
+            network.close()
+
+    def test_maxAttached(self):
+        network = PartitionedNetwork(self.routingDB, maxAttached=1)
+        try:
+            self.assertEqual(sorted(network.getUpstreamReaches(8)), range(1, 9))
+            self.assertEqual(len(network.attached), 1)
+        finally:
+            network.close()
@@ -0,0 +1,84 @@
+"""@package ecohydrolib.tests.test_simplify
+
+    @brief Test methods for ecohydrolib.spatialdata.dissolve
+
+    This software is provided free of charge under the New BSD License. Please see
+    the following license information:
+
+    Copyright (c) 2015, University of North Carolina at Chapel Hill
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+        * Redistributions of source code must retain the above copyright
+          notice, this list of conditions and the following disclaimer.
+        * Redistributions in binary form must reproduce the above copyright
+          notice, this list of conditions and the following disclaimer in the
+          documentation and/or other materials provided with the distribution.
+        * Neither the name of the University of North Carolina at Chapel Hill nor the
+          names of its contributors may be used to endorse or promote products
+          derived from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+    ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+    WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+    CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+    GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+    HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+    OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+    @author Brian Miles <brian_miles@unc.edu>
+
+    Usage:
+    @code
+    python -m unittest test_simplify
+    @endcode
+
+"""
+from unittest import TestCase
+import math
+
+from shapely.geometry import Polygon
+
+from ecohydrolib.spatialdata.simplify import MultiResolutionGeometry
+from ecohydrolib.spatialdata.simplify import getToleranceForZoom
+from ecohydrolib.spatialdata.simplify import MAX_ZOOM
+
+class TestSimplify(TestCase):
+
+    def setUp(self):
+        # Circle of radius 1 with 10000 vertices
+        n = 10000
+        self.geom = Polygon([(math.cos(2 * math.pi * i / n), math.sin(2 * math.pi * i / n)) \
+                             for i in range(n)])
+
+    def test_levels(self):
+        watershed = MultiResolutionGeometry(self.geom, tolerances=(0.0001, 0.001, 0.01))
+        self.assertEqual(watershed.tolerances, [0.0001, 0.001, 0.01])
+        self.assertTrue(watershed.getGeometry() is self.geom)
+        numCoords = [len(watershed.getGeometry(t).exterior.coords) for t in watershed.tolerances]
+        self.assertTrue(len(self.geom.exterior.coords) > numCoords[0] > numCoords[1] > numCoords[2])
+        for t in watershed.tolerances:
+            level = watershed.getGeometry(t)
+            self.assertTrue(level.is_valid)
+            self.assertTrue(self.geom.hausdorff_distance(level) <= 1.2 * t)
+        # Coarsest level not exceeding the tolerance requested
+        self.assertTrue(watershed.getGeometry(0.005) is watershed.getGeometry(0.001))
+        self.assertTrue(watershed.getGeometry(1.0) is watershed.getGeometry(0.01))
+        # Finer than all levels, snapped to the tolerance of zoom level 18
+        level = watershed.getGeometry(0.00001)
+        self.assertEqual(watershed.tolerances, [getToleranceForZoom(18), 0.0001, 0.001, 0.01])
+        self.assertTrue(watershed.getGeometry(0.000009) is level)
+        # Finer than the finest zoom level
+        self.assertTrue(watershed.getGeometry(getToleranceForZoom(MAX_ZOOM) / 2) is self.geom)
+        self.assertEqual(len(watershed.tolerances), 4)
+        for t in [0, -0.001, float('nan'), float('inf')]:
+            self.assertRaises(ValueError, watershed.getGeometry, t)
+
+    def test_getToleranceForZoom(self):
+        self.assertAlmostEqual(getToleranceForZoom(0), 360.0 / 256)
+        self.assertAlmostEqual(getToleranceForZoom(10), getToleranceForZoom(9) / 2)
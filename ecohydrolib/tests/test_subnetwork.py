@@ -0,0 +1,160 @@
+"""@package ecohydrolib.tests.test_subnetwork
+
+    @brief Test methods for ecohydrolib.nhdplus2.subnetwork
+
+    This software is provided free of charge under the New BSD License. Please see
+    the following license information:
+
+    Copyright (c) 2015, University of North Carolina at Chapel Hill
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+        * Redistributions of source code must retain the above copyright
+          notice, this list of conditions and the following disclaimer.
+        * Redistributions in binary form must reproduce the above copyright
+          notice, this list of conditions and the following disclaimer in the
+          documentation and/or other materials provided with the distribution.
+        * Neither the name of the University of North Carolina at Chapel Hill nor the
+          names of its contributors may be used to endorse or promote products
+          derived from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+    ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+    WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+    CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+    GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+    HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+    OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+    @author Brian Miles <brian_miles@unc.edu>
+
+    Usage:
+    @code
+    python -m unittest test_subnetwork
+    @endcode
+
+"""
+from unittest import TestCase
+import os
+import sqlite3
+import tempfile, shutil
+
+from shapely.geometry import Point
+
+from ecohydrolib.nhdplus2.upstreamgraph import UpstreamGraph
+from ecohydrolib.nhdplus2.ingest import createTables
+from ecohydrolib.nhdplus2.ingest import createIndexes
+from ecohydrolib.nhdplus2.nestedintervals import writeNestedIntervals
+from ecohydrolib.nhdplus2.nestedintervals import getUpstreamReachesForInterval
+from ecohydrolib.nhdplus2.gageindex import writeGageComIdTable
+from ecohydrolib.nhdplus2.gagesearch import writeGageLocationIndex
+from ecohydrolib.nhdplus2.gagesearch import getGagesInBoundingBox
+from ecohydrolib.nhdplus2.catchmentdb import writeCatchmentExtents
+from ecohydrolib.nhdplus2.catchmentdb import getCatchmentsInBoundingBox
+from ecohydrolib.nhdplus2.subnetwork import extractSubnetwork
+from ecohydrolib.tests.network import ALL_PLUSFLOW
+from ecohydrolib.tests.network import createGeometryColumns
+from ecohydrolib.tests.network import createCatchmentTable
+
+# Both test networks, reaches 1 to 10; see ecohydrolib.tests.network
+# Source_Fea, ReachCode, Measure; reach i has ReachCode '%014d' % i
+GAGE_LOC = [('01589330', '00000000000003', 50.0),
+            ('01589312', '00000000000005', 25.0),
+            ('01589300', '00000000000009', 50.0)]
+
+def insert(conn, table, values):
+    conn.execute("""INSERT INTO %s (%s) VALUES (%s)""" % \
+                 (table, ','.join(values.keys()), ','.join(['?'] * len(values))), values.values())
+
+class TestSubnetwork(TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.outputDir = os.path.join(self.tmpDir, 'project')
+        os.mkdir(self.outputDir)
+        reaches = range(1, 11)
+        
+        self.nhdPlusDB = os.path.join(self.tmpDir, 'NHDPlusDB.sqlite')
+        conn = sqlite3.connect(self.nhdPlusDB)
+        createTables(conn)
+        for r in reaches:
+            insert(conn, 'PlusFlowlineVAA', {'ComID': r, 'ReachCode': '%014d' % (r,), 
+                                             'FromMeas': 0.0, 'ToMeas': 100.0, 'Hydroseq': 100 - r})
+            insert(conn, 'NHDFlowline', {'COMID': r, 'REACHCODE': '%014d' % (r,)})
+            insert(conn, 'NHDReachCode_Comid', {'COMID': r, 'REACHCODE': '%014d' % (r,)})
+        for (fromComid, toComid) in ALL_PLUSFLOW:
+            insert(conn, 'PlusFlow', {'FROMCOMID': fromComid, 'TOCOMID': toComid})
+        for (gageID, reachcode, measure) in GAGE_LOC:
+            insert(conn, 'Gage_Loc', {'Source_Fea': gageID, 'ReachCode': reachcode, 'Measure': measure})
+            insert(conn, 'Gage_Info', {'GageID': gageID, 'Station_NM': 'Gage %s' % (gageID,)})
+            insert(conn, 'Gage_Smooth', {'SITE_NO': gageID, 'YEAR': 2000, 'MO': 1, 'AVE': 1.0})
+        conn.commit()
+        createIndexes(conn)
+        self.graph = UpstreamGraph.fromDB(conn)
+        writeNestedIntervals(conn, self.graph)
+        writeGageComIdTable(conn)
+        conn.close()
+        
+        # Mimic the layout of databases written by the OGR SQLite driver
+        self.catchmentDB = os.path.join(self.tmpDir, 'Catchment.sqlite')
+        conn = sqlite3.connect(self.catchmentDB)
+        createCatchmentTable(conn, reaches)
+        conn.commit()
+        writeCatchmentExtents(conn)
+        conn.close()
+        
+        self.gageLocDB = os.path.join(self.tmpDir, 'GageLoc.sqlite')
+        conn = sqlite3.connect(self.gageLocDB)
+        createGeometryColumns(conn, 'gageloc')
+        conn.execute("""CREATE TABLE gageloc (OGC_FID INTEGER PRIMARY KEY, GEOMETRY BLOB, 
+source_fea TEXT, reachcode TEXT, measure REAL)""")
+        conn.executemany("""INSERT INTO gageloc (GEOMETRY,source_fea,reachcode,measure) VALUES (?,?,?,?)""",
+                         ((buffer(Point(i, 0.5).wkb), g[0], g[1], g[2]) for (i, g) in enumerate(GAGE_LOC)))
+        conn.commit()
+        writeGageLocationIndex(conn)
+        conn.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def getSchema(self, path):
+        conn = sqlite3.connect(path)
+        schema = sorted(conn.execute("""SELECT type,name,sql FROM sqlite_master""").fetchall())
+        conn.close()
+        return schema
+
+    def test_extract(self):
+        paths = extractSubnetwork(self.graph, 5, self.nhdPlusDB, self.catchmentDB, self.gageLocDB,
+                                  self.outputDir)
+        self.assertEqual(sorted(paths.keys()), ['PATH_OF_NHDPLUS2_CATCHMENT', 'PATH_OF_NHDPLUS2_DB', 
+                                                'PATH_OF_NHDPLUS2_GAGELOC'])
+        # Same schema and indexes
+        self.assertEqual(self.getSchema(paths['PATH_OF_NHDPLUS2_DB']), self.getSchema(self.nhdPlusDB))
+        self.assertEqual(self.getSchema(paths['PATH_OF_NHDPLUS2_CATCHMENT']), self.getSchema(self.catchmentDB))
+        self.assertEqual(self.getSchema(paths['PATH_OF_NHDPLUS2_GAGELOC']), self.getSchema(self.gageLocDB))
+        
+        conn = sqlite3.connect(paths['PATH_OF_NHDPLUS2_DB'])
+        comids = [row[0] for row in conn.execute("""SELECT ComID FROM PlusFlowlineVAA ORDER BY ComID""")]
+        self.assertEqual(comids, [1, 2, 3, 4, 5])
+        graph = UpstreamGraph.fromDB(conn)
+        self.assertEqual(sorted(graph.getUpstreamReaches(5)), [1, 2, 3, 4, 5])
+        self.assertEqual(sorted(getUpstreamReachesForInterval(conn, 3)), [1, 2, 3])
+        gages = [row[0] for row in conn.execute("""SELECT Source_Fea FROM Gage_ComID ORDER BY Source_Fea""")]
+        self.assertEqual(gages, ['01589312', '01589330'])
+        self.assertEqual(conn.execute("""SELECT count(*) FROM Gage_Smooth""").fetchone()[0], 2)
+        conn.close()
+        
+        conn = sqlite3.connect(paths['PATH_OF_NHDPLUS2_CATCHMENT'])
+        catchments = getCatchmentsInBoundingBox(conn, {'minX': 0.0, 'minY': 0.0, 'maxX': 20.0, 'maxY': 1.0})
+        self.assertEqual(sorted(c[0] for c in catchments), [1, 2, 3, 4, 5])
+        conn.close()
+        
+        conn = sqlite3.connect(paths['PATH_OF_NHDPLUS2_GAGELOC'])
+        gages = getGagesInBoundingBox(conn, {'minX': -1.0, 'minY': 0.0, 'maxX': 5.0, 'maxY': 1.0})
+        self.assertEqual(sorted(g[0] for g in gages), ['01589312', '01589330'])
+        conn.close()
@@ -0,0 +1,180 @@
+"""@package ecohydrolib.tests.test_upstreamgraph
+
+    @brief Test methods for ecohydrolib.nhdplus2.upstreamgraph
+
+    This software is provided free of charge under the New BSD License. Please see
+    the following license information:
+
+    Copyright (c) 2015, University of North Carolina at Chapel Hill
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+        * Redistributions of source code must retain the above copyright
+          notice, this list of conditions and the following disclaimer.
+        * Redistributions in binary form must reproduce the above copyright
+          notice, this list of conditions and the following disclaimer in the
+          documentation and/or other materials provided with the distribution.
+        * Neither the name of the University of North Carolina at Chapel Hill nor the
+          names of its contributors may be used to endorse or promote products
+          derived from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+    ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+    WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+    CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+    GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+    HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+    OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+    @author Brian Miles <brian_miles@unc.edu>
+
+    Usage:
+    @code
+    python -m unittest test_upstreamgraph
+    @endcode
+
+"""
+from unittest import TestCase
+import sqlite3
+import tempfile, shutil
+
+from ecohydrolib.nhdplus2 import upstreamgraph
+from ecohydrolib.nhdplus2.upstreamgraph import UpstreamGraph
+from ecohydrolib.nhdplus2.upstreamgraph import getUpstreamReachesFromDB
+from ecohydrolib.tests.network import getUpstreamGraph
+from ecohydrolib.tests.network import insertPlusFlow
+
+# See ecohydrolib.tests.network for the test network
+
+class TestUpstreamGraph(TestCase):
+
+    def setUp(self):
+        self.graph = getUpstreamGraph()
+
+    def test_structure(self):
+        self.assertEqual(self.graph.numReaches, 8)
+        self.assertEqual(list(self.graph.comids), range(1, 9))
+        self.assertEqual(list(self.graph.indexOf([3, 42])), [2, -1])
+        upstreamOf3 = self.graph.getImmediateUpstream(self.graph.indexOf(3))
+        self.assertEqual(sorted(self.graph.comids[upstreamOf3]), [1, 2])
+
+    def test_upstream(self):
+        reaches = self.graph.getUpstreamReaches(8)
+        self.assertEqual(reaches[0], 8)
+        # Reaches below the divergence must only be visited once
+        self.assertEqual(sorted(reaches), range(1, 9))
+
+        reaches = self.graph.getUpstreamReaches(3, includeStart=False)
+        self.assertEqual(sorted(reaches), [1, 2])
+
+        self.assertEqual(len(self.graph.getUpstreamReaches(1, includeStart=False)), 0)
+        self.assertEqual(list(self.graph.getUpstreamReaches(42)), [42])
+
+    def test_incremental_upstream(self):
+        (reaches, stops) = self.graph.getIncrementalUpstreamReaches(8, [8, 3, 4])
+        self.assertEqual(sorted(reaches), [5, 6, 7, 8])
+        self.assertEqual(sorted(stops), [3, 4])
+        
+        (reaches, stops) = self.graph.getIncrementalUpstreamReaches(3, [8, 3, 4])
+        self.assertEqual(sorted(reaches), [1, 2, 3])
+        self.assertEqual(len(stops), 0)
+
+    def test_nested_upstream(self):
+        # Gages on 3, 6 and 8 (twice); 5 drains to 8 through both 6 and 7
+        nested = self.graph.getNestedUpstreamReaches([8, 3, 6, 8])
+        outlets = [n[0] for n in nested]
+        self.assertEqual(sorted(outlets), [3, 6, 8])
+        # Nested upstream outlets come first
+        self.assertTrue(outlets.index(3) < outlets.index(6) < outlets.index(8))
+        nested = dict([(n[0], n[1:]) for n in nested])
+        (incremental, upstreamOutlets, reaches) = nested[3]
+        self.assertEqual(sorted(incremental), [1, 2, 3])
+        self.assertEqual(len(upstreamOutlets), 0)
+        (incremental, upstreamOutlets, reaches) = nested[6]
+        self.assertEqual(sorted(incremental), [4, 5, 6])
+        self.assertEqual(list(upstreamOutlets), [3])
+        self.assertEqual(list(reaches), range(1, 7))
+        (incremental, upstreamOutlets, reaches) = nested[8]
+        # 4 and 5 are also reached through 7, which is not an outlet
+        self.assertEqual(sorted(incremental), [4, 5, 7, 8])
+        self.assertEqual(sorted(upstreamOutlets), [3, 6])
+        # Reaches upstream of both 6 and 7 are only counted once
+        self.assertEqual(list(reaches), range(1, 9))
+        self.assertEqual(len(reaches), 8)
+
+    def test_first_order_in_set(self):
+        reaches = self.graph.getFirstOrderUpstreamReachesInSet(8, set([3, 4, 1]))
+        self.assertEqual(sorted(reaches), [3, 4])
+
+        reaches = self.graph.getFirstOrderUpstreamReachesInSet(8, set([5, 1]))
+        self.assertEqual(list(reaches), [5])
+
+        reaches = self.graph.getFirstOrderUpstreamReachesInSet(8, set([1]), maxdepth=2)
+        self.assertEqual(len(reaches), 0)
+
+    def test_first_order_not_in_set(self):
+        # Both branches above 5 must be searched even though 4 is in the set
+        reaches = self.graph.getFirstOrderUpstreamReachesNotInSet(5, set([4, 1]))
+        self.assertEqual(sorted(reaches), [2, 3])
+
+        reaches = self.graph.getFirstOrderUpstreamReachesNotInSet(8, set([5]))
+        self.assertEqual(sorted(reaches), [6, 7])
+
+        reaches = self.graph.getFirstOrderUpstreamReachesNotInSet(8, set(), maxdepth=0)
+        self.assertEqual(sorted(reaches), [6, 7])
+
+    def test_first_order_for_reaches(self):
+        (starts, reaches) = self.graph.getFirstOrderUpstreamReachesInSetForReaches([8, 3, 42, 5],
+                                                                                   set([3, 4, 1]))
+        self.assertEqual(list(starts), [8, 8, 3, 5, 5])
+        self.assertEqual(sorted(reaches[starts == 8]), [3, 4])
+        self.assertEqual(sorted(reaches[starts == 3]), [1])
+        self.assertEqual(sorted(reaches[starts == 5]), [3, 4])
+
+        (starts, reaches) = self.graph.getFirstOrderUpstreamReachesNotInSetForReaches([5, 8],
+                                                                                      set([4, 1]))
+        self.assertEqual(sorted(reaches[starts == 5]), [2, 3])
+        self.assertEqual(sorted(reaches[starts == 8]), [2, 3, 5, 6, 7])
+
+        (starts, reaches) = self.graph.getFirstOrderUpstreamReachesInSetForReaches([], set([1]))
+        self.assertEqual(len(starts), 0)
+        self.assertEqual(len(reaches), 0)
+
+    def test_first_order_for_reaches_without_mask(self):
+        # Searches too large for per-start masks of visited reaches give the same results
+        expected = self.graph.getFirstOrderUpstreamReachesNotInSetForReaches([5, 8, 8], set([4, 1]))
+        maxMaskSize = upstreamgraph.MAX_VISITED_MASK_SIZE
+        upstreamgraph.MAX_VISITED_MASK_SIZE = 0
+        try:
+            (starts, reaches) = self.graph.getFirstOrderUpstreamReachesNotInSetForReaches([5, 8, 8],
+                                                                                          set([4, 1]))
+        finally:
+            upstreamgraph.MAX_VISITED_MASK_SIZE = maxMaskSize
+        self.assertEqual(list(starts), list(expected[0]))
+        self.assertEqual(sorted(zip(starts, reaches)), sorted(zip(*expected)))
+        self.assertEqual(sorted(reaches[starts == 8]), [2, 2, 3, 3, 5, 5, 6, 6, 7, 7])
+
+    def test_db_and_save(self):
+        conn = sqlite3.connect(':memory:')
+        insertPlusFlow(conn)
+        graph = UpstreamGraph.fromDB(conn)
+        reaches = getUpstreamReachesFromDB(conn, 8)
+        self.assertEqual(reaches[0], 8)
+        self.assertEqual(sorted(reaches), range(1, 9))
+        self.assertEqual(sorted(getUpstreamReachesFromDB(conn, 3, includeStart=False)), [1, 2])
+        self.assertEqual(len(getUpstreamReachesFromDB(conn, 1, includeStart=False)), 0)
+        conn.close()
+
+        graphPath = tempfile.mkdtemp()
+        try:
+            graph.save(graphPath)
+            graph = UpstreamGraph.load(graphPath)
+            self.assertEqual(sorted(graph.getUpstreamReaches(5)), [1, 2, 3, 4, 5])
+            del graph
+        finally:
+            shutil.rmtree(graphPath)
@@ -0,0 +1,173 @@
+"""@package ecohydrolib.tests.test_watershedcache
+
+    @brief Test methods for ecohydrolib.nhdplus2.subnetwork
+
+    This software is provided free of charge under the New BSD License. Please see
+    the following license information:
+
+    Copyright (c) 2015, University of North Carolina at Chapel Hill
+    All rights reserved.
+
+    Redistribution and use in source and binary forms, with or without
+    modification, are permitted provided that the following conditions are met:
+        * Redistributions of source code must retain the above copyright
+          notice, this list of conditions and the following disclaimer.
+        * Redistributions in binary form must reproduce the above copyright
+          notice, this list of conditions and the following disclaimer in the
+          documentation and/or other materials provided with the distribution.
+        * Neither the name of the University of North Carolina at Chapel Hill nor the
+          names of its contributors may be used to endorse or promote products
+          derived from this software without specific prior written permission.
+
+    THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+    ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+    WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+    DISCLAIMED. IN NO EVENT SHALL THE UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL
+    BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+    CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+    GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+    HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+    LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+    OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+    @author Brian Miles <brian_miles@unc.edu>
+
+    Usage:
+    @code
+    python -m unittest test_watershedcache
+    @endcode
+
+"""
+from unittest import TestCase
+import os
+import time
+import sqlite3
+import tempfile, shutil
+
+from shapely.geometry import box
+
+from ecohydrolib.spatialdata.simplify import MultiResolutionGeometry
+from ecohydrolib.nhdplus2.manifest import createManifestTable
+from ecohydrolib.nhdplus2.manifest import recordSource
+from ecohydrolib.nhdplus2.manifest import SOURCE_DBF
+from ecohydrolib.nhdplus2.watershedcache import WatershedCache
+from ecohydrolib.nhdplus2.watershedcache import getDatasetVersion
+from ecohydrolib.nhdplus2.watershedcache import TIMEOUT
+from ecohydrolib.nhdplus2.watershedcache import FLUSH_INTERVAL
+from ecohydrolib.nhdplus2.watershedcache import BOUNDING_BOX_SIZE
+
+class TestWatershedCache(TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.cachePath = os.path.join(self.tmpDir, 'WatershedCache.sqlite')
+        self.watershed = MultiResolutionGeometry(box(0, 0, 1, 2))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir)
+
+    def test_getWatershed(self):
+        cache = WatershedCache(self.cachePath)
+        try:
+            self.assertEqual(cache.getWatershed(5, 'v1'), None)
+            cache.putWatershed(5, 'v1', self.watershed, 10)
+            (watershed, numReaches) = cache.getWatershed(5, 'v1')
+            self.assertEqual(numReaches, 10)
+            self.assertTrue(watershed.geom.equals(self.watershed.geom))
+            self.assertEqual(watershed.tolerances, self.watershed.tolerances)
+            # Keyed by dataset version
+            self.assertEqual(cache.getWatershed(5, 'v2'), None)
+            bbox = cache.getBoundingBox(5, 'v1')
+            self.assertEqual((bbox['minX'], bbox['minY'], bbox['maxX'], bbox['maxY']), (0, 0, 1, 2))
+            stats = cache.getStats()
+            self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (2, 2, 1))
+        finally:
+            cache.close()
+        # Counts persist
+        cache = WatershedCache(self.cachePath)
+        self.assertEqual(cache.getStats()['hits'], 2)
+        cache.close()
+
+    def test_getBoundingBox(self):
+        cache = WatershedCache(self.cachePath)
+        try:
+            cache.putBoundingBox(7, 'v1', {'minX': 1.0, 'minY': 2.0, 'maxX': 3.0, 'maxY': 4.0}, 3)
+            self.assertEqual(cache.getBoundingBox(7, 'v1')['maxY'], 4.0)
+            # Bounding box only, geometry not cached
+            self.assertEqual(cache.getWatershed(7, 'v1'), None)
+            cache.putWatershed(7, 'v1', self.watershed, 3)
+            self.assertNotEqual(cache.getWatershed(7, 'v1'), None)
+        finally:
+            cache.close()
+
+    def test_evictBoundingBoxes(self):
+        cache = WatershedCache(self.cachePath, maxSize=3 * BOUNDING_BOX_SIZE)
+        try:
+            for comID in range(10):
+                cache.putBoundingBox(comID, 'v1', {'minX': 1.0, 'minY': 2.0, 'maxX': 3.0, 'maxY': 4.0}, 1)
+            self.assertEqual(cache.getStats()['entries'], 3)
+            self.assertEqual(cache.getBoundingBox(0, 'v1'), None)
+            self.assertNotEqual(cache.getBoundingBox(9, 'v1'), None)
+        finally:
+            cache.close()
+
+    def test_evict(self):
+        cache = WatershedCache(self.cachePath)
+        try:
+            cache.putWatershed(1, 'v1', self.watershed, 1)
+            size = cache.getStats()['size']
+            cache.maxSize = 2 * size
+            cache.putWatershed(2, 'v1', self.watershed, 1)
+            # Use 1, so that 2 is least recently used
+            self.assertNotEqual(cache.getWatershed(1, 'v1'), None)
+            cache.putWatershed(3, 'v1', self.watershed, 1)
+            self.assertEqual(cache.getStats()['entries'], 2)
+            self.assertEqual(cache.getWatershed(2, 'v1'), None)
+            self.assertNotEqual(cache.getWatershed(1, 'v1'), None)
+            self.assertNotEqual(cache.getWatershed(3, 'v1'), None)
+        finally:
+            cache.close()
+
+    def test_lockedCache(self):
+        cache = WatershedCache(self.cachePath)
+        try:
+            cache.putWatershed(5, 'v1', self.watershed, 10)
+            # Another process is writing to the cache
+            writer = sqlite3.connect(self.cachePath, isolation_level=None)
+            writer.execute("""BEGIN IMMEDIATE""")
+            start = time.time()
+            self.assertNotEqual(cache.getWatershed(5, 'v1'), None)
+            self.assertEqual(cache.getBoundingBox(6, 'v1'), None)
+            # Usage is written best-effort, without waiting for the writer
+            self.assertFalse(cache.flush())
+            self.assertTrue(time.time() - start < TIMEOUT)
+            stats = cache.getStats()
+            self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+            writer.execute("""ROLLBACK""")
+            writer.close()
+            self.assertTrue(cache.flush())
+            for i in xrange(FLUSH_INTERVAL):
+                cache.getBoundingBox(5, 'v1')
+            self.assertEqual(cache.numPending, 0)
+        finally:
+            cache.close()
+        cache = WatershedCache(self.cachePath)
+        self.assertEqual(cache.getStats()['hits'], 1 + FLUSH_INTERVAL)
+        cache.close()
+
+    def test_getDatasetVersion(self):
+        dbPath = os.path.join(self.tmpDir, 'NHDPlusDB.sqlite')
+        conn = sqlite3.connect(dbPath)
+        conn.execute("""CREATE TABLE PlusFlow (FROMCOMID INTEGER, TOCOMID INTEGER)""")
+        conn.commit()
+        # Without a manifest, the version is that of the file
+        self.assertEqual(getDatasetVersion(conn, dbPath), getDatasetVersion(conn, dbPath))
+        createManifestTable(conn)
+        recordSource(conn, 'NHDPlus01/PlusFlow.dbf', SOURCE_DBF, 'abc', 0, 0.0)
+        conn.commit()
+        version = getDatasetVersion(conn, dbPath)
+        recordSource(conn, 'NHDPlus01/PlusFlow.dbf', SOURCE_DBF, 'def', 0, 0.0)
+        conn.commit()
+        self.assertNotEqual(getDatasetVersion(conn, dbPath), version)
+        conn.close()
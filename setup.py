@@ -50,10 +50,12 @@ setup(name='ecohydrolib',
       scripts=['bin/CreateHydroShareResource.py',
                'bin/DumpClimateStationInfo.py',
                'bin/DumpMetadataToiRODSXML.py',
+               'bin/ExtractNHDPlusSubnetwork.py',
                'bin/GenerateSoilPropertyRastersFromSOLIM.py',
                'bin/GenerateSoilPropertyRastersFromSSURGO.py',
                'bin/GetBoundingboxFromStudyareaShapefile.py',
                'bin/GetCatchmentShapefileForHYDRO1kBasins.py',
+               'bin/GetCatchmentFeaturesForNHDStreamflowGages.py',
                'bin/GetCatchmentShapefileForNHDStreamflowGage.py',
                'bin/GetDEMExplorerDEMForBoundingbox.py',
                'bin/GetGADEMForBoundingBox.py',